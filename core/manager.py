@@ -36,11 +36,14 @@ import importlib
 from qtpy import QtCore
 from . import config
 
-from .util.mutex import Mutex  # Mutex provides access serialization between threads
+from .util.mutex import Mutex, mutex_profiler  # Mutex provides access serialization between threads
 from .util.modules import toposort, is_base
 from collections import OrderedDict
 from .logger import register_exception_handler
 from .threadmanager import ThreadManager
+from .scheduler import Scheduler
+from .signal_monitor import SignalMonitor
+from .sampling_profiler import sampling_profiler
 
 # try to import RemoteObjectManager. Might fail if rpyc is not installed.
 try:
@@ -116,6 +119,12 @@ class Manager(QtCore.QObject):
 
             # Thread management
             self.tm = ThreadManager()
+            # Periodic jobs (polling and display loops of the modules)
+            self.scheduler = Scheduler(self.tm)
+            # Instrumented signal connections (traffic of the display updates)
+            self.signal_monitor = SignalMonitor()
+            # Sampling profiler for all threads, started from the manager GUI or the console
+            self.sampling_profiler = sampling_profiler
             logger.debug('Main thread is {0}'.format(QtCore.QThread.currentThreadId()))
 
             # Task runner
@@ -136,6 +145,10 @@ class Manager(QtCore.QObject):
             self.configDir = os.path.dirname(config_file)
             self.readConfig(config_file)
 
+            # Lock statistics of all mutexes, shown in the manager GUI
+            if self.tree['global'].get('mutex_profiling', False):
+                mutex_profiler.enable()
+
             # check first if remote support is enabled and if so create RemoteObjectManager
             if RemoteObjectManager is None:
                 logger.error('Remote modules disabled. Rpyc not installed.')
@@ -762,7 +775,9 @@ class Manager(QtCore.QObject):
                         defined_module['remote'],
                         certfile=certfile,
                         keyfile=keyfile,
-                        cacertsfile=cacertsfile)
+                        cacertsfile=cacertsfile,
+                        transport=defined_module.get('transport', 'netref'),
+                        compression=defined_module.get('compression', 0))
                     logger.info('Remote module {0} loaded as {1}.{2}.'
                                 ''.format(defined_module['remote'], base, key))
                     with self.lock:
@@ -838,7 +853,13 @@ class Manager(QtCore.QObject):
                 logger.error('Remote URI of {0} module {1} not a string.'.format(base, key))
                 return -1
             try:
-                instance = self.rm.getRemoteModuleUrl(defined_module['remote'])
+                instance = self.rm.getRemoteModuleUrl(
+                    defined_module['remote'],
+                    certfile=defined_module.get('certfile', None),
+                    keyfile=defined_module.get('keyfile', None),
+                    cacertsfile=defined_module.get('cacerts', None),
+                    transport=defined_module.get('transport', 'netref'),
+                    compression=defined_module.get('compression', 0))
                 logger.info('Remote module {0} loaded as .{1}.{2}.'
                             ''.format(defined_module['remote'], base, key))
                 with self.lock:
@@ -1015,6 +1036,9 @@ class Manager(QtCore.QObject):
                 self.tm.joinThread('mod-{0}-{1}'.format(base, name))
             else:
                 success = module.module_state.deactivate()  # runs on_deactivate in main thread
+            # remove the periodic jobs and signal connections the module did not remove itself
+            self.scheduler.remove_jobs(module)
+            self.signal_monitor.remove_connections(module)
 
             self.saveStatusVariables(base, name, module.getStatusVariables())
             logger.debug('Deactivation success: {}'.format(success))
@@ -1375,8 +1399,28 @@ class Manager(QtCore.QObject):
                 logger.info('Deactivating module {0}.{1}'.format(base, module))
                 self.deactivateModule(base, module)
             QtCore.QCoreApplication.processEvents()
+        self.scheduler.stop_all()
+        if self.rm is not None:
+            self.rm.closeConnections()
+        self.sampling_profiler.stop()
+        self.dumpMutexProfile()
         self.sigManagerQuit.emit(self, bool(restart))
 
+    def dumpMutexProfile(self):
+        """ Write the lock statistics to the file given by 'mutex_profiling_file' in the global
+            section of the configuration, if the mutex profiler is enabled.
+        """
+        path = self.tree['global'].get('mutex_profiling_file', None)
+        if path is None or not mutex_profiler.enabled:
+            return
+        if not os.path.isabs(path):
+            path = os.path.abspath(os.path.join(self.configDir, path))
+        try:
+            mutex_profiler.dump(path)
+            logger.info('Saved lock statistics to {0}.'.format(path))
+        except OSError:
+            logger.exception('Could not save lock statistics to {0}.'.format(path))
+
     @QtCore.Slot(object)
     def registerTaskRunner(self, reference):
         """ Register/deregister/replace a task runner object.
@@ -25,13 +25,17 @@ logger = logging.getLogger(__name__)
 
 from qtpy.QtCore import QObject
 from urllib.parse import urlparse
+import inspect
+import os
 import ssl
+import sys
+import time
 from .util.models import DictTableModel, ListTableModel
+from .util.mutex import Mutex
+from .util.network import pack_payload, unpack_payload
 import rpyc
 from rpyc.utils.server import ThreadedServer
 rpyc.core.protocol.DEFAULT_CONFIG['allow_pickle'] = True
-import os
-import sys
 
 
 class SSLAuthenticator:
@@ -73,6 +77,7 @@ class RemoteObjectManager(QObject):
         self.remoteModules.headers[0] = 'Remote Modules'
         self.sharedModules = DictTableModel()
         self.sharedModules.headers[0] = 'Shared Modules'
+        self.connectionPool = RemoteConnectionPool()
 
     def makeRemoteService(self):
         """ A function that returns a class containing a module list hat can be manipulated from the host.
@@ -91,6 +96,7 @@ class RemoteObjectManager(QObject):
                 """ code that runs when a connection is created
                     (to init the service, if needed)
                 """
+                self._conn = conn
                 logger.info('Client connected!')
 
             def on_disconnect(self, conn):
@@ -106,6 +112,70 @@ class RemoteObjectManager(QObject):
 
                   @return object: reference to the module
                 """
+                return self._get_module(name)
+
+            def exposed_getCallables(self, name):
+                """ Return the names of the public methods of a shared module.
+
+                  @param str name: unique module name
+
+                  @return tuple: method names
+                """
+                module = self._get_module(name)
+                if module is None:
+                    return tuple()
+                return tuple(attr for attr, value in inspect.getmembers(type(module))
+                             if not attr.startswith('_') and inspect.isroutine(value))
+
+            def exposed_useBulkTransport(self):
+                """ Switch off the rpyc compression of this connection. Called by clients using
+                    the connection for bulk transfers, which are compressed per remote module.
+                """
+                disable_compression(self._conn)
+
+            def exposed_callBatch(self, name, request):
+                """ Call several methods of a shared module and return all results at once.
+
+                  Request and reply are serialized by pack_payload and transferred by value in a
+                  single message each, numpy arrays as contiguous buffers.
+
+                  @param str name: unique module name
+                  @param bytes request: packed tuple (calls, compression) with calls being a list
+                                        of (method name, args, kwargs) tuples and compression the
+                                        zlib level for the reply
+
+                  @return bytes: packed list of (success, result or error message) tuples
+                """
+                calls, compression = unpack_payload(request)
+                module = self._get_module(name)
+                results = list()
+                for method, args, kwargs in calls:
+                    try:
+                        if module is None:
+                            raise Exception('Module {0} is not shared.'.format(name))
+                        results.append((True, getattr(module, method)(*args, **kwargs)))
+                    except Exception as e:
+                        logger.exception('Remote call {0}.{1} failed.'.format(name, method))
+                        results.append((False, '{0}: {1}'.format(type(e).__name__, e)))
+                try:
+                    return pack_payload(results, compression)
+                except TypeError:
+                    # only data can be transferred by value, report the results that are not
+                    results = [self._check_transferable(name, calls[index][0], result)
+                               for index, result in enumerate(results)]
+                    return pack_payload(results, compression)
+
+            @staticmethod
+            def _check_transferable(name, method, result):
+                try:
+                    pack_payload(result[1])
+                except TypeError as e:
+                    logger.error('Return value of remote call {0}.{1} can not be transferred by '
+                                 'value: {2}'.format(name, method, e))
+                    return False, 'TypeError: {0}'.format(e)
+                return result
+
+            def _get_module(self, name):
                 name = str(name)
                 if name in self.modules.storage:
                     return self.modules.storage[name]
@@ -154,6 +224,11 @@ class RemoteObjectManager(QObject):
             self.server.close()
             self.server = None
 
+    def closeConnections(self):
+        """ Close all connections to remote module servers.
+        """
+        self.connectionPool.close_all()
+
     def shareModule(self, name, obj):
         """ Add a module to the list of modules that can be accessed remotely.
 
@@ -174,36 +249,54 @@ class RemoteObjectManager(QObject):
             logger.error('Module {0} was not shared.'.format(name))
         self.sharedModules.pop(name)
 
-    def getRemoteModuleUrl(self, url, certfile=None, keyfile=None, cacertsfile=None):
+    def getRemoteModuleUrl(self, url, certfile=None, keyfile=None, cacertsfile=None,
+                           transport='netref', compression=0):
         """ Get a remote module via its URL.
 
           @param str url: URL pointing to a module hosted b a remote server
           @param str certfile: filename of certificate or None if SSL is not used
           @param str keyfile: filename of key or None if SSL is not used
           @param str cacertsfile: filename of cacerts of None if SSL is not used
+          @param str transport: 'netref' or 'bulk', see getRemoteModule
+          @param int compression: zlib compression level of bulk transfers, 0 for none
 
           @return object: remote module
         """
         parsed = urlparse(url)
         name = parsed.path.replace('/', '')
         return self.getRemoteModule(parsed.hostname, parsed.port, name, certfile, keyfile,
-                                    cacertsfile)
+                                    cacertsfile, transport=transport, compression=compression)
 
-    def getRemoteModule(self, host, port, name, certfile=None, keyfile=None, cacertsfile=None):
+    def getRemoteModule(self, host, port, name, certfile=None, keyfile=None, cacertsfile=None,
+                        transport='netref', compression=0):
         """ Get a remote module via its host, port and name.
 
+          Connections to the same server are shared between all remote modules.
+
+          With transport 'netref' the rpyc reference of the module is returned and every attribute
+          or element access is a network round trip. With transport 'bulk' method calls are
+          transferred by value, i.e. returned numpy arrays arrive as one contiguous buffer.
+
           @param str host: host that the remote module server is running on
           @param int port: port that the remote module server is listening on
           @param str name: unique name of the remote module
           @param str certfile: filename of certificate or None if SSL is not used
           @param str keyfile: filename of key or None if SSL is not used
           @param str cacertsfile: filename of cacerts of None if SSL is not used
+          @param str transport: 'netref' (default) or 'bulk'
+          @param int compression: zlib compression level of bulk transfers, 0 for none
 
           @return object: remote module
         """
+        if transport not in ('netref', 'bulk'):
+            raise Exception('Unknown remote transport "{0}". Use "netref" or "bulk".'
+                            ''.format(transport))
         module = RemoteModule(host, port, name, certfile=certfile, keyfile=keyfile,
-                              cacertsfile=cacertsfile)
+                              cacertsfile=cacertsfile, pool=self.connectionPool,
+                              compression=compression, bulk=transport == 'bulk')
         self.remoteModules.append(module)
+        if transport == 'bulk':
+            return BulkModuleProxy(module)
         return module.module
 
 
@@ -252,26 +345,276 @@ class RPyCServer(QObject):
         self.server.start()
 
 
+def connect(host, port, certfile=None, keyfile=None, cacertsfile=None):
+    """ Open a rpyc connection to a remote module server.
+
+      @param str host: host that the remote module server is running on
+      @param int port: port that the remote module server is listening on
+      @param str certfile: filename of certificate or None if SSL is not used
+      @param str keyfile: filename of key or None if SSL is not used
+      @param str cacertsfile: filename of cacerts of None if SSL is not used
+
+      @return rpyc.Connection: the connection
+    """
+    if certfile is not None and keyfile is not None:
+        if not os.path.exists(certfile):
+            raise Exception('SSL certificate {0} does not exist.'.format(certfile))
+        if not os.path.exists(keyfile):
+            raise Exception('SSL private key file {0} does not exist.'.format(keyfile))
+        if (cacertsfile is not None) and (not os.path.exists(cacertsfile)):
+            logger.warning('SSL CA certificates file {0} does not exist.'.format(cacertsfile))
+        return rpyc.ssl_connect(
+            host,
+            port=port,
+            config={'allow_all_attrs': True},
+            certfile=certfile,
+            keyfile=keyfile,
+            ca_certs=cacertsfile,
+            cert_reqs=ssl.CERT_REQUIRED)
+    return rpyc.connect(host, port, config={'allow_all_attrs': True})
+
+
+def disable_compression(connection):
+    """ Switch off the compression of all messages sent through a rpyc connection.
+
+      rpyc compresses every message larger than 3 kB, which limits the throughput of large arrays.
+      Bulk transfers are compressed per remote module instead (see RemoteModule), so compression is
+      switched off on both ends of the connections used for bulk transfers only.
+
+      @param rpyc.Connection connection: the connection
+    """
+    connection._channel.compress = False
+
+
+class RemoteConnectionPool:
+    """ Shares one rpyc connection per remote module server and reconnects closed connections.
+        Modules using the bulk transport share a separate connection without rpyc compression.
+    """
+    def __init__(self):
+        self._connections = dict()
+        self._lock = Mutex()
+
+    def get(self, host, port, certfile=None, keyfile=None, cacertsfile=None, bulk=False):
+        """ Get the open connection to a server, connect if there is none or it was closed.
+
+          @param bool bulk: get the connection used for bulk transfers
+
+          @return rpyc.Connection: the connection
+        """
+        key = (host, port, certfile, keyfile, cacertsfile, bool(bulk))
+        with self._lock:
+            connection = self._connections.get(key)
+            if connection is None or connection.closed:
+                if connection is not None:
+                    logger.warning('Connection to remote module server {0}:{1} lost. '
+                                   'Reconnecting.'.format(host, port))
+                connection = connect(*key[:5])
+                if bulk:
+                    disable_compression(connection)
+                    connection.root.useBulkTransport()
+                self._connections[key] = connection
+            return connection
+
+    def close_all(self):
+        """ Close all connections of the pool. """
+        with self._lock:
+            for connection in self._connections.values():
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+            self._connections.clear()
+
+
+class TransferStatistics:
+    """ Counts calls and bytes of the bulk transfers of a remote module.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.calls = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.duration = 0.0
+
+    def add(self, calls, bytes_sent, bytes_received, duration):
+        self.requests += 1
+        self.calls += calls
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+        self.duration += duration
+
+    def as_dict(self):
+        """ Statistics as dict including the mean round trip time in s and the throughput of
+            received data in bytes/s.
+        """
+        return {'requests': self.requests,
+                'calls': self.calls,
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+                'duration': self.duration,
+                'round_trip_time': self.duration / self.requests if self.requests else 0.0,
+                'throughput': self.bytes_received / self.duration if self.duration > 0 else 0.0}
+
+
 class RemoteModule:
     """ This class represents a module on a remote computer and holds a reference to it.
     """
-    def __init__(self, host, port, name, certfile=None, keyfile=None, cacertsfile=None):
-        if certfile is not None and keyfile is not None:
-            if not os.path.exists(certfile):
-                raise Exception('SSL certificate {0} does not exist.'.format(certfile))
-            if not os.path.exists(keyfile):
-                raise Exception('SSL private key file {0} does not exist.'.format(keyfile))
-            if (cacertsfile is not None) and (not os.path.exists(cacertsfile)):
-                logger.warning('SSL CA certificates file {0} does not exist.'.format(cacertsfile))
-            self.connection = rpyc.ssl_connect(
-                host,
-                port=port,
-                config={'allow_all_attrs': True},
-                certfile=certfile,
-                keyfile=keyfile,
-                ca_certs=cacertsfile,
-                cert_reqs=ssl.CERT_REQUIRED)
-        else:
-            self.connection = rpyc.connect(host, port, config={'allow_all_attrs': True})
-        self.module = self.connection.root.getModule(name)
+    def __init__(self, host, port, name, certfile=None, keyfile=None, cacertsfile=None,
+                 pool=None, compression=0, bulk=False):
+        """
+          @param str host: host that the remote module server is running on
+          @param int port: port that the remote module server is listening on
+          @param str name: unique name of the remote module
+          @param str certfile: filename of certificate or None if SSL is not used
+          @param str keyfile: filename of key or None if SSL is not used
+          @param str cacertsfile: filename of cacerts of None if SSL is not used
+          @param RemoteConnectionPool pool: optional, pool to share the connection with other
+                                            remote modules
+          @param int compression: zlib compression level of bulk transfers, 0 for none
+          @param bool bulk: use a connection without rpyc compression, for bulk transfers
+        """
         self.name = name
+        self.compression = compression
+        self.statistics = TransferStatistics()
+        self._address = (host, port, certfile, keyfile, cacertsfile)
+        self._pool = pool
+        self._bulk = bulk
+        self._callables = None
+        self.connection = None
+        self.module = None
+        self._update_connection()
+
+    def _update_connection(self):
+        """ Get the current connection, reconnect if it was closed and refresh the module
+            reference if the connection changed.
+
+          @return rpyc.Connection: the connection
+        """
+        if self._pool is not None:
+            connection = self._pool.get(*self._address, bulk=self._bulk)
+        elif self.connection is None or self.connection.closed:
+            connection = connect(*self._address)
+            if self._bulk:
+                disable_compression(connection)
+                connection.root.useBulkTransport()
+        else:
+            connection = self.connection
+        if connection is not self.connection or self.module is None:
+            self.connection = connection
+            self.module = connection.root.getModule(self.name)
+        return connection
+
+    @property
+    def callables(self):
+        """ Names of the public methods of the remote module. """
+        if self._callables is None:
+            self._callables = frozenset(self._update_connection().root.getCallables(self.name))
+        return self._callables
+
+    def call(self, method, *args, **kwargs):
+        """ Call a method of the remote module and transfer the result by value.
+
+          @param str method: name of the method
+
+          @return: the return value of the method
+        """
+        return self.call_batch([(method, args, kwargs)])[0]
+
+    def call_batch(self, calls):
+        """ Call several methods of the remote module in a single network round trip.
+
+          @param list calls: list of (method name, args, kwargs) tuples
+
+          @return list: the return values of all methods
+        """
+        calls = [(str(method), tuple(args), dict(kwargs)) for method, args, kwargs in calls]
+        request = pack_payload((calls, self.compression), self.compression)
+        start = time.perf_counter()
+        reply = self._update_connection().root.callBatch(self.name, request)
+        results = unpack_payload(reply)
+        self.statistics.add(len(calls), len(request), len(reply), time.perf_counter() - start)
+
+        errors = ['{0}: {1}'.format(call[0], result)
+                  for call, (success, result) in zip(calls, results) if not success]
+        if errors:
+            raise Exception('Remote call of module {0} failed: {1}'.format(self.name,
+                                                                           '; '.join(errors)))
+        return [result for success, result in results]
+
+    def batch(self):
+        """ Collect method calls and execute them in a single network round trip.
+
+          Usage:
+            with remote_module.batch() as batch:
+                batch.add('get_last_image')
+                batch.add('get_exposure')
+            image, exposure = batch.results
+
+          @return BatchedCalls: the call collector
+        """
+        return BatchedCalls(self)
+
+
+class BatchedCalls:
+    """ Collects method calls of a RemoteModule and executes them on exit of the with block.
+    """
+    def __init__(self, remote_module):
+        self._remote_module = remote_module
+        self._calls = list()
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.execute()
+
+    def add(self, method, *args, **kwargs):
+        self._calls.append((method, args, kwargs))
+
+    def execute(self):
+        self.results = self._remote_module.call_batch(self._calls) if self._calls else list()
+        self._calls = list()
+        return self.results
+
+
+class BulkModuleProxy:
+    """ Stands in for a remote module with bulk transport.
+
+    Public methods are called through RemoteModule.call, so return values are transferred by value
+    in a single message. All other attributes (e.g. signals, module_state) are accessed through the
+    rpyc reference of the module.
+    """
+    def __init__(self, remote_module):
+        object.__setattr__(self, '_remote_module', remote_module)
+
+    @property
+    def __class__(self):
+        return self._remote_module.module.__class__
+
+    @property
+    def remote_module(self):
+        return self._remote_module
+
+    def __getattr__(self, name):
+        remote_module = self._remote_module
+        if name in remote_module.callables:
+            def bulk_call(*args, **kwargs):
+                return remote_module.call(name, *args, **kwargs)
+            bulk_call.__name__ = name
+            return bulk_call
+        remote_module._update_connection()
+        return getattr(remote_module.module, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._remote_module.module, name, value)
+
+    def __dir__(self):
+        return dir(self._remote_module.module)
+
+    def __repr__(self):
+        return '<BulkModuleProxy of remote module {0}>'.format(self._remote_module.name)
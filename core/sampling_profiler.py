@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains a sampling profiler for all threads of qudi.
+
+A background thread takes the Python stack of every thread (QThreads included) at a fixed interval
+and counts identical stacks. The overhead is independent of the code being profiled: the
+profiled threads are only interrupted for the short time the sampler holds the interpreter lock,
+so the profiler can be used on the running instrument. Threads waiting in the Qt event loop have no
+Python stack and are not sampled.
+
+Each stack starts with the name of the thread (the QThread names of the thread manager, e.g.
+'mod-logic-camera_logic', or 'main'), followed by the tag currently set in this thread (e.g. the
+task step), if any. The result is written in the collapsed (folded) stack format read by
+flamegraph.pl, speedscope or inferno:
+
+    main;[task HiMTask.step];_doTaskStep (logic/generic_task.py:182);... 42
+
+Usage (manager GUI: Menu > Record profile, or the console):
+    manager.sampling_profiler.start()
+    ...
+    manager.sampling_profiler.stop()
+    manager.sampling_profiler.save('profile.folded')
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from .util.modules import get_main_dir
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    """ Samples the stacks of all threads at a fixed interval and counts identical stacks. """
+
+    def __init__(self, interval=0.01, max_depth=100):
+        """
+        @param float interval: optional, time between two samples in s
+        @param int max_depth: optional, maximum number of frames per sample (innermost frames kept)
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self._thread_names = dict()
+        self._tags = dict()
+        self._stacks = dict()
+        self._samples = 0
+        self._duration = 0.
+        self._thread = None
+        self._stop = threading.Event()
+        self._labels = dict()
+        self._main_dir = get_main_dir()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def samples(self):
+        return self._samples
+
+    @property
+    def duration(self):
+        return self._duration
+
+    def register_thread(self, name):
+        """ Name the calling thread in the samples. Called by the thread manager for its QThreads.
+
+        @param str name: name of the thread
+        """
+        self._thread_names[threading.get_ident()] = name
+
+    def unregister_thread(self):
+        """ Remove the name of the calling thread, called when the thread finishes. The identifier of
+        a finished thread is reused by the next thread started.
+        """
+        self._thread_names.pop(threading.get_ident(), None)
+
+    def set_tag(self, name):
+        """ Tag the following samples of the calling thread.
+
+        @param str name: tag of the samples, None to remove the tag
+        """
+        if name is None:
+            self._tags.pop(threading.get_ident(), None)
+        else:
+            self._tags[threading.get_ident()] = name
+
+    @contextmanager
+    def tag(self, name):
+        """ Context manager tagging the samples of the calling thread, e.g. with the running task step.
+        Tags can be nested, the innermost one is used.
+
+        @param str name: tag of the samples
+        """
+        ident = threading.get_ident()
+        previous = self._tags.get(ident)
+        self._tags[ident] = name
+        try:
+            yield
+        finally:
+            if previous is None:
+                self._tags.pop(ident, None)
+            else:
+                self._tags[ident] = previous
+
+    def start(self, interval=None, clear=True):
+        """ Start sampling in a background thread.
+
+        @param float interval: optional, time between two samples in s
+        @param bool clear: optional, discard the samples of the previous runs
+        """
+        if self.running:
+            logger.warning('Sampling profiler is already running.')
+            return
+        if interval is not None:
+            self.interval = interval
+        if clear:
+            self.clear()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        logger.info('Sampling profiler started ({0:.0f} samples per s).'.format(1 / self.interval))
+
+    def stop(self):
+        """ Stop sampling. The samples are kept until the next start or clear. """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        logger.info('Sampling profiler stopped after {0} samples in {1:.1f} s.'.format(self._samples,
+                                                                                 self._duration))
+
+    def clear(self):
+        self._stacks = dict()
+        self._samples = 0
+        self._duration = 0.
+
+    def collapsed(self):
+        """ Samples in the collapsed stack format.
+
+        @return list(str): lines 'thread;[tag];outer frame;...;inner frame count', most frequent first
+        """
+        lines = list()
+        for key, count in sorted(dict(self._stacks).items(), key=lambda item: item[1], reverse=True):
+            thread, tag, codes = key
+            parts = [thread]
+            if tag is not None:
+                parts.append('[{0}]'.format(tag))
+            parts.extend(self._label(code) for code in reversed(codes))
+            lines.append('{0} {1}'.format(';'.join(parts), count))
+        return lines
+
+    def save(self, path):
+        """ Write the samples to a text file in the collapsed stack format.
+
+        @param str path: path of the file, usually with the suffix .folded
+        """
+        with open(path, 'w') as file:
+            for line in self.collapsed():
+                file.write(line + '\n')
+        logger.info('Saved {0} samples to {1}.'.format(self._samples, path))
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        start = time.perf_counter()
+        next_time = start
+        while not self._stop.is_set():
+            self._sample(own_ident)
+            self._samples += 1
+            next_time += self.interval
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                # sampling took longer than the interval, continue from now
+                next_time = time.perf_counter()
+            self._duration = time.perf_counter() - start
+
+    def _sample(self, own_ident):
+        stacks = self._stacks
+        tags = self._tags
+        max_depth = self.max_depth
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            codes = list()
+            while frame is not None and len(codes) < max_depth:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            key = (self._thread_name(ident), tags.get(ident), tuple(codes))
+            stacks[key] = stacks.get(key, 0) + 1
+
+    def _thread_name(self, ident):
+        """ Name of the thread at the time of the sample. The stacks are counted by name, since the
+        identifier of a finished thread is reused by the next thread started.
+        """
+        name = self._thread_names.get(ident)
+        if name is not None:
+            return name
+        if ident == threading.main_thread().ident:
+            return 'main'
+        thread = threading._active.get(ident)
+        if thread is not None:
+            return thread.name
+        return str(ident)
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            if filename.startswith(self._main_dir):
+                filename = os.path.relpath(filename, self._main_dir).replace('\\', '/')
+            else:
+                filename = os.path.basename(filename)
+            # ';' separates the frames and ' ' the count in the collapsed format
+            label = '{0} ({1}:{2})'.format(code.co_name, filename, code.co_firstlineno)
+            label = label.replace(';', ':')
+            self._labels[code] = label
+        return label
+
+
+sampling_profiler = SamplingProfiler()
@@ -0,0 +1,465 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the Qudi scheduler for periodic jobs (polling and display loops).
+
+A job calls a function at a fixed target rate from a single shot timer living in the thread of its
+owner (usually the logic module, so the function runs in the module thread as any other slot) or
+in the thread of the scheduler. The next due time is calculated from the start of the job, so the
+loop does not drift, and no object is created per tick.
+
+If a call takes longer than the interval (overrun), the missed ticks are either dropped and the job
+continues on its original time grid ('skip'), or a single late call is done immediately and the
+time grid restarts from there ('coalesce'). In both cases the missed ticks are not called. A job
+integrating a quantity over time (e.g. a volume from a flowrate) is added with pass_elapsed, its
+callback then receives the time since its previous call and accounts for the missed ticks itself.
+Achieved rate, jitter, duration and the number of missed ticks are recorded for each job and shown
+in the manager GUI.
+
+Jobs can carry tags, for example 'gui' for loops only refreshing a display. All jobs with a tag can
+be paused, e.g. by a task during an acquisition.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import logging
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+from qtpy import QtCore
+
+from .util.mutex import Mutex
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicJob(QtCore.QObject):
+    """ A function called periodically by a timer in a given thread.
+
+    Use Scheduler.add_job to create a job. start and stop can be called from any thread, the timer
+    is always handled in the thread of the job.
+    """
+    sigStart = QtCore.Signal()
+    sigStop = QtCore.Signal()
+
+    overrun_policies = ('skip', 'coalesce')
+
+    def __init__(self, name, callback, interval, overrun='skip', tags=(), owner=None, history=100,
+                 pass_elapsed=False):
+        """
+        @param str name: unique name of the job
+        @param callable callback: function called on each tick, without argument (see pass_elapsed)
+        @param float interval: target time between two calls in s
+        @param str overrun: optional, 'skip' or 'coalesce', handling of ticks missed because the
+                            call took too long
+        @param tuple tags: optional, tags of the job, e.g. ('gui',)
+        @param QObject owner: optional, object the job belongs to
+        @param int history: optional, number of ticks used for the statistics
+        @param bool pass_elapsed: optional, call the callback with the time in s since its previous
+                                  call (since the start of the job for the first call), including
+                                  missed and paused ticks
+        """
+        super().__init__()
+        if overrun not in self.overrun_policies:
+            raise ValueError('Unknown overrun policy "{0}" for job {1}.'.format(overrun, name))
+        self.name = name
+        self.callback = callback
+        self.overrun = overrun
+        self.tags = tuple(tags)
+        self.owner = owner
+        self.pass_elapsed = pass_elapsed
+        self.thread_name = ''
+        self.interval = interval
+        self._running = False
+        self._pause_keys = set()
+        self._due = 0.
+        self._last_call = 0.
+        self._starts = deque(maxlen=history)
+        self._lateness = deque(maxlen=history)
+        self._durations = deque(maxlen=history)
+        self._ticks = 0
+        self._skipped = 0
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self._timer.timeout.connect(self._tick)
+        self.sigStart.connect(self._start_timer)
+        self.sigStop.connect(self._stop_timer)
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @interval.setter
+    def interval(self, value):
+        """ Set the target time between two calls in s. Used from the next tick on. """
+        if value <= 0:
+            raise ValueError('The interval of job {0} must be > 0.'.format(self.name))
+        self._interval = float(value)
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def paused(self):
+        return len(self._pause_keys) > 0
+
+    def start(self):
+        """ Start the job. The first call is done after one interval. """
+        if self._running:
+            return
+        self._running = True
+        self.sigStart.emit()
+
+    def stop(self):
+        """ Stop the job. A call in progress is finished. """
+        self._running = False
+        self.sigStop.emit()
+
+    def pause(self, key):
+        """ Pause the job until all keys used to pause it are released with resume.
+
+        @param str key: identifier of the caller, e.g. the name of a task
+        """
+        self._pause_keys.add(key)
+
+    def resume(self, key):
+        """ Release the pause requested with key.
+
+        @param str key: identifier used in pause
+        """
+        if key in self._pause_keys:
+            self._pause_keys.discard(key)
+            if not self._pause_keys:
+                self._starts.clear()  # the rate is measured again from here
+
+    def stats(self):
+        """ Statistics over the last ticks.
+
+        @return dict: with keys 'target_rate', 'rate' (Hz), 'jitter' (standard deviation of the delay
+                      of the calls with respect to their due time, in s), 'duration' (mean duration
+                      of a call in s), 'max_duration' (s), 'ticks' and 'skipped' (missed ticks)
+        """
+        starts = np.array(self._starts)
+        lateness = np.array(self._lateness)
+        durations = np.array(self._durations)
+        if len(starts) > 1 and starts[-1] > starts[0]:
+            rate = float((len(starts) - 1) / (starts[-1] - starts[0]))
+        else:
+            rate = 0.
+        return {'target_rate': 1 / self._interval,
+                'rate': rate,
+                'jitter': float(np.std(lateness)) if len(lateness) > 0 else 0.,
+                'duration': float(np.mean(durations)) if len(durations) > 0 else 0.,
+                'max_duration': float(np.max(durations)) if len(durations) > 0 else 0.,
+                'ticks': self._ticks,
+                'skipped': self._skipped}
+
+    def state(self):
+        """ @return str: 'stopped', 'paused' or 'running' """
+        if not self._running:
+            return 'stopped'
+        return 'paused' if self.paused else 'running'
+
+    @QtCore.Slot()
+    def _start_timer(self):
+        if not self._running:
+            return
+        self._starts.clear()
+        self._last_call = time.monotonic()
+        self._due = self._last_call + self._interval
+        self._timer.start(int(self._interval * 1000))
+
+    @QtCore.Slot()
+    def _stop_timer(self):
+        self._timer.stop()
+
+    @QtCore.Slot()
+    def _tick(self):
+        if not self._running:
+            return
+        if not self.paused:
+            start = time.monotonic()
+            try:
+                if self.pass_elapsed:
+                    elapsed, self._last_call = start - self._last_call, start
+                    self.callback(elapsed)
+                else:
+                    self.callback()
+            except Exception:
+                logger.exception('Error in periodic job {0}, job stopped.'.format(self.name))
+                self._running = False
+                return
+            stop = time.monotonic()
+            self._starts.append(start)
+            self._lateness.append(start - self._due)
+            self._durations.append(stop - start)
+            self._ticks += 1
+            # the callback may have stopped the job
+            if not self._running:
+                return
+        self._schedule_next()
+
+    def _schedule_next(self):
+        now = time.monotonic()
+        self._due += self._interval
+        if self._due < now:
+            missed = int((now - self._due) // self._interval)
+            if self.overrun == 'skip':
+                # stay on the time grid, continue with the next slot in the future
+                self._skipped += missed + 1
+                self._due += (missed + 1) * self._interval
+            else:
+                # a single late call as soon as possible, the time grid restarts from there
+                self._skipped += missed
+                self._due = now
+        self._timer.start(max(0, int(round((self._due - now) * 1000))))
+
+
+class Scheduler(QtCore.QAbstractTableModel):
+    """ This class keeps track of all periodic jobs and provides their statistics as a table model.
+
+    Example (in a logic module):
+        self._job = self._manager.scheduler.add_job('camera_logic.live', self.loop, 0.05, owner=self,
+                                                    tags=('gui',))
+        self._job.start()
+        ...
+        self._manager.scheduler.remove_job('camera_logic.live')
+    """
+    sigJobsChanged = QtCore.Signal()
+
+    def __init__(self, thread_manager=None, refresh_interval=1000):
+        """
+        @param ThreadManager thread_manager: optional, used to create the scheduler thread
+        @param int refresh_interval: optional, time between two updates of the statistics in the
+                                     table model in ms
+        """
+        super().__init__()
+        self._jobs = OrderedDict()
+        self._rows = list()
+        self._paused_tags = dict()
+        self._thread_manager = thread_manager
+        self._thread = None
+        self.lock = Mutex()
+        self.headers = ['Name', 'Thread', 'Target (Hz)', 'Rate (Hz)', 'Jitter (ms)', 'Duration (ms)',
+                        'Skipped', 'State']
+        self.sigJobsChanged.connect(self._update_rows, QtCore.Qt.QueuedConnection)
+        self._refresh_timer = QtCore.QTimer(self)
+        self._refresh_timer.timeout.connect(self._refresh_stats)
+        self._refresh_timer.start(refresh_interval)
+
+    def add_job(self, name, callback, interval, owner=None, thread=None, overrun='skip', tags=(),
+                pass_elapsed=False):
+        """ Register a periodic job. The job is not started.
+
+        @param str name: unique name of the job. An existing job with this name is replaced.
+        @param callable callback: function called on each tick, without argument (see pass_elapsed)
+        @param float interval: target time between two calls in s
+        @param QObject owner: optional, object the job belongs to, usually the calling module
+        @param thread: optional, thread the callback is executed in: None for the thread of the
+                       owner (or the calling thread without owner), 'scheduler' for the thread of
+                       the scheduler (shared by all jobs using it) or a QThread
+        @param str overrun: optional, 'skip' or 'coalesce'
+        @param tuple tags: optional, tags of the job, e.g. ('gui',) for display loops
+        @param bool pass_elapsed: optional, call the callback with the time in s since its previous
+                                  call. Use it for jobs integrating over time, the missed ticks are
+                                  not called.
+
+        @return PeriodicJob: the registered job
+        """
+        if name in self._jobs:
+            logger.warning('Periodic job {0} is already registered and will be replaced.'.format(name))
+            self.remove_job(name)
+        job = PeriodicJob(name, callback, interval, overrun=overrun, tags=tags, owner=owner,
+                          pass_elapsed=pass_elapsed)
+        if thread == 'scheduler':
+            thread = self._scheduler_thread()
+        elif thread is None and owner is not None:
+            thread = owner.thread()
+        if thread is not None:
+            job.moveToThread(thread)
+        else:
+            thread = QtCore.QThread.currentThread()
+        app = QtCore.QCoreApplication.instance()
+        if not thread.objectName() and app is not None and thread is app.thread():
+            job.thread_name = 'main'
+        else:
+            job.thread_name = thread.objectName()
+        with self.lock:
+            for tag in job.tags:
+                for key in self._paused_tags.get(tag, ()):
+                    job.pause(key)
+            self._jobs[name] = job
+        self.sigJobsChanged.emit()
+        return job
+
+    def remove_job(self, name):
+        """ Stop and remove a job.
+
+        @param str name: name of the job
+        """
+        with self.lock:
+            job = self._jobs.pop(name, None)
+        if job is None:
+            return
+        job.stop()
+        job.deleteLater()
+        self.sigJobsChanged.emit()
+
+    def remove_jobs(self, owner):
+        """ Stop and remove all jobs of an owner.
+
+        @param QObject owner: owner of the jobs
+        """
+        with self.lock:
+            names = [name for name, job in self._jobs.items() if job.owner is owner]
+        for name in names:
+            self.remove_job(name)
+
+    def job(self, name):
+        """ @return PeriodicJob: the job with the given name, None if not registered """
+        return self._jobs.get(name)
+
+    def jobs(self):
+        """ @return list: names of the registered jobs """
+        return list(self._jobs)
+
+    def stop_all(self):
+        """ Stop all jobs. """
+        for job in list(self._jobs.values()):
+            job.stop()
+
+    def pause(self, tag, key):
+        """ Pause all jobs with a tag, including jobs registered later, until resume is called with
+        the same key. Pausing with the same key twice has no additional effect.
+
+        @param str tag: tag of the jobs to pause, e.g. 'gui'
+        @param str key: identifier of the caller, e.g. the name of a task
+        """
+        with self.lock:
+            self._paused_tags.setdefault(tag, set()).add(key)
+            for job in self._jobs.values():
+                if tag in job.tags:
+                    job.pause(key)
+
+    def resume(self, tag, key):
+        """ Release the pause of all jobs with a tag requested with key.
+
+        @param str tag: tag used in pause
+        @param str key: identifier used in pause
+        """
+        with self.lock:
+            self._paused_tags.get(tag, set()).discard(key)
+            for job in self._jobs.values():
+                if tag in job.tags:
+                    job.resume(key)
+
+    def _scheduler_thread(self):
+        if self._thread is None:
+            if self._thread_manager is not None:
+                self._thread = self._thread_manager.newThread('scheduler')
+            else:
+                self._thread = QtCore.QThread()
+            self._thread.setObjectName('scheduler')
+            self._thread.start()
+        return self._thread
+
+    @QtCore.Slot()
+    def _update_rows(self):
+        self.beginResetModel()
+        with self.lock:
+            self._rows = list(self._jobs.values())
+        self.endResetModel()
+
+    @QtCore.Slot()
+    def _refresh_stats(self):
+        if self._rows:
+            self.dataChanged.emit(self.index(0, 2), self.index(len(self._rows) - 1, len(self.headers) - 1))
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        """ Gives the number of registered jobs.
+
+          @return int: number of jobs
+        """
+        return len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        """ Gives the number of data fields of a job.
+
+          @return int: number of job data fields
+        """
+        return len(self.headers)
+
+    def flags(self, index):
+        """ Determines what can be done with entry cells in the table view.
+
+          @param QModelIndex index: cell fo which the flags are requested
+
+          @return Qt.ItemFlags: actions allowed for this cell
+        """
+        return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+
+    def data(self, index, role):
+        """ Get data from model for a given cell. Data can have a role that affects display.
+
+          @param QModelIndex index: cell for which data is requested
+          @param ItemDataRole role: role for which data is requested
+
+          @return QVariant: data for given cell and role
+        """
+        if not index.isValid() or role != QtCore.Qt.DisplayRole or index.row() >= len(self._rows):
+            return None
+        job = self._rows[index.row()]
+        column = index.column()
+        if column == 0:
+            return job.name
+        elif column == 1:
+            return job.thread_name
+        elif column == 7:
+            return job.state()
+        stats = job.stats()
+        if column == 2:
+            return '{0:.2f}'.format(stats['target_rate'])
+        elif column == 3:
+            return '{0:.2f}'.format(stats['rate'])
+        elif column == 4:
+            return '{0:.2f}'.format(stats['jitter'] * 1e3)
+        elif column == 5:
+            return '{0:.2f}'.format(stats['duration'] * 1e3)
+        elif column == 6:
+            return str(stats['skipped'])
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        """ Data for the table view headers.
+
+          @param int section: number of the column to get header data for
+          @param Qt.Orientation: orientation of header (horizontal or vertical)
+          @param ItemDataRole: role for which to get data
+
+          @return QVariant: header data for given column and role
+        """
+        if not (0 <= section < len(self.headers)):
+            return None
+        elif role != QtCore.Qt.DisplayRole:
+            return None
+        elif orientation != QtCore.Qt.Horizontal:
+            return None
+        else:
+            return self.headers[section]
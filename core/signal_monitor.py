@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the Qudi signal monitor, measuring the traffic of selected cross-thread signals.
+
+A monitored connection replaces a queued connection between a signal and a slot. The signal is
+connected directly to a recorder in the thread of the sender, which stores the arguments with a
+time stamp and posts a delivery event to a relay object living in the thread of the receiver. The
+relay calls the slot. For each connection the emit rate, the time an emission spends in the event
+queue of the receiver (delay), the execution time of the slot and the number of pending
+emissions are recorded and shown in the manager GUI. A warning is logged when the pending
+emissions pile up.
+
+Optionally a connection only delivers the latest emission (latest value wins): emissions that
+arrive while an older one is still waiting in the queue replace it. This is meant for display
+updates, where drawing outdated data only increases the latency.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import logging
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+from qtpy import QtCore
+
+from .util.mutex import Mutex
+
+logger = logging.getLogger(__name__)
+
+
+class MonitoredConnection(QtCore.QObject):
+    """ Instrumented connection between a signal and a slot.
+
+    Use SignalMonitor.connect to create a connection. The relay object lives in the thread of the
+    receiver, the recorder is called in the thread of the sender.
+    """
+    sigDeliver = QtCore.Signal()
+
+    def __init__(self, name, signal, slot, coalesce=False, owner=None, backlog_threshold=10,
+                 history=100):
+        """
+        @param str name: unique name of the connection
+        @param signal: bound signal of the sender
+        @param callable slot: function called with the arguments of the signal
+        @param bool coalesce: optional, deliver only the latest pending emission
+        @param QObject owner: optional, object the connection belongs to (usually the receiver)
+        @param int backlog_threshold: optional, number of pending emissions considered a backlog
+        @param int history: optional, number of emissions used for the statistics
+        """
+        super().__init__()
+        self.name = name
+        self.owner = owner
+        self.thread_name = ''
+        self.backlog_threshold = backlog_threshold
+        self._signal = signal
+        self._slot = slot
+        self._coalesce = bool(coalesce)
+        self._lock = Mutex()
+        self._queue = deque()
+        self._wake_pending = False
+        self._backlog = False
+        self._emitted = 0
+        self._delivered = 0
+        self._dropped = 0
+        self._max_pending = 0
+        self._emits = deque(maxlen=history)
+        self._delays = deque(maxlen=history)
+        self._durations = deque(maxlen=history)
+        self.sigDeliver.connect(self._deliver, QtCore.Qt.QueuedConnection)
+        signal.connect(self._record, QtCore.Qt.DirectConnection)
+
+    @property
+    def coalesce(self):
+        return self._coalesce
+
+    @coalesce.setter
+    def coalesce(self, value):
+        with self._lock:
+            self._coalesce = bool(value)
+
+    @property
+    def pending(self):
+        return len(self._queue)
+
+    def disconnect_signal(self):
+        """ Disconnect the recorder from the signal. Pending emissions are dropped. """
+        try:
+            self._signal.disconnect(self._record)
+        except (TypeError, RuntimeError):
+            # already disconnected, e.g. by a disconnect() of all slots of the signal
+            pass
+        with self._lock:
+            self._dropped += len(self._queue)
+            self._queue.clear()
+
+    def stats(self):
+        """ Statistics over the last emissions.
+
+        @return dict: with keys 'rate' (emissions per s), 'delay' (mean time from the emission to the
+                      call of the slot in s), 'max_delay' (s), 'duration' (mean duration of the
+                      slot in s), 'max_duration' (s), 'emitted', 'delivered', 'dropped' (replaced
+                      by a newer emission), 'pending' and 'max_pending'
+        """
+        emits = np.array(self._emits)
+        delays = np.array(self._delays)
+        durations = np.array(self._durations)
+        if len(emits) > 1 and emits[-1] > emits[0]:
+            rate = float((len(emits) - 1) / (emits[-1] - emits[0]))
+        else:
+            rate = 0.
+        return {'rate': rate,
+                'delay': float(np.mean(delays)) if len(delays) > 0 else 0.,
+                'max_delay': float(np.max(delays)) if len(delays) > 0 else 0.,
+                'duration': float(np.mean(durations)) if len(durations) > 0 else 0.,
+                'max_duration': float(np.max(durations)) if len(durations) > 0 else 0.,
+                'emitted': self._emitted,
+                'delivered': self._delivered,
+                'dropped': self._dropped,
+                'pending': len(self._queue),
+                'max_pending': self._max_pending}
+
+    def state(self):
+        """ @return str: 'backlog', 'latest only' or 'ok' """
+        if self._backlog:
+            return 'backlog'
+        return 'latest only' if self._coalesce else 'ok'
+
+    def _record(self, *args):
+        """ Called in the thread of the sender for each emission. """
+        now = time.perf_counter()
+        with self._lock:
+            if self._coalesce:
+                self._dropped += len(self._queue)
+                self._queue.clear()
+                post = not self._wake_pending
+            else:
+                post = True
+            self._queue.append((now, args))
+            self._wake_pending = True
+            self._emitted += 1
+            self._emits.append(now)
+            pending = len(self._queue)
+            if pending > self._max_pending:
+                self._max_pending = pending
+            new_backlog = pending >= self.backlog_threshold and not self._backlog
+            if new_backlog:
+                self._backlog = True
+        if post:
+            self.sigDeliver.emit()
+        if new_backlog:
+            logger.warning('{0} emissions of {1} are waiting for the receiving thread.'.format(
+                pending, self.name))
+
+    @QtCore.Slot()
+    def _deliver(self):
+        """ Called in the thread of the receiver for each posted emission. """
+        with self._lock:
+            self._wake_pending = False
+            if not self._queue:
+                # already delivered with a newer emission
+                return
+            emitted, args = self._queue.popleft()
+            if not self._queue:
+                self._backlog = False
+        start = time.perf_counter()
+        try:
+            self._slot(*args)
+        except Exception:
+            logger.exception('Error in the slot of {0}.'.format(self.name))
+        finally:
+            self._durations.append(time.perf_counter() - start)
+            self._delays.append(start - emitted)
+            self._delivered += 1
+
+
+class SignalMonitor(QtCore.QAbstractTableModel):
+    """ This class keeps track of the monitored signal connections and provides their statistics as
+    a table model. The column 'Latest only' can be toggled in the table.
+
+    Example (in a GUI module, instead of self._logic.sigUpdateDisplay.connect(self.update_data)):
+        self._manager.signal_monitor.connect('camera_gui.sigUpdateDisplay',
+                                             self._logic.sigUpdateDisplay, self.update_data,
+                                             owner=self, coalesce=True)
+        ...
+        self._manager.signal_monitor.remove_connection('camera_gui.sigUpdateDisplay')
+
+    The connections of a module are removed when the module is deactivated.
+    """
+    sigConnectionsChanged = QtCore.Signal()
+
+    coalesce_column = 8
+
+    def __init__(self, refresh_interval=1000):
+        """
+        @param int refresh_interval: optional, time between two updates of the statistics in the
+                                     table model in ms
+        """
+        super().__init__()
+        self._connections = OrderedDict()
+        self._rows = list()
+        self.lock = Mutex()
+        self.headers = ['Name', 'Thread', 'Rate (Hz)', 'Delay (ms)', 'Max delay (ms)', 'Slot (ms)',
+                        'Pending', 'Dropped', 'Latest only', 'State']
+        self.sigConnectionsChanged.connect(self._update_rows, QtCore.Qt.QueuedConnection)
+        self._refresh_timer = QtCore.QTimer(self)
+        self._refresh_timer.timeout.connect(self._refresh_stats)
+        self._refresh_timer.start(refresh_interval)
+
+    def connect(self, name, signal, slot, owner=None, thread=None, coalesce=False,
+                backlog_threshold=10):
+        """ Connect a signal to a slot through a monitored connection.
+
+        @param str name: unique name of the connection. An existing connection with this name is
+                         replaced.
+        @param signal: bound signal of the sender
+        @param callable slot: function called with the arguments of the signal
+        @param QObject owner: optional, object the connection belongs to, usually the receiving
+                              module
+        @param QThread thread: optional, thread the slot is executed in. Defaults to the thread of
+                               the object of the slot if it is a QObject method, the thread of the
+                               owner or the calling thread, in this order.
+        @param bool coalesce: optional, deliver only the latest pending emission
+        @param int backlog_threshold: optional, number of pending emissions logged as a backlog
+
+        @return MonitoredConnection: the connection
+        """
+        if name in self._connections:
+            logger.warning('Signal connection {0} is already registered and will be replaced.'
+                           ''.format(name))
+            self.remove_connection(name)
+        if thread is None:
+            receiver = getattr(slot, '__self__', None)
+            if isinstance(receiver, QtCore.QObject):
+                thread = receiver.thread()
+            elif owner is not None:
+                thread = owner.thread()
+            else:
+                thread = QtCore.QThread.currentThread()
+        connection = MonitoredConnection(name, signal, slot, coalesce=coalesce, owner=owner,
+                                         backlog_threshold=backlog_threshold)
+        connection.moveToThread(thread)
+        app = QtCore.QCoreApplication.instance()
+        if not thread.objectName() and app is not None and thread is app.thread():
+            connection.thread_name = 'main'
+        else:
+            connection.thread_name = thread.objectName()
+        with self.lock:
+            self._connections[name] = connection
+        self.sigConnectionsChanged.emit()
+        return connection
+
+    def remove_connection(self, name):
+        """ Disconnect and remove a connection.
+
+        @param str name: name of the connection
+        """
+        with self.lock:
+            connection = self._connections.pop(name, None)
+        if connection is None:
+            return
+        connection.disconnect_signal()
+        connection.deleteLater()
+        self.sigConnectionsChanged.emit()
+
+    def remove_connections(self, owner):
+        """ Disconnect and remove all connections of an owner.
+
+        @param QObject owner: owner of the connections
+        """
+        for name in [name for name, conn in self._connections.items() if conn.owner is owner]:
+            self.remove_connection(name)
+
+    def connection(self, name):
+        """ @return MonitoredConnection: the connection with the given name, None if not registered
+        """
+        return self._connections.get(name)
+
+    def connections(self):
+        """ @return list: names of the registered connections """
+        return list(self._connections)
+
+    def set_coalesce(self, name, coalesce):
+        """ Switch the latest value wins delivery of a connection on or off.
+
+        @param str name: name of the connection
+        @param bool coalesce: deliver only the latest pending emission
+        """
+        connection = self._connections.get(name)
+        if connection is not None:
+            connection.coalesce = coalesce
+            self._refresh_stats()
+
+    @QtCore.Slot()
+    def _update_rows(self):
+        self.beginResetModel()
+        with self.lock:
+            self._rows = list(self._connections.values())
+        self.endResetModel()
+
+    @QtCore.Slot()
+    def _refresh_stats(self):
+        if self._rows:
+            self.dataChanged.emit(self.index(0, 2), self.index(len(self._rows) - 1, len(self.headers) - 1))
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        """ Gives the number of registered connections.
+
+          @return int: number of connections
+        """
+        return len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        """ Gives the number of data fields of a connection.
+
+          @return int: number of connection data fields
+        """
+        return len(self.headers)
+
+    def flags(self, index):
+        """ Determines what can be done with entry cells in the table view.
+
+          @param QModelIndex index: cell fo which the flags are requested
+
+          @return Qt.ItemFlags: actions allowed for this cell
+        """
+        if index.column() == self.coalesce_column:
+            return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsUserCheckable
+        return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+
+    def data(self, index, role):
+        """ Get data from model for a given cell. Data can have a role that affects display.
+
+          @param QModelIndex index: cell for which data is requested
+          @param ItemDataRole role: role for which data is requested
+
+          @return QVariant: data for given cell and role
+        """
+        if not index.isValid() or index.row() >= len(self._rows):
+            return None
+        connection = self._rows[index.row()]
+        column = index.column()
+        if column == self.coalesce_column:
+            if role == QtCore.Qt.CheckStateRole:
+                return QtCore.Qt.Checked if connection.coalesce else QtCore.Qt.Unchecked
+            return None
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if column == 0:
+            return connection.name
+        elif column == 1:
+            return connection.thread_name
+        elif column == 9:
+            return connection.state()
+        stats = connection.stats()
+        if column == 2:
+            return '{0:.2f}'.format(stats['rate'])
+        elif column == 3:
+            return '{0:.2f}'.format(stats['delay'] * 1e3)
+        elif column == 4:
+            return '{0:.2f}'.format(stats['max_delay'] * 1e3)
+        elif column == 5:
+            return '{0:.2f}'.format(stats['duration'] * 1e3)
+        elif column == 6:
+            return '{0} (max {1})'.format(stats['pending'], stats['max_pending'])
+        elif column == 7:
+            return str(stats['dropped'])
+        return None
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        """ Toggle the latest value wins delivery from the table view.
+
+          @param QModelIndex index: cell to change
+          @param value: new check state
+          @param ItemDataRole role: role of the change
+
+          @return bool: whether the data was changed
+        """
+        if (not index.isValid() or index.column() != self.coalesce_column
+                or role != QtCore.Qt.CheckStateRole or index.row() >= len(self._rows)):
+            return False
+        self._rows[index.row()].coalesce = (value == QtCore.Qt.Checked)
+        self.dataChanged.emit(index, self.index(index.row(), len(self.headers) - 1))
+        return True
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        """ Data for the table view headers.
+
+          @param int section: number of the column to get header data for
+          @param Qt.Orientation: orientation of header (horizontal or vertical)
+          @param ItemDataRole: role for which to get data
+
+          @return QVariant: header data for given column and role
+        """
+        if not (0 <= section < len(self.headers)):
+            return None
+        elif role != QtCore.Qt.DisplayRole:
+            return None
+        elif orientation != QtCore.Qt.Horizontal:
+            return None
+        return self.headers[section]
@@ -25,6 +25,7 @@ logger = logging.getLogger(__name__)
 from qtpy import QtCore
 from collections import OrderedDict
 from .util.mutex import Mutex
+from .sampling_profiler import sampling_profiler
 
 
 class ThreadManager(QtCore.QAbstractTableModel):
@@ -211,6 +212,19 @@ class ThreadItem(QtCore.QObject):
         self.thread.setObjectName(name)
         self.name = name
         self.thread.finished.connect(self.myThreadHasQuit)
+        # started is emitted in the new thread, register its name for the sampling profiler there
+        self.thread.started.connect(self.registerThreadName, QtCore.Qt.DirectConnection)
+        self.thread.finished.connect(self.unregisterThreadName, QtCore.Qt.DirectConnection)
+
+    def registerThreadName(self):
+        """ Signal handler for the start of the thread, called in the new thread.
+        """
+        sampling_profiler.register_thread(self.name)
+
+    def unregisterThreadName(self):
+        """ Signal handler for the end of the thread, called in the finishing thread.
+        """
+        sampling_profiler.unregister_thread()
 
     def myThreadHasQuit(self):
         """ Signal handler for quitting thread.
@@ -24,11 +24,199 @@ Originally distributed under MIT/X11 license. See documentation/MITLicense.txt f
 """
 
 from qtpy import QtCore
+from bisect import bisect
+from time import perf_counter
+import json
+import os
+import sys
 import traceback
+import weakref
 import logging
 logger = logging.getLogger(__name__)
 
 
+class MutexStats:
+    """ Lock statistics of a single mutex, recorded while the MutexProfiler is enabled.
+
+    The statistics are only written by the thread holding the mutex, so they are serialized by
+    the mutex itself and need no additional lock.
+    """
+
+    # upper edges of the histogram bins in seconds, the last bin collects everything longer
+    bin_edges = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.acquisitions = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.wait_total = 0.
+        self.wait_max = 0.
+        self.hold_total = 0.
+        self.hold_max = 0.
+        self.wait_histogram = [0] * (len(self.bin_edges) + 1)
+        self.hold_histogram = [0] * (len(self.bin_edges) + 1)
+        # call site (filename, line, function) -> [count, hold_total, hold_max]
+        self.holders = dict()
+        # thread name -> [contended acquisitions, wait_total]
+        self.waiters = dict()
+
+    def add_wait(self, wait, contended):
+        self.acquisitions += 1
+        self.wait_histogram[bisect(self.bin_edges, wait)] += 1
+        if contended:
+            self.contended += 1
+            self.wait_total += wait
+            if wait > self.wait_max:
+                self.wait_max = wait
+            thread = _thread_name()
+            waiter = self.waiters.get(thread)
+            if waiter is None:
+                self.waiters[thread] = [1, wait]
+            else:
+                waiter[0] += 1
+                waiter[1] += wait
+
+    def add_hold(self, hold, site):
+        self.hold_total += hold
+        if hold > self.hold_max:
+            self.hold_max = hold
+        self.hold_histogram[bisect(self.bin_edges, hold)] += 1
+        holder = self.holders.get(site)
+        if holder is None:
+            self.holders[site] = [1, hold, hold]
+        else:
+            holder[0] += 1
+            holder[1] += hold
+            if hold > holder[2]:
+                holder[2] = hold
+
+
+class MutexProfiler:
+    """ Registry of all Mutex instances and switch for the recording of their lock statistics.
+
+    Every Mutex registers itself on creation, named after the module (or class) and the source
+    line that created it. While the profiler is enabled, each lock records whether it was
+    contended, how long the calling thread waited, how long the mutex was held and by which call
+    site. When disabled, the overhead of a lock is a single attribute check.
+
+    Enabled on startup with the entry 'mutex_profiling: True' in the global section of the
+    configuration or at runtime from the manager GUI or the console:
+
+        from core.util.mutex import mutex_profiler
+        mutex_profiler.enable()
+        ...
+        mutex_profiler.dump('mutex_profile.json')
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._mutexes = weakref.WeakSet()
+        self._enabled_since = None
+
+    def enable(self):
+        if not self.enabled:
+            self._enabled_since = perf_counter()
+            self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def register(self, mutex):
+        self._mutexes.add(mutex)
+
+    def reset(self):
+        """ Clear the statistics of all mutexes. """
+        for mutex in list(self._mutexes):
+            mutex.stats.reset()
+        if self.enabled:
+            self._enabled_since = perf_counter()
+
+    def snapshot(self, top=10):
+        """ Statistics of all mutexes which have been locked while the profiler was enabled.
+
+        @param int top: number of holders (call sites) and waiting threads to report per mutex
+
+        @return list(dict): statistics sorted by total wait time, times in seconds
+        """
+        result = list()
+        for mutex in list(self._mutexes):
+            stats = mutex.stats
+            if stats.acquisitions == 0:
+                continue
+            holders = sorted(dict(stats.holders).items(), key=lambda item: item[1][1], reverse=True)
+            waiters = sorted(dict(stats.waiters).items(), key=lambda item: item[1][1], reverse=True)
+            result.append({
+                'name': mutex.name,
+                'created': mutex.created,
+                'acquisitions': stats.acquisitions,
+                'contended': stats.contended,
+                'timeouts': stats.timeouts,
+                'wait_total': stats.wait_total,
+                'wait_max': stats.wait_max,
+                'hold_total': stats.hold_total,
+                'hold_max': stats.hold_max,
+                'wait_histogram': list(stats.wait_histogram),
+                'hold_histogram': list(stats.hold_histogram),
+                'holders': [{'site': _format_site(site), 'count': count, 'hold_total': total,
+                             'hold_max': maximum} for site, (count, total, maximum) in holders[:top]],
+                'waiters': [{'thread': thread, 'count': count, 'wait_total': total}
+                            for thread, (count, total) in waiters[:top]]
+            })
+        result.sort(key=lambda item: item['wait_total'], reverse=True)
+        return result
+
+    def dump(self, path, top=10):
+        """ Write the statistics of all mutexes to a JSON file.
+
+        @param str path: path of the JSON file
+        @param int top: number of holders and waiting threads to report per mutex
+        """
+        duration = 0. if self._enabled_since is None else perf_counter() - self._enabled_since
+        data = {'enabled': self.enabled,
+                'duration': duration,
+                'histogram_bin_edges': list(MutexStats.bin_edges),
+                'mutexes': self.snapshot(top)}
+        with open(path, 'w') as file:
+            json.dump(data, file, indent=2)
+
+
+mutex_profiler = MutexProfiler()
+
+
+def _thread_name():
+    thread = QtCore.QThread.currentThread()
+    app = QtCore.QCoreApplication.instance()
+    if app is not None and thread is app.thread():
+        return 'main'
+    return thread.objectName() or str(int(QtCore.QThread.currentThreadId()))
+
+
+def _call_site():
+    """ (filename, line, function) of the first frame outside of this file. """
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    if frame is None:
+        return '?', 0, '?'
+    return frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name
+
+
+def _format_site(site):
+    filename, line, function = site
+    return '{0}:{1} ({2})'.format(_relative_path(filename), line, function)
+
+
+def _relative_path(filename):
+    try:
+        return os.path.relpath(filename)
+    except ValueError:
+        # different drive on Windows
+        return filename
+
+
 class Mutex(QtCore.QMutex):
     """Extends QMutex (which serves as access serialization between threads).
 
@@ -37,6 +225,7 @@ class Mutex(QtCore.QMutex):
       (if initialized with debug=True)
     * Drop-in replacement for threading.Lock
     * Context management (enter/exit)
+    * Lock statistics (if the MutexProfiler is enabled)
     """
 
     def __init__(self, *args, **kargs):
@@ -46,6 +235,26 @@ class Mutex(QtCore.QMutex):
         self.mutex = QtCore.QMutex()  # for serializing access to self.tb
         self.tb = []
         self.debug = kargs.pop('debug', False)  # True to enable debugging functions
+        self.stats = MutexStats()
+        self._holds = []  # (lock time, call site) of the current holder, for the profiler
+        filename, line, _ = _call_site()
+        self.created = '{0}:{1}'.format(_relative_path(filename), line)
+        self.name = kargs.pop('name', None) or self._owner_name()
+        mutex_profiler.register(self)
+
+    @staticmethod
+    def _owner_name():
+        """ Name of the qudi module (or class) creating this mutex. """
+        frame = sys._getframe(2)
+        while frame is not None and frame.f_code.co_filename == __file__:
+            frame = frame.f_back
+        owner = None if frame is None else frame.f_locals.get('self')
+        if owner is None:
+            return '?' if frame is None else frame.f_code.co_name
+        name = getattr(owner, '_name', None)
+        if isinstance(name, str):
+            return '{0} ({1})'.format(name, type(owner).__name__)
+        return type(owner).__name__
 
     def tryLock(self, timeout=None, id=None):
         """ Try to lock  the mutex.
@@ -55,6 +264,25 @@ class Mutex(QtCore.QMutex):
 
             @return bool: whether locking succeeded
         """
+        if not mutex_profiler.enabled:
+            return self._try_lock(timeout, id)
+        start = perf_counter()
+        locked = self._try_lock(0, id)
+        contended = not locked
+        if contended and timeout:
+            locked = self._try_lock(timeout, id)
+        if locked:
+            self._record_lock(start, contended)
+        else:
+            self.stats.timeouts += 1
+        return locked
+
+    def _record_lock(self, start, contended):
+        now = perf_counter()
+        self.stats.add_wait(now - start, contended)
+        self._holds.append((now, _call_site()))
+
+    def _try_lock(self, timeout=None, id=None):
         if timeout is None:
             locked = QtCore.QMutex.tryLock(self)
         else:
@@ -78,8 +306,16 @@ class Mutex(QtCore.QMutex):
         """
         c = 0
         wait_time = 5000  # in ms
+        profile = mutex_profiler.enabled
+        if profile:
+            start = perf_counter()
+            if self._try_lock(0, id):
+                self._record_lock(start, False)
+                return
         while True:
-            if self.tryLock(wait_time, id):
+            if self._try_lock(wait_time, id):
+                if profile:
+                    self._record_lock(start, True)
                 break
             c += 1
             if self.debug:
@@ -98,6 +334,10 @@ class Mutex(QtCore.QMutex):
     def unlock(self):
         """ Unlock mutex.
         """
+        if self._holds:
+            locked, site = self._holds.pop()
+            if mutex_profiler.enabled:
+                self.stats.add_hold(perf_counter() - locked, site)
         QtCore.QMutex.unlock(self)
         if self.debug:
             self.mutex.lock()
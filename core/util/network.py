@@ -19,6 +19,10 @@ Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
 top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
 """
 
+import json
+import struct
+import zlib
+import numpy as np
 import rpyc.core.netref
 import rpyc.utils.classic
 
@@ -30,3 +34,148 @@ def netobtain(obj):
         return rpyc.utils.classic.obtain(obj)
     else:
         return obj
+
+
+PAYLOAD_RAW = b'\x00'
+PAYLOAD_ZLIB = b'\x01'
+_HEADER_SIZE = struct.Struct('<Q')
+MAX_PAYLOAD_SIZE = 2**32
+
+
+def pack_payload(obj, compression=0):
+    """
+    Serialize an object into a single bytes object for transfer by value.
+
+    Numpy arrays are stored as contiguous buffers, so a complete array is transferred in one
+    message instead of one network round trip per element access of a netref. Only data is
+    transferred (no pickle), so unpacking a payload received from the network cannot execute code.
+    Supported are None, bool, int, float, complex, str, bytes, lists, tuples, dicts, numpy arrays
+    (except object arrays) and numpy scalars, nested in any way.
+
+    @param obj: object to serialize, e.g. a numpy array or a container of arrays
+    @param int compression: optional, zlib compression level (1-9), no compression for 0
+
+    @return bytes: the serialized object
+    """
+    buffers = list()
+    header = json.dumps(_encode(obj, buffers), separators=(',', ':')).encode('utf-8')
+    body = b''.join([_HEADER_SIZE.pack(len(header)), header] + buffers)
+    if compression > 0 and len(body) >= 1024:
+        compressed = _HEADER_SIZE.pack(len(body)) + zlib.compress(body, compression)
+        if len(compressed) < len(body):
+            return PAYLOAD_ZLIB + compressed
+    return PAYLOAD_RAW + body
+
+
+def unpack_payload(payload, max_size=MAX_PAYLOAD_SIZE):
+    """
+    Deserialize an object packed by pack_payload. Returned numpy arrays are writable.
+
+    Compressed payloads are decompressed no further than the size given in front of the
+    compressed data, so a small payload received from the network cannot expand without bound.
+
+    @param bytes payload: the serialized object
+    @param int max_size: optional, largest accepted size of the decompressed payload in bytes
+
+    @return: the deserialized object
+    """
+    payload = bytes(netobtain(payload))
+    flag = payload[:1]
+    if flag == PAYLOAD_ZLIB:
+        body = _decompress(memoryview(payload)[1:], max_size)
+    elif flag == PAYLOAD_RAW:
+        body = bytearray(memoryview(payload)[1:])
+    else:
+        raise ValueError('Unknown payload type {0!r}.'.format(flag))
+    header_size = _HEADER_SIZE.unpack_from(body)[0]
+    start = _HEADER_SIZE.size
+    tree = json.loads(body[start:start + header_size].decode('utf-8'))
+    return _decode(tree, memoryview(body)[start + header_size:])
+
+
+def _decompress(data, max_size):
+    """ Decompress the body of a compressed payload, which starts with its decompressed size. """
+    if len(data) < _HEADER_SIZE.size:
+        raise ValueError('Truncated compressed payload.')
+    size = _HEADER_SIZE.unpack_from(data)[0]
+    if size > max_size:
+        raise ValueError('Payload of {0} bytes exceeds the limit of {1} bytes.'.format(size, max_size))
+    decompressor = zlib.decompressobj()
+    body = bytearray(decompressor.decompress(data[_HEADER_SIZE.size:], size))
+    if decompressor.unconsumed_tail or len(body) > size:
+        raise ValueError('Compressed payload is larger than its declared size of {0} bytes.'.format(size))
+    if not decompressor.eof or len(body) != size:
+        raise ValueError('Compressed payload is truncated or smaller than its declared size.')
+    return body
+
+
+def _encode(obj, buffers):
+    """ Convert obj into a JSON compatible tree. The data of numpy arrays and bytes is appended to
+        buffers, in the order in which _decode reads it back.
+    """
+    if obj is None or isinstance(obj, (bool, str)):
+        return obj
+    if isinstance(obj, (int, float)) and not isinstance(obj, np.generic):
+        return obj
+    if isinstance(obj, complex):
+        return {'complex': [obj.real, obj.imag]}
+    if isinstance(obj, (bytes, bytearray)):
+        buffers.append(bytes(obj))
+        return {'bytes': len(obj)}
+    if isinstance(obj, (np.ndarray, np.generic)):
+        array = np.asarray(obj)
+        if array.dtype.hasobject:
+            raise TypeError('Numpy arrays of Python objects can not be transferred.')
+        buffers.append(array.tobytes())
+        return {'ndarray': array.dtype.str, 'shape': list(array.shape), 'scalar': isinstance(obj, np.generic)}
+    if isinstance(obj, list):
+        return [_encode(item, buffers) for item in obj]
+    if isinstance(obj, tuple):
+        return {'tuple': [_encode(item, buffers) for item in obj]}
+    if isinstance(obj, dict):
+        return {'dict': [[_encode(key, buffers), _encode(value, buffers)] for key, value in obj.items()]}
+    raise TypeError('Objects of type {0} can not be transferred.'.format(type(obj).__name__))
+
+
+def _decode(tree, data):
+    """ Rebuild the object encoded by _encode from the tree and the concatenated buffers. """
+    position = 0
+
+    def read(size):
+        nonlocal position
+        if size < 0 or position + size > len(data):
+            raise ValueError('Payload truncated.')
+        position += size
+        return data[position - size:position]
+
+    def decode(node):
+        if isinstance(node, list):
+            return [decode(item) for item in node]
+        if not isinstance(node, dict):
+            return node
+        if 'tuple' in node:
+            return tuple(decode(item) for item in node['tuple'])
+        if 'dict' in node:
+            return {_hashable(decode(key)): decode(value) for key, value in node['dict']}
+        if 'complex' in node:
+            return complex(*node['complex'])
+        if 'bytes' in node:
+            return bytes(read(int(node['bytes'])))
+        if 'ndarray' in node:
+            dtype = np.dtype(node['ndarray'])
+            if dtype.hasobject:
+                raise ValueError('Numpy arrays of Python objects can not be transferred.')
+            shape = tuple(int(n) for n in node['shape'])
+            count = int(np.prod(shape, dtype=np.int64))
+            array = np.frombuffer(read(count * dtype.itemsize), dtype=dtype, count=count).reshape(shape)
+            return array[()] if node['scalar'] else array
+        raise ValueError('Unknown node in payload.')
+
+    return decode(tree)
+
+
+def _hashable(key):
+    """ Dict keys that were tuples are decoded as tuples, lists are not valid keys. """
+    if isinstance(key, list):
+        return tuple(_hashable(item) for item in key)
+    return key
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains a writer for image stacks in the OME-Zarr format (OME-NGFF, version 0.4).
+
+The data is stored in a directory store: every chunk is a separate file, so an ongoing acquisition
+can be opened by a viewer and copied to a server chunk by chunk. Each chunk holds a single plane of
+a single channel. The axes are (c, z, y, x). Frames are appended one after the other, with the
+channels interleaved as in the stacks acquired by the camera (frame i belongs to channel i % c).
+
+Together with the full resolution data (dataset '0'), a pyramid of downsampled versions (datasets
+'1', '2', ..., each binned 2 x 2 with respect to the previous one) is written while the frames are
+appended. The metadata is stored in the attributes of the group, under the key 'qudi', next to the
+OME-NGFF 'multiscales' description.
+
+Requires the zarr (version 2) and numcodecs packages.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import json
+import numpy as np
+
+try:
+    import zarr
+    from numcodecs import Blosc
+    has_zarr = True
+except ImportError:
+    zarr = None
+    Blosc = None
+    has_zarr = False
+
+
+class OmeZarrWriter:
+    """
+    Appends frames of a fixed shape to an OME-Zarr image with a multiscale pyramid.
+
+    The shape of the arrays is updated after each append, so a reader always sees the frames
+    written so far. Memory usage is bounded by the size of the blocks passed to append.
+
+    Usage:
+        with OmeZarrWriter(path, channels=2, metadata=metadata) as writer:
+            writer.append(block)  # block of shape (n, rows, cols)
+    """
+
+    def __init__(self, path, channels=1, metadata=None, pyramid_levels=3, compression='zstd',
+                 compression_level=3, pixel_size=1., z_step=1., dtype=np.uint16):
+        """
+        @param str path: full path of the directory to create (usually with the suffix .zarr).
+                         An existing image is overwritten.
+        @param int channels: optional, number of interleaved channels in the stack
+        @param dict metadata: optional, JSON serializable metadata to store in the attributes
+        @param int pyramid_levels: optional, number of downsampled levels in addition to the full
+                                   resolution data
+        @param str compression: optional, name of the blosc compressor ('zstd', 'lz4', 'blosclz',
+                                'zlib') for lossless compression. No compression if None.
+        @param int compression_level: optional, compression level (1 - 9)
+        @param float pixel_size: optional, pixel size in µm
+        @param float z_step: optional, distance between the planes in µm
+        @param dtype: optional, numpy dtype of the data
+        """
+        if not has_zarr:
+            raise ImportError('The packages zarr and numcodecs are required to write OME-Zarr files.')
+        self.path = path
+        self.channels = max(1, int(channels))
+        self.metadata = dict() if metadata is None else dict(metadata)
+        self.pyramid_levels = max(0, int(pyramid_levels))
+        self.pixel_size = float(pixel_size)
+        self.z_step = float(z_step)
+        self.dtype = np.dtype(dtype)
+        if compression is None:
+            self._compressor = None
+        else:
+            self._compressor = Blosc(cname=compression, clevel=compression_level, shuffle=Blosc.BITSHUFFLE)
+        self._group = zarr.open_group(zarr.DirectoryStore(path), mode='w')
+        self._arrays = None
+        self._frame_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def frame_count(self):
+        return self._frame_count
+
+    @property
+    def closed(self):
+        return self._group is None
+
+    def append(self, frames):
+        """
+        Append one or several frames to the image. The pyramid levels are updated for the new
+        frames only.
+
+        @param numpy.ndarray frames: a single frame of shape (rows, cols) or several frames of
+                                     shape (n, rows, cols)
+
+        @return int: the number of frames written
+        """
+        if self._group is None:
+            raise ValueError('Can not append to closed OME-Zarr image "{0}".'.format(self.path))
+        frames = np.asarray(frames)
+        if frames.ndim == 2:
+            frames = frames[np.newaxis]
+        if self._arrays is None:
+            self._create_arrays(frames.shape[1:])
+        if frames.shape[1:] != self._arrays[0].shape[2:]:
+            raise ValueError('Frames of shape {0} do not match the frame shape {1} of the OME-Zarr '
+                             'image.'.format(frames.shape[1:], self._arrays[0].shape[2:]))
+
+        planes = -(-(self._frame_count + len(frames)) // self.channels)  # ceil division
+        for array in self._arrays:
+            if array.shape[1] < planes:
+                array.resize(array.shape[:1] + (planes,) + array.shape[2:])
+
+        for frame in frames:
+            channel, plane = self._frame_count % self.channels, self._frame_count // self.channels
+            frame = frame.astype(self.dtype, copy=False)
+            for array in self._arrays:
+                array[channel, plane] = frame
+                frame = self._downsample(frame)
+            self._frame_count += 1
+        return len(frames)
+
+    def update_metadata(self, **kwargs):
+        """ Update the metadata stored in the attributes. Written to disk with the next flush. """
+        self.metadata.update(kwargs)
+
+    def flush(self):
+        """ Write the attributes of the group (the chunks are written on append). """
+        if self._group is None:
+            return
+        self._group.attrs.put({'multiscales': self._multiscales(),
+                               'qudi': {'frame_count': self._frame_count,
+                                        'metadata': json.loads(json.dumps(self.metadata, default=str))}})
+
+    def close(self):
+        """ Write the final attributes. """
+        if self._group is None:
+            return
+        self.flush()
+        self._group = None
+
+    def _create_arrays(self, frame_shape):
+        rows, cols = (int(n) for n in frame_shape)
+        self._arrays = []
+        for level in range(self.pyramid_levels + 1):
+            shape = (self.channels, 0, rows, cols)
+            self._arrays.append(self._group.create_dataset(str(level), shape=shape, chunks=(1, 1, rows, cols),
+                                                           dtype=self.dtype, compressor=self._compressor,
+                                                           fill_value=0))
+            rows, cols = max(1, rows // 2), max(1, cols // 2)
+        self.flush()
+
+    def _downsample(self, frame):
+        """ Bin a frame by 2 x 2 pixels (mean). Odd last rows or columns are dropped. """
+        rows, cols = frame.shape
+        if rows < 2 or cols < 2:
+            return frame
+        binned = frame[:rows // 2 * 2, :cols // 2 * 2].reshape(rows // 2, 2, cols // 2, 2).mean(axis=(1, 3))
+        return binned.astype(self.dtype)
+
+    def _multiscales(self):
+        datasets = []
+        for level in range(self.pyramid_levels + 1):
+            scale = [1., self.z_step, self.pixel_size * 2 ** level, self.pixel_size * 2 ** level]
+            datasets.append({'path': str(level), 'coordinateTransformations': [{'type': 'scale', 'scale': scale}]})
+        return [{'version': '0.4',
+                 'axes': [{'name': 'c', 'type': 'channel'},
+                          {'name': 'z', 'type': 'space', 'unit': 'micrometer'},
+                          {'name': 'y', 'type': 'space', 'unit': 'micrometer'},
+                          {'name': 'x', 'type': 'space', 'unit': 'micrometer'}],
+                 'datasets': datasets,
+                 'type': 'mean'}]
+
+
+def read_ome_zarr(path, level=0):
+    """
+    Open an OME-Zarr image written by OmeZarrWriter. The data is not loaded, the chunks are read
+    when the array is indexed.
+
+    @param str path: path of the OME-Zarr directory
+    @param int level: optional, pyramid level (0 = full resolution)
+
+    @return zarr.Array, dict: data of shape (c, z, y, x), metadata
+    """
+    if not has_zarr:
+        raise ImportError('The packages zarr and numcodecs are required to read OME-Zarr files.')
+    group = zarr.open_group(zarr.DirectoryStore(path), mode='r')
+    return group[str(level)], group.attrs.get('qudi', dict()).get('metadata', dict())
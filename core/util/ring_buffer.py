@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains a ring buffer for multichannel time traces and incremental filters working on it.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class RingBuffer:
+    """
+    Fixed size buffer for multichannel time traces of shape (channels, size).
+
+    Every sample is stored twice (at index i and i + size of an array of length 2 * size). This way
+    the chronologically ordered trace is always a contiguous slice of the internal array and can be
+    returned as a view without copying or rolling the data. Appending n samples costs O(n).
+
+    Views returned by the data property are only valid until the next append. The oldest samples
+    of an old view are overwritten by the newest ones.
+    """
+
+    def __init__(self, channels, size, dtype=np.float64, fill_value=0):
+        """
+        @param int channels: number of channels (rows) of the trace
+        @param int size: number of samples per channel
+        @param dtype: numpy dtype of the data
+        @param fill_value: initial value of all samples
+        """
+        if size < 1:
+            raise ValueError('RingBuffer size must be >= 1.')
+        self._size = int(size)
+        self._buffer = np.full((int(channels), 2 * self._size), fill_value, dtype=dtype)
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def channels(self):
+        return self._buffer.shape[0]
+
+    @property
+    def dtype(self):
+        return self._buffer.dtype
+
+    @property
+    def samples_written(self):
+        """ Total number of samples appended since creation or the last reset. """
+        return self._count
+
+    @property
+    def data(self):
+        """ Read-only view of shape (channels, size) ordered from the oldest to the newest sample.
+        """
+        view = self._buffer[:, self._head:self._head + self._size]
+        view.flags.writeable = False
+        return view
+
+    def latest(self, count):
+        """
+        Read-only view of the newest samples.
+
+        @param int count: number of samples (<= size)
+
+        @return numpy.ndarray: view of shape (channels, count)
+        """
+        count = min(int(count), self._size)
+        end = self._head + self._size
+        view = self._buffer[:, end - count:end]
+        view.flags.writeable = False
+        return view
+
+    def reset(self, fill_value=0):
+        self._buffer[...] = fill_value
+        self._head = 0
+        self._count = 0
+
+    def append(self, data):
+        """
+        Append new samples to the buffer. If more than size samples are passed only the newest are
+        kept.
+
+        @param numpy.ndarray data: new samples of shape (channels, n) or (channels,) for a single
+                                   sample
+        """
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data[:, np.newaxis]
+        count = data.shape[1]
+        if count == 0:
+            return
+        self._count += count
+        if count >= self._size:
+            self._buffer[:, :self._size] = data[:, -self._size:]
+            self._buffer[:, self._size:] = data[:, -self._size:]
+            self._head = 0
+            return
+
+        first = min(count, self._size - self._head)
+        self._write(self._head, data[:, :first])
+        if first < count:
+            self._write(0, data[:, first:])
+        self._head = (self._head + count) % self._size
+
+    def overwrite_latest(self, data):
+        """
+        Overwrite the newest samples of the buffer without advancing it.
+
+        @param numpy.ndarray data: samples of shape (channels, n) with n <= size or (channels,) for
+                                   a single sample
+        """
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data[:, np.newaxis]
+        count = data.shape[1]
+        if count > self._size:
+            raise ValueError('Can not overwrite more samples than the buffer size.')
+        start = (self._head - count) % self._size
+        first = min(count, self._size - start)
+        self._write(start, data[:, :first])
+        if first < count:
+            self._write(0, data[:, first:])
+
+    def _write(self, position, data):
+        stop = position + data.shape[1]
+        self._buffer[:, position:stop] = data
+        self._buffer[:, position + self._size:stop + self._size] = data
+
+
+class MovingAverageFilter:
+    """
+    Incremental moving average with a uniform window.
+
+    Only the filter output for the newest samples of a RingBuffer is calculated, using the
+    width - 1 samples before them, i.e. the cost is O(new samples + width) per update.
+    """
+
+    def __init__(self, width):
+        self.width = max(1, int(width))
+
+    def __call__(self, buffer, count, rows=None):
+        """
+        @param RingBuffer buffer: the input trace buffer
+        @param int count: number of newest samples to calculate the filter output for
+        @param list rows: optional, indices of the channels to filter. All channels if None.
+
+        @return numpy.ndarray: filter output of shape (channels, count)
+        """
+        width = min(self.width, buffer.size)
+        count = min(int(count), buffer.size - width + 1)
+        tail = buffer.latest(count + width - 1)
+        if rows is not None:
+            tail = tail[rows]
+        cumsum = np.cumsum(tail, axis=1, dtype=np.float64)
+        result = cumsum[:, width - 1:].copy()
+        result[:, 1:] -= cumsum[:, :-width]
+        return result / width
+
+
+class MovingMedianFilter:
+    """
+    Incremental moving median. Only the output for the newest samples of a RingBuffer is
+    calculated, vectorized over all channels. The cost is O(new samples * width) per update.
+    """
+
+    def __init__(self, width):
+        self.width = max(1, int(width))
+
+    def __call__(self, buffer, count, rows=None):
+        """
+        @param RingBuffer buffer: the input trace buffer
+        @param int count: number of newest samples to calculate the filter output for
+        @param list rows: optional, indices of the channels to filter. All channels if None.
+
+        @return numpy.ndarray: filter output of shape (channels, count)
+        """
+        width = min(self.width, buffer.size)
+        count = min(int(count), buffer.size - width + 1)
+        tail = buffer.latest(count + width - 1)
+        if rows is not None:
+            tail = tail[rows]
+        return np.median(sliding_window_view(tail, width, axis=1), axis=2)
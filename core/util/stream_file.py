@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains a simple appendable binary file format to stream data to disk.
+
+The file consists of a fixed size text header followed by the raw data. The header is a JSON
+dictionary (padded with spaces) holding the dtype and the shape of a single frame (record), the
+number of frames written and arbitrary metadata. The data is written frame after frame in C-order,
+so the file can be memory-mapped as an array of shape (frame_count, *frame_shape).
+
+The frame count in the header is only updated on flush and close. If the writing process crashes
+the number of complete frames is recovered from the file size, so a partial file is still readable.
+
+BackgroundStreamFileWriter does the writing, syncing and closing in its own thread, so a data
+acquisition loop appending to the file is never blocked by the disk.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STREAM_FILE_MAGIC = b'QUDISTREAM\n'
+STREAM_FILE_HEADER_SIZE = 4096
+
+
+class StreamFileWriter:
+    """
+    Appends frames of a fixed shape and dtype to a binary file with header.
+
+    Memory usage is bounded by the size of the blocks passed to append, nothing is accumulated.
+    The file is flushed and synced to disk at least every fsync_interval seconds.
+
+    Usage:
+        with StreamFileWriter(path, frame_shape=(3,), dtype=np.float64) as writer:
+            writer.append(block)  # block of shape (n, 3)
+    """
+
+    def __init__(self, path, frame_shape, dtype, metadata=None, fsync_interval=5.0):
+        """
+        @param str path: full path of the file to create. An existing file is overwritten.
+        @param tuple frame_shape: shape of a single frame, e.g. (channels,) or (height, width)
+        @param dtype: numpy dtype of the data
+        @param dict metadata: optional, JSON serializable metadata to store in the header
+        @param float fsync_interval: optional, maximum time in seconds between two syncs to disk.
+                                     Syncing is disabled for values <= 0.
+        """
+        self.path = path
+        self.frame_shape = tuple(int(n) for n in frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.metadata = dict() if metadata is None else dict(metadata)
+        self.fsync_interval = fsync_interval
+        self._frame_nbytes = int(np.prod(self.frame_shape, dtype=np.int64)) * self.dtype.itemsize
+        self._frame_count = 0
+        self._last_sync = time.monotonic()
+        self._file = open(path, 'wb')
+        self._write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def frame_count(self):
+        return self._frame_count
+
+    @property
+    def bytes_written(self):
+        return self._frame_count * self._frame_nbytes
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def append(self, frames):
+        """
+        Append one or several frames to the file.
+
+        @param numpy.ndarray frames: a single frame of shape frame_shape or several frames of shape
+                                     (n, *frame_shape)
+
+        @return int: the number of frames written
+        """
+        if self._file is None:
+            raise ValueError('Can not append to closed stream file "{0}".'.format(self.path))
+        frames = np.asarray(frames)
+        if frames.shape == self.frame_shape:
+            frames = frames[np.newaxis]
+        if frames.shape[1:] != self.frame_shape:
+            raise ValueError('Frames of shape {0} do not match the frame shape {1} of the stream '
+                             'file.'.format(frames.shape[1:], self.frame_shape))
+        frames = np.ascontiguousarray(frames, dtype=self.dtype)
+        self._file.write(frames.data)
+        self._frame_count += frames.shape[0]
+
+        if 0 < self.fsync_interval <= time.monotonic() - self._last_sync:
+            self.flush()
+        return frames.shape[0]
+
+    def update_metadata(self, **kwargs):
+        """ Update the metadata stored in the header. Written to disk with the next flush. """
+        self.metadata.update(kwargs)
+
+    def flush(self):
+        """ Update the header and sync the file to disk. """
+        if self._file is None:
+            return
+        self._write_header()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        """ Write the final header and close the file. """
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+    def _write_header(self):
+        header = {'dtype': self.dtype.str,
+                  'frame_shape': self.frame_shape,
+                  'frame_count': self._frame_count,
+                  'metadata': self.metadata}
+        header = STREAM_FILE_MAGIC + json.dumps(header, default=str).encode('utf-8')
+        if len(header) >= STREAM_FILE_HEADER_SIZE:
+            raise ValueError('Stream file metadata too large to fit into the header.')
+        header = header.ljust(STREAM_FILE_HEADER_SIZE - 1) + b'\n'
+        position = self._file.tell()
+        self._file.seek(0)
+        self._file.write(header)
+        if position > 0:
+            self._file.seek(position)
+
+
+class BackgroundStreamFileWriter:
+    """
+    StreamFileWriter running in a writer thread. append, update_metadata and close only queue the
+    request and return immediately. The file is written, synced (see fsync_interval) and closed by
+    the writer thread in the order of the requests.
+
+    The queued frames are not copied, the caller must not modify them afterwards. If the disk can
+    not keep up, append blocks once max_queued_blocks blocks are waiting, so the memory stays
+    bounded. Errors of the writer thread are logged, the following frames are discarded.
+    """
+
+    def __init__(self, path, frame_shape, dtype, metadata=None, fsync_interval=5.0,
+                 max_queued_blocks=1000):
+        """
+        @param int max_queued_blocks: optional, maximum number of blocks waiting to be written
+
+        See StreamFileWriter for the other parameters. The file is created in the calling thread,
+        so an OSError is raised here.
+        """
+        self._writer = StreamFileWriter(path, frame_shape, dtype, metadata=metadata,
+                                        fsync_interval=fsync_interval)
+        self.path = path
+        self.frame_shape = self._writer.frame_shape
+        self._frame_count = 0
+        self._closing = False
+        self._queue = queue.Queue(maxsize=max(1, int(max_queued_blocks)))
+        self._thread = threading.Thread(target=self._run, name='stream-file-writer', daemon=True)
+        self._thread.start()
+
+    @property
+    def frame_count(self):
+        """ Number of frames appended so far, including the frames not yet written. """
+        return self._frame_count
+
+    @property
+    def closed(self):
+        return self._closing
+
+    def append(self, frames):
+        """
+        Queue one or several frames to be appended to the file.
+
+        @param numpy.ndarray frames: a single frame of shape frame_shape or several frames of shape
+                                     (n, *frame_shape)
+
+        @return int: the number of frames queued
+        """
+        if self._closing:
+            raise ValueError('Can not append to closed stream file "{0}".'.format(self.path))
+        frames = np.asarray(frames)
+        if frames.shape == self.frame_shape:
+            frames = frames[np.newaxis]
+        if frames.shape[1:] != self.frame_shape:
+            raise ValueError('Frames of shape {0} do not match the frame shape {1} of the stream '
+                             'file.'.format(frames.shape[1:], self.frame_shape))
+        self._queue.put(('append', frames))
+        self._frame_count += frames.shape[0]
+        return frames.shape[0]
+
+    def update_metadata(self, **kwargs):
+        """ Update the metadata stored in the header. Written with the next flush of the writer. """
+        self._queue.put(('metadata', kwargs))
+
+    def close(self, callback=None, wait=True):
+        """
+        Write the final header and close the file in the writer thread.
+
+        @param callable callback: optional, called in the writer thread with the path of the file
+                                  once it is closed
+        @param bool wait: optional, block until the file is closed and the callback has returned
+        """
+        if not self._closing:
+            self._closing = True
+            self._queue.put(('close', callback))
+        if wait:
+            self._thread.join()
+
+    def _run(self):
+        failed = False
+        while True:
+            request, argument = self._queue.get()
+            try:
+                if request == 'append' and not failed:
+                    self._writer.append(argument)
+                elif request == 'metadata':
+                    self._writer.update_metadata(**argument)
+                elif request == 'close':
+                    self._writer.close()
+                    if argument is not None:
+                        argument(self.path)
+                    return
+            except Exception:
+                logger.exception('Error while writing stream file "{0}".'.format(self.path))
+                failed = True
+                if request == 'close':
+                    return
+
+
+def read_stream_file_header(path):
+    """
+    Read the header of a stream file.
+
+    The frame count is corrected using the file size, e.g. if the file has not been closed
+    properly. Incomplete trailing frames are ignored.
+
+    @param str path: path of the stream file
+
+    @return dict: header with keys 'dtype', 'frame_shape', 'frame_count' and 'metadata'
+    """
+    with open(path, 'rb') as file:
+        raw_header = file.read(STREAM_FILE_HEADER_SIZE)
+    if not raw_header.startswith(STREAM_FILE_MAGIC) or len(raw_header) < STREAM_FILE_HEADER_SIZE:
+        raise ValueError('File "{0}" is not a qudi stream file.'.format(path))
+    header = json.loads(raw_header[len(STREAM_FILE_MAGIC):].decode('utf-8'))
+    header['dtype'] = np.dtype(header['dtype'])
+    header['frame_shape'] = tuple(header['frame_shape'])
+    frame_nbytes = int(np.prod(header['frame_shape'], dtype=np.int64)) * header['dtype'].itemsize
+    if frame_nbytes > 0:
+        data_nbytes = os.path.getsize(path) - STREAM_FILE_HEADER_SIZE
+        # frames are always written before the header is updated, so the file size is the truth
+        header['frame_count'] = data_nbytes // frame_nbytes
+    return header
+
+
+def read_stream_file(path, mmap=True):
+    """
+    Read the data of a stream file.
+
+    @param str path: path of the stream file
+    @param bool mmap: optional, return a read-only memory-mapped array instead of loading the data
+
+    @return numpy.ndarray, dict: data of shape (frame_count, *frame_shape), header
+    """
+    header = read_stream_file_header(path)
+    shape = (header['frame_count'],) + header['frame_shape']
+    if mmap and header['frame_count'] > 0:
+        data = np.memmap(path, dtype=header['dtype'], mode='r', offset=STREAM_FILE_HEADER_SIZE,
+                         shape=shape)
+    else:
+        with open(path, 'rb') as file:
+            file.seek(STREAM_FILE_HEADER_SIZE)
+            data = np.fromfile(file, dtype=header['dtype'], count=int(np.prod(shape)))
+        data = data.reshape(shape)
+    return data, header
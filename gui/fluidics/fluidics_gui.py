@@ -36,6 +36,7 @@ from functools import partial
 import numpy as np
 
 from gui.guibase import GUIBase
+from gui.guiutils import DecimatedTracePlot
 from core.connector import Connector
 from core.configoption import ConfigOption
 
@@ -232,18 +233,16 @@ class FluidicsGUI(GUIBase):
         It establishes the signal-slot connections for the toolbar actions.
         """
         # initialize the line plot
-        # data for flowrate plot initialization
-        self.t_data = []
-        self.flowrate_data = []
-        self.pressure_data = []
-
         # create a reference to the line object (this is returned when calling plot method of pg.PlotWidget)
         self._mw.flowrate_PlotWidget.setLabel('left', 'Flowrate', units='ul/min')
         # self._mw.flowrate_PlotWidget.setLabel('left', 'Pressure', units='mbar')
         self._mw.flowrate_PlotWidget.setLabel('bottom', 'Time', units='s')
         self._mw.flowrate_PlotWidget.addLegend()
-        self._flowrate_timetrace = self._mw.flowrate_PlotWidget.plot(self.t_data, self.flowrate_data, pen=(255, 0, 0), name='flowrate')
-        self._pressure_timetrace = self._mw.flowrate_PlotWidget.plot(self.t_data, self.pressure_data, pen=(0, 0, 255), name='pressure')
+        self._flowrate_timetrace = self._mw.flowrate_PlotWidget.plot([], [], pen=(255, 0, 0), name='flowrate')
+        self._pressure_timetrace = self._mw.flowrate_PlotWidget.plot([], [], pen=(0, 0, 255), name='pressure')
+        # the whole measurement is shown, decimated to the plot width (one sample per second)
+        self._flow_trace = DecimatedTracePlot(self._mw.flowrate_PlotWidget,
+                                              [self._flowrate_timetrace, self._pressure_timetrace])
 
         # set text to unit labels
         self._mw.pressure_unit_Label.setText(self._flow_logic.get_pressure_unit()[0])  # first element of the returned list. For multiplexing case, more widgets would be created and another list element affected.
@@ -559,9 +558,7 @@ class FluidicsGUI(GUIBase):
             self.sigStopFlowMeasure.emit()
         else:
             self._mw.start_flow_measurement_Action.setText('Stop flowrate measurement')
-            self.t_data = []
-            self.flowrate_data = []
-            self.pressure_data = []
+            self._flow_trace.clear()
             self.sigStartFlowMeasure.emit()
 
     @QtCore.Slot(list, list)
@@ -581,21 +578,7 @@ class FluidicsGUI(GUIBase):
         :param float pressure: current pressure value retrieved from hardware
         :param float flowrate: current flowrate retrieved from hardware
         """
-        if len(self.flowrate_data) < 100:
-            self.t_data.append(len(self.t_data))
-            self.flowrate_data.append(flowrate)
-            self.pressure_data.append(pressure)
-
-        else:
-            self.t_data[:-1] = self.t_data[1:]
-            self.t_data[-1] += 1
-            self.flowrate_data[:-1] = self.flowrate_data[1:]  # shift data one position to the left
-            self.flowrate_data[-1] = flowrate
-            self.pressure_data[:-1] = self.pressure_data[1:]  # shift data one position to the left
-            self.pressure_data[-1] = pressure
-
-        self._flowrate_timetrace.setData(self.t_data, self.flowrate_data)  # t axis running with time
-        self._pressure_timetrace.setData(self.t_data, self.pressure_data)
+        self._flow_trace.append(self._flow_trace.history.samples, [flowrate, pressure])
 
     @QtCore.Slot()
     def measure_volume_clicked(self):
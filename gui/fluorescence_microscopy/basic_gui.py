@@ -365,7 +365,10 @@ class BasicGUI(GUIBase):
         self._camera_logic.sigTemperatureChanged.connect(self.update_temperature)
 
         # data acquisition signals
-        self._camera_logic.sigUpdateDisplay.connect(self.update_data)
+        # only the latest image is displayed if the gui thread falls behind
+        self.getSignalMonitor().connect('{0}.sigUpdateDisplay'.format(self._name),
+                                        self._camera_logic.sigUpdateDisplay, self.update_data, owner=self,
+                                        coalesce=True)
         self._camera_logic.sigAcquisitionFinished.connect(self.acquisition_finished)  # for single acquisition
         self._camera_logic.sigVideoFinished.connect(self.enable_camera_toolbuttons)
         self._camera_logic.sigVideoSavingFinished.connect(self.video_saving_finished)
@@ -825,7 +828,7 @@ class BasicGUI(GUIBase):
         # disable camera related toolbuttons
         self.disable_camera_toolbuttons()
         # set the flag to True so that the dialog knows that is was called from save video button
-        if self._camera_logic.get_name() == 'iXon Ultra 897':
+        if self._camera_logic.spooling_available():
             self._spooling = True
         else:
             self._video = True
@@ -843,7 +846,7 @@ class BasicGUI(GUIBase):
         self.disable_camera_toolbuttons()
         # decide depending on camera which signal has to be emitted in save_video_accepted method
         # same approach can later be used to regroup save_video and save_long_video buttons into one action
-        if self._camera_logic.get_name() == 'iXon Ultra 897':
+        if self._camera_logic.spooling_available():
             self._spooling = True
         else:
             self._video = True
@@ -1090,8 +1093,10 @@ class BasicGUI(GUIBase):
     def laser_set_to_zero(self):
         """ Callback of laser_zero_Action.
         """
-        for item in self.laser_DSpinBoxes:
-            item.setValue(0)
+        # each spinbox updates one laser line: send the new intensities to the celesta source at once
+        with self._laser_logic.lumencor_coalesced_update():
+            for item in self.laser_DSpinBoxes:
+                item.setValue(0)
         # also set brightfield control to zero in case it is available
         if self.brightfield_control:
             self.bf_control_DSpinBox.setValue(0)
@@ -1114,9 +1119,10 @@ class BasicGUI(GUIBase):
 # callbacks of signals from logic --------------------------------------------------------------------------------------
     def update_laser_spinbox(self):
         """ Update values in laser spinboxes if the intensity dictionary in the logic module was changed """
-        for index, item in enumerate(self.laser_DSpinBoxes):
-            label = 'laser'+str(index + 1)  # create the label to address the corresponding laser
-            item.setValue(self._laser_logic._intensity_dict[label])
+        with self._laser_logic.lumencor_coalesced_update():
+            for index, item in enumerate(self.laser_DSpinBoxes):
+                label = 'laser'+str(index + 1)  # create the label to address the corresponding laser
+                item.setValue(self._laser_logic._intensity_dict[label])
 
     @QtCore.Slot()
     def reset_laser_toolbutton(self):
@@ -27,7 +27,6 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 -----------------------------------------------------------------------------------
 """
 import os
-import numpy as np
 
 from qtpy import QtCore
 from qtpy import QtGui
@@ -36,6 +35,7 @@ from qtpy import uic
 import pyqtgraph as pg
 
 from gui.guibase import GUIBase
+from gui.guiutils import DecimatedTracePlot
 from core.connector import Connector
 
 
@@ -138,7 +138,7 @@ class FocusGUI(GUIBase):
     raw_imageitem = None
     threshold_imageitem = None
     _centroid = None
-    y_data = None
+    _timetrace_plot = None
     _w_pid = None
     _timetrace = None
 
@@ -191,10 +191,10 @@ class FocusGUI(GUIBase):
         position = self._focus_logic.get_position()
         self._mw.position_Label.setText('z position (um): {:.3f}'.format(position))
 
-        # data for timetrace initialization
-        self.y_data = np.zeros(100)
         # create a reference to the line object (this is returned when calling plot method of pg.PlotWidget)
-        self._timetrace = self._mw.timetrace_PlotWidget.plot(self.y_data, pen=(0, 255, 0))
+        self._timetrace = self._mw.timetrace_PlotWidget.plot([], [], pen=(0, 255, 0))
+        # the last 100 samples are shown
+        self._timetrace_plot = DecimatedTracePlot(self._mw.timetrace_PlotWidget, [self._timetrace], window=100)
 
         # toolbutton state
         self._mw.piezo_init_Action.setChecked(False)
@@ -256,7 +256,10 @@ class FocusGUI(GUIBase):
         self._focus_logic.sigPlotCalibration.connect(self.plot_calibration)
         self._focus_logic.sigOffsetCalibration.connect(self.display_offset)
         self._focus_logic.sigDisplayImage.connect(self.live_display)
-        self._focus_logic.sigDisplayImageAndMask.connect(self.live_display)
+        # only the latest image is displayed if the gui thread falls behind
+        self.getSignalMonitor().connect('{0}.sigDisplayImageAndMask'.format(self._name),
+                                        self._focus_logic.sigDisplayImageAndMask, self.live_display, owner=self,
+                                        coalesce=True)
         self._focus_logic.sigAutofocusStopped.connect(self.autofocus_stopped)
         self._focus_logic.sigAutofocusError.connect(self.autofocus_stopped)
         self._focus_logic.sigSetpointDefined.connect(self.update_autofocus_setpoint)
@@ -418,14 +421,7 @@ class FocusGUI(GUIBase):
         :param: float position: current position of the piezo
         :return: None
         """
-        # t data not needed, only if it is wanted that the axis labels move also. then see variant 2 from pyqtgraph.examples scrolling plot
-        # self.t_data[:-1] = self.t_data[1:] # shift data in the array one position to the left, keeping same array size
-        # self.t_data[-1] += 1 # add the new last element
-        self.y_data[:-1] = self.y_data[1:]  # shift data one position to the left ..
-        self.y_data[-1] = position
-
-        # self._timetrace.setData(self.t_data, self.y_data) # x axis values running with the timetrace
-        self._timetrace.setData(self.y_data)  # x axis values do not move
+        self._timetrace_plot.append(self._timetrace_plot.history.samples, [position])
 
 # ----------------------------------------------------------------------------------------------------------------------
 # Slots for autofocus
@@ -33,6 +33,13 @@ class GUIBaseMixin(BaseMixin):
         warnings.warn('Every GUI module needs to reimplement the show() '
                 'function!')
 
+    def getSignalMonitor(self):
+        """ Get the signal monitor of the manager, used for instrumented connections to logic signals.
+
+          @return SignalMonitor: signal monitor of the manager
+        """
+        return self._manager.signal_monitor
+
     def saveWindowPos(self, window):
         self._statusVariables['pos_x'] = window.pos().x()
         self._statusVariables['pos_y'] = window.pos().y()
@@ -20,6 +20,7 @@ Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
 top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
 """
 
+import numpy as np
 import pyqtgraph as pg
 
 
@@ -107,3 +108,190 @@ class ColorBar(pg.GraphicsObject):
         """
         return pg.QtCore.QRectF(self.pic.boundingRect())
 
+
+def min_max_decimate(x, y_min, y_max=None, bins=1000):
+    """ Reduce a trace to at most bins groups of consecutive samples, keeping the minimum and the maximum of each
+    group. Every group is drawn as a vertical line from its minimum to its maximum at the position of its first
+    sample, so peaks and noise amplitude stay visible at any length of the trace.
+
+    @param numpy.ndarray x: x values (1D, ascending)
+    @param numpy.ndarray y_min: y values, or lower envelope if y_max is given
+    @param numpy.ndarray y_max: optional, upper envelope of the y values
+    @param int bins: maximum number of groups, typically the width of the plot in pixels
+
+    @return (numpy.ndarray, numpy.ndarray): x and y values to pass to setData
+    """
+    x = np.asarray(x)
+    y_min = np.asarray(y_min)
+    y_max = y_min if y_max is None else np.asarray(y_max)
+    size = int(np.ceil(len(x) / max(1, int(bins))))
+    if size <= 1 and y_max is y_min:
+        return x, y_min
+    starts = np.arange(0, len(x), max(1, size))
+    if len(starts) == 0:
+        return x, y_min
+    lower = np.minimum.reduceat(y_min, starts) if size > 1 else y_min
+    upper = np.maximum.reduceat(y_max, starts) if size > 1 else y_max
+    return np.repeat(x[starts], 2), np.column_stack((lower, upper)).ravel()
+
+
+def is_plot_visible(widget):
+    """ Check whether a widget is shown on the screen (not hidden, in a closed dock or in a minimized window).
+
+    @param QWidget widget: widget to check, e.g. a pyqtgraph PlotWidget
+
+    @return bool: True if the widget is visible
+    """
+    return widget.isVisible() and not widget.window().isMinimized()
+
+
+class TraceHistory:
+    """ Bounded columnar store for multichannel time traces.
+
+    Each entry holds a time stamp and the minimum and maximum of each channel. When the store is full, pairs of
+    consecutive entries are merged, which halves the time resolution of the history. The whole run is therefore kept
+    in constant memory, with the extrema of the signals preserved. Alternatively, the oldest half of the entries is
+    discarded.
+    """
+
+    def __init__(self, channels, capacity=10000, merge=True):
+        """
+        @param int channels: number of channels
+        @param int capacity: maximum number of entries (rounded up to an even number)
+        @param bool merge: optional, merge pairs of entries when the store is full. If False, the oldest half of the
+                           entries is discarded instead.
+        """
+        capacity = max(2, int(capacity) + int(capacity) % 2)
+        self.merge = merge
+        self._t = np.empty(capacity)
+        self._min = np.empty((int(channels), capacity))
+        self._max = np.empty((int(channels), capacity))
+        self._count = 0
+        self._samples_per_entry = 1
+        self._samples_in_last = 0
+        self._samples = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def samples(self):
+        """ Total number of samples appended since creation or the last clear. """
+        return self._samples
+
+    @property
+    def samples_per_entry(self):
+        """ Number of samples merged into each entry (1 as long as the store was never full). """
+        return self._samples_per_entry
+
+    @property
+    def t(self):
+        return self._t[:self._count]
+
+    @property
+    def minimum(self):
+        return self._min[:, :self._count]
+
+    @property
+    def maximum(self):
+        return self._max[:, :self._count]
+
+    def clear(self):
+        self._count = 0
+        self._samples_per_entry = 1
+        self._samples_in_last = 0
+        self._samples = 0
+
+    def append(self, t, values):
+        """ Add a sample.
+
+        @param float t: time stamp (ascending)
+        @param list values: one value per channel
+        """
+        values = np.asarray(values, dtype=float)
+        self._samples += 1
+        if 0 < self._samples_in_last < self._samples_per_entry:
+            last = self._count - 1
+            np.minimum(self._min[:, last], values, out=self._min[:, last])
+            np.maximum(self._max[:, last], values, out=self._max[:, last])
+            self._samples_in_last += 1
+            return
+        if self._count == len(self._t):
+            self._compact()
+        self._t[self._count] = t
+        self._min[:, self._count] = values
+        self._max[:, self._count] = values
+        self._count += 1
+        self._samples_in_last = 1
+
+    def _compact(self):
+        half = self._count // 2
+        if not self.merge:
+            self._t[:half] = self._t[half:self._count]
+            self._min[:, :half] = self._min[:, half:self._count]
+            self._max[:, :half] = self._max[:, half:self._count]
+            self._count = half
+            return
+        self._t[:half] = self._t[0:self._count:2]
+        self._min[:, :half] = np.minimum(self._min[:, 0:self._count:2], self._min[:, 1:self._count:2])
+        self._max[:, :half] = np.maximum(self._max[:, 0:self._count:2], self._max[:, 1:self._count:2])
+        self._count = half
+        self._samples_per_entry *= 2
+        self._samples_in_last = self._samples_per_entry
+
+
+class DecimatedTracePlot:
+    """ Live time traces in a pyqtgraph plot with a bounded history, decimated to the width of the plot.
+
+    The cost of a redraw does not depend on the duration of the run. While the plot is not visible, the samples are
+    only stored and the curves are updated on the next visible redraw.
+
+    Usage:
+        curves = [plot_widget.plot(pen='r'), plot_widget.plot(pen='b')]
+        self._trace = DecimatedTracePlot(plot_widget, curves)
+        self._trace.append(t, [value_1, value_2])
+    """
+
+    def __init__(self, plot_widget, curves, capacity=10000, window=None):
+        """
+        @param pg.PlotWidget plot_widget: widget showing the curves
+        @param list curves: PlotDataItems, one per channel
+        @param int capacity: optional, maximum number of stored entries
+        @param float window: optional, only the last window (in units of t) is shown and older samples are
+                             discarded once the capacity is reached. Whole history if None.
+        """
+        self.plot_widget = plot_widget
+        self.curves = list(curves)
+        self.window = window
+        self.history = TraceHistory(len(self.curves), capacity, merge=window is None)
+
+    def append(self, t, values):
+        """ Add a sample and redraw if the plot is visible.
+
+        @param float t: time stamp
+        @param list values: one value per curve
+        """
+        self.history.append(t, values)
+        self.redraw()
+
+    def clear(self):
+        self.history.clear()
+        for curve in self.curves:
+            curve.setData([], [])
+
+    def redraw(self, force=False):
+        """ Update the curves with the decimated history.
+
+        @param bool force: optional, update also if the plot is not visible
+        """
+        if len(self.history) == 0 or not (force or is_plot_visible(self.plot_widget)):
+            return
+        t = self.history.t
+        start = 0
+        if self.window is not None:
+            start = np.searchsorted(t, t[-1] - self.window)
+        bins = max(100, int(self.plot_widget.getPlotItem().getViewBox().width()))
+        exact = self.history.samples_per_entry == 1
+        for curve, lower, upper in zip(self.curves, self.history.minimum, self.history.maximum):
+            x, y = min_max_decimate(t[start:], lower[start:], None if exact else upper[start:], bins)
+            curve.setData(x, y)
@@ -136,6 +136,8 @@ class ManagerGui(GUIBase):
         self._mw.actionAbout_Qt.triggered.connect(QtWidgets.QApplication.aboutQt)
         self._mw.actionAbout_Qudi.triggered.connect(self.showAboutQudi)
         self._mw.actionReset_to_default_layout.triggered.connect(self.resetToDefaultLayout)
+        self._mw.actionRecordProfile.setChecked(self._manager.sampling_profiler.running)
+        self._mw.actionRecordProfile.toggled.connect(self.recordProfile)
 
         self._manager.sigShowManager.connect(self.show)
         self._manager.sigConfigChanged.connect(self.updateConfigWidgets)
@@ -164,6 +166,12 @@ class ManagerGui(GUIBase):
         self.startIPythonWidget()
         # thread widget
         self._mw.threadWidget.threadListView.setModel(self._manager.tm)
+        # periodic jobs widget
+        self._mw.schedulerTableView.setModel(self._manager.scheduler)
+        self._mw.schedulerTableView.horizontalHeader().setStretchLastSection(True)
+        # signal traffic widget
+        self._mw.signalTableView.setModel(self._manager.signal_monitor)
+        self._mw.signalTableView.horizontalHeader().setStretchLastSection(True)
         # remote widget
         # hide remote menu item if rpyc is not available
         self._mw.actionRemoteView.setVisible(self._manager.rm is not None)
@@ -184,6 +192,9 @@ class ManagerGui(GUIBase):
         self._mw.configDisplayDockWidget.hide()
         self._mw.remoteDockWidget.hide()
         self._mw.threadDockWidget.hide()
+        self._mw.schedulerDockWidget.hide()
+        self._mw.mutexDockWidget.hide()
+        self._mw.signalDockWidget.hide()
         self._mw.show()
 
     def on_deactivate(self):
@@ -205,6 +216,7 @@ class ManagerGui(GUIBase):
         self._mw.action_Load_all_modules.triggered.disconnect()
         self._mw.actionAbout_Qt.triggered.disconnect()
         self._mw.actionAbout_Qudi.triggered.disconnect()
+        self._mw.actionRecordProfile.toggled.disconnect()
         self.saveWindowPos(self._mw)
         self._mw.close()
 
@@ -240,24 +252,36 @@ class ManagerGui(GUIBase):
         self._mw.consoleDockWidget.setVisible(True)
         self._mw.remoteDockWidget.setVisible(False)
         self._mw.threadDockWidget.setVisible(False)
+        self._mw.schedulerDockWidget.setVisible(False)
+        self._mw.mutexDockWidget.setVisible(False)
+        self._mw.signalDockWidget.setVisible(False)
         self._mw.logDockWidget.setVisible(True)
 
         self._mw.actionConfigurationView.setChecked(False)
         self._mw.actionConsoleView.setChecked(True)
         self._mw.actionRemoteView.setChecked(False)
         self._mw.actionThreadsView.setChecked(False)
+        self._mw.actionSchedulerView.setChecked(False)
+        self._mw.actionMutexView.setChecked(False)
+        self._mw.actionSignalView.setChecked(False)
         self._mw.actionLogView.setChecked(True)
 
         self._mw.configDisplayDockWidget.setFloating(False)
         self._mw.consoleDockWidget.setFloating(False)
         self._mw.remoteDockWidget.setFloating(False)
         self._mw.threadDockWidget.setFloating(False)
+        self._mw.schedulerDockWidget.setFloating(False)
+        self._mw.mutexDockWidget.setFloating(False)
+        self._mw.signalDockWidget.setFloating(False)
         self._mw.logDockWidget.setFloating(False)
 
         self._mw.addDockWidget(QtCore.Qt.DockWidgetArea(8), self._mw.configDisplayDockWidget)
         self._mw.addDockWidget(QtCore.Qt.DockWidgetArea(2), self._mw.consoleDockWidget)
         self._mw.addDockWidget(QtCore.Qt.DockWidgetArea(8), self._mw.remoteDockWidget)
         self._mw.addDockWidget(QtCore.Qt.DockWidgetArea(8), self._mw.threadDockWidget)
+        self._mw.addDockWidget(QtCore.Qt.DockWidgetArea(8), self._mw.schedulerDockWidget)
+        self._mw.addDockWidget(QtCore.Qt.DockWidgetArea(8), self._mw.mutexDockWidget)
+        self._mw.addDockWidget(QtCore.Qt.DockWidgetArea(8), self._mw.signalDockWidget)
         self._mw.addDockWidget(QtCore.Qt.DockWidgetArea(8), self._mw.logDockWidget)
 
     def handleLogEntry(self, entry):
@@ -516,6 +540,30 @@ Go, play.
             self.sigSaveConfig.emit(filename)
 
 
+    def recordProfile(self, record):
+        """ Start the sampling profiler or stop it and ask the user for a file to save the profile to.
+
+          @param bool record: start (True) or stop (False) the profiler
+        """
+        profiler = self._manager.sampling_profiler
+        if record:
+            profiler.start()
+            return
+        profiler.stop()
+        if profiler.samples == 0:
+            return
+        filename = QtWidgets.QFileDialog.getSaveFileName(
+            self._mw,
+            'Save profile',
+            os.path.join(get_main_dir(), 'profile.folded'),
+            'Collapsed stacks (*.folded);;All files (*)')[0]
+        if filename != '':
+            try:
+                profiler.save(filename)
+            except OSError:
+                self.log.exception('Could not save profile to {0}.'.format(filename))
+
+
 class ManagerMainWindow(QtWidgets.QMainWindow):
 
     """ This class represents the Manager Window.
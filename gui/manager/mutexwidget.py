@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the Qudi widget showing the lock statistics of the mutexes.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+import logging
+import os
+
+from core.util.mutex import mutex_profiler
+from qtpy import QtCore, QtWidgets, uic
+from qtpy.QtWidgets import QWidget
+
+logger = logging.getLogger(__name__)
+
+
+class MutexProfilerModel(QtCore.QAbstractTableModel):
+    """ Table of the mutex lock statistics, sorted by the total time threads waited for a lock.
+    """
+    headers = ['Name', 'Created', 'Locks', 'Contended', 'Wait (ms)', 'Max wait (ms)',
+               'Hold (ms)', 'Max hold (ms)', 'Top holder', 'Top waiter']
+
+    def __init__(self):
+        super().__init__()
+        self._rows = list()
+
+    def refresh(self):
+        """ Take a new snapshot of the statistics. """
+        self.beginResetModel()
+        self._rows = mutex_profiler.snapshot(top=1)
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return len(self.headers)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            if 0 <= section < len(self.headers):
+                return self.headers[section]
+        return None
+
+    def data(self, index, role):
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+        row = self._rows[index.row()]
+        column = index.column()
+        if column == 0:
+            return row['name']
+        elif column == 1:
+            return row['created']
+        elif column == 2:
+            return str(row['acquisitions'])
+        elif column == 3:
+            return str(row['contended'])
+        elif column == 4:
+            return '{0:.1f}'.format(row['wait_total'] * 1e3)
+        elif column == 5:
+            return '{0:.2f}'.format(row['wait_max'] * 1e3)
+        elif column == 6:
+            return '{0:.1f}'.format(row['hold_total'] * 1e3)
+        elif column == 7:
+            return '{0:.2f}'.format(row['hold_max'] * 1e3)
+        elif column == 8:
+            return row['holders'][0]['site'] if row['holders'] else ''
+        elif column == 9:
+            return row['waiters'][0]['thread'] if row['waiters'] else ''
+        return None
+
+
+class MutexWidget(QWidget):
+    """ Widget to switch the mutex profiler on and off, with the table of the lock statistics.
+    """
+
+    def __init__(self):
+        super().__init__()
+        this_dir = os.path.dirname(__file__)
+        ui_file = os.path.join(this_dir, 'ui_mutexwidget.ui')
+
+        # Load it
+        uic.loadUi(ui_file, self)
+
+        self.model = MutexProfilerModel()
+        self.mutexTableView.setModel(self.model)
+        self.mutexTableView.horizontalHeader().setStretchLastSection(True)
+        self.profileCheckBox.setChecked(mutex_profiler.enabled)
+        self.profileCheckBox.toggled.connect(self.setProfiling)
+        self.resetButton.clicked.connect(self.resetStatistics)
+        self.saveButton.clicked.connect(self.saveStatistics)
+
+        self._refresh_timer = QtCore.QTimer(self)
+        self._refresh_timer.setInterval(1000)
+        self._refresh_timer.timeout.connect(self.refresh)
+        self._refresh_timer.start()
+
+    def refresh(self):
+        """ Update the table if the widget is visible and there is something new to show. """
+        self.profileCheckBox.setChecked(mutex_profiler.enabled)
+        if self.isVisible() and (mutex_profiler.enabled or self.model.rowCount() == 0):
+            self.model.refresh()
+
+    def setProfiling(self, enabled):
+        if enabled:
+            mutex_profiler.enable()
+        else:
+            mutex_profiler.disable()
+        self.model.refresh()
+
+    def resetStatistics(self):
+        mutex_profiler.reset()
+        self.model.refresh()
+
+    def saveStatistics(self):
+        filename = QtWidgets.QFileDialog.getSaveFileName(
+            self,
+            'Save lock statistics',
+            'mutex_profile.json',
+            'JSON files (*.json)')[0]
+        if filename != '':
+            try:
+                mutex_profiler.dump(filename)
+            except OSError:
+                logger.exception('Could not save lock statistics to {0}.'.format(filename))
@@ -395,7 +395,9 @@ class ODMRGui(GUIBase):
                                                      QtCore.Qt.QueuedConnection)
         self._odmr_logic.sigOutputStateUpdated.connect(self.update_status,
                                                        QtCore.Qt.QueuedConnection)
-        self._odmr_logic.sigOdmrPlotsUpdated.connect(self.update_plots, QtCore.Qt.QueuedConnection)
+        self.getSignalMonitor().connect('{0}.sigOdmrPlotsUpdated'.format(self._name),
+                                        self._odmr_logic.sigOdmrPlotsUpdated, self.update_plots,
+                                        owner=self, coalesce=True)
         self._odmr_logic.sigOdmrFitUpdated.connect(self.update_fit, QtCore.Qt.QueuedConnection)
         self._odmr_logic.sigOdmrElapsedTimeUpdated.connect(self.update_elapsedtime,
                                                            QtCore.Qt.QueuedConnection)
@@ -423,7 +425,7 @@ class ODMRGui(GUIBase):
         self._mw.action_Settings.triggered.disconnect()
         self._odmr_logic.sigParameterUpdated.disconnect()
         self._odmr_logic.sigOutputStateUpdated.disconnect()
-        self._odmr_logic.sigOdmrPlotsUpdated.disconnect()
+        self.getSignalMonitor().remove_connection('{0}.sigOdmrPlotsUpdated'.format(self._name))
         self._odmr_logic.sigOdmrFitUpdated.disconnect()
         self._odmr_logic.sigOdmrElapsedTimeUpdated.disconnect()
         self.sigCwMwOn.disconnect()
@@ -28,6 +28,7 @@ from core.configoption import ConfigOption
 from core.statusvariable import StatusVar
 from gui.colordefs import QudiPalettePale as palette
 from gui.guibase import GUIBase
+from gui.guiutils import min_max_decimate, is_plot_visible
 from qtpy import QtCore
 from qtpy import QtWidgets
 from qtpy import uic
@@ -459,12 +460,17 @@ class TimeSeriesGui(GUIBase):
             self.log.error('Must provide a full data set of x and y values. update_data failed.')
             return
 
-        if data is not None:
-            for channel, y_arr in data.items():
-                self.curves[channel].setData(y=y_arr, x=data_time)
-        if smooth_data is not None:
-            for channel, y_arr in smooth_data.items():
-                self.averaged_curves[channel].setData(y=y_arr, x=smooth_time)
+        # the traces are decimated to the plot width and only drawn if the plot is visible
+        if is_plot_visible(self._pw):
+            bins = max(100, int(self._pw.plotItem.vb.width()))
+            if data is not None:
+                for channel, y_arr in data.items():
+                    x, y = min_max_decimate(data_time, y_arr, bins=bins)
+                    self.curves[channel].setData(y=y, x=x)
+            if smooth_data is not None:
+                for channel, y_arr in smooth_data.items():
+                    x, y = min_max_decimate(smooth_time, y_arr, bins=bins)
+                    self.averaged_curves[channel].setData(y=y, x=x)
 
         curr_value_channel = self._mw.curr_value_comboBox.currentText()
         if curr_value_channel != 'None':
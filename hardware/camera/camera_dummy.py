@@ -25,13 +25,183 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 -----------------------------------------------------------------------------------
 """
 
+import json
 import numpy as np
+import os
 import time
+from collections import OrderedDict
 from core.module import Base
 from core.configoption import ConfigOption
+from core.connector import Connector
 from interface.camera_interface import CameraInterface
 
 
+class SyntheticFrameSource:
+    """ Fast source of realistic synthetic camera frames.
+
+    The sample is a fixed set of fluorescent spots, each one in focus at its own z position. The spots are blurred
+    depending on the distance between the piezo z position and their focal plane. Frames are uint16 with shot noise
+    and a camera offset, as delivered by the sCMOS and EMCCD cameras.
+
+    The expected photon image is rendered once per (quantized) z position and cached. The shot noise is approximated
+    by a gaussian noise drawn from a pre-generated noise vector at a random offset, so that generating a frame costs
+    only a few vectorized operations and no random number generation.
+
+    Alternatively, a bank of complete frames (covering a range of z positions) can be pre-generated, optionally in a
+    file that is memory-mapped. The frame closest to the requested z position is then returned as a read-only view
+    without any computation (the noise of the frames at the same z position is identical).
+    """
+    def __init__(self, shape, number_of_spots=200, spot_sigma=1.5, rayleigh_range=1., sample_depth=4.,
+                 photons_per_spot=20000., background=10., offset=100, z_step=0.05, cache_size=8, seed=0):
+        """
+        @param tuple shape: (rows, columns) of the frames
+        @param int number_of_spots: number of fluorescent spots in the field of view
+        @param float spot_sigma: standard deviation of the in focus spots in pixels
+        @param float rayleigh_range: axial distance in µm at which the spot width increases by sqrt(2)
+        @param float sample_depth: the focal planes of the spots are distributed over sample_depth around z = 0 (µm)
+        @param float photons_per_spot: mean number of photons per spot and second of exposure
+        @param float background: background photons per pixel and second of exposure
+        @param int offset: camera offset in counts
+        @param float z_step: quantization of the z position for the cache of rendered images (µm)
+        @param int cache_size: number of rendered images kept in the cache
+        @param int seed: seed of the random generator, the sample is identical for identical seeds
+        """
+        self.shape = tuple(int(n) for n in shape)
+        self.spot_sigma = spot_sigma
+        self.rayleigh_range = rayleigh_range
+        self.background = background
+        self.offset = offset
+        self.z_step = z_step
+        self.cache_size = cache_size
+        self.bank = None
+        self.bank_z = None  # z position of each frame of the bank
+        self.bank_scale = None  # scale the bank was generated with
+
+        self._rng = np.random.default_rng(seed)
+        self._spot_rows = self._rng.uniform(0, self.shape[0], number_of_spots)
+        self._spot_cols = self._rng.uniform(0, self.shape[1], number_of_spots)
+        self._spot_z = self._rng.uniform(-sample_depth / 2, sample_depth / 2, number_of_spots)
+        self._spot_photons = photons_per_spot * self._rng.lognormal(0, 0.5, number_of_spots)
+
+        # twice the frame size, so that any offset smaller than the frame size gives a complete frame of noise
+        size = self.shape[0] * self.shape[1]
+        self._noise = self._rng.standard_normal(2 * size, dtype=np.float32)
+        self._cache = OrderedDict()
+
+    def frame(self, z=0., scale=1., out=None):
+        """ Generate a single frame.
+
+        @param float z: position of the focal plane in µm
+        @param float scale: exposure time in seconds multiplied by the gain
+        @param numpy.ndarray out: optional, uint16 array of shape self.shape the frame is written to
+
+        @return numpy.ndarray: frame of dtype uint16
+        """
+        mean, std = self._expected_image(z, scale)
+        size = mean.size
+        start = self._rng.integers(0, size)
+        noise = self._noise[start:start + size].reshape(self.shape)
+        data = np.multiply(std, noise)
+        data += mean
+        np.clip(data, 0, np.iinfo(np.uint16).max, out=data)
+        if out is None:
+            return data.astype(np.uint16)
+        out[...] = data
+        return out
+
+    def stack(self, z_positions, scale=1.):
+        """ Generate a stack of frames.
+
+        @param list z_positions: position of the focal plane in µm for each frame
+        @param float scale: exposure time in seconds multiplied by the gain
+
+        @return numpy.ndarray: frames of shape (len(z_positions), rows, columns) and dtype uint16
+        """
+        data = np.empty((len(z_positions),) + self.shape, dtype=np.uint16)
+        for i, z in enumerate(z_positions):
+            self.frame(z, scale, out=data[i])
+        return data
+
+    def build_bank(self, z_positions, scale=1., path=None):
+        """ Pre-generate a bank of frames.
+
+        @param list z_positions: position of the focal plane in µm for each frame of the bank
+        @param float scale: exposure time in seconds multiplied by the gain
+        @param str path: optional, npy file the bank is written to and memory-mapped from. An existing file is reused
+                         if it was generated with the same shape, z positions and scale (stored in <path>.json).
+        """
+        z_positions = np.asarray(z_positions, dtype=float)
+        shape = (len(z_positions),) + self.shape
+        parameters = {'shape': list(shape), 'z_positions': z_positions.tolist(), 'scale': float(scale)}
+        self.bank_z = z_positions
+        self.bank_scale = scale
+        if path is None:
+            self.bank = self.stack(z_positions, scale)
+            self.bank.flags.writeable = False
+            return
+
+        parameter_path = path + '.json'
+        if os.path.isfile(path) and os.path.isfile(parameter_path):
+            with open(parameter_path, 'r') as file:
+                if json.load(file) == parameters:
+                    self.bank = np.load(path, mmap_mode='r')
+                    return
+        self.bank = None  # release the memory map before the file is overwritten
+        bank = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint16, shape=shape)
+        for i, z in enumerate(z_positions):
+            self.frame(z, scale, out=bank[i])
+        bank.flush()
+        del bank
+        with open(parameter_path, 'w') as file:
+            json.dump(parameters, file)
+        self.bank = np.load(path, mmap_mode='r')
+
+    def clear_bank(self):
+        """ Discard the bank, e.g. when the exposure or gain changed. """
+        self.bank = None
+        self.bank_z = None
+        self.bank_scale = None
+
+    def bank_frames(self, n_frames, z=0.):
+        """ Frames from the bank at the z position of the bank closest to z.
+
+        @param int n_frames: number of frames
+        @param float z: position of the focal plane in µm
+
+        @return numpy.ndarray: read-only view of shape (n_frames, rows, columns)
+        """
+        index = int(np.argmin(np.abs(self.bank_z - z)))
+        return np.broadcast_to(self.bank[index], (n_frames,) + self.shape)
+
+    def _expected_image(self, z, scale):
+        """ Mean and standard deviation (shot noise) of the counts for the focal plane z. Both are cached. """
+        key = (int(round(z / self.z_step)), scale)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        z = key[0] * self.z_step
+        photons = np.full(self.shape, self.background, dtype=np.float32)
+        dz = (z - self._spot_z) / self.rayleigh_range
+        sigmas = self.spot_sigma * np.sqrt(1 + dz ** 2)
+        amplitudes = self._spot_photons / (2 * np.pi * sigmas ** 2)
+        for row, col, sigma, amplitude in zip(self._spot_rows, self._spot_cols, sigmas, amplitudes):
+            half_width = int(np.ceil(4 * sigma))
+            row_start, row_stop = max(int(row) - half_width, 0), min(int(row) + half_width + 1, self.shape[0])
+            col_start, col_stop = max(int(col) - half_width, 0), min(int(col) + half_width + 1, self.shape[1])
+            profile_rows = np.exp(-(np.arange(row_start, row_stop) - row) ** 2 / (2 * sigma ** 2))
+            profile_cols = np.exp(-(np.arange(col_start, col_stop) - col) ** 2 / (2 * sigma ** 2))
+            photons[row_start:row_stop, col_start:col_stop] += amplitude * np.outer(profile_rows, profile_cols)
+        photons *= scale
+        std = np.sqrt(photons)
+        photons += self.offset
+
+        self._cache[key] = (photons, std)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return photons, std
+
+
 class CameraDummy(Base, CameraInterface):
     """ Dummy implementation of a microscope camera.
 
@@ -44,13 +214,31 @@ class CameraDummy(Base, CameraInterface):
         resolution: (720, 1280)
         exposure: 0.1 
         gain: 1.0
+        frame_source: 'synthetic'  # 'synthetic': uint16 frames of a simulated sample, 'bank': pre-generated
+                                   # synthetic frames returned as read-only views, 'random': gaussian noise (float)
+        number_of_spots: 200
+        frame_bank_size: 64
+        frame_bank_path: None  # optional, npy file used to memory-map the frame bank
+        piezo_axis: 'z'
+        sample_focus_position: 25  # piezo position (in µm) at which the simulated sample is in focus
+        connect:
+            piezo: 'piezo_dummy'  # optional, the synthetic sample is defocused according to the piezo position
     """
+    # connectors
+    piezo = Connector(interface='MotorInterface', optional=True)
+
     # config options
     _support_live = ConfigOption('support_live', True)
     _camera_name = ConfigOption('camera_name', 'Dummy camera')  # 'Dummy camera' 'iXon Ultra 897'
     _resolution = ConfigOption('resolution', (720, 1280))  # (720, 1280) indicate (nb rows, nb cols) because row-major config is used in gui module
     _exposure = ConfigOption('exposure', .1)
     _gain = ConfigOption('gain', 1.)
+    _frame_source_mode = ConfigOption('frame_source', 'synthetic')
+    _number_of_spots = ConfigOption('number_of_spots', 200)
+    _frame_bank_size = ConfigOption('frame_bank_size', 64)
+    _frame_bank_path = ConfigOption('frame_bank_path', None)
+    _piezo_axis = ConfigOption('piezo_axis', 'z')
+    _sample_focus_position = ConfigOption('sample_focus_position', 25)
 
     # camera attributes
     _live = False  # attribute indicating if the camera is currently in live mode
@@ -65,6 +253,7 @@ class CameraDummy(Base, CameraInterface):
     _full_height = 0
 
     _progress = 0
+    _random_offset = 100  # camera offset in counts of the uint16 movie frames in random mode
 
     _frame_transfer = False
 
@@ -74,12 +263,20 @@ class CameraDummy(Base, CameraInterface):
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
+        self._piezo = None
+        self._frame_source = None
+        self._movie_start_time = None
+        self._frames_delivered = 0
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
         """
         self._full_width = self._resolution[1]
         self._full_height = self._resolution[0]
+        if self._frame_source_mode not in ['synthetic', 'bank', 'random']:
+            self.log.warning(f'Unknown frame source {self._frame_source_mode}. Using synthetic frames instead.')
+            self._frame_source_mode = 'synthetic'
+        self._piezo = self.piezo()
 
     def on_deactivate(self):
         """ Deinitialisation performed during deactivation of the module.
@@ -116,6 +313,7 @@ class CameraDummy(Base, CameraInterface):
         :return: bool: Success ?
         """
         self._exposure = exposure
+        self._clear_frame_bank()
         return True
 
     def get_exposure(self):
@@ -133,6 +331,7 @@ class CameraDummy(Base, CameraInterface):
         :return: bool: Success ?
         """
         self._gain = gain
+        self._clear_frame_bank()
         return True
 
     def get_gain(self):
@@ -258,6 +457,8 @@ class CameraDummy(Base, CameraInterface):
                 self._live = True
                 self._acquiring = False
             self.n_frames = n_frames
+            self._movie_start_time = time.monotonic()
+            self._frames_delivered = 0
             self.log.info('started movie acquisition')
             return True
         else:
@@ -271,6 +472,7 @@ class CameraDummy(Base, CameraInterface):
         self._live = False
         self._acquiring = False
         self.n_frames = 1
+        self._movie_start_time = None
         self.log.info('movie acquisition finished')
         return True
 
@@ -294,7 +496,11 @@ class CameraDummy(Base, CameraInterface):
 
         :return: None
         """
-        pass
+        self.stop_acquisition()
+        self.n_frames = frames
+        self.set_exposure(exposure)
+        if gain is not None:
+            self.set_gain(gain)
 
     def reset_camera_after_multichannel_imaging(self):
         """ Reset the camera to a default state after an experiment using synchronization between lightsources and
@@ -302,7 +508,8 @@ class CameraDummy(Base, CameraInterface):
 
          :return: None
          """
-        pass
+        self.stop_acquisition()
+        self.n_frames = 1
 
 # ----------------------------------------------------------------------------------------------------------------------
 # Methods for image data retrieval
@@ -315,9 +522,31 @@ class CameraDummy(Base, CameraInterface):
 
         Each pixel might be a float, integer or sub pixels
         """
-        data = np.random.normal(size=self.image_size) * self._exposure * self._gain
-        # data = data.astype(np.int16)  # type conversion
-        return data
+        if self._frame_source_mode == 'random':
+            return np.random.normal(size=self.image_size) * self._exposure * self._gain
+        return self._get_frames(1)[0]
+
+    def get_new_frames(self):
+        """ Return the frames acquired since the last call during a movie acquisition, together with the total number
+        of frames acquired since the start of the movie. The acquisition runs at the frame rate given by the exposure
+        time.
+
+        :return: tuple (numpy array: image data of shape (n, rows, cols), int: number of acquired frames)
+        """
+        if self._movie_start_time is None:
+            return np.zeros((0,) + tuple(self.image_size), dtype=np.uint16), 0
+        acquired = min(int((time.monotonic() - self._movie_start_time) / self._exposure), self.n_frames)
+        n_new = acquired - self._frames_delivered
+        self._frames_delivered = acquired
+        if self._frame_source_mode == 'random':
+            # the gaussian noise is centered on a camera offset and clipped, negative values would wrap around in uint16
+            frames = self._data_generator(size=(n_new,) + tuple(self.image_size)) * self._exposure * self._gain
+            frames += self._random_offset
+            np.clip(np.rint(frames), 0, np.iinfo(np.uint16).max, out=frames)
+            frames = frames.astype(np.uint16)
+        else:
+            frames = self._get_frames(n_new)
+        return frames, acquired
 
     def get_acquired_data(self):
         """ Return an array of last acquired image in case of a run till abort acquisition
@@ -327,6 +556,10 @@ class CameraDummy(Base, CameraInterface):
 
         Each pixel might be a float, integer or sub pixels
         """
+        if self._frame_source_mode != 'random':
+            data = self._get_frames(self.n_frames)
+            return data if self.n_frames > 1 else data[0]
+
         if self.n_frames > 1:
             data = self._data_generator(size=(self.n_frames, self.image_size[0], self.image_size[1])) * self._exposure * self._gain
         else:
@@ -337,6 +570,28 @@ class CameraDummy(Base, CameraInterface):
 # Non-Interface functions
 # ======================================================================================================================
 
+# ----------------------------------------------------------------------------------------------------------------------
+# Simulation of the acquisition triggered by the FPGA (fixed length mode)
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _start_acquisition(self):
+        """ Start the acquisition of the n_frames frames configured in prepare_camera_for_multichannel_imaging. The
+        camera waits for the external trigger, the frames are returned by get_acquired_data.
+
+        :return: bool: Success ?
+        """
+        if self._live:
+            return False
+        self._acquiring = True
+        return True
+
+    def _abort_acquisition(self):
+        """ Abort the acquisition started with _start_acquisition.
+
+        :return: None
+        """
+        self.stop_acquisition()
+
 # ----------------------------------------------------------------------------------------------------------------------
 # Helper functions
 # ----------------------------------------------------------------------------------------------------------------------
@@ -350,6 +605,44 @@ class CameraDummy(Base, CameraInterface):
         data = np.random.normal(size=size)
         return data
 
+    def _get_frames(self, n_frames):
+        """ Synthetic uint16 frames of the simulated sample at the current piezo position.
+
+        :param: int n_frames: number of frames
+
+        :return: np.array(uint16) data of shape (n_frames, rows, cols). Read-only if the frame bank is used.
+        """
+        shape = tuple(int(n) for n in self.image_size)
+        scale = float(self._exposure * self._gain)
+        if self._frame_source is None or self._frame_source.shape != shape:
+            self._frame_source = SyntheticFrameSource(shape, number_of_spots=self._number_of_spots)
+
+        z = self._get_piezo_position()
+        if self._frame_source_mode == 'bank':
+            if self._frame_source.bank is None:
+                # the bank covers a defocus range of +/- 2 µm around the sample, with the current exposure and gain
+                z_positions = np.linspace(-2, 2, self._frame_bank_size)
+                self._frame_source.build_bank(z_positions, scale, path=self._frame_bank_path)
+            return self._frame_source.bank_frames(n_frames, z)
+        return self._frame_source.stack([z] * n_frames, scale)
+
+    def _clear_frame_bank(self):
+        """ The frames of the bank depend on the exposure time and the gain. It is generated again on the next call of
+        _get_frames.
+        """
+        if self._frame_source is not None:
+            self._frame_source.clear_bank()
+
+    def _get_piezo_position(self):
+        """ Position of the connected piezo relative to the position where the sample is in focus, 0 if no piezo is
+        connected.
+
+        :return: float z position in µm
+        """
+        if self._piezo is None:
+            return 0.
+        return self._piezo.get_pos([self._piezo_axis])[self._piezo_axis] - self._sample_focus_position
+
 # ----------------------------------------------------------------------------------------------------------------------
 # Simulation of Andor camera
 # ----------------------------------------------------------------------------------------------------------------------
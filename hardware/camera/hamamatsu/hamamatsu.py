@@ -285,6 +285,23 @@ class HCam(Base, CameraInterface):
         except Exception:
             return False
 
+    def start_spooling_acquisition(self, n_frames):
+        """ Start a movie acquisition into the ring buffer of the camera (run till abort mode), so that the memory
+        needed does not depend on the number of frames. The frames must be retrieved regularly using get_new_frames.
+        The acquisition is stopped by finish_movie_acquisition.
+
+        :param: int n_frames: number of frames
+
+        :return: bool: Success ?
+        """
+        self.n_frames = n_frames
+        try:
+            self.camera.setACQMode('run_till_abort')
+            self.camera.startAcquisition()
+            return True
+        except Exception:
+            return False
+
     def finish_movie_acquisition(self):
         """ Reset the conditions used to save a movie to default.
 
@@ -359,6 +376,19 @@ class HCam(Base, CameraInterface):
         image_array = np.reshape(data, (dim[1], dim[0]))
         return image_array
 
+    def get_new_frames(self):
+        """ Return all frames acquired since the last call, together with the total number of frames acquired since
+        the start of the acquisition. Frames overwritten in the ring buffer of the camera (buffer overrun) are missing.
+
+        :return: tuple (numpy ndarray: image data in format [[[row],[row]...], ...], int: number of acquired frames)
+        """
+        [frames, dim] = self.camera.getFrames()  # frames is a list of HCamData objects, dim is [image_width, image_height]
+        if frames:
+            image_array = np.stack([np.reshape(frame.getData(), (dim[1], dim[0])) for frame in frames])
+        else:
+            image_array = np.zeros((0, dim[1], dim[0]), dtype=np.uint16)
+        return image_array, self.camera.last_frame_number
+
     def get_acquired_data(self):
         """ Return an array of the acquired data.
         Depending on the acquisition mode, this can be just one frame (single scan, run_till_abort)
@@ -316,16 +316,9 @@ class ConfocalScannerDummy(Base, ConfocalScannerInterface):
         if np.shape(line_path)[1] != self._line_length:
             self._set_up_line(np.shape(line_path)[1])
 
+        line_path = np.asarray(line_path, dtype=float)
         count_data = np.random.uniform(0, 2e4, self._line_length)
-        z_data = line_path[2, :]
-
-        #TODO: Change the gaussian function here to the one from fitlogic and delete the local modules to calculate
-        #the gaussian functions
-        x_data = np.array(line_path[0, :])
-        y_data = np.array(line_path[1, :])
-        for i in range(self._num_points):
-            count_data += self.twoD_gaussian_function((x_data, y_data), *(self._points[i])
-                ) * self.gaussian_function(np.array(z_data), *(self._points_z[i]))
+        count_data += self._fluorescence(line_path[0, :], line_path[1, :], line_path[2, :])
 
         time.sleep(self._line_length * 1. / self._clock_frequency)
         time.sleep(self._line_length * 1. / self._clock_frequency)
@@ -333,12 +326,43 @@ class ConfocalScannerDummy(Base, ConfocalScannerInterface):
         # update the scanner position instance variable
         self._current_position = list(line_path[:, -1])
 
+        # the ramp channel follows the y position, so that paths containing several lines (frame scan) show the
+        # same ramp as single lines
         return np.array([
                 count_data,
                 5e5 - count_data,
-                np.ones(count_data.shape) * line_path[1, 0] * 100
+                line_path[1, :] * 100
             ]).transpose()
 
+    def _fluorescence(self, x_data, y_data, z_data, block_size=4096):
+        """ Signal of all dummy NVs at the given positions. Vectorized over the NVs and the positions, processed in
+        blocks of positions to limit the memory usage for long paths.
+
+        Same model as the sum of twoD_gaussian_function * gaussian_function over all NVs.
+
+        @param numpy.ndarray x_data: x positions
+        @param numpy.ndarray y_data: y positions
+        @param numpy.ndarray z_data: z positions
+        @param int block_size: number of positions processed at once
+
+        @return numpy.ndarray: the fluorescence at each position
+        """
+        amplitude, x_zero, y_zero, sigma_x, sigma_y, theta, offset = (p[:, np.newaxis] for p in self._points.T)
+        amplitude_z, z_zero, sigma_z, offset_z = (p[:, np.newaxis] for p in self._points_z.T)
+        a = (np.cos(theta)**2) / (2 * sigma_x**2) + (np.sin(theta)**2) / (2 * sigma_y**2)
+        b = -(np.sin(2 * theta)) / (4 * sigma_x**2) + (np.sin(2 * theta)) / (4 * sigma_y**2)
+        c = (np.sin(theta)**2) / (2 * sigma_x**2) + (np.cos(theta)**2) / (2 * sigma_y**2)
+
+        signal = np.empty(len(x_data))
+        for start in range(0, len(x_data), block_size):
+            block = slice(start, start + block_size)
+            dx = x_data[np.newaxis, block] - x_zero
+            dy = y_data[np.newaxis, block] - y_zero
+            xy = offset + amplitude * np.exp(-(a * dx**2 + 2 * b * dx * dy + c * dy**2))
+            z = amplitude_z * np.exp(-(z_data[np.newaxis, block] - z_zero)**2 / (2 * sigma_z**2)) + offset_z
+            signal[block] = np.sum(xy * z, axis=0)
+        return signal
+
     def close_scanner(self):
         """ Closes the scanner and cleans up afterwards.
 
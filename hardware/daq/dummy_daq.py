@@ -26,6 +26,8 @@ Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
 top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
 -----------------------------------------------------------------------------------
 """
+import numpy as np
+
 from core.module import Base
 from core.configoption import ConfigOption
 from interface.lasercontrol_interface import LasercontrolInterface
@@ -64,6 +66,11 @@ class DummyDaq(Base, LasercontrolInterface):
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
+        # digital lines used for the synchronization with the FPGA (same attributes as the NI-DAQ), the dummy
+        # taskhandles are the names of the lines
+        self.start_acquisition_taskhandle = 'start_acquisition'
+        self.acquisition_done_taskhandle = 'acquisition_done'
+        self._digital_lines = {}
 
     def on_activate(self):
         """ Initialization steps when module is called.
@@ -123,6 +130,38 @@ class DummyDaq(Base, LasercontrolInterface):
         """
         pass
 
+    def write_to_do_channel(self, taskhandle, num_samp, digital_write):
+        """ Write a value to a digital output virtual channel.
+
+        :param: DAQmx.Taskhandle object taskhandle: pointer to the virtual channel
+        :param: int num_samp: number of values to write
+        :param: np.ndarray digital_write: np array containing the values to write, using dtype=np.uint8
+
+        :return: None
+        """
+        self._digital_lines[taskhandle] = np.array(digital_write[:num_samp], dtype=np.uint8)
+
+    def set_up_di_channel(self, taskhandle, channel):
+        """ Create a digital input virtual channel.
+
+        :param: DAQmx.Taskhandle object taskhandle: pointer to the virtual channel
+        :param: str channel: identifier of the physical channel, such as 'Dev1/DIO0'
+
+        :return: None
+        """
+        pass
+
+    def read_di_channel(self, taskhandle, num_samp):
+        """ Read a value from a digital input virtual channel. The simulated FPGA is always ready: the 'acquisition
+        done' line reads 1.
+
+        :param: DAQmx.Taskhandle object taskhandle: pointer to the virtual channel
+        :param: int num_samp: number of values to read
+
+        :return: np.ndarray data: values read from the digital input channel (dtype np.uint8)
+        """
+        return np.ones((num_samp,), dtype=np.uint8)
+
     def close_task(self, taskhandle):
         """ Stop and clear a task identified by taskhandle. Reset the taskhandle as nullpointer.
         :param: DAQmx.Taskhandle object taskhandle: pointer to the virtual channel
@@ -28,11 +28,17 @@ Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
 top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
 -----------------------------------------------------------------------------------
 """
+import http.client
+import json
+import threading
+import urllib.parse
 import urllib.request
+from contextlib import contextmanager
 from core.module import Base
 from core.configoption import ConfigOption
+from core.util.mutex import Mutex, RecursiveMutex
 from interface.lasercontrol_interface import LasercontrolInterface
-from time import sleep
+from time import sleep, monotonic
 
 
 class LumencorCelesta(Base, LasercontrolInterface):
@@ -51,15 +57,38 @@ class LumencorCelesta(Base, LasercontrolInterface):
             - "546"
             - "638"
             - "749"
+        keep_alive: True  # optional, reuse one HTTP connection for all commands
+        http_timeout: 2  # optional, in s
+        use_state_cache: True  # optional, skip commands that would not change the line intensities / states
+        standby_check_interval: 60  # optional, in s. Standby status is only queried after this idle time
+
+    With use_state_cache, the intensities and states of the laser lines are mirrored in the driver and commands that
+    would not change them are not sent. Changes made on the front panel of the source are not seen by the driver,
+    call refresh_state_cache in that case.
     """
 
     # config options
     _ip = ConfigOption('ip', missing='error')
     _wavelengths = ConfigOption('wavelengths', missing='error')
+    _keep_alive = ConfigOption('keep_alive', True)
+    _http_timeout = ConfigOption('http_timeout', 2.0)
+    _use_state_cache = ConfigOption('use_state_cache', True)
+    _standby_check_interval = ConfigOption('standby_check_interval', 60.0)
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
         self.laser_lines = {}
+        self.threadlock = Mutex()
+        # protects the state cache, so that comparing with the cache, sending and updating it is done at once
+        self._cache_lock = RecursiveMutex()
+        self._connection = None
+        # mirror of the source state, None if unknown
+        self._intensity_cache = None
+        self._state_cache = None
+        self._last_command_time = None
+        # updates collected by coalesced_update, separately for each thread: the updates of another thread are sent
+        # right away. Attributes 'depth', 'intensity' and 'state' (None if nothing is pending).
+        self._batch = threading.local()
 
     def on_activate(self):
         """ Initialization: test whether the celesta is connected
@@ -67,6 +96,8 @@ class LumencorCelesta(Base, LasercontrolInterface):
         try:
             message = self.lumencor_httpcommand(self._ip, 'GET VER')
             print('Lumencor source version {} was found'.format(message['message']))
+            if self._use_state_cache:
+                self.refresh_state_cache()
         except Exception:
             self.log.warning('Lumencor celesta laser source was not found - HTTP connection was not possible')
 
@@ -75,6 +106,7 @@ class LumencorCelesta(Base, LasercontrolInterface):
         """
         self.stop_all()
         self.set_ttl(False)
+        self._close_connection()
 
 # ----------------------------------------------------------------------------------------------------------------------
 # Celesta status functions
@@ -122,16 +154,19 @@ class LumencorCelesta(Base, LasercontrolInterface):
         """
 
         # check whether the laser source is in stand-by mode. Launch the wake-up procedure if at least one line is
-        # switched ON (at least one item in laser_on is equal to 1)
-        status = self.status()
-        if status == "A STAT 6" and (1 in laser_on):
-            self.wakeup()
+        # switched ON (at least one item in laser_on is equal to 1). The source only goes to stand-by after a long
+        # idle time, so the status query is skipped if it received a command recently.
+        if (1 in laser_on) and self._standby_check_needed():
+            status = self.status()
+            if status == "A STAT 6":
+                self.wakeup()
 
-        # define the intensity for each line
-        self.set_intensity_all_laser_lines(intensity)
+        with self.coalesced_update():
+            # define the intensity for each line
+            self.set_intensity_all_laser_lines(intensity)
 
-        # switch ON/OFF the laser lines (0=OFF ; 1=ON)
-        self.set_state_all_laser_lines(laser_on)
+            # switch ON/OFF the laser lines (0=OFF ; 1=ON)
+            self.set_state_all_laser_lines(laser_on)
 
     def get_dict(self):
         """ Retrieves the channel name and the voltage range for each analog output for laser control from the
@@ -161,29 +196,59 @@ class LumencorCelesta(Base, LasercontrolInterface):
 # ----------------------------------------------------------------------------------------------------------------------
 
     def get_laserline_intensity(self):
-        """ Return the intensity of all laser lines
+        """ Return the intensity of all laser lines. Taken from the state cache if it is enabled and up to date.
 
             intensity : array of int - indicate the intensity of each laser line
         """
-        message = self.lumencor_httpcommand(self._ip, 'GET MULCHINT')
-        intensity = [int(s) for s in message['message'].split() if s.isdigit()]
+        pending = self._pending('intensity')
+        if pending is not None:
+            return list(pending)
+        with self._cache_lock:
+            if self._use_state_cache and self._intensity_cache is not None:
+                return list(self._intensity_cache)
+
+            message = self.lumencor_httpcommand(self._ip, 'GET MULCHINT')
+            intensity = [int(s) for s in message['message'].split() if s.isdigit()]
+            if self._use_state_cache:
+                self._intensity_cache = list(intensity)
 
         return intensity
 
     def get_laserline_state(self):
-        """ Return the status of all laser lines
+        """ Return the status of all laser lines. Taken from the state cache if it is enabled and up to date.
 
             status : array of int - indicate the status of each laser line (1=ON, 0=OFF)
         """
-        message = self.lumencor_httpcommand(self._ip, 'GET MULCH')
-        status = [int(s) for s in message['message'].split() if s.isdigit()]
+        pending = self._pending('state')
+        if pending is not None:
+            return list(pending)
+        with self._cache_lock:
+            if self._use_state_cache and self._state_cache is not None:
+                return list(self._state_cache)
+
+            message = self.lumencor_httpcommand(self._ip, 'GET MULCH')
+            status = [int(s) for s in message['message'].split() if s.isdigit()]
+            if self._use_state_cache:
+                self._state_cache = list(status)
 
         return status
 
+    def refresh_state_cache(self):
+        """ Read the intensities and states of all laser lines from the source into the state cache.
+        """
+        with self._cache_lock:
+            self._intensity_cache = None
+            self._state_cache = None
+            self.get_laserline_intensity()
+            self.get_laserline_state()
+
     def stop_all(self):
         """ Set all laser lines to zero.
         """
-        self.lumencor_httpcommand(self._ip, 'SET MULCH 0 0 0 0 0 0 0')
+        self._batch.state = None
+        with self._cache_lock:
+            self.lumencor_httpcommand(self._ip, 'SET MULCH 0 0 0 0 0 0 0')
+            self._state_cache = [0] * len(self._wavelengths) if self._use_state_cache else None
 
     def set_ttl(self, ttl_state):
         """ Define whether the celesta source can be controlled through ttl control.
@@ -218,8 +283,17 @@ class LumencorCelesta(Base, LasercontrolInterface):
 
             intensity : array of int - indicate the laser power (in per thousand)
         """
-        command = 'SET MULCHINT {}'.format(' '.join(map(str, intensity)))
-        self.lumencor_httpcommand(self._ip, command)
+        intensity = [int(value) for value in intensity]
+        if getattr(self._batch, 'depth', 0):
+            self._batch.intensity = intensity
+            return
+        with self._cache_lock:
+            if self._use_state_cache and intensity == self._intensity_cache:
+                return
+            command = 'SET MULCHINT {}'.format(' '.join(map(str, intensity)))
+            self.lumencor_httpcommand(self._ip, command)
+            if self._use_state_cache:
+                self._intensity_cache = intensity
 
     def set_selected_laser_line_on_off(self, wavelength, state):
         """ Switch specified laser line to ON or OFF
@@ -243,8 +317,48 @@ class LumencorCelesta(Base, LasercontrolInterface):
 
             state : array of int - indicate 0 to switch OFF the specified line, or 1 to switch it ON.
         """
-        command = 'SET MULCH {}'.format(' '.join(map(str, state)))
-        self.lumencor_httpcommand(self._ip, command)
+        state = [int(value) for value in state]
+        if getattr(self._batch, 'depth', 0):
+            self._batch.state = state
+            return
+        with self._cache_lock:
+            if self._use_state_cache and state == self._state_cache:
+                return
+            command = 'SET MULCH {}'.format(' '.join(map(str, state)))
+            self.lumencor_httpcommand(self._ip, command)
+            if self._use_state_cache:
+                self._state_cache = state
+
+    @contextmanager
+    def coalesced_update(self):
+        """ Collect all intensity and state updates of the laser lines issued within the with block (e.g. one
+        imaging step) and send only the final intensities and states on exit, skipping what did not change.
+
+        Only the updates issued by the calling thread are collected, updates from other threads are sent right away.
+
+        Usage:
+            with celesta.coalesced_update():
+                celesta.set_intensity_all_laser_lines(intensity)
+                celesta.set_state_all_laser_lines(state)
+        """
+        batch = self._batch
+        batch.depth = getattr(batch, 'depth', 0) + 1
+        try:
+            yield
+        finally:
+            batch.depth -= 1
+            if not batch.depth:
+                intensity, batch.intensity = self._pending('intensity'), None
+                state, batch.state = self._pending('state'), None
+                if intensity is not None:
+                    self.set_intensity_all_laser_lines(intensity)
+                if state is not None:
+                    self.set_state_all_laser_lines(state)
+
+    def _pending(self, name):
+        """ Update of the intensities ('intensity') or states ('state') collected in the calling thread, or None.
+        """
+        return getattr(self._batch, name, None)
 
 # ----------------------------------------------------------------------------------------------------------------------
 # Helper functions
@@ -255,11 +369,52 @@ class LumencorCelesta(Base, LasercontrolInterface):
         Sends commands to the lumencor system via http.
         Please find commands here:
         http://lumencor.com/wp-content/uploads/sites/11/2019/01/57-10018.pdf
+
+        With keep_alive, all commands are sent through one persistent HTTP connection, which is reopened if the source
+        closed it.
         """
-        command_full = r'http://' + ip + '/service/?command=' + command.replace(' ', '%20')
-        with urllib.request.urlopen(command_full) as response:
-            message = eval(response.read())  # the default is conveniently JSON so eval creates dictionary
-            if message['message'][0] == 'E':
-                self.log.warning('An error occurred - the command was not recognized')
+        path = '/service/?command=' + urllib.parse.quote(command)
+        with self.threadlock:
+            if self._keep_alive:
+                try:
+                    raw_message = self._session_request(ip, path)
+                except (http.client.HTTPException, ConnectionError):
+                    # the source closed the persistent connection, retry once with a new one
+                    self._close_connection()
+                    raw_message = self._session_request(ip, path)
+            else:
+                with urllib.request.urlopen('http://' + ip + path, timeout=self._http_timeout) as response:
+                    raw_message = response.read()
+            self._last_command_time = monotonic()
+
+        message = json.loads(raw_message)  # the source answers with a JSON dictionary
+        if message['message'][0] == 'E':
+            self.log.warning('An error occurred - the command was not recognized')
 
         return message
+
+    def _session_request(self, ip, path):
+        """ Send a GET request through the persistent HTTP connection and return the response body.
+        """
+        if self._connection is None:
+            self._connection = http.client.HTTPConnection(ip, timeout=self._http_timeout)
+        self._connection.request('GET', path, headers={'Connection': 'keep-alive'})
+        response = self._connection.getresponse()
+        body = response.read()
+        if response.will_close:
+            self._close_connection()
+        return body
+
+    def _close_connection(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _standby_check_needed(self):
+        """ The source can only be in stand-by if no line is emitting and it did not receive commands for a while.
+        """
+        if not self._use_state_cache or self._last_command_time is None or self._state_cache is None:
+            return True
+        if 1 in self._state_cache:
+            return False
+        return monotonic() - self._last_command_time > self._standby_check_interval
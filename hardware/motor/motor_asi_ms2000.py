@@ -30,7 +30,9 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 """
 import numpy as np
 import serial
-from time import sleep, time
+import threading
+from contextlib import contextmanager
+from time import sleep, time, monotonic
 import re
 
 from core.module import Base
@@ -39,6 +41,159 @@ from interface.brightfield_interface import BrightfieldInterface
 from core.configoption import ConfigOption
 
 
+# ======================================================================================================================
+# Telemetry broker owning the serial line
+# ======================================================================================================================
+
+class StageTelemetryBroker:
+    """ Serializes the access to the serial line of the stage and polls its telemetry (position and status) in a
+    background thread at a fixed rate.
+
+    Motion commands (high priority) are always served before polling queries waiting for the line. The latest
+    telemetry is cached with the time it was taken, so that consumers (GUI tracking, tasks, autofocus) can read it
+    without a serial round trip. Telemetry of a polling cycle that started before the last motion command was written
+    is discarded.
+    """
+
+    def __init__(self, poll_function, rate, log):
+        """
+        :param callable poll_function: function returning the telemetry as dict, called from the polling thread
+        :param float rate: polling rate in Hz
+        :param log: logger of the hardware module
+        """
+        self._poll_function = poll_function
+        self._period = 1 / rate if rate > 0 else None
+        self.log = log
+
+        self._condition = threading.Condition()
+        self._line_busy = False
+        self._priority_waiting = 0
+
+        self._telemetry = None
+        self._telemetry_time = -np.inf
+        self._motion_count = 0  # number of motion commands written, incremented while the line is held
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def is_polling(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def period(self):
+        return self._period
+
+    def start(self):
+        """ Start the polling thread (if a polling rate was defined). """
+        if self._period is None or self.is_polling:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._poll_loop, name='asi-stage-telemetry', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the polling thread and wait until it finished. """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    @contextmanager
+    def serial_access(self, high_priority=True):
+        """ Context manager giving exclusive access to the serial line. Low priority requests (polling) wait as long
+        as high priority requests (commands) are pending.
+        """
+        with self._condition:
+            if high_priority:
+                self._priority_waiting += 1
+            try:
+                while self._line_busy or (not high_priority and self._priority_waiting):
+                    self._condition.wait()
+            finally:
+                if high_priority:
+                    self._priority_waiting -= 1
+            self._line_busy = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._line_busy = False
+                self._condition.notify_all()
+
+    def notify_motion(self):
+        """ Mark the cached telemetry as outdated. Must be called inside serial_access, right after a motion command
+        was written, so that no polling query can be sent between the command and this call.
+        """
+        with self._condition:
+            self._motion_count += 1
+            self._telemetry = None
+
+    def get_latest(self, max_age=None):
+        """ Return the latest telemetry if it is up to date.
+
+        :param float max_age: optional, maximum age in s. Default: two polling periods
+
+        :return dict: telemetry including the key 'timestamp' (time.monotonic), None if not available or outdated
+        """
+        if max_age is None:
+            max_age = 2 * self._period if self._period is not None else 0
+        with self._condition:
+            if self._telemetry is None or monotonic() - self._telemetry_time > max_age:
+                return None
+            return dict(self._telemetry, timestamp=self._telemetry_time)
+
+    def wait_for(self, predicate, timeout):
+        """ Wait until telemetry taken after the last motion command fulfills predicate.
+
+        :param callable predicate: function taking the telemetry dict and returning a bool
+        :param float timeout: maximum waiting time in s
+
+        :return bool: True if the condition was met, False on timeout or if polling is not running
+        """
+        deadline = monotonic() + timeout
+        with self._condition:
+            while self.is_polling:
+                if self._telemetry is not None and predicate(self._telemetry):
+                    return True
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(min(remaining, self._period))
+        return False
+
+    def poll_once(self):
+        """ Run one polling cycle and cache the telemetry, unless a motion command was written in the meantime.
+
+        :return bool: True if the telemetry was cached
+        """
+        start = monotonic()
+        with self._condition:
+            motion_count = self._motion_count
+        telemetry = self._poll_function()
+        with self._condition:
+            # a motion command written during the polling cycle makes (part of) the answers outdated
+            cached = motion_count == self._motion_count
+            if cached:
+                self._telemetry = telemetry
+                self._telemetry_time = start
+            self._condition.notify_all()
+        return cached
+
+    def _poll_loop(self):
+        error_logged = False
+        while not self._stop_event.is_set():
+            start = monotonic()
+            try:
+                self.poll_once()
+            except Exception:
+                if not error_logged:
+                    self.log.exception('Polling the stage telemetry failed.')
+                    error_logged = True
+            else:
+                error_logged = False
+            self._stop_event.wait(max(0.0, self._period - (monotonic() - start)))
+
+
 # ======================================================================================================================
 # Hardware class
 # ======================================================================================================================
@@ -55,6 +210,11 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
         second_axis_label: 'y'
         third_axis_label: 'z'
         LED connected: False
+        telemetry_rate: 5  # optional, in Hz. Position and status are polled in the background, 0 to disable
+
+    All accesses to the serial line are serialized, motion commands are served before the telemetry polling. With
+    telemetry polling enabled, get_pos returns the cached position as long as it is up to date and wait_for_idle
+    waits for the polled status instead of querying it itself.
     """
     # config options
     _com_port = ConfigOption("com_port", missing="error")
@@ -66,6 +226,7 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
     _third_axis_label = ConfigOption("third_axis_label", None)
 
     _has_led = ConfigOption("LED connected", False, missing="warn")
+    _telemetry_rate = ConfigOption("telemetry_rate", 0)
 
     # attributes
     _conversion_factor = 10.0  # user will send positions in um, stage uses 0.1 um
@@ -76,10 +237,12 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
         self._led_mode = 'Internal'
+        self._broker = None
 
     def on_activate(self):
         """ Initialization: opening serial port and setting internal attributes.
         """
+        self._broker = StageTelemetryBroker(self._poll_telemetry, self._telemetry_rate, self.log)
         try:
             self._serial_connection = serial.Serial(
                 self._com_port, baudrate=self._baud_rate, bytesize=8, parity="N", stopbits=1, xonxoff=True
@@ -100,12 +263,15 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
             if self._has_led:
                 self.led_mode('Internal')
 
+            self._broker.start()
+
         except Exception:
             self.log.error(f'ASI MS2000 automated stage not connected. Check if device is switched on.')
 
     def on_deactivate(self):
         """ Close serial port when deactivating the module.
         """
+        self._broker.stop()
         self._serial_connection.close()
         # safety check  # to explore when problem with stage arises again ..
         port_open = self._serial_connection.is_open
@@ -155,16 +321,19 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
         """
         err = False
         try:
+            steps = []
             for axis_label in param_dict:
                 if (
                     axis_label in self.axis_list
                 ):  # to ensure that only configured axes are taken into account in case param_dict indicates other axes
                     step = np.round(param_dict[axis_label] * self._conversion_factor, decimals=4)  # avoid error due to decimal overflow
-                    cmd = f"R {axis_label}={step}\r"
-                    self.write(cmd)
-                    err = True
+                    steps.append(f"{axis_label}={step}")
                 else:
                     self.log.warn(f"axis {axis_label} is not configured")
+            if steps:
+                # all axes in a single command
+                self.write(f"R {' '.join(steps)}\r", motion=True)
+                err = True
         except Exception:
             self.log.error("Relative movement of ASI MS2000 translation stage is not possible.")
             
@@ -179,16 +348,19 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
         """
         err = False
         try:
+            positions = []
             for axis_label in param_dict:
                 if (
                     axis_label in self.axis_list
                 ):  # to ensure that only configured axes are taken into account in case param_dict indicates other axes
                     new_pos = np.round(param_dict[axis_label] * self._conversion_factor, decimals=4)  # avoid error due to decimal overflow
-                    cmd = f"M {axis_label}={new_pos}\r"
-                    self.write(cmd)
-                    err = True
+                    positions.append(f"{axis_label}={new_pos}")
                 else:
                     self.log.warn(f"axis {axis_label} is not configured")
+            if positions:
+                # all axes in a single command
+                self.write(f"M {' '.join(positions)}\r", motion=True)
+                err = True
 
         except Exception:
             self.log.error("Absolute movement of ASI MS2000 translation stage is not possible")
@@ -204,41 +376,50 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
         :return bool: error code (True: ok, False: error)
         """
         cmd = "\\r"
-        self.write(cmd)
+        self.write(cmd, motion=True)
         # self._serial_connection.flush() # tried this, also flushInput(), to enable command N+1. does not work....
         # to be improved
         return True
 
-    def get_pos(self, param_list=None):
+    def get_pos(self, param_list=None, max_age=None):
         """ Gets current position of the stage.
 
+        If telemetry polling is enabled, the cached position is returned as long as it is up to date (taken after the
+        last motion command and not older than max_age). Otherwise all axes are queried with a single command.
+
         :param list param_list: optional, if a specific position of an axis
                                 is desired, then the labels of the needed
                                 axis should be passed in the param_list.
                                 If nothing is passed, then from each axis the
                                 position is asked.
+        :param float max_age: optional, maximum age in s of the cached position. Default: two polling periods
 
         :return dict pos: Dictionary with axis name and current position of the translation stage
         """
-        pos = {}
+        telemetry = self._broker.get_latest(max_age)
+        all_pos = telemetry['position'] if telemetry is not None else self._query_positions()
 
         if not param_list:  # get all axes
-            # this list is generated above to generalize more easily in case that more axes are added
-            for axis_label in self.axis_list:
-                cmd = f"W {axis_label}\r"
-                # [3:] -> remove the leading 'A: '
-                pos[axis_label] = float(self.query(cmd)[3:]) / self._conversion_factor
-
-        else:
-            for item in param_list:
-                if item in self.axis_list:
-                    cmd = f"W {item}\r"
-                    pos[item] = float(self.query(cmd)[3:]) / self._conversion_factor
-                else:
-                    self.log.warn(f'Specified axis not available: {item}')
+            return dict(all_pos)
 
+        pos = {}
+        for item in param_list:
+            if item in self.axis_list:
+                pos[item] = all_pos[item]
+            else:
+                self.log.warn(f'Specified axis not available: {item}')
         return pos
 
+    def get_telemetry(self, max_age=None):
+        """ Return the latest polled telemetry of the stage without serial communication.
+
+        :param float max_age: optional, maximum age in s. Default: two polling periods
+
+        :return dict: with keys 'position' (dict, in um), 'status' ('N' idle, 'B' busy) and 'timestamp'
+                      (time.monotonic), None if polling is disabled or the telemetry is outdated
+        """
+        return self._broker.get_latest(max_age)
+
     def get_status(self, param_list=None):
         """ Queries if any motors are still busy moving following a serial command.
 
@@ -272,14 +453,14 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
         if not param_list:
             for axis_label in self.axis_list:
                 cmd = f"AA {axis_label}\r"
-                self.write(cmd)
+                self.write(cmd, motion=True)
                 err = 0
 
         else:
             for item in param_list:
                 if item in self.axis_list:
                     cmd = f"AA {item}\r"
-                    self.write(cmd)
+                    self.write(cmd, motion=True)
                     err = 0
                 else:
                     self.log.warn(f'Specified axis not available: {item}')
@@ -342,8 +523,14 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
     def wait_for_idle(self):
         """ Wait until a motorized stage is in idle state.
         Checks every 1 s until timeout if a motor is running from a serial command 'B' or not 'N'
+        With telemetry polling enabled, the polled status is used instead of querying the stage.
         :return None
         """
+        if self._broker.is_polling:
+            if not self._broker.wait_for(lambda telemetry: telemetry['status'] == 'N', self._timeout):
+                self.log.error("ASI MS2000 translation stage timeout occurred")
+            return
+
         status = self.get_status()
         waiting_time = 0
         while status != "N":
@@ -365,7 +552,7 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
         :return: error code (ok: 0)
         """
         cmd = "! X Y \r"
-        self.write(cmd)
+        self.write(cmd, motion=True)
         return 0
 
     def set_to_zero(self):
@@ -374,7 +561,7 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
         :return: error code (ok: 0)
         """
         cmd = "Z \r"
-        self.write(cmd)
+        self.write(cmd, motion=True)
         return 0
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -417,37 +604,43 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
 # Helper functions
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def query(self, command):
+    def query(self, command, high_priority=True):
         """ Clears the input buffer and queries an utf-8 encoded command.
         
         :param: string command: message to send to the serial port, typically in the format
         'COMMANDSHORTCUT [AXIS=value]\r'
+        :param: bool high_priority: False for polling queries, which are only sent if no other command is waiting
         :return: string answer: formatted and decoded response from serial port
         """
-
-        self._serial_connection.flushInput()
-        self._serial_connection.flushOutput()
-        self._serial_connection.write(command.encode())
-        answer = self._serial_connection.readline().decode().strip()
+        with self._broker.serial_access(high_priority):
+            self._serial_connection.flushInput()
+            self._serial_connection.flushOutput()
+            self._serial_connection.write(command.encode())
+            answer = self._serial_connection.readline().decode().strip()
         # print("ASI stage query {}".format(command))
         # print("ASI stage query return : {}".format(answer))
         return answer
 
-    def write(self, command):
+    def write(self, command, motion=False):
         """ Clears the input buffer and writes an utf-8 encoded command to the serial port .
         
         :param string command: message to send to the serial port, typically in the format
         'COMMANDSHORTCUT [AXIS=value]\r'
+        :param bool motion: True if the command moves the stage (or changes the position reference). The cached
+                            telemetry is marked outdated before the line is released.
         :return: None
         """
         n_attempt = 0
         success = False
 
         while n_attempt < 10 and success is False:
-            self._serial_connection.flushInput()
-            self._serial_connection.flushOutput()
-            self._serial_connection.write(command.encode())
-            answer = self._serial_connection.readline().decode().strip()
+            with self._broker.serial_access():
+                self._serial_connection.flushInput()
+                self._serial_connection.flushOutput()
+                self._serial_connection.write(command.encode())
+                if motion:
+                    self._broker.notify_motion()
+                answer = self._serial_connection.readline().decode().strip()
             is_match = bool(re.match(":A", answer))
             if is_match is True:
                 success = True
@@ -458,3 +651,26 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
 
         if success is False:
             print('The ASI stage is unable to execute the command : {}'. format(command))
+
+    def _query_positions(self, high_priority=True):
+        """ Query the position of all axes with a single command.
+
+        :param: bool high_priority: False for polling queries
+        :return dict: axis label and position in um
+        """
+        answer = self.query(f"W {' '.join(self.axis_list)}\r", high_priority)
+        # [3:] -> remove the leading ':A '
+        values = answer[3:].split()
+        if len(values) != len(self.axis_list):
+            raise ValueError(f'Unexpected answer of the ASI stage to position query: {answer}')
+        return {axis_label: float(value) / self._conversion_factor for axis_label, value in zip(self.axis_list, values)}
+
+    def _poll_telemetry(self):
+        """ Polling function of the telemetry broker. The status is queried before the position, so that the
+        position of a cycle reporting idle state is the final position of the last movement.
+
+        :return dict: telemetry with keys 'status' and 'position'
+        """
+        status = self.query("/ \r", high_priority=False)
+        position = self._query_positions(high_priority=False)
+        return {'status': status, 'position': position}
@@ -62,6 +62,7 @@ class MotorDummy(Base, MotorInterface):
         self._axis_label = self._z_axis.label
 
         self._wait_after_movement = 0.5  # in seconds
+        self._led_intensity = 0
 
     # TODO: Checks if configuration is set and is reasonable
 
@@ -550,6 +551,13 @@ class MotorDummy(Base, MotorInterface):
     def wait_for_idle(self):
         time.sleep(0.1)
 
+    def led_control(self, intens):
+        """ Simulates the LED of the ASI stage used for brightfield imaging.
+        :param: int intensity: percentage of maximum intensity to be applied to the LED
+        :return: None
+        """
+        self._led_intensity = int(min(max(intens, 0), 99))
+
     def _make_wait_after_movement(self):
         """ Define a time which the dummy should wait after each movement. """
         time.sleep(self._wait_after_movement)
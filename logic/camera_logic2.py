@@ -27,8 +27,9 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 -----------------------------------------------------------------------------------
 """
 import numpy as np
-from time import sleep  #, time
+from time import sleep, monotonic  #, time
 import os
+from functools import partial
 from tifffile import TiffWriter
 # from PIL import Image
 from astropy.io import fits
@@ -36,11 +37,13 @@ import yaml
 
 from core.connector import Connector
 from core.configoption import ConfigOption
+from core.util.stream_file import StreamFileWriter
+from core.util.ome_zarr import OmeZarrWriter, has_zarr
 from logic.generic_logic import GenericLogic
 from qtpy import QtCore
 
 # ======================================================================================================================
-# Worker class for camera live display
+# Worker classes for video saving and spooling
 # ======================================================================================================================
 
 
@@ -49,23 +52,7 @@ class WorkerSignals(QtCore.QObject):
     sigFinished = QtCore.Signal()
     sigStepFinished = QtCore.Signal(str, str, int, bool, dict, bool)
     sigSpoolingStepFinished = QtCore.Signal(str, str, str, bool, dict)
-
-
-class LiveImageWorker(QtCore.QRunnable):
-    """ Worker thread to update the live image at the desired frame rate
-
-    The worker handles only the waiting time, and emits a signal that serves to trigger the update indicators
-    """
-    def __init__(self, time_constant):
-        super(LiveImageWorker, self).__init__()
-        self.signals = WorkerSignals()
-        self.time_constant = time_constant
-
-    @QtCore.Slot()
-    def run(self):
-        """ """
-        sleep(self.time_constant)
-        self.signals.sigFinished.emit()
+    sigSpoolProgress = QtCore.Signal(int, int)  # frames written, frames dropped
 
 
 class SaveProgressWorker(QtCore.QRunnable):
@@ -116,6 +103,150 @@ class SpoolProgressWorker(QtCore.QRunnable):
                                                   self.metadata)
 
 
+class SoftwareSpoolWorker(QtCore.QRunnable):
+    """ Worker thread draining the frames acquired by the camera into a file during a software spooling acquisition.
+
+    If the camera hardware provides the (non-interface) method get_new_frames, all frames acquired since the last call
+    are retrieved. The frames missing with respect to the number of frames acquired by the camera are counted as
+    dropped (for example after an overrun of the camera buffer). For cameras without this method, the most recent image
+    is retrieved each time the progress of the camera increases, frames acquired in between are counted as dropped.
+
+    The worker runs until n_frames were written or dropped, until the camera stopped acquiring without delivering new
+    frames, or until stop is called. The signal sigFinished is emitted at the end, the error attribute is set if an
+    exception occurred.
+    """
+    def __init__(self, hardware, writer, n_frames, poll_interval, progress_interval):
+        super(SoftwareSpoolWorker, self).__init__()
+        self.signals = WorkerSignals()
+        self.hardware = hardware
+        self.writer = writer
+        self.n_frames = n_frames
+        self.poll_interval = poll_interval
+        self.progress_interval = progress_interval
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.latest_frame = None
+        self.error = None
+        self._stop_requested = False
+        self._last_progress = 0
+
+    def stop(self):
+        """ Request the worker to stop after the current iteration. """
+        self._stop_requested = True
+
+    @QtCore.Slot()
+    def run(self):
+        """ """
+        last_report = monotonic()
+        try:
+            while not self._stop_requested and self.frames_written + self.frames_dropped < self.n_frames:
+                frames, frames_acquired = self._drain()
+                if len(frames) > 0:
+                    frames = frames[:self.n_frames - self.frames_written - self.frames_dropped]
+                    self.writer.append(frames)
+                    self.frames_written += len(frames)
+                    self.latest_frame = frames[-1]
+                frames_acquired = min(frames_acquired, self.n_frames)
+                self.frames_dropped = max(self.frames_dropped, frames_acquired - self.frames_written)
+
+                if monotonic() - last_report >= self.progress_interval:
+                    last_report = monotonic()
+                    self.signals.sigSpoolProgress.emit(self.frames_written, self.frames_dropped)
+                if len(frames) == 0:
+                    if self.hardware.get_ready_state():  # acquisition stopped or aborted, no more frames to expect
+                        break
+                    sleep(self.poll_interval)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.writer.update_metadata(frames_saved=self.frames_written, frames_dropped=self.frames_dropped)
+            self.writer.close()
+            self.signals.sigSpoolProgress.emit(self.frames_written, self.frames_dropped)
+            self.signals.sigFinished.emit()
+
+    def _drain(self):
+        """ Retrieve the new frames from the camera.
+
+        :return: tuple (np.ndarray frames of shape (n, rows, cols), int number of frames acquired by the camera so far)
+        """
+        if hasattr(self.hardware, 'get_new_frames'):
+            return self.hardware.get_new_frames()
+
+        progress = self.hardware.get_progress()
+        if progress > self._last_progress:
+            self._last_progress = progress
+            return self.hardware.get_most_recent_image()[np.newaxis], progress
+        return [], progress
+
+
+class TiffSpoolWriter:
+    """ Appends frames to a (big) tiff file. The tiff file is written contiguously, so that it can be read as a single
+    stack, even if the acquisition was stopped early. """
+    def __init__(self, path):
+        self.path = path
+        self._tif = TiffWriter(path, bigtiff=True)
+
+    def append(self, frames):
+        self._tif.save(frames.astype(np.uint16, copy=False), contiguous=True)
+
+    def update_metadata(self, **kwargs):
+        pass  # the metadata is saved in a separate txt file for the tiff format
+
+    def close(self):
+        if self._tif is not None:
+            self._tif.close()
+            self._tif = None
+
+
+class NpySpoolWriter:
+    """ Writes frames to a npy file pre-allocated for n_frames on the first call of append. Frames that were not written
+    (dropped frames, or an acquisition stopped early) remain zero. """
+    def __init__(self, path, n_frames):
+        self.path = path
+        self.n_frames = n_frames
+        self._array = None
+        self._index = 0
+
+    def append(self, frames):
+        if self._array is None:
+            self._array = np.lib.format.open_memmap(self.path, mode='w+', dtype=np.uint16,
+                                                    shape=(self.n_frames,) + frames.shape[1:])
+        self._array[self._index:self._index + len(frames)] = frames
+        self._index += len(frames)
+
+    def update_metadata(self, **kwargs):
+        pass  # the metadata is saved in a separate txt file for the npy format
+
+    def close(self):
+        if self._array is not None:
+            self._array.flush()
+            self._array = None
+
+
+class RawSpoolWriter:
+    """ Appends frames to a qudi stream file (raw data with a json header containing the metadata, see
+    core.util.stream_file). The file is opened on the first call of append, when the frame shape is known. """
+    def __init__(self, path, metadata=None):
+        self.path = path
+        self._metadata = dict() if metadata is None else dict(metadata)
+        self._writer = None
+
+    def append(self, frames):
+        if self._writer is None:
+            self._writer = StreamFileWriter(self.path, frame_shape=frames.shape[1:], dtype=np.uint16,
+                                            metadata=self._metadata)
+        self._writer.append(frames)
+
+    def update_metadata(self, **kwargs):
+        self._metadata.update(kwargs)
+        if self._writer is not None:
+            self._writer.update_metadata(**kwargs)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
 # ======================================================================================================================
 # Logic class
 # ======================================================================================================================
@@ -130,6 +261,10 @@ class CameraLogic(GenericLogic):
     camera_logic:
         module.Class: 'camera_logic2.CameraLogic'
         default_exposure: 20
+        zarr_compression: 'zstd'  # lossless compression of the OME-Zarr chunks ('zstd', 'lz4', .., or None)
+        zarr_pyramid_levels: 3  # number of downsampled levels written together with the OME-Zarr data
+        software_spooling: False  # if True, spooling is done by the logic for any camera (always for cameras that
+                                  # do not provide spooling, such as hamamatsu and thorlabs cameras)
         connect:
             hardware: 'andor_ultra_camera'
     """
@@ -138,6 +273,10 @@ class CameraLogic(GenericLogic):
 
     # config options
     _max_fps = ConfigOption('default_exposure', 20)
+    software_spooling = ConfigOption('software_spooling', False)
+    _spool_poll_interval = ConfigOption('spool_poll_interval', 0.005)  # in s
+    _zarr_compression = ConfigOption('zarr_compression', 'zstd')  # blosc compressor, or None for no compression
+    _zarr_pyramid_levels = ConfigOption('zarr_pyramid_levels', 3)
 
     # signals
     sigUpdateDisplay = QtCore.Signal()
@@ -172,11 +311,16 @@ class CameraLogic(GenericLogic):
     _kinetic_time = None
 
     _hardware = None
-    fileformat_list = ['tif', 'fits', 'npy']
+    fileformat_list = ['tif', 'fits', 'npy', 'zarr'] if has_zarr else ['tif', 'fits', 'npy']
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
         self.threadpool = QtCore.QThreadPool()
+        # dedicated thread for the software spooling, so that the disk access never waits for a display worker
+        self._spool_threadpool = QtCore.QThreadPool()
+        self._spool_threadpool.setMaxThreadCount(1)
+        self._spool_worker = None
+        self._live_job = None
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
@@ -196,9 +340,16 @@ class CameraLogic(GenericLogic):
         self.get_gain()
         self.get_temperature()
 
+        # periodic job refreshing the live image
+        self._live_job = self.getScheduler().add_job('{0}.live'.format(self._name), self.loop, 1 / self._fps,
+                                                     owner=self, tags=('gui',))
+
     def on_deactivate(self):
         """ Perform required deactivation. """
-        pass
+        self.getScheduler().remove_job(self._live_job.name)
+        if self._spool_worker is not None:
+            self._spool_worker.stop()
+            self._spool_threadpool.waitForDone()
 
 # ----------------------------------------------------------------------------------------------------------------------
 # (Low-level) methods making the camera interface functions accessible from the GUI.
@@ -463,9 +614,8 @@ class CameraLogic(GenericLogic):
         """
         self.enabled = True
 
-        worker = LiveImageWorker(1 / self._fps)
-        worker.signals.sigFinished.connect(self.loop)
-        self.threadpool.start(worker)
+        self._live_job.interval = 1 / self._fps
+        self._live_job.start()
 
         if self._hardware.support_live_acquisition():
             self._hardware.start_live_acquisition()
@@ -473,16 +623,12 @@ class CameraLogic(GenericLogic):
             self._hardware.start_single_acquisition()
 
     def loop(self):
-        """ Execute one step in the live display loop.
+        """ Execute one step in the live display loop. Called periodically by the scheduler while live mode is on.
         """
         if self.enabled:
             self._last_image = self._hardware.get_acquired_data()
             self.sigUpdateDisplay.emit()
 
-            worker = LiveImageWorker(1 / self._fps)
-            worker.signals.sigFinished.connect(self.loop)
-            self.threadpool.start(worker)
-
             if not self._hardware.support_live_acquisition():
                 self._hardware.start_single_acquisition()  # the hardware has to check it's not busy
 
@@ -490,6 +636,7 @@ class CameraLogic(GenericLogic):
         """ Stop the live display loop.
         """
         self.enabled = False
+        self._live_job.stop()
         self._hardware.stop_acquisition()
         self.sigVideoFinished.emit()
 
@@ -634,6 +781,8 @@ class CameraLogic(GenericLogic):
         elif fileformat == '.npy':
             self.save_to_npy(complete_path, image_data)
             self.save_metadata_txt_file(filenamestem, '_Movie', metadata)
+        elif fileformat == '.zarr':
+            self.save_to_zarr(complete_path, image_data, metadata)
         else:
             self.log.info(f'Your fileformat {fileformat} is currently not covered')
 
@@ -656,6 +805,11 @@ class CameraLogic(GenericLogic):
 
         :return: None
         """
+        # the andor camera spools only to tiff and fits, the other formats are handled by the software spooling
+        if self.software_spooling or not self.has_hardware_spooling() or fileformat not in ['.tif', '.fits']:
+            self.start_software_spooling(filenamestem, fileformat, n_frames, is_display, metadata)
+            return
+
         if self.enabled:  # live mode is on
             # store the state of live mode in a helper variable
             self.restart_live = True
@@ -764,6 +918,144 @@ class CameraLogic(GenericLogic):
 
         self.sigSpoolingFinished.emit()
 
+    # software spooling, available for all cameras ---------------------------------------------------------------------
+    def has_hardware_spooling(self):
+        """ Check if the camera spools movies to disk by itself.
+
+        :return: bool: True for the andor camera
+        """
+        return hasattr(self._hardware, '_set_spool')
+
+    def has_software_spooling(self):
+        """ Check if the software spooling can retrieve every frame of a movie while it is acquired. This needs the
+        (non-interface) method get_new_frames of the camera hardware. Only the most recent image can be retrieved from
+        other cameras, so most of the frames would be dropped.
+
+        :return: bool: True for the hamamatsu camera and the camera dummy
+        """
+        return hasattr(self._hardware, 'get_new_frames')
+
+    def spooling_available(self):
+        """ Check if movies can be spooled to disk (instead of being stored in memory until the end of the acquisition).
+
+        :return: bool: True if the camera provides spooling or the software spooling can retrieve all its frames
+        """
+        return self.has_hardware_spooling() or self.has_software_spooling()
+
+    def start_software_spooling(self, filenamestem, fileformat, n_frames, is_display, metadata):
+        """ Starts saving n_frames to disk while they are acquired. The frames are retrieved from the camera and written
+        to the file on a dedicated thread, so that the size of a movie is limited by the disk and not by the memory.
+
+        :param: str filenamestem, such as '/home/barho/images/2020-12-16/samplename'
+        :param: str fileformat: including the dot: '.tif', '.npy' (file pre-allocated for n_frames), '.raw'
+                (qudi stream file with the metadata in the header) or '.zarr' (OME-Zarr, metadata in the attributes).
+                '.fits' is not available and replaced by '.tif'.
+        :param: int n_frames: number of frames to be saved
+        :param: bool is_display: show images on live display on gui
+        :param: dict metadata: meta information to be saved with the image data (in a separate txt file for tiff and
+                npy fileformat, or in the file for raw and zarr fileformat)
+
+        :return: None
+        """
+        if fileformat == '.fits':
+            self.log.warning('Fits files can not be written during the acquisition. Spooling to tiff instead.')
+            fileformat = '.tif'
+        if fileformat not in ['.tif', '.npy', '.raw', '.zarr']:
+            self.log.info(f'Your fileformat {fileformat} is currently not covered')
+            return
+
+        if self.enabled:  # live mode is on
+            # store the state of live mode in a helper variable
+            self.restart_live = True
+            self.enabled = False  # live mode will stop then
+            self._hardware.stop_acquisition()
+
+        self.saving = True
+        path = self.create_generic_filename(filenamestem, '_Movie', 'movie', fileformat, addfile=False)
+        if fileformat == '.tif':
+            writer = TiffSpoolWriter(path)
+        elif fileformat == '.npy':
+            writer = NpySpoolWriter(path, n_frames)
+        elif fileformat == '.zarr':
+            writer = OmeZarrWriter(path, metadata=metadata, pyramid_levels=self._zarr_pyramid_levels,
+                                   compression=self._zarr_compression)
+        else:
+            writer = RawSpoolWriter(path, metadata)
+
+        # cameras acquiring into a ring buffer (such as the hamamatsu) provide a specific method, so that the camera
+        # buffer does not need to hold the complete movie
+        if hasattr(self._hardware, 'start_spooling_acquisition'):
+            err = self._hardware.start_spooling_acquisition(n_frames)
+        else:
+            err = self._hardware.start_movie_acquisition(n_frames)
+        if not err:
+            self.log.warning('Spooling did not start')
+
+        worker = SoftwareSpoolWorker(self._hardware, writer, n_frames, self._spool_poll_interval, 1 / self._fps)
+        worker.signals.sigSpoolProgress.connect(partial(self.software_spooling_progress, is_display=is_display))
+        worker.signals.sigFinished.connect(partial(self.finish_software_spooling, filenamestem, path, fileformat,
+                                                   metadata))
+        self._spool_worker = worker
+        self._spool_threadpool.start(worker)
+
+    def software_spooling_progress(self, frames_written, frames_dropped, is_display=False):
+        """ Slot called regularly by the spooling worker. Updates the progress and the live display if activated.
+
+        :param: int frames_written: number of frames saved so far
+        :param: int frames_dropped: number of frames lost so far
+        :param: bool is_display: show images on live display on gui
+
+        :return: None
+        """
+        self.sigProgress.emit(frames_written)
+        if is_display and self._spool_worker is not None and self._spool_worker.latest_frame is not None:
+            self._last_image = self._spool_worker.latest_frame
+            self.sigUpdateDisplay.emit()
+
+    def stop_software_spooling(self):
+        """ Stop a software spooling acquisition before all frames are acquired. The frames acquired so far are kept.
+
+        :return: None
+        """
+        if self._spool_worker is not None:
+            self._spool_worker.stop()
+
+    def finish_software_spooling(self, filenamestem, path, fileformat, metadata):
+        """ This method finishes the software spooling procedure, once the spooling worker finished.
+
+        :param: str filenamestem, such as '/home/barho/images/2020-12-16/samplename'
+        :param: str path: complete path of the file created in start_software_spooling
+        :param: str fileformat: including the dot, such as '.tif', '.npy', '.raw'
+        :param: dict metadata: meta information to be saved with the image data
+
+        :return: None
+        """
+        worker = self._spool_worker
+        self._spool_worker = None
+        self._hardware.finish_movie_acquisition()
+
+        if worker.error is not None:
+            self.log.error(f'Spooling to {path} failed after {worker.frames_written} frames: {worker.error}')
+        else:
+            self.log.info('Saved data to file {}'.format(path))
+        if worker.frames_dropped > 0:
+            self.log.warning(f'{worker.frames_dropped} frames were dropped during spooling to {path}.')
+
+        metadata = dict(metadata)
+        metadata['Frames saved'] = worker.frames_written
+        metadata['Frames dropped'] = worker.frames_dropped
+        if fileformat not in ['.raw', '.zarr']:  # the metadata is already in the raw or zarr file
+            self.save_metadata_txt_file(filenamestem, '_Movie', metadata)
+
+        self.saving = False
+
+        # restart live in case it was activated
+        if self.restart_live:
+            self.restart_live = False  # reset to default value
+            self.start_loop()
+
+        self.sigSpoolingFinished.emit()
+
 # ----------------------------------------------------------------------------------------------------------------------
 # Methods for Qudi tasks / experiments requiring synchronization between camera and lightsources
 # ----------------------------------------------------------------------------------------------------------------------
@@ -1038,6 +1330,27 @@ class CameraLogic(GenericLogic):
         # t1 = time()
         # print(f'Saving time : {t1-t0}s')
 
+    def save_to_zarr(self, path, data, metadata, channels=1, pixel_size=1., z_step=1.):
+        """ Save the image data in OME-Zarr format, with one chunk per plane and a pyramid of downsampled images.
+        The metadata is saved in the attributes of the zarr group, no separate metadata file is needed.
+
+        :param: str path: complete path of the directory where the data is saved to (including the suffix .zarr)
+        :param: data: np.array (2D or 3D, with interleaved channels in case of a 3D stack)
+        :param: dict metadata: dictionary containing the metadata that shall be saved with the image data
+        :param: int channels: number of interleaved channels in the stack
+        :param: float pixel_size: pixel size in um
+        :param: float z_step: distance between two planes in um
+
+        :return: None
+        """
+        try:
+            with OmeZarrWriter(path, channels=channels, metadata=metadata, pyramid_levels=self._zarr_pyramid_levels,
+                               compression=self._zarr_compression, pixel_size=pixel_size, z_step=z_step) as writer:
+                writer.append(data)
+            self.log.info('Saved data to file {}'.format(path))
+        except Exception as e:
+            self.log.warning(f'Data not saved: {e}')
+
 # ----------------------------------------------------------------------------------------------------------------------
 # Methods to handle the user interface state
 # ----------------------------------------------------------------------------------------------------------------------
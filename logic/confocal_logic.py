@@ -21,9 +21,14 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 from qtpy import QtCore
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy
+import os
+import threading
 import time
 import datetime
+import uuid
+import zlib
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
@@ -31,6 +36,7 @@ import matplotlib.pyplot as plt
 from logic.generic_logic import GenericLogic
 from core.util.mutex import Mutex
 from core.connector import Connector
+from core.configoption import ConfigOption
 from core.statusvariable import StatusVar
 
 
@@ -41,6 +47,103 @@ class OldConfigFileError(Exception):
         super().__init__('Old configuration file detected. Ignoring confocal history.')
 
 
+class HistoryImage:
+    """ Image of a confocal history entry.
+
+    The image array is kept by reference (no copy) until the image is compressed, which is done in the background
+    for older history entries. Consecutive history entries whose image did not change share the same HistoryImage.
+    Images persisted to a file are loaded lazily on first access.
+    """
+
+    def __init__(self, array=None, filename=None):
+        """
+        @param numpy.ndarray array: optional, the image. Must not be modified afterwards.
+        @param str filename: optional, file the image was persisted to, see persist
+        """
+        self._lock = threading.Lock()
+        self._array = array
+        self._compressed = None
+        self._shape = None if array is None else array.shape
+        self._dtype = None if array is None else array.dtype
+        self.filename = filename
+
+    @property
+    def shape(self):
+        with self._lock:
+            if self._shape is None:
+                self._load()
+            return self._shape
+
+    @property
+    def nbytes(self):
+        """ Memory currently used by the image in bytes. """
+        if self._array is not None:
+            return self._array.nbytes
+        if self._compressed is not None:
+            return len(self._compressed)
+        return 0
+
+    @property
+    def is_compressed(self):
+        return self._array is None
+
+    @property
+    def array(self):
+        """ The image. A new array is returned for compressed images. """
+        with self._lock:
+            if self._array is not None:
+                return self._array
+            if self._compressed is None:
+                self._load()
+            shuffled = np.frombuffer(zlib.decompress(self._compressed), dtype=np.uint8)
+            return shuffled.reshape(self._dtype.itemsize, -1).transpose().copy().view(
+                self._dtype).reshape(self._shape)
+
+    def compress(self):
+        """ Compress the image and release the array. The bytes are shuffled by significance before compression,
+        which improves the compression ratio of float images considerably.
+        """
+        with self._lock:
+            if self._array is None:
+                return
+            array = np.ascontiguousarray(self._array)
+            shuffled = array.view(np.uint8).reshape(-1, array.dtype.itemsize).transpose()
+            self._compressed = zlib.compress(shuffled.tobytes(), 1)
+            self._array = None
+
+    def persist(self, directory):
+        """ Write the compressed image to a file in directory, if it was not written before.
+
+        @param str directory: directory of the history files
+
+        @return str: the name of the file
+        """
+        self.compress()
+        with self._lock:
+            if self.filename is None or not os.path.isfile(self.filename):
+                if self._compressed is None:
+                    self._load()
+                filename = os.path.join(directory, '{0}.npz'.format(uuid.uuid4().hex))
+                np.savez(filename,
+                         data=np.frombuffer(self._compressed, dtype=np.uint8),
+                         shape=np.array(self._shape),
+                         dtype=np.array(self._dtype.str))
+                self.filename = filename
+            return self.filename
+
+    def _load(self):
+        """ Read the compressed image from its file. A missing file is taken as an empty image. """
+        if self.filename is None or not os.path.isfile(self.filename):
+            self._compressed = zlib.compress(b'', 1)
+            self._shape = (0, 0)
+            self._dtype = np.dtype(float)
+            return
+        with np.load(self.filename) as npz:
+            self._compressed = npz['data'].tobytes()
+            self._shape = tuple(int(n) for n in npz['shape'])
+            self._dtype = np.dtype(str(npz['dtype']))
+
+
 class ConfocalHistoryEntry(QtCore.QObject):
     """ This class contains all relevant parameters of a Confocal scan.
         It provides methods to extract, restore and serialize this data.
@@ -103,6 +206,34 @@ class ConfocalHistoryEntry(QtCore.QObject):
         self.tilt_reference_x = 0
         self.tilt_reference_y = 0
 
+        # images, see HistoryImage
+        self.xy_image_store = None
+        self.depth_image_store = None
+
+    @property
+    def xy_image(self):
+        if self.xy_image_store is None:
+            raise AttributeError('History entry has no xy image.')
+        return self.xy_image_store.array
+
+    @xy_image.setter
+    def xy_image(self, image):
+        self.xy_image_store = HistoryImage(image)
+
+    @property
+    def depth_image(self):
+        if self.depth_image_store is None:
+            raise AttributeError('History entry has no depth image.')
+        return self.depth_image_store.array
+
+    @depth_image.setter
+    def depth_image(self, image):
+        self.depth_image_store = HistoryImage(image)
+
+    @property
+    def image_stores(self):
+        return [store for store in (self.xy_image_store, self.depth_image_store) if store is not None]
+
     def restore(self, confocal):
         """ Write data back into confocal logic and pull all the necessary strings """
         confocal._current_x = self.current_x
@@ -130,20 +261,21 @@ class ConfocalHistoryEntry(QtCore.QObject):
         confocal._scanning_device.tilt_reference_y = self.tilt_reference_y
         confocal._scanning_device.tiltcorrection = self.tilt_correction
 
+        # the images are shared with the logic, which copies them before modifying them
         confocal.initialize_image()
-        try:
-            if confocal.xy_image.shape == self.xy_image.shape:
-                confocal.xy_image = np.copy(self.xy_image)
-        except AttributeError:
-            self.xy_image = np.copy(confocal.xy_image)
+        if self.xy_image_store is None:
+            self.xy_image_store = confocal._share_image('xy')
+        elif confocal.xy_image.shape == self.xy_image_store.shape:
+            confocal.xy_image = self.xy_image_store.array
+            confocal._shared_images['xy'] = self.xy_image_store
 
         confocal._zscan = True
         confocal.initialize_image()
-        try:
-            if confocal.depth_image.shape == self.depth_image.shape:
-                confocal.depth_image = np.copy(self.depth_image)
-        except AttributeError:
-            self.depth_image = np.copy(confocal.depth_image)
+        if self.depth_image_store is None:
+            self.depth_image_store = confocal._share_image('depth')
+        elif confocal.depth_image.shape == self.depth_image_store.shape:
+            confocal.depth_image = self.depth_image_store.array
+            confocal._shared_images['depth'] = self.depth_image_store
         confocal._zscan = False
 
     def snapshot(self, confocal):
@@ -172,11 +304,16 @@ class ConfocalHistoryEntry(QtCore.QObject):
         self.point1 = np.copy(confocal.point1)
         self.point2 = np.copy(confocal.point2)
         self.point3 = np.copy(confocal.point3)
-        self.xy_image = np.copy(confocal.xy_image)
-        self.depth_image = np.copy(confocal.depth_image)
+        # no copy, unchanged images are shared with the previous history entry
+        self.xy_image_store = confocal._share_image('xy')
+        self.depth_image_store = confocal._share_image('depth')
 
-    def serialize(self):
-        """ Give out a dictionary that can be saved via the usual means """
+    def serialize(self, directory=None):
+        """ Give out a dictionary that can be saved via the usual means
+
+        @param str directory: optional, if given the images are persisted as files in this directory (only once
+                              for every image) and only the file names are part of the dictionary.
+        """
         serialized = dict()
         serialized['focus_position'] = [self.current_x, self.current_y, self.current_z, self.current_a]
         serialized['x_range'] = list(self.image_x_range)
@@ -197,12 +334,22 @@ class ConfocalHistoryEntry(QtCore.QObject):
         serialized['tilt_point3'] = list(self.point3)
         serialized['tilt_reference'] = [self.tilt_reference_x, self.tilt_reference_y]
         serialized['tilt_slope'] = [self.tilt_slope_x, self.tilt_slope_y]
-        serialized['xy_image'] = self.xy_image
-        serialized['depth_image'] = self.depth_image
+        if directory is None:
+            serialized['xy_image'] = self.xy_image
+            serialized['depth_image'] = self.depth_image
+        else:
+            if self.xy_image_store is not None:
+                serialized['xy_image_file'] = os.path.basename(self.xy_image_store.persist(directory))
+            if self.depth_image_store is not None:
+                serialized['depth_image_file'] = os.path.basename(self.depth_image_store.persist(directory))
         return serialized
 
-    def deserialize(self, serialized):
-        """ Restore Confocal history object from a dict """
+    def deserialize(self, serialized, directory=None):
+        """ Restore Confocal history object from a dict
+
+        @param dict serialized: the serialized entry
+        @param str directory: optional, directory of the persisted images
+        """
         if 'focus_position' in serialized and len(serialized['focus_position']) == 4:
             self.current_x = serialized['focus_position'][0]
             self.current_y = serialized['focus_position'][1]
@@ -246,17 +393,50 @@ class ConfocalHistoryEntry(QtCore.QObject):
                 self.depth_image = serialized['depth_image'].copy()
             else:
                 raise OldConfigFileError()
+        # persisted images are only loaded when accessed
+        if directory is not None:
+            for key in ('xy', 'depth'):
+                if '{0}_image_file'.format(key) in serialized:
+                    filename = os.path.join(directory, serialized['{0}_image_file'.format(key)])
+                    if os.path.isfile(filename):
+                        setattr(self, '{0}_image_store'.format(key), HistoryImage(filename=filename))
 
 
 class ConfocalLogic(GenericLogic):
     """
     This is the Logic class for confocal scanning.
+
+    Example config for copy-paste:
+
+    confocal_logic:
+        module.Class: 'confocal_logic.ConfocalLogic'
+        frame_scan: False  # optional
+        frame_scan_chunk_time: 1  # optional, in s
+        history_memory_budget: 512  # optional, in MB
+        connect:
+            confocalscanner1: 'scanner_tilt_interfuse'
+            savelogic: 'savelogic'
+
+    In line scan mode (default) every image line costs three scan_line calls (start, scan and return line). In frame
+    scan mode the scan and return lines of the whole image are precomputed as one trajectory, which is sent to the
+    scanner in chunks of several lines (of about frame_scan_chunk_time duration), so that the image is filled from
+    one continuous count stream. The mode can be changed by setting the frame_scan attribute while not scanning.
+
+    History entries share unchanged images with each other and with the logic (the logic copies an image before
+    modifying it). All but the newest entry are compressed in the background and written to the history directory
+    next to the status file, so that only file names are stored in the status variables. The oldest entries are
+    dropped if the history exceeds history_memory_budget.
     """
 
     # declare connectors
     confocalscanner1 = Connector(interface='ConfocalScannerInterface')
     savelogic = Connector(interface='SaveLogic')
 
+    # config options
+    _frame_scan = ConfigOption('frame_scan', False)
+    _frame_scan_chunk_time = ConfigOption('frame_scan_chunk_time', 1.0)
+    _history_memory_budget = ConfigOption('history_memory_budget', 512)
+
     # status vars
     _clock_frequency = StatusVar('clock_frequency', 500)
     return_slowness = StatusVar(default=50)
@@ -300,24 +480,38 @@ class ConfocalLogic(GenericLogic):
         self.depth_img_is_xz = True
         self.permanent_scan = False
 
+        # precomputed scan and return lines of the whole image for frame scan mode
+        self._frame_trajectory = None
+        self._frame_line_samples = 0
+
+        # HistoryImage currently sharing the xy / depth image array with the logic, None if not shared
+        self._shared_images = {'xy': None, 'depth': None}
+        self._history_executor = None
+        self._history_dir = None
+
     def on_activate(self):
         """ Initialisation performed during activation of the module.
         """
         self._scanning_device = self.confocalscanner1()
         self._save_logic = self.savelogic()
+        self.frame_scan = bool(self._frame_scan)
 
         # Reads in the maximal scanning range. The unit of that scan range is micrometer!
         self.x_range = self._scanning_device.get_position_range()[0]
         self.y_range = self._scanning_device.get_position_range()[1]
         self.z_range = self._scanning_device.get_position_range()[2]
 
+        self._history_executor = ThreadPoolExecutor(max_workers=1)
+        self._history_dir = os.path.join(self._manager.getStatusDir(), 'confocal_history_{0}'.format(self._name))
+        os.makedirs(self._history_dir, exist_ok=True)
+
         # restore here ...
         self.history = []
         for i in reversed(range(1, self.max_history_length)):
             try:
                 new_history_item = ConfocalHistoryEntry(self)
                 new_history_item.deserialize(
-                    self._statusVariables['history_{0}'.format(i)])
+                    self._statusVariables['history_{0}'.format(i)], self._history_dir)
                 self.history.append(new_history_item)
             except KeyError:
                 pass
@@ -329,7 +523,7 @@ class ConfocalLogic(GenericLogic):
                         'Restoring history {0} failed.'.format(i))
         try:
             new_state = ConfocalHistoryEntry(self)
-            new_state.deserialize(self._statusVariables['history_0'])
+            new_state.deserialize(self._statusVariables['history_0'], self._history_dir)
             new_state.restore(self)
         except:
             new_state = ConfocalHistoryEntry(self)
@@ -357,10 +551,18 @@ class ConfocalLogic(GenericLogic):
         closing_state = ConfocalHistoryEntry(self)
         closing_state.snapshot(self)
         self.history.append(closing_state)
+        # wait for the background compression, entries already persisted are not written again
+        self._history_executor.shutdown(wait=True)
         histindex = 0
+        used_files = set()
         for state in reversed(self.history):
-            self._statusVariables['history_{0}'.format(histindex)] = state.serialize()
+            if histindex >= self.max_history_length:
+                break
+            serialized = state.serialize(self._history_dir)
+            used_files.update(serialized.get(key) for key in ('xy_image_file', 'depth_image_file'))
+            self._statusVariables['history_{0}'.format(histindex)] = serialized
             histindex += 1
+        self._remove_unused_history_files(used_files)
         return 0
 
     def switch_hardware(self, to_on=False):
@@ -489,6 +691,9 @@ class ConfocalLogic(GenericLogic):
         self._YL = self._Y
         self._AL = np.zeros(self._XL.shape)
 
+        # a new image array is created below
+        self._shared_images['depth' if self._zscan else 'xy'] = None
+
         # Arrays for retrace line
         self._return_XL = np.linspace(self._XL[-1], self._XL[0], self.return_slowness)
         self._return_AL = np.zeros(self._return_XL.shape)
@@ -595,6 +800,9 @@ class ConfocalLogic(GenericLogic):
             self.set_position('scanner')
             return -1
 
+        if self.frame_scan:
+            self._build_frame_trajectory()
+
         self.signal_scan_lines_next.emit()
         return 0
 
@@ -624,6 +832,9 @@ class ConfocalLogic(GenericLogic):
             self.set_position('scanner')
             return -1
 
+        if self.frame_scan:
+            self._build_frame_trajectory()
+
         self.signal_scan_lines_next.emit()
         return 0
 
@@ -736,9 +947,14 @@ class ConfocalLogic(GenericLogic):
                 if len(self.history) > self.max_history_length:
                     self.history.pop(0)
                 self.history_index = len(self.history) - 1
+                self._compact_history()
                 return
 
-        image = self.depth_image if self._zscan else self.xy_image
+        if self.frame_scan:
+            self._scan_frame_chunk()
+            return
+
+        image = self._get_writable_image()
         n_ch = len(self.get_scanner_axes())
         s_ch = len(self.get_scanner_count_channels())
 
@@ -852,6 +1068,167 @@ class ConfocalLogic(GenericLogic):
             self.stop_scanning()
             self.signal_scan_lines_next.emit()
 
+    def _get_writable_image(self):
+        """ Return the image of the current scan (xy or depth), after copying it if it is shared with the history.
+
+        @return numpy.ndarray: the image, which may be modified
+        """
+        key = 'depth' if self._zscan else 'xy'
+        if self._shared_images[key] is not None:
+            if self._zscan:
+                self.depth_image = np.copy(self.depth_image)
+            else:
+                self.xy_image = np.copy(self.xy_image)
+            self._shared_images[key] = None
+        return self.depth_image if self._zscan else self.xy_image
+
+    def _share_image(self, key):
+        """ Share the current xy or depth image with a history entry without copying it.
+
+        @param str key: 'xy' or 'depth'
+
+        @return HistoryImage: the shared image
+        """
+        if self._shared_images[key] is None:
+            self._shared_images[key] = HistoryImage(self.xy_image if key == 'xy' else self.depth_image)
+        return self._shared_images[key]
+
+    def _compact_history(self):
+        """ Compress and persist the images of all but the newest history entry in the background and drop the
+        oldest entries if the history exceeds the memory budget.
+        """
+        newest = set(id(store) for store in self.history[-1].image_stores) if self.history else set()
+        for entry in self.history[:-1]:
+            for store in entry.image_stores:
+                if id(store) not in newest and not store.is_compressed:
+                    self._history_executor.submit(self._compress_history_image, store)
+
+        budget = self._history_memory_budget * 2**20
+        while len(self.history) > 1:
+            stores = {id(store): store for entry in self.history for store in entry.image_stores}
+            if sum(store.nbytes for store in stores.values()) <= budget:
+                break
+            self.history.pop(0)
+            self.history_index = max(self.history_index - 1, 0)
+            self.log.debug('Confocal history exceeds the memory budget, oldest entry dropped.')
+
+    def _compress_history_image(self, store):
+        try:
+            store.persist(self._history_dir)
+        except Exception:
+            self.log.exception('Could not compress confocal history image.')
+
+    def _remove_unused_history_files(self, used_files):
+        """ Delete the files of images no longer referenced by the saved history.
+
+        @param set used_files: names of the files referenced by the status variables
+        """
+        for filename in os.listdir(self._history_dir):
+            if filename.endswith('.npz') and filename not in used_files:
+                path = os.path.join(self._history_dir, filename)
+                try:
+                    os.remove(path)
+                except OSError:
+                    self.log.warning('Could not remove unused confocal history file {0}.'.format(path))
+
+    def _build_frame_trajectory(self):
+        """ Precompute the scan and return lines of all lines of the current image as one trajectory.
+
+        Line i of the image occupies the samples [i * P, i * P + n) of the trajectory with n the number of pixels per
+        line and P = n + return_slowness the number of samples per line including the return line.
+        """
+        image = self._get_writable_image()
+        n_ch = len(self.get_scanner_axes())
+        n_lines, n_pixels = image.shape[0], image.shape[1]
+        n_return = self.return_slowness
+
+        # adjust z of the lines in the image to current z before building the trajectory
+        if not self._zscan:
+            image[:, :, 2] = self._current_z
+
+        trajectory = np.empty((n_lines, n_pixels + n_return, max(n_ch, 3)))
+        trajectory[:, :n_pixels, :3] = image[:, :, :3]
+        # return lines run backwards along the scan axis at the position of the line in the other axes
+        trajectory[:, n_pixels:, :3] = image[:, :1, :3]
+        if self.depth_img_is_xz or not self._zscan:
+            trajectory[:, n_pixels:, 0] = self._return_XL
+        else:
+            trajectory[:, n_pixels:, 1] = self._return_YL
+        if n_ch > 3:
+            trajectory[:, :, 3] = self._current_a
+
+        self._frame_line_samples = n_pixels + n_return
+        self._frame_trajectory = trajectory.reshape(-1, trajectory.shape[2])[:, :n_ch].transpose().copy()
+
+    def _frame_chunk_lines(self):
+        """ Number of image lines to scan with one call to the scanner in frame scan mode. """
+        lines = int(self._frame_scan_chunk_time * self._clock_frequency / self._frame_line_samples)
+        return max(1, lines)
+
+    def _scan_frame_chunk(self):
+        """ Scan the next chunk of lines of the image in frame scan mode.
+
+        The precomputed trajectory of the lines (including the return lines) is sent to the scanner in a single
+        scan_line call. On the first chunk of a scan the line from the current position to the start of the image is
+        prepended. The counts of the scan lines are copied into the image, the counts of the return lines are
+        discarded.
+        """
+        image = self._get_writable_image()
+        n_ch = len(self.get_scanner_axes())
+        s_ch = len(self.get_scanner_count_channels())
+        n_pixels = image.shape[1]
+
+        try:
+            first_line = self._scan_counter
+            last_line = min(first_line + self._frame_chunk_lines(), image.shape[0])
+            # copy, since the scanner (e.g. tilt correction) may modify the path in place
+            chunk = self._frame_trajectory[:, first_line * self._frame_line_samples:
+                                              last_line * self._frame_line_samples].copy()
+
+            n_start = 0
+            if first_line == 0:
+                # make a line from the current cursor position to the starting position of the scan,
+                # counts are thrown away
+                rs = self.return_slowness
+                start_pos = [self._current_x, self._current_y, self._current_z, self._current_a][:n_ch]
+                start_line = np.linspace(start_pos, chunk[:, 0], rs).transpose()
+                chunk = np.hstack((start_line, chunk))
+                n_start = rs
+
+            counts = self._scanning_device.scan_line(chunk, pixel_clock=True)
+            if np.any(counts == -1):
+                self.stopRequested = True
+                self.signal_scan_lines_next.emit()
+                return
+
+            # update image with the counts of the scan lines of the chunk
+            counts = np.asarray(counts)[n_start:].reshape(
+                last_line - first_line, self._frame_line_samples, s_ch)
+            image[first_line:last_line, :, 3:3 + s_ch] = counts[:, :n_pixels]
+            if self._zscan:
+                self.signal_depth_image_updated.emit()
+            else:
+                self.signal_xy_image_updated.emit()
+
+            self._scan_counter = last_line
+
+            # stop scanning when last line scan was performed and makes scan not continuable
+            if self._scan_counter >= np.size(self._image_vert_axis):
+                if not self.permanent_scan:
+                    self.stop_scanning()
+                    if self._zscan:
+                        self._zscan_continuable = False
+                    else:
+                        self._xyscan_continuable = False
+                else:
+                    self._scan_counter = 0
+
+            self.signal_scan_lines_next.emit()
+        except:
+            self.log.exception('The scan went wrong, killing the scanner.')
+            self.stop_scanning()
+            self.signal_scan_lines_next.emit()
+
     def save_xy_data(self, colorscale_range=None, percentile_range=None, block=True):
         """ Save the current confocal xy data to file.
 
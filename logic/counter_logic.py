@@ -24,12 +24,43 @@ from collections import OrderedDict
 import numpy as np
 import time
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 
 from core.connector import Connector
 from core.statusvariable import StatusVar
 from logic.generic_logic import GenericLogic
 from interface.slow_counter_interface import CountingMode
 from core.util.mutex import Mutex
+from core.util.ring_buffer import RingBuffer, MovingMedianFilter
+
+
+def draw_count_trace_figure(data, channel_count):
+    """ Draw the figure saved with the count trace. Kept at module level, so the save logic can
+    draw it in its figure rendering process.
+
+    @param: nparray data: a numpy array containing the time and the counts of all detectors
+    @param: int channel_count: number of detector channels
+
+    @return: fig fig: a matplotlib figure object (not managed by pyplot) to be saved to file.
+    """
+    count_data = data[:, 1:channel_count+1]
+    time_data = data[:, 0]
+
+    # Scale count values using SI prefix
+    prefix = ['', 'k', 'M', 'G']
+    prefix_index = 0
+    while np.max(count_data) > 1000:
+        count_data = count_data / 1000
+        prefix_index = prefix_index + 1
+    counts_prefix = prefix[prefix_index]
+
+    # Create figure
+    fig = Figure()
+    ax = fig.subplots()
+    ax.plot(time_data, count_data, linestyle=':', linewidth=0.5)
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('Fluorescence (' + counts_prefix + 'c/s)')
+    return fig
 
 
 class CounterLogic(GenericLogic):
@@ -95,6 +126,11 @@ class CounterLogic(GenericLogic):
         self._counting_mode = CountingMode['CONTINUOUS']
 
         self._saving = False
+
+        # ring buffers holding the count trace and the smoothed count trace
+        self._count_buffer = None
+        self._smoothed_buffer = None
+        self._median_filter = None
         return
 
     def on_activate(self):
@@ -112,8 +148,7 @@ class CounterLogic(GenericLogic):
         number_of_detectors = constraints.max_detectors
 
         # initialize data arrays
-        self.countdata = np.zeros([len(self.get_channels()), self._count_length])
-        self.countdata_smoothed = np.zeros([len(self.get_channels()), self._count_length])
+        self._init_count_buffers()
         self.rawdata = np.zeros([len(self.get_channels()), self._counting_samples])
         self._already_counted_samples = 0  # For gated counting
         self._data_to_save = []
@@ -140,6 +175,24 @@ class CounterLogic(GenericLogic):
         self.sigCountDataNext.disconnect()
         return
 
+    def _init_count_buffers(self):
+        """ (Re-)create the ring buffers for the count traces and the median filter. """
+        channels = len(self.get_channels())
+        self._count_buffer = RingBuffer(channels, self._count_length)
+        self._smoothed_buffer = RingBuffer(channels, self._count_length)
+        self._median_filter = MovingMedianFilter(self._smooth_window_length)
+        return
+
+    @property
+    def countdata(self):
+        """ Read-only view of the count trace (channels x count_length), oldest value first. """
+        return self._count_buffer.data
+
+    @property
+    def countdata_smoothed(self):
+        """ Read-only view of the median smoothed count trace (channels x count_length). """
+        return self._smoothed_buffer.data
+
     def get_hardware_constraints(self):
         """
         Retrieve the hardware constrains from the counter device.
@@ -312,12 +365,14 @@ class CounterLogic(GenericLogic):
             filepath = self._save_logic.get_path_for_module(module_name='Counter')
 
             if save_figure:
-                fig = self.draw_figure(data=np.array(self._data_to_save))
+                plot_function = draw_count_trace_figure
             else:
-                fig = None
-            self._save_logic.save_data(data, filepath=filepath, parameters=parameters,
-                                       filelabel=filelabel, plotfig=fig, delimiter='\t')
-            self.log.info('Counter Trace saved to:\n{0}'.format(filepath))
+                plot_function = None
+            self._save_logic.save_data_async(
+                data, filepath=filepath, parameters=parameters, filelabel=filelabel,
+                plot_function=plot_function, plot_data=self._data_to_save,
+                plot_parameters={'channel_count': len(self.get_channels())}, delimiter='\t',
+                saved_message='Counter Trace saved to:\n{0}'.format(filepath))
 
         self.sigSavingStatusChanged.emit(self._saving)
         return self._data_to_save, parameters
@@ -329,26 +384,9 @@ class CounterLogic(GenericLogic):
 
         @return: fig fig: a matplotlib figure object to be saved to file.
         """
-        count_data = data[:, 1:len(self.get_channels())+1]
-        time_data = data[:, 0]
-
-        # Scale count values using SI prefix
-        prefix = ['', 'k', 'M', 'G']
-        prefix_index = 0
-        while np.max(count_data) > 1000:
-            count_data = count_data / 1000
-            prefix_index = prefix_index + 1
-        counts_prefix = prefix[prefix_index]
-
         # Use qudi style
         plt.style.use(self._save_logic.mpl_qd_style)
-
-        # Create figure
-        fig, ax = plt.subplots()
-        ax.plot(time_data, count_data, linestyle=':', linewidth=0.5)
-        ax.set_xlabel('Time (s)')
-        ax.set_ylabel('Fluorescence (' + counts_prefix + 'c/s)')
-        return fig
+        return draw_count_trace_figure(data, len(self.get_channels()))
 
     def set_counting_mode(self, mode='CONTINUOUS'):
         """Set the counting mode, to change between continuous and gated counting.
@@ -426,8 +464,7 @@ class CounterLogic(GenericLogic):
 
             # initialising the data arrays
             self.rawdata = np.zeros([len(self.get_channels()), self._counting_samples])
-            self.countdata = np.zeros([len(self.get_channels()), self._count_length])
-            self.countdata_smoothed = np.zeros([len(self.get_channels()), self._count_length])
+            self._init_count_buffers()
             self._sampling_data = np.empty([len(self.get_channels()), self._counting_samples])
 
             # the sample index for gated counting
@@ -535,8 +572,8 @@ class CounterLogic(GenericLogic):
         parameters['Smooth Window Length (# of events)'] = self._smooth_window_length
 
         filepath = self._save_logic.get_path_for_module(module_name='Counter')
-        self._save_logic.save_data(data, filepath=filepath, parameters=parameters,
-                                   filelabel=filelabel, delimiter='\t')
+        self._save_logic.save_data_async(data, filepath=filepath, parameters=parameters,
+                                         filelabel=filelabel, delimiter='\t')
 
         self.log.debug('Current Counter Trace saved to: {0}'.format(filepath))
         return data, filepath, parameters, filelabel
@@ -553,18 +590,10 @@ class CounterLogic(GenericLogic):
         Processes the raw data from the counting device
         @return:
         """
-        for i, ch in enumerate(self.get_channels()):
-            # remember the new count data in circular array
-            self.countdata[i, 0] = np.average(self.rawdata[i])
-        # move the array to the left to make space for the new data
-        self.countdata = np.roll(self.countdata, -1, axis=1)
-        # also move the smoothing array
-        self.countdata_smoothed = np.roll(self.countdata_smoothed, -1, axis=1)
+        # remember the new count data in circular array
+        self._count_buffer.append(np.average(self.rawdata, axis=1))
         # calculate the median and save it
-        window = -int(self._smooth_window_length / 2) - 1
-        for i, ch in enumerate(self.get_channels()):
-            self.countdata_smoothed[i, window:] = np.median(self.countdata[i,
-                                                            -self._smooth_window_length:])
+        self._append_median()
 
         # save the data if necessary
         if self._saving:
@@ -594,14 +623,9 @@ class CounterLogic(GenericLogic):
         @return:
         """
         # remember the new count data in circular array
-        self.countdata[0] = np.average(self.rawdata[0])
-        # move the array to the left to make space for the new data
-        self.countdata = np.roll(self.countdata, -1)
-        # also move the smoothing array
-        self.countdata_smoothed = np.roll(self.countdata_smoothed, -1)
+        self._count_buffer.append(np.average(self.rawdata, axis=1))
         # calculate the median and save it
-        self.countdata_smoothed[-int(self._smooth_window_length / 2) - 1:] = np.median(
-            self.countdata[-self._smooth_window_length:])
+        self._append_median()
 
         # save the data if necessary
         if self._saving:
@@ -615,7 +639,7 @@ class CounterLogic(GenericLogic):
             else:
                 # append tuple to data stream (timestamp, average counts)
                 self._data_to_save.append(np.array((time.time() - self._saving_start_time,
-                                                    self.countdata[-1])))
+                                                    self.countdata[0, -1])))
         return
 
     def _process_data_finite_gated(self):
@@ -623,19 +647,26 @@ class CounterLogic(GenericLogic):
         Processes the raw data from the counting device
         @return:
         """
-        if self._already_counted_samples+len(self.rawdata[0]) >= len(self.countdata):
-            needed_counts = len(self.countdata) - self._already_counted_samples
-            self.countdata[0:needed_counts] = self.rawdata[0][0:needed_counts]
-            self.countdata = np.roll(self.countdata, -needed_counts)
+        needed_counts = self._count_length - self._already_counted_samples
+        # append the new data (at most until the trace is filled)
+        self._count_buffer.append(self.rawdata[:, :needed_counts])
+        if self.rawdata.shape[1] >= needed_counts:
             self._already_counted_samples = 0
             self.stopRequested = True
         else:
-            # replace the first part of the array with the new data:
-            self.countdata[0:len(self.rawdata[0])] = self.rawdata[0]
-            # roll the array by the amount of data it had been inserted:
-            self.countdata = np.roll(self.countdata, -len(self.rawdata[0]))
             # increment the index counter:
-            self._already_counted_samples += len(self.rawdata[0])
+            self._already_counted_samples += self.rawdata.shape[1]
+        return
+
+    def _append_median(self):
+        """
+        Append the median of the newest smooth_window_length counts to the smoothed trace. The
+        median is also written to the preceding half window to align it with the count trace.
+        """
+        median = self._median_filter(self._count_buffer, 1)
+        self._smoothed_buffer.append(median)
+        window = min(int(self._smooth_window_length / 2) + 1, self._count_length)
+        self._smoothed_buffer.overwrite_latest(np.repeat(median, window, axis=1))
         return
 
     def _stopCount_wait(self, timeout=5.0):
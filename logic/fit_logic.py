@@ -22,12 +22,15 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 import importlib
 import inspect
+import logging
 import lmfit
 from qtpy import QtCore
 import numpy as np
 import os
 import sys
+import types
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from distutils.version import LooseVersion
 
 from logic.generic_logic import GenericLogic
@@ -37,6 +40,113 @@ from core.config import load, save
 from core.configoption import ConfigOption
 
 
+def import_fit_methods(path_list):
+    """ Import all functions defined in the python files of the fit methods directories.
+
+    @param list path_list: directories containing the fit methods files
+
+    @return OrderedDict: function name -> function
+    """
+    methods = OrderedDict()
+    for path in path_list:
+        for f in sorted(os.listdir(path)):
+            if os.path.isfile(os.path.join(path, f)) and f.endswith('.py'):
+                if path not in sys.path:
+                    sys.path.append(path)
+                mod = importlib.import_module(f[:-3])
+                for method in dir(mod):
+                    ref = getattr(mod, method)
+                    if callable(ref) and (inspect.ismethod(ref) or inspect.isfunction(ref)):
+                        methods[method] = ref
+    return methods
+
+
+class FitMethods:
+    """ Plain container of the fit methods (make_*_fit, make_*_model, estimate_*, ...) bound to an object other than
+    FitLogic, used in the worker processes of the batch fits where no FitLogic module exists.
+    """
+
+    def __init__(self, path_list):
+        self.log = logging.getLogger(__name__)
+        for name, function in import_fit_methods(path_list).items():
+            setattr(self, name, types.MethodType(function, self))
+
+
+_worker_fit_methods = None
+
+
+def _init_fit_worker(path_list):
+    """ Initializer of the batch fit processes: import the fit methods once per process. """
+    global _worker_fit_methods
+    _worker_fit_methods = FitMethods(path_list)
+
+
+def _batch_fit_worker(fit_name, estimator_name, use_settings, x_data, y_data, warm_start):
+    """ Fit a block of traces in a worker process. See batch_fit. """
+    return batch_fit(_worker_fit_methods, fit_name, estimator_name, use_settings, x_data, y_data, warm_start)
+
+
+def batch_fit(fit_methods, fit_name, estimator_name, use_settings, x_data, y_data, warm_start=True):
+    """ Fit several traces with the same model one after the other.
+
+    The model is created once. The initial parameters of the first trace are given by the estimator. If warm_start
+    is True, each following trace starts from the result of the previous one, as long as that fit succeeded.
+
+    This function is kept at module level so it can be executed in a separate process.
+
+    @param fit_methods: FitLogic or FitMethods instance providing the make_*_model and estimate_* methods
+    @param str fit_name: name of the fit function, e.g. 'lorentzian'
+    @param str estimator_name: name of the estimator, e.g. 'dip' ('generic' for the default estimator)
+    @param str use_settings: dumped lmfit.Parameters (Parameters.dumps) overriding the initial parameters, or None
+    @param numpy.ndarray x_data: x values, 1D (shared by all traces) or one row per trace
+    @param numpy.ndarray y_data: 2D array with one trace per row
+    @param bool warm_start: optional, start each fit from the result of the previous trace
+
+    @return tuple (values, errors, success, redchi): 2D arrays of the parameter values and errors (one row per
+                                                      trace, columns in the order of model.make_params()),
+                                                      1D arrays of the success flags and reduced chi-square
+    """
+    model, params = getattr(fit_methods, 'make_{0}_model'.format(fit_name))()
+    if estimator_name == 'generic':
+        estimator = getattr(fit_methods, 'estimate_{0}'.format(fit_name))
+    else:
+        estimator = getattr(fit_methods, 'estimate_{0}_{1}'.format(fit_name, estimator_name))
+    if use_settings is not None:
+        use_settings = lmfit.parameter.Parameters().loads(use_settings)
+    names = list(params)
+    x_data = np.asarray(x_data)
+    y_data = np.asarray(y_data)
+    values = np.full((len(y_data), len(names)), np.nan)
+    errors = np.full((len(y_data), len(names)), np.nan)
+    success = np.zeros(len(y_data), dtype=bool)
+    redchi = np.full(len(y_data), np.nan)
+
+    previous = None
+    for i, y in enumerate(y_data):
+        x = x_data[i] if x_data.ndim == y_data.ndim else x_data
+        if previous is None:
+            error, initial = estimator(x, y, model.make_params())
+        else:
+            initial = previous.copy()
+        initial = fit_methods._substitute_params(initial_params=initial, update_params=use_settings)
+        try:
+            result = model.fit(y, x=x, params=initial)
+        except Exception:
+            fit_methods.log.exception('Batch fit of trace {0} failed.'.format(i))
+            previous = None
+            continue
+        values[i] = [result.params[name].value for name in names]
+        errors[i] = [np.nan if result.params[name].stderr is None else result.params[name].stderr
+                     for name in names]
+        success[i] = result.success
+        redchi[i] = result.redchi
+        if warm_start and result.success and np.all(np.isfinite(values[i])):
+            previous = result.params
+        else:
+            previous = None
+    return values, errors, success, redchi
+
+
 class FitLogic(GenericLogic):
     """
     Documentation to add a new fit model/estimator/function can be found in
@@ -54,13 +164,16 @@ class FitLogic(GenericLogic):
     _additional_methods_import_path = ConfigOption(name='additional_fit_methods_path',
                                                    default=None,
                                                    missing='nothing')
+    # Number of worker processes for the batch fits (0: number of CPUs, 1: no worker processes)
+    _batch_fit_processes = ConfigOption(name='batch_fit_processes', default=0, missing='nothing')
+    # Minimum number of traces per worker process, smaller batches are fitted in fewer processes
+    _batch_fit_min_traces = ConfigOption(name='batch_fit_min_traces_per_process', default=16, missing='nothing')
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         # locking for thread safety
         self.lock = Mutex()
 
-        filenames = []
         # for path in directories:
         path_list = [os.path.join(get_main_dir(), 'logic', 'fitmethods')]
         # adding additional path, to be defined in the config
@@ -82,12 +195,9 @@ class FitLogic(GenericLogic):
                 self.log.error('ConfigOption additional_predefined_methods_path needs to either be a string or '
                                'a list of strings.')
 
-        for path in path_list:
-            for f in os.listdir(path):
-                if os.path.isfile(os.path.join(path, f)) and f.endswith('.py'):
-                    filenames.append(f[:-3])
-                    if path not in sys.path:
-                        sys.path.append(path)
+        self._fit_methods_path_list = path_list
+        self._batch_executor = None
+        self._batch_executor_processes = 0
 
         # A dictionary containing all fit methods and their estimators.
         self.fit_list = OrderedDict()
@@ -101,25 +211,21 @@ class FitLogic(GenericLogic):
         models_for_dict = list()
         fits_for_dict = list()
 
-        for files in filenames:
-            mod = importlib.import_module('{0}'.format(files))
-            for method in dir(mod):
-                ref = getattr(mod, method)
-                if callable(ref) and (inspect.ismethod(ref) or inspect.isfunction(ref)):
-                    method_str = str(method)
-                    try:
-                        # import methods in Fitlogic
-                        setattr(FitLogic, method, ref)
-                        # append method to a list of methods to include in the fit_list dictionary
-                        if method_str.startswith('make_') and method_str.endswith('_fit'):
-                            fits_for_dict.append(method_str.split('_', 1)[1].rsplit('_', 1)[0])
-                        elif method_str.startswith('make_') and method_str.endswith('_model'):
-                            models_for_dict.append(method_str.split('_', 1)[1].rsplit('_', 1)[0])
-                        elif method_str.startswith('estimate_'):
-                            estimators_for_dict.append(method_str.split('_', 1)[1])
-                    except:
-                        self.log.error('Method "{0}" could not be imported to FitLogic.'
-                                       ''.format(str(method)))
+        for method, ref in import_fit_methods(path_list).items():
+            method_str = str(method)
+            try:
+                # import methods in Fitlogic
+                setattr(FitLogic, method, ref)
+                # append method to a list of methods to include in the fit_list dictionary
+                if method_str.startswith('make_') and method_str.endswith('_fit'):
+                    fits_for_dict.append(method_str.split('_', 1)[1].rsplit('_', 1)[0])
+                elif method_str.startswith('make_') and method_str.endswith('_model'):
+                    models_for_dict.append(method_str.split('_', 1)[1].rsplit('_', 1)[0])
+                elif method_str.startswith('estimate_'):
+                    estimators_for_dict.append(method_str.split('_', 1)[1])
+            except:
+                self.log.error('Method "{0}" could not be imported to FitLogic.'
+                               ''.format(str(method)))
 
         fits_for_dict.sort()
         models_for_dict.sort()
@@ -177,7 +283,74 @@ class FitLogic(GenericLogic):
 
     def on_deactivate(self):
         """ """
-        pass
+        if self._batch_executor is not None:
+            self._batch_executor.shutdown(wait=True)
+            self._batch_executor = None
+
+    def batch_fit(self, fit_name, estimator_name, x_data, y_data, use_settings=None, warm_start=True,
+                  processes=None):
+        """ Fit many traces with the same model, split in blocks over a pool of worker processes.
+
+        @param str fit_name: name of the fit function, e.g. 'lorentzian'
+        @param str estimator_name: name of the estimator, e.g. 'dip' ('generic' for the default estimator)
+        @param numpy.ndarray x_data: x values, 1D (shared by all traces) or one row per trace
+        @param numpy.ndarray y_data: 2D array with one trace per row
+        @param lmfit.Parameters use_settings: optional, parameters overriding the initial values of each fit
+        @param bool warm_start: optional, start each fit from the result of the previous trace of its block
+        @param int processes: optional, number of worker processes. The ConfigOption batch_fit_processes is used if
+                              None, all fits are done in the calling thread if 1.
+
+        @return numpy.ndarray: structured array with one element per trace and the fields 'success' (bool),
+                               'redchi' (float), 'params' and 'errors' (each with one float field per parameter
+                               of the model, e.g. result['params']['center'])
+        """
+        y_data = np.asarray(y_data, dtype=float)
+        if y_data.ndim == 1:
+            y_data = y_data[np.newaxis]
+        x_data = np.asarray(x_data, dtype=float)
+        model, params = getattr(self, 'make_{0}_model'.format(fit_name))()
+        names = list(params)
+        dumped_settings = None if use_settings is None or len(use_settings) == 0 else use_settings.dumps()
+
+        if processes is None:
+            processes = self._batch_fit_processes if self._batch_fit_processes > 0 else os.cpu_count()
+        blocks = min(int(processes), len(y_data) // max(1, int(self._batch_fit_min_traces)))
+        if blocks <= 1:
+            results = [batch_fit(self, fit_name, estimator_name, dumped_settings, x_data, y_data, warm_start)]
+        else:
+            executor = self._get_batch_executor(int(processes))
+            bounds = np.linspace(0, len(y_data), blocks + 1).astype(int)
+            futures = []
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                x_block = x_data[start:stop] if x_data.ndim == y_data.ndim else x_data
+                futures.append(executor.submit(_batch_fit_worker, fit_name, estimator_name, dumped_settings,
+                                               x_block, y_data[start:stop], warm_start))
+            results = [future.result() for future in futures]
+
+        param_dtype = [(name, float) for name in names]
+        result = np.zeros(len(y_data), dtype=[('success', bool), ('redchi', float),
+                                              ('params', param_dtype), ('errors', param_dtype)])
+        result['success'] = np.concatenate([block[2] for block in results])
+        result['redchi'] = np.concatenate([block[3] for block in results])
+        values = np.concatenate([block[0] for block in results])
+        errors = np.concatenate([block[1] for block in results])
+        for column, name in enumerate(names):
+            result['params'][name] = values[:, column]
+            result['errors'][name] = errors[:, column]
+        return result
+
+    def _get_batch_executor(self, processes):
+        """ Get the pool of worker processes for the batch fits, created on first use and kept until deactivation.
+        """
+        with self.lock:
+            if self._batch_executor is not None and self._batch_executor_processes != processes:
+                self._batch_executor.shutdown(wait=False)
+                self._batch_executor = None
+            if self._batch_executor is None:
+                self._batch_executor = ProcessPoolExecutor(max_workers=processes, initializer=_init_fit_worker,
+                                                           initargs=(self._fit_methods_path_list,))
+                self._batch_executor_processes = processes
+            return self._batch_executor
 
     def validate_load_fits(self, fits):
         """ Take fit names and estimators from a dict and check if they are valid.
@@ -448,10 +621,8 @@ class FitContainer(QtCore.QObject):
             self.current_fit = 'No Fit'
 
         if self.current_fit != 'No Fit':
-            # after the fit was performed, retrieve the fitting function and
-            # evaluate the fitted parameters according to the function:
-            model, params = self.fit_list[self.current_fit]['make_model']()
-            fit_y = model.eval(x=fit_x, params=result.params)
+            # after the fit was performed, evaluate the fitted model (no need to create it again)
+            fit_y = result.eval(x=fit_x)
 
         if result is not None:
             self.current_fit_param = result.params
@@ -462,3 +633,22 @@ class FitContainer(QtCore.QObject):
         self.sigFitUpdated.emit()
 
         return fit_x, fit_y, result
+
+    def do_batch_fit(self, x_data, y_data, warm_start=True, processes=None):
+        """ Performs the chosen fit on many traces, e.g. all lines of a matrix, using the batch fit of FitLogic.
+        The current fit result of the container is not modified.
+
+        @param array x_data: 1D np.array with the x values shared by all traces, or one row per trace
+        @param array y_data: 2D np.array with one trace per row
+        @param bool warm_start: optional, start each fit from the result of the previous trace
+        @param int processes: optional, number of worker processes (see FitLogic.batch_fit)
+
+        @return numpy.ndarray: structured array with one element per trace and the fields 'success', 'redchi',
+                               'params' and 'errors' (see FitLogic.batch_fit). None if the current fit is 'No Fit'.
+        """
+        if self.current_fit not in self.fit_list:
+            return None
+        fit = self.fit_list[self.current_fit]
+        return self.fit_logic.batch_fit(fit['fit_name'], fit['est_name'], x_data, y_data,
+                                        use_settings=self.use_settings, warm_start=warm_start,
+                                        processes=processes)
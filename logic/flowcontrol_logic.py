@@ -30,7 +30,6 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 """
 # import logging
 import numpy as np
-from time import sleep
 from simple_pid import PID
 
 from qtpy import QtCore
@@ -57,82 +56,6 @@ from core.connector import Connector
 #     return wrap
 
 
-# ======================================================================================================================
-# Worker classes
-# ======================================================================================================================
-
-class WorkerSignals(QtCore.QObject):
-    """ Defines the signals available from a running worker thread.
-
-    For simplicity, contains all the signals for the different child classes of QRunnable
-    (although each child class uses only one of these signals). """
-
-    sigFinished = QtCore.Signal()
-    sigRegulationWaitFinished = QtCore.Signal(float)  # parameter: target_flowrate
-    # sigIntegrationIntervalFinished = QtCore.Signal(float, float)  # parameters: target_volume, integration_interval
-    sigIntegrationIntervalFinished = QtCore.Signal(float)  # parameters : sampling_interval
-
-
-class MeasurementWorker(QtCore.QRunnable):
-    """ Worker thread to monitor the pressure and the flow-rate every x seconds when measuring mode is on.
-
-    The worker handles only the waiting time, and emits a signal that serves to trigger the update of indicators on GUI.
-    """
-
-    def __init__(self, *args, **kwargs):
-        super(MeasurementWorker, self).__init__(*args, **kwargs)
-        self.signals = WorkerSignals()
-
-    @QtCore.Slot()
-    def run(self):
-        """ """
-        sleep(1)  # 1 second as time constant
-        self.signals.sigFinished.emit()
-
-
-class RegulationWorker(QtCore.QRunnable):
-    """ Worker thread to regulate the pressure every 1 second when regulation loop is on.
-
-    The worker handles only the waiting time, and emits a signal that serves to trigger the next regulation step.
-    The signal transmits the target flowrate value to the next loop iteration.
-    """
-
-    def __init__(self, target_flowrate):
-        super(RegulationWorker, self).__init__()
-        self.signals = WorkerSignals()
-        self.target_flowrate = target_flowrate
-
-    @QtCore.Slot()
-    def run(self):
-        """ """
-        sleep(1)  # 1 second as time constant
-        self.signals.sigRegulationWaitFinished.emit(self.target_flowrate)
-
-
-class VolumeCountWorker(QtCore.QRunnable):
-    """ Worker thread to measure the injected volume of buffer or probe
-
-    The worker handles only the waiting time, and emits a signal that serves to trigger a new sampling.
-    The signal originally transmits the target volume and the sampling interval to the next loop iteration. However,
-    different target_volumes values were sometimes transmitted (not clear why - likely due to previous interactions with
-    the GUI). To simplify the script, only the sampling interval is now transmitted. The target volume is defined
-    elsewhere in the code."""
-
-    # def __init__(self, target_volume, sampling_interval):
-    def __init__(self, sampling_interval):
-        super(VolumeCountWorker, self).__init__()
-        self.signals = WorkerSignals()
-        # self.target_volume = target_volume
-        self.sampling_interval = sampling_interval
-
-    @QtCore.Slot()
-    def run(self):
-        """ """
-        sleep(self.sampling_interval)
-        self.signals.sigIntegrationIntervalFinished.emit(self.sampling_interval)
-        # self.signals.sigIntegrationIntervalFinished.emit(self.target_volume, self.sampling_interval)
-
-
 # ======================================================================================================================
 # Logic class
 # ======================================================================================================================
@@ -193,10 +116,12 @@ class FlowcontrolLogic(GenericLogic):
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
-        self.threadpool = QtCore.QThreadPool()
         self._flowboard = None
         self._daq_logic = None
         self.pid = None
+        self._measurement_job = None
+        self._regulation_job = None
+        self._volume_job = None
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
@@ -209,8 +134,20 @@ class FlowcontrolLogic(GenericLogic):
         # signals from connected logic
         self._daq_logic.sigRinsingDurationFinished.connect(self.rinsing_finished)
 
+        # periodic jobs for the continuous processes. The volume count must not lose any sampling interval: a late
+        # step is done as soon as possible and integrates the flowrate over the time elapsed since the previous step.
+        scheduler = self.getScheduler()
+        self._measurement_job = scheduler.add_job('{0}.flow_measurement'.format(self._name), self.flow_measurement_loop,
+                                                  1, owner=self, tags=('gui',))
+        self._regulation_job = scheduler.add_job('{0}.pressure_regulation'.format(self._name),
+                                                 self.pressure_regulation_loop, 1, owner=self)
+        self._volume_job = scheduler.add_job('{0}.volume_count'.format(self._name), self.volume_measurement_loop,
+                                             self.sampling_interval, owner=self, overrun='coalesce',
+                                             pass_elapsed=True)
+
     def on_deactivate(self):
         """ Perform required deactivation. """
+        self.getScheduler().remove_jobs(self)
         self.set_pressure(0.0)
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -344,24 +281,18 @@ class FlowcontrolLogic(GenericLogic):
         :return: None
         """
         self.measuring_flowrate = True
-        # monitor the pressure and flowrate, using a worker thread
-        worker = MeasurementWorker()
-        worker.signals.sigFinished.connect(self.flow_measurement_loop)
-        self.threadpool.start(worker)
+        # monitor the pressure and flowrate every second, using a periodic job of the scheduler
+        self._measurement_job.start()
 
     def flow_measurement_loop(self):
-        """ Continous measuring of the flowrate and the pressure at a defined sampling rate using a worker thread.
+        """ Continous measuring of the flowrate and the pressure. Called periodically by the scheduler until measuring
+        mode is switched off.
         :param: None
         :return: None
         """
         pressure = self.get_pressure()
         flowrate = self.get_flowrate()
         self.sigUpdateFlowMeasurement.emit(pressure, flowrate)
-        if self.measuring_flowrate:
-            # enter in a loop until measuring mode is switched off
-            worker = MeasurementWorker()
-            worker.signals.sigFinished.connect(self.flow_measurement_loop)
-            self.threadpool.start(worker)
 
     def stop_flow_measurement(self):
         """ Stops the measurement of flowrate and pressure.
@@ -370,6 +301,7 @@ class FlowcontrolLogic(GenericLogic):
         :return: None
         """
         self.measuring_flowrate = False
+        self._measurement_job.stop()
         # get once again the latest values
         pressure = self.get_pressure()
         flowrate = self.get_flowrate()
@@ -409,30 +341,22 @@ class FlowcontrolLogic(GenericLogic):
         self.regulating = True
         self.pid = self.init_pid(setpoint=target_flowrate)
 
-        # regulate the pressure, using a worker thread
-        worker = RegulationWorker(target_flowrate)
-        worker.signals.sigRegulationWaitFinished.connect(self.pressure_regulation_loop)
-        self.threadpool.start(worker)
+        # regulate the pressure every second, using a periodic job of the scheduler
+        self._regulation_job.start()
 
     def stop_pressure_regulation_loop(self):
         """ Stop the continuous pressure regulation mode. Set the flag to False to avoid entering in a new loop.
         :return: None
         """
         self.regulating = False
+        self._regulation_job.stop()
 
-    def pressure_regulation_loop(self, target_flowrate):
-        """ Perform a step of pressure regulation towards reaching the target flowrate.
-        :param: int target_flowrate
-                (could eventually be removed because it was used in the initialization of the simple PID and is no longer needed.
-                 Then the RegulationWorker must also be modified)
+    def pressure_regulation_loop(self):
+        """ Perform a step of pressure regulation towards reaching the target flowrate (the setpoint of the PID).
+        Called periodically by the scheduler until the regulating mode is stopped.
         :return: None
         """
         self.regulate_pressure_pid()
-        if self.regulating:
-            # enter in a loop until the regulating mode is stopped
-            worker = RegulationWorker(target_flowrate)
-            worker.signals.sigRegulationWaitFinished.connect(self.pressure_regulation_loop)
-            self.threadpool.start(worker)
 
 # Volume count ---------------------------------------------------------------------------------------------------------
 
@@ -451,30 +375,30 @@ class FlowcontrolLogic(GenericLogic):
         self.target_volume = target_volume
         if self.total_volume < self.target_volume:
             self.target_volume_reached = False
-        # start summing up the total volume, using a worker thread
-        # worker = VolumeCountWorker(target_volume, sampling_interval)
-        worker = VolumeCountWorker(self.sampling_interval)
-        worker.signals.sigIntegrationIntervalFinished.connect(self.volume_measurement_loop)
-        self.threadpool.start(worker)
+        # start summing up the total volume, using a periodic job of the scheduler
+        self._volume_job.interval = self.sampling_interval
+        self._volume_job.start()
 
-    def volume_measurement_loop(self):
+    def volume_measurement_loop(self, elapsed=None):
         """ Perform a step in the volume count loop.
-        :param: int target_volume: target volume to be injected. Volume measurement will be stopped when target volume
-        is reached (necessary for tasks).
+        :param: float elapsed: time in s since the previous step, the sampling interval if None. It is longer than the
+                                sampling interval if steps were missed.
         :return: None
         """
+        if elapsed is None:
+            elapsed = self.sampling_interval
         # calculate the fluidics parameters. Note that the total volume is rounded as safety to avoid entering into the
         # else part when target volume is not yet reached due to data overflow
         flowrate = self.get_flowrate()[0]
         pressure = self.get_pressure()[0]
-        self.total_volume += flowrate * self.sampling_interval / 60
+        self.total_volume += flowrate * elapsed / 60
         self.total_volume = np.round(self.total_volume, decimals=3)
-        self.time_since_start += self.sampling_interval
+        self.time_since_start += elapsed
 
         # print(f"The target volume is {self.target_volume} & the total volume is {self.total_volume}")
         # print("")
 
-        self.sigUpdateVolumeMeasurement.emit(int(self.total_volume), self.time_since_start, flowrate, pressure)
+        self.sigUpdateVolumeMeasurement.emit(int(self.total_volume), int(self.time_since_start), flowrate, pressure)
 
         # The second conditions was added to avoid target volume error. Sometimes, the target volume is never reached
         # and the pump keeps injecting without stopping.
@@ -486,11 +410,9 @@ class FlowcontrolLogic(GenericLogic):
             self.sigTargetVolumeReached.emit()
 
         # second condition is necessary to stop measurement via GUI button
-        if not self.target_volume_reached and self.measuring_volume:
-            # enter in a loop until the target_volume is reached
-            worker = VolumeCountWorker(self.sampling_interval)
-            worker.signals.sigIntegrationIntervalFinished.connect(self.volume_measurement_loop)
-            self.threadpool.start(worker)
+        if self.target_volume_reached or not self.measuring_volume:
+            # the loop runs until the target_volume is reached
+            self._volume_job.stop()
 
         # when using np.inf as target_volume, the comparison ended sometimes up in the wrong branch (else) because np.inf was sometimes a large negative number
 
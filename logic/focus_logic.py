@@ -36,6 +36,7 @@ from time import sleep, time
 import numpy as np
 from numpy.polynomial import Polynomial as Poly
 from functools import partial
+from scipy.interpolate import Rbf
 
 # ======================================================================================================================
 # Worker classes
@@ -62,20 +63,163 @@ class AutofocusWorker(QtCore.QRunnable):
         self.signals.sigFinished.emit()
 
 
-class Worker(QtCore.QRunnable):
-    """ Worker thread for live camera display or piezo position timetrace.
-    The worker handles only the waiting time between the sampling of an image / a position. """
+# ======================================================================================================================
+# Focus map
+# ======================================================================================================================
 
-    def __init__(self, time_constant):
-        super(Worker, self).__init__()
-        self.signals = WorkerSignals()
-        self.time_constant = time_constant
+class FocusMap:
+    """ Model of the sample surface built from the focused z positions measured on the ROIs.
 
-    @QtCore.Slot()
-    def run(self):
-        """ """
-        sleep(self.time_constant)
-        self.signals.sigFinished.emit()
+    The latest focused z of each ROI is stored together with its xy stage position. A surface is fitted through these
+    points: either a plane (least squares, needs 3 ROIs) or a smoothed thin plate spline (needs 'spline_min_points'
+    ROIs, falls back to the plane otherwise). The residual of each ROI with respect to the fitted surface is kept, so
+    that local features (e.g. a bead or an embryo locally lifting the surface) are predicted as well.
+
+    Measurements are organized in cycles (for example one cycle per hybridization round). Between two cycles the sample
+    usually drifts as a whole. For this reason, as soon as ROIs were measured in the current cycle, the mean deviation
+    between their new z and the prediction from the previous cycle is added to all predictions.
+    """
+    def __init__(self, model='plane', spline_smoothing=0.1, spline_min_points=6):
+        """
+        @param str model: 'plane' or 'spline'
+        @param float spline_smoothing: smoothing parameter of the thin plate spline (0: interpolation)
+        @param int spline_min_points: minimum number of ROIs needed to fit the spline
+        """
+        if model not in ['plane', 'spline']:
+            raise ValueError(f'Unknown focus map model {model}. Use "plane" or "spline".')
+        self.model = model
+        self.spline_smoothing = spline_smoothing
+        self.spline_min_points = max(int(spline_min_points), 4)
+        self.cycle = 0
+        self._points = {}  # roi name: (x, y, z, cycle)
+        self._surface = None
+        self._offset = 0  # axial shift applied to the points since the last fit
+        self._residuals = {}
+        self._cycle_deviations = {}  # roi name: measured z - predicted z, for the rois measured in the current cycle
+        self._refine = True  # no surface from a previous cycle yet: refit the surface with each new ROI
+
+    def __len__(self):
+        return len(self._points)
+
+    @property
+    def residuals(self):
+        """ Deviation of each ROI from the fitted surface (in µm). """
+        return dict(self._residuals)
+
+    @property
+    def drift(self):
+        """ Mean axial drift of the sample since the last cycle (in µm), estimated from the ROIs already measured in
+        the current cycle. """
+        if not self._cycle_deviations:
+            return 0
+        return float(np.mean(list(self._cycle_deviations.values())))
+
+    def reset(self):
+        """ Forget all measurements. """
+        self.cycle = 0
+        self._points = {}
+        self._surface = None
+        self._offset = 0
+        self._residuals = {}
+        self._cycle_deviations = {}
+        self._refine = True
+
+    def new_cycle(self):
+        """ Start a new cycle. The surface is refitted with the latest measurement of each ROI and the drift estimate
+        is reset. Nothing is done as long as no ROI was measured, so that the tasks can start each round (including the
+        first one) with a new cycle. """
+        if not self._points:
+            return
+        self.cycle += 1
+        self._cycle_deviations = {}
+        self.fit()
+        self._refine = self._surface is None
+
+    def record(self, name, x, y, z):
+        """ Store the focused z position of a ROI.
+
+        @param str name: name of the ROI
+        @param float x: x stage position of the ROI
+        @param float y: y stage position of the ROI
+        @param float z: focused position (in µm)
+        """
+        if not self._refine:
+            prediction = self.predict(x, y, name=name, include_drift=False)
+            if prediction is not None:
+                self._cycle_deviations[name] = z - prediction
+        self._points[name] = (float(x), float(y), float(z), self.cycle)
+        # as long as no surface could be fitted in a previous cycle (first cycle, or less than 3 ROIs), the surface is
+        # refined with each new ROI. Later on, the surface of the previous cycle is kept and only the drift is updated,
+        # so that the prediction of the remaining ROIs stays consistent.
+        if self._refine:
+            self.fit()
+
+    def shift(self, dz):
+        """ Shift all stored positions by dz, for example after the translation stage was moved to bring the piezo
+        back into its central range.
+
+        @param float dz: axial shift in µm
+        """
+        self._points = {name: (x, y, z + dz, cycle) for name, (x, y, z, cycle) in self._points.items()}
+        # the surface is not refitted, because the points may stem from different cycles
+        self._offset += dz
+
+    def fit(self):
+        """ Fit the surface model through the latest measurement of each ROI and update the residuals.
+        """
+        self._surface = None
+        self._offset = 0
+        self._residuals = {}
+        if len(self._points) < 3:
+            return
+
+        names = list(self._points.keys())
+        points = np.array([self._points[name][:3] for name in names])
+        x, y, z = points.T
+        if self.model == 'spline' and len(names) >= self.spline_min_points:
+            try:
+                self._surface = Rbf(x, y, z, function='thin_plate', smooth=self.spline_smoothing)
+            except np.linalg.LinAlgError:  # degenerated roi layout, such as all rois on a line
+                self._surface = None
+        if self._surface is None:
+            # if all rois are on a line, lstsq returns the minimum norm solution (no tilt perpendicular to the line)
+            coefficients = np.linalg.lstsq(np.column_stack((x, y, np.ones_like(x))), z, rcond=None)[0]
+            self._surface = partial(self._plane, coefficients=coefficients)
+
+        residuals = z - self._surface(x, y)
+        self._residuals = dict(zip(names, residuals.astype(float)))
+
+    def predict(self, x, y, name=None, include_drift=True):
+        """ Predict the focused z position at the given stage position.
+
+        If less than 3 ROIs are known, the last measurement of the same ROI (or the mean of all measurements) is used.
+
+        @param float x: x stage position
+        @param float y: y stage position
+        @param str name: optional, name of the ROI. If the ROI is known, its residual is added to the prediction.
+        @param bool include_drift: add the drift estimated in the current cycle
+
+        @return float: predicted z position in µm, or None if no measurement is available
+        """
+        if not self._points:
+            return None
+
+        if self._surface is None:
+            if name in self._points:
+                z = self._points[name][2]
+            else:
+                z = np.mean([point[2] for point in self._points.values()])
+        else:
+            z = float(self._surface(np.atleast_1d(float(x)), np.atleast_1d(float(y)))[0])
+            z += self._residuals.get(name, 0) + self._offset
+
+        if include_drift:
+            z += self.drift
+        return float(z)
+
+    @staticmethod
+    def _plane(x, y, coefficients):
+        return coefficients[0] * x + coefficients[1] * y + coefficients[2]
 
 
 # ======================================================================================================================
@@ -93,6 +237,7 @@ class FocusLogic(GenericLogic):
         init_position: 10
         readout_device: 'qpd'  # 'camera', 'qpd'
         rescue_autofocus_possible: True
+        focus_map_model: 'plane'  # 'plane', 'spline' or None to disable the prediction of the focus position
         connect:
             piezo: 'mcl'
             autofocus: 'autofocus_logic'
@@ -107,6 +252,7 @@ class FocusLogic(GenericLogic):
     _rescue_autofocus_possible: bool = ConfigOption('rescue_autofocus_possible', False, missing='warn')
     _min_piezo_step: float = ConfigOption('minimum_piezo_displacement_autofocus', 0.02, missing='warn')
     experiments: list = ConfigOption('experiments', [], missing='warn')
+    _focus_map_model = ConfigOption('focus_map_model', 'plane')
 
     # signals
     sigStepChanged = QtCore.Signal(float)
@@ -158,6 +304,9 @@ class FocusLogic(GenericLogic):
         self.threadpool = QtCore.QThreadPool()
         self._piezo = None
         self._autofocus_logic = None
+        self.focus_map = None
+        self._timetrace_job = None
+        self._live_job = None
 
         # uncomment if needed:
         # self.threadlock = Mutex()
@@ -173,6 +322,10 @@ class FocusLogic(GenericLogic):
         self._max_z = self._piezo.get_constraints()[self._axis]['pos_max']
         self.init_piezo()
 
+        # initialize the sample surface model used to predict the focus position on each roi
+        if self._focus_map_model:
+            self.focus_map = FocusMap(model=self._focus_map_model)
+
         # intialize the first field of the combox
         self.experiments.insert(0, 'Indicate your experiment..')
 
@@ -186,10 +339,18 @@ class FocusLogic(GenericLogic):
         self._autofocus_logic.sigOffsetDefined.connect(self.define_autofocus_setpoint)
         self._autofocus_logic.sigStageMoved.connect(self.finish_piezo_position_correction)
 
+        # periodic jobs for the piezo position timetrace and the camera live display
+        scheduler = self.getScheduler()
+        self._timetrace_job = scheduler.add_job('{0}.timetrace'.format(self._name), self.position_tracking_loop,
+                                                self.timetrace_update_time, owner=self, tags=('gui',))
+        self._live_job = scheduler.add_job('{0}.live_display'.format(self._name), self.live_display_loop,
+                                           self.live_update_time, owner=self, tags=('gui',))
+
     def on_deactivate(self):
         """ Perform required deactivation.
         Reset the piezo to the zero position.
         """
+        self.getScheduler().remove_jobs(self)
         self.go_to_position(0.5)
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -346,24 +507,20 @@ class FocusLogic(GenericLogic):
         """ Start the timetrace of the piezo position. This method serves as slot called by gui signal sigTimetraceOn.
         """
         self.timetrace_enabled = True
-        worker = Worker(self.timetrace_update_time)
-        worker.signals.sigFinished.connect(self.position_tracking_loop)
-        self.threadpool.start(worker)
+        self._timetrace_job.start()
 
     def stop_position_tracking(self):
         """ Stop the timetrace of the piezo position. This method serves as slot called by gui signal sigTimetraceOff.
         """
         self.timetrace_enabled = False
+        self._timetrace_job.stop()
 
     def position_tracking_loop(self):
-        """ Execute step in the data recording loop, get the current z position of the piezo.
+        """ Execute step in the data recording loop, get the current z position of the piezo. Called periodically by
+        the scheduler while the timetrace is on.
         """
         position = self.get_position()
         self.sigUpdateTimetrace.emit(position)
-        if self.timetrace_enabled:
-            worker = Worker(self.timetrace_update_time)
-            worker.signals.sigFinished.connect(self.position_tracking_loop)
-            self.threadpool.start(worker)
 
 # ----------------------------------------------------------------------------------------------------------------------
 # Methods for live display of camera (image display dockwidget)
@@ -373,13 +530,10 @@ class FocusLogic(GenericLogic):
         """ Start the camera live display. """
         self.live_display_enabled = True
         self._autofocus_logic.start_camera_live()
-
-        worker = Worker(self.live_update_time)
-        worker.signals.sigFinished.connect(self.live_display_loop)
-        self.threadpool.start(worker)
+        self._live_job.start()
 
     def live_display_loop(self):
-        """ Refresh the camera live image.
+        """ Refresh the camera live image. Called periodically by the scheduler while the live display is on.
         """
         im = self._autofocus_logic.get_latest_image()
 
@@ -392,13 +546,9 @@ class FocusLogic(GenericLogic):
         else:
             pass
 
-        if self.live_display_enabled:
-            worker = Worker(self.live_update_time)
-            worker.signals.sigFinished.connect(self.live_display_loop)
-            self.threadpool.start(worker)
-
     def stop_live_display(self):
         """ Stop the camera live image. """
+        self._live_job.stop()
         self._autofocus_logic.stop_camera_live()
         self.live_display_enabled = False
 
@@ -721,6 +871,9 @@ class FocusLogic(GenericLogic):
                 self.start_autofocus()  # using default conditions for autofocus
                 # calculate the relative movement necessary to move piezo to 25 um
                 step = np.round(25 - piezo_pos, decimals=3)
+                # the sample surface is seen at a piezo position shifted by step once the stage has moved
+                if self.focus_map is not None:
+                    self.focus_map.shift(step)
                 self.sigDoStageMovement.emit(step)
             else:  # no signal found
                 self.log.warning('Position correction could not be done because autofocus signal not found!')
@@ -775,6 +928,63 @@ class FocusLogic(GenericLogic):
         self._stage_is_positioned = True
         self.sigFocusFound.emit()
 
+# ----------------------------------------------------------------------------------------------------------------------
+# Focus map: prediction of the focus position on each ROI
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def reset_focus_map(self):
+        """ Forget all focus positions recorded on the ROIs, for example when a new sample is mounted.
+        """
+        if self.focus_map is not None:
+            self.focus_map.reset()
+
+    def start_focus_map_cycle(self):
+        """ Indicate that a new cycle over all ROIs starts (e.g. a new hybridization round). The sample surface is
+        refitted using the latest focus position of each ROI.
+        """
+        if self.focus_map is not None:
+            self.focus_map.new_cycle()
+
+    def record_focus(self, roi_name, roi_position):
+        """ Store the current piezo position as focus position of the ROI. Call this method once the focus was
+        found on the ROI (and before moving the piezo for the acquisition of a stack).
+
+        @param str roi_name: name of the ROI
+        @param roi_position: (x, y, ...) stage position of the ROI
+        @return: None
+        """
+        if self.focus_map is not None:
+            self.focus_map.record(roi_name, roi_position[0], roi_position[1], self.get_position())
+
+    def predict_focus(self, roi_name, roi_position):
+        """ Predict the piezo position at which the ROI will be in focus.
+
+        @param str roi_name: name of the ROI
+        @param roi_position: (x, y, ...) stage position of the ROI
+        @return float: predicted piezo position, or None if no prediction is available
+        """
+        if self.focus_map is None:
+            return None
+        return self.focus_map.predict(roi_position[0], roi_position[1], name=roi_name)
+
+    def go_to_predicted_focus(self, roi_name, roi_position):
+        """ Move the piezo to the predicted focus position of the ROI. Used before the autofocus (or search focus)
+        so that the PID starts close to the setpoint and the signal is not lost. The piezo is not moved if no
+        prediction is available or if the prediction is too close to the limits of the travel range.
+
+        @param str roi_name: name of the ROI
+        @param roi_position: (x, y, ...) stage position of the ROI
+        @return float: predicted piezo position, or None if the piezo was not moved
+        """
+        z = self.predict_focus(roi_name, roi_position)
+        if z is None:
+            return None
+        if not self._min_z + 1 < z < self._max_z - 1:
+            self.log.info(f'Predicted focus position {z:.2f} µm out of piezo range. Piezo not moved.')
+            return None
+        self.go_to_position(np.round(z, decimals=3))
+        return z
+
 # ----------------------------------------------------------------------------------------------------------------------
 # Methods to handle the user interface state
 # ----------------------------------------------------------------------------------------------------------------------
@@ -47,6 +47,13 @@ class GenericLogic(Base):
         """
         return self._manager.tm._threads['mod-logic-' + self._name].thread
 
+    def getScheduler(self):
+        """ Get the scheduler of the manager, used to register periodic jobs (polling and display loops).
+
+          @return Scheduler: scheduler of the manager
+        """
+        return self._manager.scheduler
+
     def getTaskRunner(self):
         """ Get a reference to the task runner module registered in the manager.
 
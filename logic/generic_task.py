@@ -20,11 +20,14 @@ Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
 top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
 """
 import abc
+import os
 import sys
 import logging
+from contextlib import contextmanager
 from qtpy import QtCore
 
 from core.meta import TaskMetaclass
+from core.sampling_profiler import sampling_profiler
 from core.util.mutex import Mutex
 from fysom import Fysom
 
@@ -124,6 +127,7 @@ class InterruptableTask(QtCore.QObject, Fysom, metaclass=TaskMetaclass):
         # class attribute self.aborted switches to True if self._abort is called.
         # This attribute needs to be read in the runTaskStep method of child classes of generic Task to stop execution
         # of a task without waiting for runTaskStep to be finished.
+        self._spans = None
 
         self.sigDoStart.connect(self._doStart, QtCore.Qt.QueuedConnection)
         self.sigDoPause.connect(self._doPause, QtCore.Qt.QueuedConnection)
@@ -139,6 +143,17 @@ class InterruptableTask(QtCore.QObject, Fysom, metaclass=TaskMetaclass):
         return logging.getLogger("{0}.{1}".format(
             self.__module__, self.__class__.__name__))
 
+    @property
+    def spans(self):
+        """
+        Returns the recorder of the durations of the phases of the task, created on first use.
+        It is imported here since task_logging_functions imports pandas.
+        """
+        if self._spans is None:
+            from logic.task_logging_functions import SpanRecorder
+            self._spans = SpanRecorder(task_name=self.name)
+        return self._spans
+
     def onchangestate(self, e):
         """ Fysom callback for state transition.
 
@@ -168,8 +183,11 @@ class InterruptableTask(QtCore.QObject, Fysom, metaclass=TaskMetaclass):
         try:
             # print('dostart', QtCore.QThread.currentThreadId(), self.current)
             self.runner.pausePauseTasks(self)
+            self.runner.pausePauseLoops(self)
             self.runner.preRunPPTasks(self)
-            self.startTask()
+            self.spans.reset()
+            with self.span('start'):
+                self.startTask()
             self.startingFinished()
             self.sigStarted.emit()
             self.sigNextTaskStep.emit()
@@ -195,7 +213,9 @@ class InterruptableTask(QtCore.QObject, Fysom, metaclass=TaskMetaclass):
                 self.sigDoFinish.emit()
 
             else:
-                if self.runTaskStep():
+                with self.span('step'):
+                    next_step = self.runTaskStep()
+                if next_step:
                     self.sigNextTaskStep.emit()
                 else:
                     self.finish()
@@ -233,6 +253,7 @@ class InterruptableTask(QtCore.QObject, Fysom, metaclass=TaskMetaclass):
         try:
             self.pauseTask()
             self.runner.postRunPPTasks(self)
+            self.runner.resumePauseLoops(self)
             self.pausingFinished()
             self.sigPaused.emit()
         except Exception as e:
@@ -248,6 +269,7 @@ class InterruptableTask(QtCore.QObject, Fysom, metaclass=TaskMetaclass):
         """ Actually execute resuming action.
         """
         try:
+            self.runner.pausePauseLoops(self)
             self.runner.preRunPPTasks(self)
             self.resumeTask()
             self.resumingFinished()
@@ -265,8 +287,11 @@ class InterruptableTask(QtCore.QObject, Fysom, metaclass=TaskMetaclass):
     def _doFinish(self):
         """ Actually finish execution.
         """
-        self.cleanupTask()
+        with self.span('cleanup'):
+            self.cleanupTask()
+        self.finishSpans()
         self.runner.resumePauseTasks(self)
+        self.runner.resumePauseLoops(self)
         self.runner.postRunPPTasks(self)
         self.finishingFinished()
         self.sigFinished.emit()
@@ -280,7 +305,10 @@ class InterruptableTask(QtCore.QObject, Fysom, metaclass=TaskMetaclass):
         """
         self.aborted = True
         self.log.info('Task aborted')
-        self.cleanupTask()
+        with self.span('cleanup'):
+            self.cleanupTask()
+        self.finishSpans()
+        self.runner.resumePauseLoops(self)
         self.sigFinished.emit()
         # for debugging:
         # stopped = self.isstate('stopped')
@@ -288,6 +316,72 @@ class InterruptableTask(QtCore.QObject, Fysom, metaclass=TaskMetaclass):
         # running = self.isstate('running')
         # print(f'stopped: {stopped}, paused: {paused}, running: {running}')
 
+    def beginSpan(self, name, **attributes):
+        """ Start measuring the duration of a phase of the task. Use span instead if the phase is a block of code.
+
+            @param str name: name of the phase, e.g. 'hybridization'
+            @param attributes: optional, json serializable values describing the span, e.g. cycle=3
+        """
+        self.spans.begin(name, **attributes)
+        self._setProfilerTag()
+
+    def endSpan(self, name=None):
+        """ Stop measuring the duration of a phase started with beginSpan.
+
+            @param str name: optional, name of the phase. The innermost phase if None.
+        """
+        self.spans.end(name)
+        self._setProfilerTag()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """ Context manager measuring the duration of a phase of the task. Spans can be nested, for example:
+
+            with self.span('autofocus', roi=roi_name):
+                ...
+
+            The durations are written to the file set by setSpanFile and summarised in the log when the task
+            finishes. runTaskStep, startTask and cleanupTask are measured as the phases 'step', 'start' and 'cleanup'.
+            The samples of the sampling profiler are tagged with the current phase.
+
+            @param str name: name of the phase
+            @param attributes: optional, json serializable values describing the span, e.g. roi='ROI_001'
+        """
+        self.beginSpan(name, **attributes)
+        try:
+            yield
+        finally:
+            self.endSpan(name)
+
+    def setSpanFile(self, path, flush_interval=60):
+        """ Write the durations of the phases to a csv file, usually next to the log of the experiment.
+            A summary per phase is written to <path>_summary.csv when the task finishes.
+
+            @param str path: complete path to the csv file
+            @param float flush_interval: time in s after which recorded phases are written to the file
+        """
+        self.spans.flush_interval = flush_interval
+        self.spans.set_path(path)
+
+    def finishSpans(self):
+        """ Close the open phases, write the remaining ones to file and log the summary per phase.
+        """
+        try:
+            self.spans.close_all()
+            self._setProfilerTag()
+            self.spans.flush()
+            if self.spans.path is not None:
+                self.spans.save_summary('{0}_summary.csv'.format(os.path.splitext(self.spans.path)[0]))
+        except OSError as e:
+            self.log.warning('Could not save the durations of the phases of task {0}. {1}'.format(self.name, e))
+        summary = self.spans.format_summary()
+        if summary:
+            self.log.info('Durations of the phases of task {0}:\n{1}'.format(self.name, summary))
+
+    def _setProfilerTag(self):
+        phase = self.spans.current_phase
+        sampling_profiler.set_tag('task {0}.{1}'.format(self.name, phase) if phase else None)
+
     def checkStartPrerequisites(self):
         """ Check whether this task can be started by checking if all tasks to be paused are either stopped or can be paused.
             Also check custom prerequisites.
@@ -449,7 +543,8 @@ class PrePostTask(QtCore.QObject, Fysom, metaclass=TaskMetaclass):
         """
         self.sigPreExecStart.emit()
         try:
-            self.preExecute()
+            with sampling_profiler.tag('task {0}.pre'.format(self.name)):
+                self.preExecute()
         except Exception as e:
             self.log.exception('Exception during task {0}. {1}'.format(
                 self.name, e))
@@ -463,7 +558,8 @@ class PrePostTask(QtCore.QObject, Fysom, metaclass=TaskMetaclass):
         """
         self.sigPostExecStart.emit()
         try:
-            self.postExecute()
+            with sampling_profiler.tag('task {0}.post'.format(self.name)):
+                self.postExecute()
         except Exception as e:
             self.log.exception('Exception during task {0}. {1}'.format(
                 self.name, e))
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Qudi-CBS
+
+An extension to Qudi.
+
+This module contains the injection scheduler used by the Hi-M tasks to run a hybridization or photobleaching
+sequence (as configured with the injections module) on top of the valve logic and the flowcontrol logic.
+
+Compared to running the sequence step by step, the scheduler
+    - moves the 8 way valve to the position of the next injection during the incubation steps (the syringe valve
+      is closed and the pressure is 0, so the valve is not in the fluidic path at this moment). The move overlaps
+      only with the incubation time: no other valve is commanded before it is finished,
+    - does not move a valve a second time if it was already moved in advance,
+    - predicts the start and end time of each step from the volume and flowrate of the injections and the
+      incubation times, and corrects the prediction using the overhead measured on the previous injections.
+
+-----------------------------------------------------------------------------------
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+-----------------------------------------------------------------------------------
+"""
+import logging
+import time
+from contextlib import nullcontext
+from datetime import datetime
+
+
+class InjectionScheduler:
+    """ Runs a sequence of injection and incubation steps and predicts when each step will be finished.
+
+    A step is a dictionary as created by the injections module: {'product': str, 'volume': float (in ul),
+    'flowrate': float (in ul/min), 'time': None} for an injection, {'product': None, 'volume': None,
+    'flowrate': None, 'time': int (in s)} for an incubation.
+
+    Usage (from a task):
+        scheduler = InjectionScheduler(self.ref['valves'], self.ref['flow'], self.buffer_dict, log=self.log,
+                                       is_aborted=lambda: self.aborted, span=self.span)
+        scheduler.run(self.hybridization_list, on_tick=..., after_step=...)
+    """
+
+    def __init__(self, valves, flow, buffer_dict, log=None, is_aborted=None, span=None, poll_interval=1.,
+                 settle_time=1., product_valve='a', syringe_valve='c', syringe_closed=1, syringe_open=2,
+                 injection_overhead=5.):
+        """
+        :param: valves: valve logic
+        :param: flow: flowcontrol logic
+        :param: dict buffer_dict: valve position of the 8 way valve addressed by the product name
+        :param: log: optional, logger used for the info messages
+        :param: callable is_aborted: optional, returns True if the sequence should be interrupted
+        :param: callable span: optional, context manager factory span(name, **attributes) used to time each step
+        :param: float poll_interval: time between two checks of the injected volume and the incubation time, in s
+        :param: float settle_time: time to wait after stopping the pressure regulation, in s (done twice)
+        :param: str product_valve: identifier of the 8 way valve selecting the product
+        :param: str syringe_valve: identifier of the valve opening and closing the flux towards the pump
+        :param: int syringe_closed: position of the syringe valve stopping the flux
+        :param: int syringe_open: position of the syringe valve opening the flux
+        :param: float injection_overhead: time added to the nominal duration (volume / flowrate) of an injection for
+                                          the prediction, in s, until the overhead was measured
+        """
+        self.valves = valves
+        self.flow = flow
+        self.buffer_dict = buffer_dict
+        self.log = log if log is not None else logging.getLogger(__name__)
+        self.is_aborted = is_aborted if is_aborted is not None else (lambda: False)
+        self.span = span
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.product_valve = product_valve
+        self.syringe_valve = syringe_valve
+        self.syringe_closed = syringe_closed
+        self.syringe_open = syringe_open
+        self.default_overhead = injection_overhead
+
+        self.plan = []
+        self._overheads = []
+        self._product_position = None  # position of the product valve when set by the scheduler
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # prediction
+    # ------------------------------------------------------------------------------------------------------------------
+
+    @property
+    def injection_overhead(self):
+        """ Time spent during an injection in addition to volume / flowrate (valve moves, pressure settling), in s.
+        Mean of the last measured injections, or the default value if no injection was measured yet.
+        """
+        if not self._overheads:
+            return self.default_overhead
+        recent = self._overheads[-10:]
+        return sum(recent) / len(recent)
+
+    def valve_position(self, step):
+        """ Position of the product valve for a step.
+
+        :param: dict step: injection or incubation step
+        :return: int valve position, or None for an incubation step
+        """
+        if step['product'] is None:
+            return None
+        return self.buffer_dict[step['product']]
+
+    def nominal_duration(self, step):
+        """ Predicted duration of a step, in s.
+
+        :param: dict step: injection or incubation step
+        :return: float duration
+        """
+        if step['product'] is None:
+            return float(step['time'])
+        return step['volume'] / step['flowrate'] * 60 + self.injection_overhead
+
+    def predict(self, sequence, start=None):
+        """ Predict the start and end time of each step of a sequence.
+
+        :param: list sequence: list of injection and incubation steps
+        :param: float start: optional, start time of the sequence (time.time() format), default now
+        :return: list of dictionaries with keys 'step', 'product', 'predicted_start', 'predicted_end', 'start', 'end'
+        """
+        t = time.time() if start is None else start
+        plan = []
+        for index, step in enumerate(sequence):
+            duration = self.nominal_duration(step)
+            plan.append({'step': index + 1, 'product': step['product'], 'predicted_start': t,
+                         'predicted_end': t + duration, 'start': None, 'end': None})
+            t += duration
+        return plan
+
+    @property
+    def predicted_end(self):
+        """ Predicted end of the sequence currently (or last) run, in time.time() format, or None. """
+        if not self.plan:
+            return None
+        return self.plan[-1]['predicted_end']
+
+    def remaining_time(self):
+        """ Predicted time until the end of the sequence currently run, in s. """
+        if self.predicted_end is None:
+            return 0.
+        return max(self.predicted_end - time.time(), 0.)
+
+    def _update_plan(self, index):
+        """ Shift the prediction of the following steps using the measured end time of a step. """
+        entry = self.plan[index]
+        delay = entry['end'] - entry['predicted_end']
+        entry['predicted_end'] = entry['end']
+        for following in self.plan[index + 1:]:
+            following['predicted_start'] += delay
+            following['predicted_end'] += delay
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # execution
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def preposition(self, step):
+        """ Move the product valve to the position of an injection step without waiting for the move to finish.
+        This must only be done while the product valve is not in the fluidic path (syringe valve closed or
+        pressure 0). The caller must wait for idle valves before commanding any other valve, since the valves of
+        the chain can not be moved at the same time.
+
+        :param: dict step: injection or incubation step (nothing is done for an incubation step)
+        """
+        if step is None:
+            return
+        position = self.valve_position(step)
+        if position is None or position == self._product_position:
+            return
+        self.valves.set_valve_position(self.product_valve, position)
+        self._product_position = position
+
+    def run(self, sequence, on_tick=None, before_step=None, before_injection=None, after_step=None):
+        """ Run a sequence of injection and incubation steps. The syringe valve must be open (towards the pump) and
+        the other valves in the position for the injection before calling this method. The syringe valve is open again
+        at the end of the sequence.
+
+        :param: list sequence: list of injection and incubation steps
+        :param: callable on_tick: optional, on_tick(index, step) called every poll interval during each step
+        :param: callable before_step: optional, before_step(index, step) called at the start of each step
+        :param: callable before_injection: optional, before_injection(index, step, valve_position) called when the
+                                           product valve is in position, before the pressure regulation is started
+        :param: callable after_step: optional, after_step(index, step) called at the end of each step
+        """
+        self.plan = self.predict(sequence)
+        if self.plan:
+            self.log.info('Predicted end of the sequence: {0} ({1:.0f} s)'.format(
+                datetime.fromtimestamp(self.predicted_end).strftime('%H:%M:%S'), self.remaining_time()))
+
+        try:
+            for index, step in enumerate(sequence):
+                if self.is_aborted():
+                    break
+
+                entry = self.plan[index]
+                entry['start'] = time.time()
+                if before_step is not None:
+                    before_step(index, step)
+
+                if step['product'] is not None:
+                    with self._span('injection', index):
+                        self._inject(index, step, on_tick, before_injection)
+                else:
+                    next_injection = next((item for item in sequence[index + 1:] if item['product'] is not None),
+                                          None)
+                    with self._span('incubation', index):
+                        self._incubate(index, step, next_injection, on_tick)
+
+                entry['end'] = time.time()
+                self._update_plan(index)
+                if after_step is not None:
+                    after_step(index, step)
+        finally:
+            # the product valve may be moved by the task after the sequence
+            self._product_position = None
+
+    def _span(self, name, index):
+        if self.span is None:
+            return nullcontext()
+        return self.span(name, step=index + 1)
+
+    def _inject(self, index, step, on_tick, before_injection):
+        """ Inject the volume of product given in the step, using the pressure regulation at the given flowrate. """
+        start = time.time()
+        position = self.valve_position(step)
+        if position != self._product_position:
+            self.valves.set_valve_position(self.product_valve, position)
+            self._product_position = position
+        else:
+            self.log.debug('Valve {0} already in position {1}'.format(self.product_valve, position))
+        self.valves.wait_for_idle()
+
+        if before_injection is not None:
+            before_injection(index, step, position)
+
+        self.flow.set_pressure(0.0)  # as initial value
+        self.flow.start_pressure_regulation_loop(step['flowrate'])
+        # start counting the volume of buffer or probe
+        self.flow.start_volume_measurement(step['volume'])
+
+        while not self.flow.target_volume_reached:
+            time.sleep(self.poll_interval)
+            if on_tick is not None:
+                on_tick(index, step)
+            if self.is_aborted():
+                break
+
+        self.flow.stop_pressure_regulation_loop()
+        time.sleep(self.settle_time)  # time to wait until last regulation step is finished, afterwards reset pressure
+        if on_tick is not None:
+            on_tick(index, step)
+        time.sleep(self.settle_time)
+        self.flow.set_pressure(0.0)
+
+        if not self.is_aborted():
+            self._overheads.append(time.time() - start - step['volume'] / step['flowrate'] * 60)
+
+    def _incubate(self, index, step, next_injection, on_tick):
+        """ Stop the flux during the incubation time. The product valve is moved to the position of the next injection
+        in the meantime.
+        """
+        t = step['time']
+        self.log.info(f'Incubation time.. {t} s')
+        self.valves.set_valve_position(self.syringe_valve, self.syringe_closed)  # stop flux
+        self.valves.wait_for_idle()
+
+        # the product valve is not in the fluidic path while the flux is stopped
+        self.preposition(next_injection)
+
+        end = time.time() + t
+        while not self.is_aborted():
+            remaining = end - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(self.poll_interval, remaining))
+            if on_tick is not None:
+                on_tick(index, step)
+
+        self.valves.wait_for_idle()  # the product valve may still be moving if the incubation is short
+        self.valves.set_valve_position(self.syringe_valve, self.syringe_open)  # open flux again
+        self.valves.wait_for_idle()
+        self.log.info('Incubation time finished')
@@ -34,6 +34,7 @@ from logic.generic_logic import GenericLogic
 from qtpy import QtCore
 from core.configoption import ConfigOption
 from time import sleep
+from contextlib import nullcontext
 
 import numpy as np
 
@@ -352,6 +353,22 @@ class LaserControlLogic(GenericLogic):
         """
         self._controller.set_state_all_laser_lines(laser_on)
 
+    def lumencor_coalesced_update(self):
+        """ Context manager collecting the intensity and emission updates of the laser lines issued within one imaging
+        step, so that only the final (changed) settings are sent to the celesta source.
+
+        For other controller types, the updates are applied right away (the context manager does nothing), so that
+        it can be used in code common to all setups.
+
+        Usage:
+            with laser_logic.lumencor_coalesced_update():
+                laser_logic.lumencor_set_laser_line_intensities(intensity_dict)
+                laser_logic.lumencor_set_laser_line_emission(laser_on)
+        """
+        if self.controllertype == 'celesta':
+            return self._controller.coalesced_update()
+        return nullcontext()
+
     @staticmethod
     def lumencor_read_intensity_dict(intensity_dict):
         """ Define the intensity of each laser lines of the celesta source. Set emission states of all laser lines to O.
@@ -28,6 +28,7 @@ import numpy as np
 import time
 import datetime
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 
 from logic.generic_logic import GenericLogic
 from core.util.mutex import Mutex
@@ -36,6 +37,230 @@ from core.configoption import ConfigOption
 from core.statusvariable import StatusVar
 
 
+def draw_odmr_figure(data, cbar_range=None, percentile_range=None, number_of_lines=None):
+    """ Draw the summary figure saved with the ODMR data of a channel and a frequency range. Kept at
+    module level, so the save logic can draw it in its figure rendering process.
+
+    @param: dict data: figure data, see ODMRLogic.get_figure_data
+    @param: list cbar_range: (optional) [color_scale_min, color_scale_max].
+                             If not supplied then a default of data_min to data_max
+                             will be used.
+    @param: list percentile_range: (optional) Percentile range of the chosen cbar_range.
+    @param: int number_of_lines: number of lines of the matrix plot
+
+    @return: fig fig: a matplotlib figure object (not managed by pyplot) to be saved to file.
+    """
+    freq_data = data['freq_data']
+    count_data = data['count_data']
+    matrix_data = data['matrix_data']
+    fit_freq_vals = data['freq_data']
+    fit_count_vals = data.get('fit_count_vals', 0.0)
+
+    # If no colorbar range was given, take full range of data
+    if cbar_range is None:
+        cbar_range = np.array([np.min(matrix_data), np.max(matrix_data)])
+    else:
+        cbar_range = np.array(cbar_range)
+
+    prefix = ['', 'k', 'M', 'G', 'T']
+    prefix_index = 0
+
+    # Rescale counts data with SI prefix
+    while np.max(count_data) > 1000:
+        count_data = count_data / 1000
+        fit_count_vals = fit_count_vals / 1000
+        prefix_index = prefix_index + 1
+
+    counts_prefix = prefix[prefix_index]
+
+    # Rescale frequency data with SI prefix
+    prefix_index = 0
+
+    while np.max(freq_data) > 1000:
+        freq_data = freq_data / 1000
+        fit_freq_vals = fit_freq_vals / 1000
+        prefix_index = prefix_index + 1
+
+    mw_prefix = prefix[prefix_index]
+
+    # Rescale matrix counts data with SI prefix
+    prefix_index = 0
+
+    while np.max(matrix_data) > 1000:
+        matrix_data = matrix_data / 1000
+        cbar_range = cbar_range / 1000
+        prefix_index = prefix_index + 1
+
+    cbar_prefix = prefix[prefix_index]
+
+    # Create figure
+    fig = Figure()
+    ax_mean, ax_matrix = fig.subplots(nrows=2, ncols=1)
+
+    ax_mean.plot(freq_data, count_data, linestyle=':', linewidth=0.5)
+
+    # Do not include fit curve if there is no fit calculated.
+    if hasattr(fit_count_vals, '__len__'):
+        ax_mean.plot(fit_freq_vals, fit_count_vals, marker='None')
+
+    ax_mean.set_ylabel('Fluorescence (' + counts_prefix + 'c/s)')
+    ax_mean.set_xlim(np.min(freq_data), np.max(freq_data))
+
+    matrixplot = ax_matrix.imshow(
+        matrix_data,
+        cmap='inferno',  # reference the right place in qd
+        origin='lower',
+        vmin=cbar_range[0],
+        vmax=cbar_range[1],
+        extent=[np.min(freq_data),
+                np.max(freq_data),
+                0,
+                number_of_lines
+                ],
+        aspect='auto',
+        interpolation='nearest')
+
+    ax_matrix.set_xlabel('Frequency (' + mw_prefix + 'Hz)')
+    ax_matrix.set_ylabel('Scan #')
+
+    # Adjust subplots to make room for colorbar
+    fig.subplots_adjust(right=0.8)
+
+    # Add colorbar axis to figure
+    cbar_ax = fig.add_axes([0.85, 0.15, 0.02, 0.7])
+
+    # Draw colorbar
+    cbar = fig.colorbar(matrixplot, cax=cbar_ax)
+    cbar.set_label('Fluorescence (' + cbar_prefix + 'c/s)')
+
+    # remove ticks from colorbar for cleaner image
+    cbar.ax.tick_params(which=u'both', length=0)
+
+    # If we have percentile information, draw that to the figure
+    if percentile_range is not None:
+        cbar.ax.annotate(str(percentile_range[0]),
+                         xy=(-0.3, 0.0),
+                         xycoords='axes fraction',
+                         horizontalalignment='right',
+                         verticalalignment='center',
+                         rotation=90
+                         )
+        cbar.ax.annotate(str(percentile_range[1]),
+                         xy=(-0.3, 1.0),
+                         xycoords='axes fraction',
+                         horizontalalignment='right',
+                         verticalalignment='center',
+                         rotation=90
+                         )
+        cbar.ax.annotate('(percentile)',
+                         xy=(-0.3, 0.5),
+                         xycoords='axes fraction',
+                         horizontalalignment='right',
+                         verticalalignment='center',
+                         rotation=90
+                         )
+
+    return fig
+
+
+class OdmrLineAccumulator:
+    """ Stores the ODMR sweep lines and keeps the running sum of all lines and of the last lines_to_average lines,
+    so that adding a line costs O(number of frequency points), independent of the number of elapsed sweeps.
+
+    The lines are stored newest first, written from the end of a pre-allocated buffer towards its beginning. The
+    history and the matrix of the most recent lines are therefore views into the buffer which are not modified by
+    later lines. The buffer is followed by matrix_lines rows of zeros, so that the matrix always has matrix_lines rows.
+    If the buffer is full, it is reallocated with twice the capacity.
+    """
+
+    def __init__(self, channels, points, capacity, matrix_lines, lines_to_average=0):
+        """
+        @param int channels: number of counter channels
+        @param int points: number of frequency points per line
+        @param int capacity: expected number of lines (pre-allocated)
+        @param int matrix_lines: number of lines in the matrix
+        @param int lines_to_average: number of most recent lines to average (0 means all)
+        """
+        self._capacity = max(1, int(capacity))
+        self._matrix_lines = max(1, int(matrix_lines))
+        self._buffer = np.zeros([self._capacity + self._matrix_lines, channels, points])
+        self._start = self._capacity  # index of the most recent line
+        self._sum = np.zeros([channels, points])
+        self._window_sum = np.zeros([channels, points])
+        self._lines_to_average = 0
+        self.set_lines_to_average(lines_to_average)
+
+    @property
+    def count(self):
+        """ Number of lines added since the creation or the last clear. """
+        return self._capacity - self._start
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def lines(self):
+        """ All lines, newest first, array of shape (count, channels, points). """
+        return self._buffer[self._start:self._capacity]
+
+    @property
+    def matrix(self):
+        """ The matrix_lines most recent lines, newest first, padded with zeros. """
+        return self._buffer[self._start:self._start + self._matrix_lines]
+
+    @property
+    def mean(self):
+        """ Mean of the lines_to_average most recent lines (of all lines if lines_to_average is 0). """
+        if self._lines_to_average <= 0:
+            return self._sum / max(1, self.count)
+        return self._window_sum / max(1, min(self._lines_to_average, self.count))
+
+    def set_lines_to_average(self, lines_to_average):
+        """ Change the number of lines to average. Recalculates the sum of the averaged lines once.
+
+        @param int lines_to_average: number of most recent lines to average (0 means all)
+        """
+        self._lines_to_average = int(lines_to_average)
+        if self._lines_to_average > 0:
+            self._window_sum = np.sum(self.lines[:self._lines_to_average], axis=0)
+
+    def add_line(self, line):
+        """ Add a new line.
+
+        @param numpy.ndarray line: counts of shape (channels, points)
+
+        @return bool: True if the buffer had to be expanded
+        """
+        expanded = self._start == 0
+        if expanded:
+            self._expand()
+        self._start -= 1
+        self._buffer[self._start] = line
+        self._sum += self._buffer[self._start]
+        if self._lines_to_average > 0:
+            self._window_sum += self._buffer[self._start]
+            if self.count > self._lines_to_average:
+                self._window_sum -= self._buffer[self._start + self._lines_to_average]
+        return expanded
+
+    def clear(self):
+        """ Remove all lines. """
+        self._buffer[self._start:self._capacity] = 0
+        self._start = self._capacity
+        self._sum[:] = 0
+        self._window_sum[:] = 0
+
+    def _expand(self):
+        """ Reallocate the buffer with twice the capacity. The previous buffer (and views into it) remain valid. """
+        count = self.count
+        buffer = np.zeros((2 * self._capacity + self._matrix_lines,) + self._buffer.shape[1:])
+        buffer[2 * self._capacity - count:] = self._buffer[self._start:]
+        self._start = 2 * self._capacity - count
+        self._capacity *= 2
+        self._buffer = buffer
+
+
 class ODMRLogic(GenericLogic):
     """This is the Logic class for ODMR."""
 
@@ -128,12 +353,12 @@ class ODMRLogic(GenericLogic):
 
         # Initalize the ODMR data arrays (mean signal and sweep matrix)
         self._initialize_odmr_plots()
-        # Raw data array
-        self.odmr_raw_data = np.zeros(
-            [self.number_of_lines,
-             len(self._odmr_counter.get_odmr_channels()),
-             self.odmr_plot_x.size]
-        )
+        # Raw data, running sums and matrix lines
+        self._line_accumulator = OdmrLineAccumulator(len(self._odmr_counter.get_odmr_channels()),
+                                                     self.odmr_plot_x.size,
+                                                     self.number_of_lines,
+                                                     self.number_of_lines,
+                                                     self.lines_to_average)
 
         # Switch off microwave and set CW frequency and power
         self.mw_off()
@@ -268,18 +493,9 @@ class ODMRLogic(GenericLogic):
         """
         self.lines_to_average = int(lines_to_average)
 
-        if self.lines_to_average <= 0:
-            self.odmr_plot_y = np.mean(
-                self.odmr_raw_data[:max(1, self.elapsed_sweeps), :, :],
-                axis=0,
-                dtype=np.float64
-            )
-        else:
-            self.odmr_plot_y = np.mean(
-                self.odmr_raw_data[:max(1, min(self.lines_to_average, self.elapsed_sweeps)), :, :],
-                axis=0,
-                dtype=np.float64
-            )
+        with self.threadlock:
+            self._line_accumulator.set_lines_to_average(self.lines_to_average)
+            self.odmr_plot_y = self._line_accumulator.mean
 
         self.sigOdmrPlotsUpdated.emit(self.odmr_plot_x, self.odmr_plot_y, self.odmr_plot_xy)
         self.sigParameterUpdated.emit({'average_length': self.lines_to_average})
@@ -670,11 +886,11 @@ class ODMRLogic(GenericLogic):
                 estimated_number_of_lines = self.number_of_lines
             self.log.debug('Estimated number of raw data lines: {0:d}'
                            ''.format(estimated_number_of_lines))
-            self.odmr_raw_data = np.zeros(
-                [estimated_number_of_lines,
-                 len(self._odmr_counter.get_odmr_channels()),
-                 self.odmr_plot_x.size]
-            )
+            self._line_accumulator = OdmrLineAccumulator(len(self._odmr_counter.get_odmr_channels()),
+                                                         self.odmr_plot_x.size,
+                                                         estimated_number_of_lines,
+                                                         self.number_of_lines,
+                                                         self.lines_to_average)
             self.sigNextLine.emit()
             return 0
 
@@ -767,45 +983,18 @@ class ODMRLogic(GenericLogic):
                 self.sigNextLine.emit()
                 return
 
-            # Add new count data to raw_data array and append if array is too small
+            # Add new count data to the raw data and the running sums (the raw data is expanded if too small)
             if self._clearOdmrData:
-                self.odmr_raw_data[:, :, :] = 0
+                self._line_accumulator.clear()
                 self._clearOdmrData = False
-            if self.elapsed_sweeps == (self.odmr_raw_data.shape[0] - 1):
-                expanded_array = np.zeros(self.odmr_raw_data.shape)
-                self.odmr_raw_data = np.concatenate((self.odmr_raw_data, expanded_array), axis=0)
+            if self._line_accumulator.add_line(new_counts):
                 self.log.warning('raw data array in ODMRLogic was not big enough for the entire '
-                                 'measurement. Array will be expanded.\nOld array shape was '
-                                 '({0:d}, {1:d}), new shape is ({2:d}, {3:d}).'
-                                 ''.format(self.odmr_raw_data.shape[0] - self.number_of_lines,
-                                           self.odmr_raw_data.shape[1],
-                                           self.odmr_raw_data.shape[0],
-                                           self.odmr_raw_data.shape[1]))
-
-            # shift data in the array "up" and add new data at the "bottom"
-            self.odmr_raw_data = np.roll(self.odmr_raw_data, 1, axis=0)
+                                 'measurement. Array will be expanded to {0:d} lines.'
+                                 ''.format(self._line_accumulator.capacity))
 
-            self.odmr_raw_data[0] = new_counts
-
-            # Add new count data to mean signal
-            if self._clearOdmrData:
-                self.odmr_plot_y[:, :] = 0
-
-            if self.lines_to_average <= 0:
-                self.odmr_plot_y = np.mean(
-                    self.odmr_raw_data[:max(1, self.elapsed_sweeps), :, :],
-                    axis=0,
-                    dtype=np.float64
-                )
-            else:
-                self.odmr_plot_y = np.mean(
-                    self.odmr_raw_data[:max(1, min(self.lines_to_average, self.elapsed_sweeps)), :, :],
-                    axis=0,
-                    dtype=np.float64
-                )
-
-            # Set plot slice of matrix
-            self.odmr_plot_xy = self.odmr_raw_data[:self.number_of_lines, :, :]
+            # Update mean signal and plot slice of matrix
+            self.odmr_plot_y = self._line_accumulator.mean
+            self.odmr_plot_xy = self._line_accumulator.matrix
 
             # Update elapsed time/sweeps
             self.elapsed_sweeps += 1
@@ -818,6 +1007,11 @@ class ODMRLogic(GenericLogic):
             self.sigNextLine.emit()
             return
 
+    @property
+    def odmr_raw_data(self):
+        """ All ODMR lines of the current measurement, newest first, array of shape (sweeps, channels, points). """
+        return self._line_accumulator.lines
+
     def get_odmr_channels(self):
         return self._odmr_counter.get_odmr_channels()
 
@@ -898,13 +1092,13 @@ class ODMRLogic(GenericLogic):
             parameters['Step sizes (Hz)'] = self.mw_steps
             parameters['Clock Frequencies (Hz)'] = self.clock_frequency
             parameters['Channel'] = '{0}: {1}'.format(nch, channel)
-            self._save_logic.save_data(data_raw,
-                                       filepath=filepath,
-                                       parameters=parameters,
-                                       filelabel=filelabel_raw,
-                                       fmt='%.6e',
-                                       delimiter='\t',
-                                       timestamp=timestamp)
+            self._save_logic.save_data_async(data_raw,
+                                             filepath=filepath,
+                                             parameters=parameters,
+                                             filelabel=filelabel_raw,
+                                             fmt='%.6e',
+                                             delimiter='\t',
+                                             timestamp=timestamp)
 
             # now create a plot for each scan range
             data_start_ind = 0
@@ -942,20 +1136,20 @@ class ODMRLogic(GenericLogic):
                         parameters[name] = str(param)
                 # add all fit parameter to the saved data:
 
-                fig = self.draw_figure(nch, ii,
-                                       cbar_range=colorscale_range,
-                                       percentile_range=percentile_range)
-
-                self._save_logic.save_data(data,
-                                           filepath=filepath,
-                                           parameters=parameters,
-                                           filelabel=filelabel,
-                                           fmt='%.6e',
-                                           delimiter='\t',
-                                           timestamp=timestamp,
-                                           plotfig=fig)
-
-        self.log.info('ODMR data saved to:\n{0}'.format(filepath))
+                self._save_logic.save_data_async(data,
+                                                 filepath=filepath,
+                                                 parameters=parameters,
+                                                 filelabel=filelabel,
+                                                 fmt='%.6e',
+                                                 delimiter='\t',
+                                                 timestamp=timestamp,
+                                                 plot_function=draw_odmr_figure,
+                                                 plot_data=self.get_figure_data(nch, ii),
+                                                 plot_parameters={'cbar_range': colorscale_range,
+                                                                  'percentile_range': percentile_range,
+                                                                  'number_of_lines': self.number_of_lines},
+                                                 saved_message='ODMR data of channel {0}, range {1} '
+                                                               'saved to:\n{2}'.format(nch, ii, filepath))
         return
 
     def draw_figure(self, channel_number, freq_range, cbar_range=None, percentile_range=None):
@@ -969,8 +1163,18 @@ class ODMRLogic(GenericLogic):
 
         @return: fig fig: a matplotlib figure object to be saved to file.
         """
+        # Use qudi style
+        plt.style.use(self._save_logic.mpl_qd_style)
+        return draw_odmr_figure(self.get_figure_data(channel_number, freq_range),
+                                cbar_range=cbar_range, percentile_range=percentile_range,
+                                number_of_lines=self.number_of_lines)
+
+    def get_figure_data(self, channel_number, freq_range):
+        """ Collect the data of the summary figure of a channel and a frequency range.
+
+        @return dict: frequencies, mean counts, matrix data and fit curve (if a fit was performed)
+        """
         key = 'channel: {0}, range: {1}'.format(channel_number, freq_range)
-        freq_data = self.frequency_lists[freq_range]
         lengths = [len(freq_range) for freq_range in self.frequency_lists]
         cumulative_sum = list()
         tmp_val = 0
@@ -981,121 +1185,13 @@ class ODMRLogic(GenericLogic):
 
         ind_start = cumulative_sum[freq_range]
         ind_end = cumulative_sum[freq_range + 1]
-        count_data = self.odmr_plot_y[channel_number][ind_start:ind_end]
-        fit_freq_vals = self.frequency_lists[freq_range]
+        figure_data = {'freq_data': self.frequency_lists[freq_range],
+                       'count_data': self.odmr_plot_y[channel_number][ind_start:ind_end],
+                       'matrix_data': self.select_odmr_matrix_data(self.odmr_plot_xy, channel_number,
+                                                                   freq_range)}
         if key in self.fits_performed:
-            fit_count_vals = self.fits_performed[key][2].eval()
-        else:
-            fit_count_vals = 0.0
-        matrix_data = self.select_odmr_matrix_data(self.odmr_plot_xy, channel_number, freq_range)
-
-        # If no colorbar range was given, take full range of data
-        if cbar_range is None:
-            cbar_range = np.array([np.min(matrix_data), np.max(matrix_data)])
-        else:
-            cbar_range = np.array(cbar_range)
-
-        prefix = ['', 'k', 'M', 'G', 'T']
-        prefix_index = 0
-
-        # Rescale counts data with SI prefix
-        while np.max(count_data) > 1000:
-            count_data = count_data / 1000
-            fit_count_vals = fit_count_vals / 1000
-            prefix_index = prefix_index + 1
-
-        counts_prefix = prefix[prefix_index]
-
-        # Rescale frequency data with SI prefix
-        prefix_index = 0
-
-        while np.max(freq_data) > 1000:
-            freq_data = freq_data / 1000
-            fit_freq_vals = fit_freq_vals / 1000
-            prefix_index = prefix_index + 1
-
-        mw_prefix = prefix[prefix_index]
-
-        # Rescale matrix counts data with SI prefix
-        prefix_index = 0
-
-        while np.max(matrix_data) > 1000:
-            matrix_data = matrix_data / 1000
-            cbar_range = cbar_range / 1000
-            prefix_index = prefix_index + 1
-
-        cbar_prefix = prefix[prefix_index]
-
-        # Use qudi style
-        plt.style.use(self._save_logic.mpl_qd_style)
-
-        # Create figure
-        fig, (ax_mean, ax_matrix) = plt.subplots(nrows=2, ncols=1)
-
-        ax_mean.plot(freq_data, count_data, linestyle=':', linewidth=0.5)
-
-        # Do not include fit curve if there is no fit calculated.
-        if hasattr(fit_count_vals, '__len__'):
-            ax_mean.plot(fit_freq_vals, fit_count_vals, marker='None')
-
-        ax_mean.set_ylabel('Fluorescence (' + counts_prefix + 'c/s)')
-        ax_mean.set_xlim(np.min(freq_data), np.max(freq_data))
-
-        matrixplot = ax_matrix.imshow(
-            matrix_data,
-            cmap=plt.get_cmap('inferno'),  # reference the right place in qd
-            origin='lower',
-            vmin=cbar_range[0],
-            vmax=cbar_range[1],
-            extent=[np.min(freq_data),
-                    np.max(freq_data),
-                    0,
-                    self.number_of_lines
-                    ],
-            aspect='auto',
-            interpolation='nearest')
-
-        ax_matrix.set_xlabel('Frequency (' + mw_prefix + 'Hz)')
-        ax_matrix.set_ylabel('Scan #')
-
-        # Adjust subplots to make room for colorbar
-        fig.subplots_adjust(right=0.8)
-
-        # Add colorbar axis to figure
-        cbar_ax = fig.add_axes([0.85, 0.15, 0.02, 0.7])
-
-        # Draw colorbar
-        cbar = fig.colorbar(matrixplot, cax=cbar_ax)
-        cbar.set_label('Fluorescence (' + cbar_prefix + 'c/s)')
-
-        # remove ticks from colorbar for cleaner image
-        cbar.ax.tick_params(which=u'both', length=0)
-
-        # If we have percentile information, draw that to the figure
-        if percentile_range is not None:
-            cbar.ax.annotate(str(percentile_range[0]),
-                             xy=(-0.3, 0.0),
-                             xycoords='axes fraction',
-                             horizontalalignment='right',
-                             verticalalignment='center',
-                             rotation=90
-                             )
-            cbar.ax.annotate(str(percentile_range[1]),
-                             xy=(-0.3, 1.0),
-                             xycoords='axes fraction',
-                             horizontalalignment='right',
-                             verticalalignment='center',
-                             rotation=90
-                             )
-            cbar.ax.annotate('(percentile)',
-                             xy=(-0.3, 0.5),
-                             xycoords='axes fraction',
-                             horizontalalignment='right',
-                             verticalalignment='center',
-                             rotation=90
-                             )
-
-        return fig
+            figure_data['fit_count_vals'] = self.fits_performed[key][2].eval()
+        return figure_data
 
     def select_odmr_matrix_data(self, odmr_matrix, nch, freq_range):
         odmr_matrix_dp = odmr_matrix[:, nch]
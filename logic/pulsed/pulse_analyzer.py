@@ -23,6 +23,7 @@ import os
 import sys
 import inspect
 import importlib
+from functools import partial
 
 from core.util.modules import get_main_dir
 from core.util.helpers import natural_sort
@@ -203,10 +204,20 @@ class PulseAnalyzer(PulseAnalyzerBase):
                                                 and the measurement error corresponding to each
                                                 data point.
         """
-        analysis_method = self._analysis_methods[self._current_analysis_method]
+        return self.get_analysis_function()(laser_data=laser_data)
+
+    def get_analysis_function(self):
+        """
+        Returns the currently selected analysis method with the current keyword arguments bound to
+        it. Later changes of the analysis settings do not affect the returned function, so that it
+        can be called outside of the threadlock of the measurement logic.
 
+        @return functools.partial: function(laser_data) returning the tuple (signal, error) of the
+                                   analysis method
+        """
+        analysis_method = self._analysis_methods[self._current_analysis_method]
         kwargs = self._get_analysis_method_kwargs(analysis_method)
-        return analysis_method(laser_data=laser_data, **kwargs)
+        return partial(analysis_method, **kwargs)
 
     def _get_analysis_method_kwargs(self, method):
         """
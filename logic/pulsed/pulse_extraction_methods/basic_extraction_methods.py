@@ -21,6 +21,7 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 import numpy as np
 from scipy import ndimage
+from scipy.signal import find_peaks
 
 from logic.pulsed.pulse_extractor import PulseExtractorBase
 
@@ -31,6 +32,8 @@ class BasicPulseExtractor(PulseExtractorBase):
     """
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # Edge positions found by ungated_conv_deriv_batched, reused while the sequence is unchanged
+        self._edge_cache = None
 
     def gated_conv_deriv(self, count_data, conv_std_dev=20.0, flank_width=0):
         """
@@ -254,6 +257,111 @@ class BasicPulseExtractor(PulseExtractorBase):
         return_dict['laser_indices_falling'] = falling_ind
         return return_dict
 
+    def ungated_conv_deriv_batched(self, count_data, conv_std_dev=20.0):
+        """ Detects the laser pulses in the ungated timetrace data and extracts them.
+
+        Same edge detection as ungated_conv_deriv, but all rising and falling edges are found in
+        one pass by a peak search (with a minimum separation of 2 * conv_std_dev) on the derivative
+        instead of one laser pulse at a time. All pulses are extracted with a single gather.
+
+        The edge positions are cached and reused for subsequent sweeps as long as the sequence,
+        the trace length and the parameters do not change. The edges are searched again if the
+        accumulated counts drop (new measurement) or doubled since the last search (better
+        statistics).
+
+        @param numpy.ndarray count_data: The raw timetrace data (1D) from an ungated fast counter
+        @param float conv_std_dev: The standard deviation of the gaussian used for smoothing
+
+        @return dict: The extracted laser pulses of the timetrace (2D array, dim 0: laser number,
+                      dim 1: time bin) as well as the indices for rising and falling flanks.
+        """
+        # Create return dictionary
+        return_dict = {'laser_counts_arr': np.empty(0, dtype='int64'),
+                       'laser_indices_rising': np.empty(0, dtype='int64'),
+                       'laser_indices_falling': np.empty(0, dtype='int64')}
+
+        number_of_lasers = self.measurement_settings.get('number_of_lasers')
+        if not isinstance(number_of_lasers, int) or count_data.size == 0:
+            return return_dict
+
+        total_counts = float(np.sum(count_data))
+        cache_key = self._get_edge_cache_key(count_data, number_of_lasers, conv_std_dev)
+        if (self._edge_cache is not None and self._edge_cache[0] == cache_key
+                and self._edge_cache[1] <= total_counts < 2 * self._edge_cache[1]):
+            rising_ind, falling_ind = self._edge_cache[2], self._edge_cache[3]
+        else:
+            edges = self._find_laser_edges(count_data, number_of_lasers, conv_std_dev)
+            if edges is None:
+                self._edge_cache = None
+                return_dict['laser_counts_arr'] = np.zeros((number_of_lasers, 10), dtype='int64')
+                return return_dict
+            rising_ind, falling_ind = edges
+            self._edge_cache = (cache_key, total_counts, rising_ind, falling_ind)
+
+        # find the maximum laser length to use as size for the laser array
+        laser_length = max(int(np.max(falling_ind - rising_ind)), 1)
+
+        # gather all laser pulses at once. Bins beyond the end of the trace are set to zero.
+        gather_ind = rising_ind[:, np.newaxis] + np.arange(laser_length)
+        laser_arr = np.take(count_data, gather_ind, mode='clip').astype('int64', copy=False)
+        laser_arr[gather_ind >= count_data.size] = 0
+
+        return_dict['laser_counts_arr'] = laser_arr
+        return_dict['laser_indices_rising'] = rising_ind.copy()
+        return_dict['laser_indices_falling'] = falling_ind.copy()
+        return return_dict
+
+    def _get_edge_cache_key(self, count_data, number_of_lasers, conv_std_dev):
+        """ Everything the laser edge positions of ungated_conv_deriv_batched depend on. """
+        rising_bins = self.sampling_information.get('laser_rising_bins')
+        if rising_bins is not None:
+            rising_bins = np.asarray(rising_bins).tobytes()
+        return (count_data.size,
+                number_of_lasers,
+                conv_std_dev,
+                self.fast_counter_settings.get('bin_width'),
+                self.sampling_information.get('number_of_samples'),
+                rising_bins)
+
+    @staticmethod
+    def _find_laser_edges(count_data, number_of_lasers, conv_std_dev):
+        """
+        Find the rising and falling edges of all laser pulses in an ungated timetrace in one
+        vectorized pass.
+
+        @param numpy.ndarray count_data: The raw timetrace data (1D)
+        @param int number_of_lasers: number of laser pulses to find
+        @param float conv_std_dev: The standard deviation of the gaussian used for smoothing
+
+        @return tuple: sorted rising and falling edge indices (numpy.ndarray each) or None if the
+                       edge detection failed
+        """
+        trace = count_data.astype(float)
+        try:
+            conv_deriv = np.gradient(ndimage.gaussian_filter1d(trace, conv_std_dev))
+            # reference derivative with a small and fixed filter width to refine the edge positions
+            conv_deriv_ref = np.gradient(ndimage.gaussian_filter1d(trace, 10))
+        except (ValueError, RuntimeError):
+            return None
+        if not np.any(conv_deriv):
+            return None
+
+        min_distance = max(int(2 * conv_std_dev), 1)
+        refine_offsets = np.arange(-int(conv_std_dev), max(int(conv_std_dev), 1))
+
+        edges = list()
+        for deriv, deriv_ref in ((conv_deriv, conv_deriv_ref), (-conv_deriv, -conv_deriv_ref)):
+            # all local maxima separated by at least min_distance, keep the highest ones
+            peaks, properties = find_peaks(deriv, height=0, distance=min_distance)
+            if peaks.size < number_of_lasers:
+                return None
+            peaks = peaks[np.argsort(properties['peak_heights'])[::-1][:number_of_lasers]]
+            # refine all edge positions at once within +-conv_std_dev on the reference derivative
+            window_ind = np.clip(peaks[:, np.newaxis] + refine_offsets, 0, deriv_ref.size - 1)
+            refined = window_ind[np.arange(peaks.size), np.argmax(deriv_ref[window_ind], axis=1)]
+            edges.append(np.sort(refined).astype('int64'))
+        return edges[0], edges[1]
+
     def ungated_threshold(self, count_data, count_threshold=10, min_laser_length=200e-9,
                           threshold_tolerance=20e-9):
         """
@@ -23,6 +23,7 @@ import os
 import sys
 import inspect
 import importlib
+from functools import partial
 
 from core.util.modules import get_main_dir
 from core.util.helpers import natural_sort
@@ -211,18 +212,32 @@ class PulseExtractor(PulseExtractorBase):
                                          containing the timetrace to extract laser pulses from.
         @return dict: result dictionary of the extraction method
         """
-        if count_data.ndim > 1 and not self.is_gated:
-            self.log.error('"is_gated" flag is set to False but the count data to extract laser '
-                           'pulses from is in the format of a gated timetrace (2D numpy array).')
-        elif count_data.ndim == 1 and self.is_gated:
-            self.log.error('"is_gated" flag is set to True but the count data to extract laser '
-                           'pulses from is in the format of an ungated timetrace (1D numpy array).')
+        return self.get_extraction_function()(count_data)
 
-        if self.is_gated:
+    def get_extraction_function(self):
+        """
+        Returns the currently selected extraction method with the current keyword arguments bound
+        to it. Later changes of the extraction settings do not affect the returned function, so
+        that it can be called outside of the threadlock of the measurement logic.
+
+        @return functools.partial: function(count_data) returning the result dictionary of the
+                                   extraction method
+        """
+        is_gated = self.is_gated
+        if is_gated:
             extraction_method = self._gated_extraction_methods[self._current_extraction_method]
         else:
             extraction_method = self._ungated_extraction_methods[self._current_extraction_method]
         kwargs = self._get_extraction_method_kwargs(extraction_method)
+        return partial(self._call_extraction_method, extraction_method, kwargs, is_gated)
+
+    def _call_extraction_method(self, extraction_method, kwargs, is_gated, count_data):
+        if count_data.ndim > 1 and not is_gated:
+            self.log.error('"is_gated" flag is set to False but the count data to extract laser '
+                           'pulses from is in the format of a gated timetrace (2D numpy array).')
+        elif count_data.ndim == 1 and is_gated:
+            self.log.error('"is_gated" flag is set to True but the count data to extract laser '
+                           'pulses from is in the format of an ungated timetrace (1D numpy array).')
         return extraction_method(count_data=count_data, **kwargs)
 
     def _get_extraction_method_kwargs(self, method):
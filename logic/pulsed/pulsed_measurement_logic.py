@@ -39,6 +39,32 @@ from logic.pulsed.pulse_extractor import PulseExtractor
 from logic.pulsed.pulse_analyzer import PulseAnalyzer
 
 
+class PulsedAnalysisWorkerSignals(QtCore.QObject):
+    """ Defines the signals available from a running pulsed analysis worker thread. """
+    sigFinished = QtCore.Signal(object)
+
+
+class PulsedAnalysisWorker(QtCore.QRunnable):
+    """ Worker thread pulling the raw data from the fast counter and running the pulse extraction and analysis on it,
+    so that the logic thread (and the GUI waiting for it) is not blocked by long time traces.
+
+    The result dictionary (or None if the analysis failed) is sent with sigFinished.
+    """
+    def __init__(self, analysis_function, generation):
+        super(PulsedAnalysisWorker, self).__init__()
+        self.signals = PulsedAnalysisWorkerSignals()
+        self.analysis_function = analysis_function
+        self.generation = generation
+
+    @QtCore.Slot()
+    def run(self):
+        """ """
+        result = self.analysis_function()
+        if result is not None:
+            result['generation'] = self.generation
+        self.signals.sigFinished.emit(result)
+
+
 class PulsedMeasurementLogic(GenericLogic):
     """
     This is the Logic class for the control of pulsed measurements.
@@ -129,6 +155,14 @@ class PulsedMeasurementLogic(GenericLogic):
 
         # threading
         self._threadlock = Mutex()
+        # the analysis runs on a single worker thread. A timer tick is skipped while the previous analysis is running.
+        self._analysis_threadpool = QtCore.QThreadPool()
+        self._analysis_threadpool.setMaxThreadCount(1)
+        self._analysis_running = False
+        self._analysis_generation = 0  # results of older generations are discarded
+        self._settings_version = 0  # incremented on changes of the extraction and analysis settings
+        self._analyzed_version = None  # settings version and raw data used for the last analysis
+        self._analyzed_raw_data = None
 
         # measurement data
         self.signal_data = np.empty((2, 0), dtype=float)
@@ -217,6 +251,7 @@ class PulsedMeasurementLogic(GenericLogic):
         """
         if self.module_state() == 'locked':
             self.stop_pulsed_measurement()
+        self._analysis_threadpool.waitForDone()
 
         self._statusVariables['_controlled_variable'] = list(self._controlled_variable)
         if len(self.fc.fit_list) > 0:
@@ -649,6 +684,7 @@ class PulsedMeasurementLogic(GenericLogic):
         # Use threadlock to update settings during a running measurement
         with self._threadlock:
             self._pulseanalyzer.analysis_settings = settings_dict
+            self._settings_version += 1
             self.sigAnalysisSettingsUpdated.emit(self.analysis_settings)
         return
 
@@ -674,6 +710,7 @@ class PulsedMeasurementLogic(GenericLogic):
         # Use threadlock to update settings during a running measurement
         with self._threadlock:
             self._pulseextractor.extraction_settings = settings_dict
+            self._settings_version += 1
             self.sigExtractionSettingsUpdated.emit(self.extraction_settings)
         return
 
@@ -777,6 +814,8 @@ class PulsedMeasurementLogic(GenericLogic):
 
                 # initialize data arrays
                 self._initialize_data_arrays()
+                self._analysis_generation += 1
+                self._analyzed_raw_data = None
 
                 # recall stashed raw data
                 if stashed_raw_data_tag in self._saved_raw_data:
@@ -818,7 +857,7 @@ class PulsedMeasurementLogic(GenericLogic):
         """
         # Get raw data and analyze it a last time just before stopping the measurement.
         try:
-            self._pulsed_analysis_loop()
+            self._analyze_now()
         except:
             pass
 
@@ -965,7 +1004,7 @@ class PulsedMeasurementLogic(GenericLogic):
         """ Analyse and display the data
         """
         if self.module_state() == 'locked':
-            self._pulsed_analysis_loop()
+            self._analyze_now()
         return
 
     @QtCore.Slot(str)
@@ -1098,78 +1137,138 @@ class PulsedMeasurementLogic(GenericLogic):
         return
 
     def _pulsed_analysis_loop(self):
-        """ Acquires laser pulses from fast counter,
-            calculates fluorescence signal and creates plots.
+        """ Starts the worker thread acquiring the laser pulses from the fast counter and calculating the fluorescence
+            signal. The plots are updated when the worker is finished (see _publish_analysis_result).
+            Skipped if the analysis of the previous timer tick is still running.
         """
-        with self._threadlock:
-            if self.module_state() == 'locked':
-                # Update elapsed time
+        if self._analysis_running or self.module_state() != 'locked':
+            return
+        self._analysis_running = True
+        worker = PulsedAnalysisWorker(self._analyze_raw_data, self._analysis_generation)
+        worker.signals.sigFinished.connect(self._publish_analysis_result)
+        self._analysis_threadpool.start(worker)
+        return
 
-                self._extract_laser_pulses()
+    def _analyze_now(self):
+        """ Acquires and analyses the data in the calling thread, waiting for a running worker first.
+            The result of the running worker is discarded, since it is older.
+        """
+        self._analysis_threadpool.waitForDone()
+        self._analysis_generation += 1
+        result = self._analyze_raw_data()
+        if result is not None:
+            result['generation'] = self._analysis_generation
+        self._publish_analysis_result(result)
+        return
 
-                tmp_signal, tmp_error = self._analyze_laser_pulses()
+    def _analyze_raw_data(self):
+        """ Acquires laser pulses from fast counter and calculates fluorescence signal.
+            Called on the analysis worker thread (or in _analyze_now). The threadlock is only held to pull the raw data
+            and to take a snapshot of the settings, the extraction and analysis run without it so that settings changes
+            and the publishing of results are not blocked. Only new arrays are created, the published data arrays are
+            never modified.
 
-                # exclude laser pulses to ignore
-                if len(self._laser_ignore_list) > 0:
-                    # Convert relative negative indices into absolute positive indices
-                    while self._laser_ignore_list[0] < 0:
-                        neg_index = self._laser_ignore_list[0]
-                        self._laser_ignore_list[0] = len(tmp_signal) + neg_index
-                        self._laser_ignore_list.sort()
+        @return dict: result with keys 'raw_data', 'laser_data', 'signal_data', 'measurement_error', 'elapsed_sweeps'
+                      and 'elapsed_time'. The data keys are missing if the raw data did not change since the last
+                      analysis. None if no measurement is running or the analysis failed.
+        """
+        with self._threadlock:
+            if self.module_state() != 'locked':
+                return None
+            try:
+                fc_data, info_dict = self._get_raw_data()
+                settings_version = self._settings_version
+                extract = self._pulseextractor.get_extraction_function()
+                analyse = self._pulseanalyzer.get_analysis_function()
+                laser_ignore_list = list(self._laser_ignore_list)
+                alternating = self._alternating
+                signal_data = self.signal_data.copy()
+                measurement_error = self.measurement_error.copy()
+            except Exception:
+                self.log.exception('Pulsed analysis failed.')
+                return None
+
+        result = dict(info_dict)
+        # the extraction and analysis results do not change if neither raw data nor settings changed
+        if (self._analyzed_version == settings_version and self._analyzed_raw_data is not None
+                and np.array_equal(fc_data, self._analyzed_raw_data)):
+            return result
+        self._analyzed_version = settings_version
+        self._analyzed_raw_data = fc_data
 
-                    tmp_signal = np.delete(tmp_signal, self._laser_ignore_list)
-                    tmp_error = np.delete(tmp_error, self._laser_ignore_list)
+        try:
+            laser_data = extract(fc_data)['laser_counts_arr']
+            # analyze pulses and get data points for signal array. Also check if extraction
+            # worked (non-zero array returned).
+            if laser_data.any():
+                tmp_signal, tmp_error = analyse(laser_data=laser_data)
+            else:
+                tmp_signal = np.zeros(laser_data.shape[0])
+                tmp_error = np.zeros(laser_data.shape[0])
+
+            # exclude laser pulses to ignore (relative negative indices are converted into absolute positive indices)
+            if len(laser_ignore_list) > 0:
+                laser_ignore_list = sorted(i + len(tmp_signal) if i < 0 else i for i in laser_ignore_list)
+                tmp_signal = np.delete(tmp_signal, laser_ignore_list)
+                tmp_error = np.delete(tmp_error, laser_ignore_list)
+
+            # order data according to alternating flag
+            if alternating:
+                if len(signal_data[0]) != len(tmp_signal[::2]):
+                    self.log.error('Length of controlled variable ({0}) does not match length of number of readout '
+                                   'pulses ({1}).'.format(len(signal_data[0]), len(tmp_signal[::2])))
+                    return result
+                signal_data[1] = tmp_signal[::2]
+                signal_data[2] = tmp_signal[1::2]
+                measurement_error[1] = tmp_error[::2]
+                measurement_error[2] = tmp_error[1::2]
+            else:
+                if len(signal_data[0]) != len(tmp_signal):
+                    self.log.error('Length of controlled variable ({0}) does not match length of number of readout '
+                                   'pulses ({1}).'.format(len(signal_data[0]), len(tmp_signal)))
+                    return result
+                signal_data[1] = tmp_signal
+                measurement_error[1] = tmp_error
+        except Exception:
+            self.log.exception('Pulsed analysis failed.')
+            return None
+
+        result.update({'raw_data': fc_data,
+                       'laser_data': laser_data,
+                       'signal_data': signal_data,
+                       'measurement_error': measurement_error})
+        return result
+
+    @QtCore.Slot(object)
+    def _publish_analysis_result(self, result):
+        """ Publishes the result of an analysis in the logic thread and notifies the GUI.
+            The published arrays are made read-only, they are replaced (never modified) by the next analysis.
+
+        @param dict result: result of _analyze_raw_data
+        """
+        with self._threadlock:
+            self._analysis_running = False
+            if result is not None and result.get('generation') != self._analysis_generation:
+                return  # result of an analysis started before the measurement was restarted or stopped
+            if result is None:
+                return
 
-                # order data according to alternating flag
-                if self._alternating:
-                    if len(self.signal_data[0]) != len(tmp_signal[::2]):
-                        self.log.error('Length of controlled variable ({0}) does not match length of number of readout '
-                                       'pulses ({1}).'.format(len(self.signal_data[0]), len(tmp_signal[::2])))
-                        return
-                    self.signal_data[1] = tmp_signal[::2]
-                    self.signal_data[2] = tmp_signal[1::2]
-                    self.measurement_error[1] = tmp_error[::2]
-                    self.measurement_error[2] = tmp_error[1::2]
-                else:
-                    if len(self.signal_data[0]) != len(tmp_signal):
-                        self.log.error('Length of controlled variable ({0}) does not match length of number of readout '
-                                       'pulses ({1}).'.format(len(self.signal_data[0]), len(tmp_signal)))
-                        return
-                    self.signal_data[1] = tmp_signal
-                    self.measurement_error[1] = tmp_error
+            self.__elapsed_sweeps = result['elapsed_sweeps']
+            self.__elapsed_time = result['elapsed_time']
+            if 'signal_data' in result:
+                for key in ['raw_data', 'laser_data', 'signal_data', 'measurement_error']:
+                    result[key].flags.writeable = False
+                    setattr(self, key, result[key])
 
                 # Compute alternative data array from signal
                 self._compute_alt_data()
 
-            # emit signals
-            self.sigTimerUpdated.emit(self.__elapsed_time, self.__elapsed_sweeps,
-                                      self.__timer_interval)
-            self.sigMeasurementDataUpdated.emit()
-            return
-
-    def _extract_laser_pulses(self):
-        # Get counter raw data (including recalled raw data from previous measurement)
-        fc_data, info_dict = self._get_raw_data()
-        self.raw_data = fc_data
-        self.__elapsed_sweeps = info_dict['elapsed_sweeps']
-        self.__elapsed_time = info_dict['elapsed_time']
-
-        # extract laser pulses from raw data
-        return_dict = self._pulseextractor.extract_laser_pulses(self.raw_data)
-        self.laser_data = return_dict['laser_counts_arr']
+        # emit signals
+        self.sigTimerUpdated.emit(self.__elapsed_time, self.__elapsed_sweeps,
+                                  self.__timer_interval)
+        self.sigMeasurementDataUpdated.emit()
         return
 
-    def _analyze_laser_pulses(self):
-        # analyze pulses and get data points for signal array. Also check if extraction
-        # worked (non-zero array returned).
-        if self.laser_data.any():
-            tmp_signal, tmp_error = self._pulseanalyzer.analyse_laser_pulses(
-                self.laser_data)
-        else:
-            tmp_signal = np.zeros(self.laser_data.shape[0])
-            tmp_error = np.zeros(self.laser_data.shape[0])
-        return tmp_signal, tmp_error
-
     def _get_raw_data(self):
         """
         Get the raw count data from the fast counting hardware and perform sanity checks.
@@ -36,6 +36,12 @@ class SamplingBase:
     params = OrderedDict()
     log = logging.getLogger(__name__)
 
+    # Set to True if the samples do not depend on the time array but only on its length (e.g. DC).
+    time_invariant = False
+    # Names of the frequency parameters if the function is periodic in each of these frequencies
+    # (e.g. sums/products of sines). Used to detect identical sample chunks in a rotating frame.
+    periodic_frequency_params = tuple()
+
     def __repr__(self):
         kwargs = []
         for param, def_dict in self.params.items():
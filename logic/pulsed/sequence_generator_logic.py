@@ -20,6 +20,7 @@ Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
 top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
 """
 
+import hashlib
 import numpy as np
 import os
 import pickle
@@ -65,6 +66,9 @@ class SequenceGeneratorLogic(GenericLogic):
                                        default=os.path.join(get_home_dir(), 'saved_pulsed_assets'),
                                        missing='warn')
     _overhead_bytes = ConfigOption(name='overhead_bytes', default=0, missing='nothing')
+    # Maximum memory in bytes used to cache sampled element chunks for reuse. 0 disables the cache.
+    _sample_cache_bytes = ConfigOption(name='sample_cache_bytes', default=128 * 2**20,
+                                       missing='nothing')
     # Optional additional paths to import from
     _additional_methods_import_path = ConfigOption(name='additional_predefined_methods_path',
                                                    default=None,
@@ -138,6 +142,12 @@ class SequenceGeneratorLogic(GenericLogic):
         self._saved_pulse_blocks = OrderedDict()
         self._saved_pulse_block_ensembles = OrderedDict()
         self._saved_pulse_sequences = OrderedDict()
+
+        # LRU cache of normalized analog sample chunks and its current size in bytes
+        self._sample_chunk_cache = OrderedDict()
+        self._sample_chunk_cache_size = 0
+        # Sampling results by waveform name tag, used to skip re-sampling of unchanged ensembles
+        self._sampled_ensemble_cache = dict()
         return
 
     def on_activate(self):
@@ -204,6 +214,9 @@ class SequenceGeneratorLogic(GenericLogic):
     def on_deactivate(self):
         """ Deinitialisation performed during deactivation of the module.
         """
+        self._sample_chunk_cache = OrderedDict()
+        self._sample_chunk_cache_size = 0
+        self._sampled_ensemble_cache = dict()
         return
 
     # @_saved_pulse_blocks.constructor
@@ -1650,6 +1663,10 @@ class SequenceGeneratorLogic(GenericLogic):
         Therefore it iterates through all blocks, repetitions and elements of the ensemble and
         calculates the exact voltages (float64) according to the specified math_function. The
         samples are later on stored inside a float32 array.
+        Consecutive elements with identical functions are sampled in one go (rotating frame only)
+        and identical sample chunks are reused from a cache (see _get_analog_samples). If the
+        ensemble and the pulse generator settings did not change since the last call, the
+        waveforms already present on the device are used without sampling.
         So each element is calculated with high precision (float64) and then down-converted to
         float32 to be stored.
 
@@ -1690,6 +1707,27 @@ class SequenceGeneratorLogic(GenericLogic):
         # Set the waveform name (excluding the device specific channel naming suffix, i.e. '_ch1')
         waveform_name = name_tag if name_tag else ensemble.name
 
+        # Skip sampling if the very same ensemble has already been sampled with the current pulse
+        # generator settings and the waveforms are still present on the device.
+        ensemble_key = self._get_ensemble_sampling_key(ensemble, offset_bin)
+        cached_result = self._sampled_ensemble_cache.get(waveform_name)
+        if cached_result is not None and cached_result[0] == ensemble_key:
+            if set(cached_result[2]).issubset(self.sampled_waveforms):
+                self.log.debug('PulseBlockEnsemble "{0}" unchanged. Using previously sampled '
+                               'waveforms.'.format(ensemble.name))
+                if waveform_name == ensemble.name and not ensemble.sampling_information:
+                    ensemble.sampling_information = dict()
+                    ensemble.sampling_information.update(cached_result[3])
+                    ensemble.sampling_information[
+                        'pulse_generator_settings'] = self.pulse_generator_settings
+                    ensemble.sampling_information['waveforms'] = list(cached_result[2])
+                    self.save_ensemble(ensemble)
+                if not self.__sequence_generation_in_progress:
+                    self.module_state.unlock()
+                self.sigAvailableWaveformsUpdated.emit(self.sampled_waveforms)
+                self.sigSampleEnsembleComplete.emit(ensemble)
+                return cached_result[1], list(cached_result[2]), copy.deepcopy(cached_result[3])
+
         # check for old waveforms associated with the ensemble and delete them from pulse generator.
         self._delete_waveform_by_nametag(waveform_name)
 
@@ -1775,101 +1813,80 @@ class SequenceGeneratorLogic(GenericLogic):
         processed_samples = 0
         # Index to keep track of the samples written into the preallocated samples array
         array_write_index = 0
-        # Keep track of the number of elements already written
-        element_count = 0
         # set of written waveform names on the device
         written_waveforms = set()
-        # Iterate over all blocks within the PulseBlockEnsemble object
-        for block_name, reps in ensemble.block_list:
-            block = self.get_block(block_name)
-            # Iterate over all repetitions of the current block
-            for rep_no in range(reps + 1):
-                # Iterate over the PulseBlockElement instances inside the current block
-                for element in block.element_list:
-                    digital_high = element.digital_high
-                    pulse_function = element.pulse_function
-                    element_length_bins = ensemble_info['elements_length_bins'][element_count]
-
-                    # Indicator on how many samples of this element have been written already
-                    element_samples_written = 0
-
-                    while element_samples_written != element_length_bins:
-                        samples_to_add = min(array_length - array_write_index,
-                                             element_length_bins - element_samples_written)
-                        # create floating point time array for the current element inside rotating
-                        # frame if analog samples are to be calculated.
-                        if pulse_function:
-                            time_arr = (offset_bin + np.arange(
-                                samples_to_add, dtype='float64')) / self.__sample_rate
-
-                        # Calculate respective part of the sample arrays
-                        for chnl in digital_high:
-                            digital_samples[chnl][array_write_index:array_write_index + samples_to_add] = digital_high[
-                                chnl]
-                        for chnl in pulse_function:
-                            analog_samples[chnl][array_write_index:array_write_index + samples_to_add] = pulse_function[
-                                                                                                             chnl].get_samples(
-                                time_arr) / (self.__analog_levels[0][chnl] / 2)
-
-                        # Free memory
-                        if pulse_function:
-                            del time_arr
-
-                        element_samples_written += samples_to_add
-                        array_write_index += samples_to_add
-                        processed_samples += samples_to_add
-                        # if the rotating frame should be preserved (default) increment the offset
-                        # counter for the time array.
-                        if ensemble.rotating_frame:
-                            offset_bin += samples_to_add
-
-                        # Check if the temporary sample array is full and write to the device if so.
-                        if array_write_index == array_length:
-                            # Set first/last chunk flags
-                            is_first_chunk = array_write_index == processed_samples
-                            is_last_chunk = processed_samples == ensemble_info['number_of_samples']
-                            written_samples, wfm_list = self.pulsegenerator().write_waveform(
-                                name=waveform_name,
-                                analog_samples=analog_samples,
-                                digital_samples=digital_samples,
-                                is_first_chunk=is_first_chunk,
-                                is_last_chunk=is_last_chunk,
-                                total_number_of_samples=ensemble_info['number_of_samples'])
-
-                            # Update written waveforms set
-                            written_waveforms.update(wfm_list)
-
-                            # check if write process was successful
-                            if written_samples != array_length:
-                                self.log.error('Sampling of block "{0}" in ensemble "{1}" failed. '
-                                               'Write to device was unsuccessful.\nThe number of '
-                                               'actually written samples ({2:d}) does not match '
-                                               'the number of samples staged to write ({3:d}).'
-                                               ''.format(block_name, ensemble.name, written_samples,
-                                                         array_length))
-                                if not self.__sequence_generation_in_progress:
-                                    self.module_state.unlock()
-                                self.sigAvailableWaveformsUpdated.emit(self.sampled_waveforms)
-                                self.sigSampleEnsembleComplete.emit(None)
-                                return -1, list(), dict()
-
-                            # Reset array write start pointer
-                            array_write_index = 0
-
-                            # check if the temporary write array needs to be truncated for the next
-                            # part. (because it is the last part of the ensemble to write which can
-                            # be shorter than the previous chunks)
-                            if array_length > ensemble_info['number_of_samples'] - processed_samples:
-                                array_length = ensemble_info['number_of_samples'] - processed_samples
-                                analog_samples = dict()
-                                digital_samples = dict()
-                                for chnl in ensemble_info['analog_channels']:
-                                    analog_samples[chnl] = np.empty(array_length, dtype='float32')
-                                for chnl in ensemble_info['digital_channels']:
-                                    digital_samples[chnl] = np.empty(array_length, dtype=bool)
-
-                    # Increment element index
-                    element_count += 1
+        # Iterate over all runs of elements. Consecutive elements with identical sampling functions
+        # are merged into a single run if the rotating frame is preserved, so they can be sampled
+        # with a single call.
+        for block_name, pulse_function, digital_high, run_length_bins in self._get_element_runs(
+                ensemble, ensemble_info['elements_length_bins']):
+            # Indicator on how many samples of this run have been written already
+            run_samples_written = 0
+
+            while run_samples_written != run_length_bins:
+                samples_to_add = min(array_length - array_write_index,
+                                     run_length_bins - run_samples_written)
+                write_slice = slice(array_write_index, array_write_index + samples_to_add)
+
+                # Calculate respective part of the sample arrays
+                for chnl in digital_high:
+                    digital_samples[chnl][write_slice] = digital_high[chnl]
+                for chnl in pulse_function:
+                    analog_samples[chnl][write_slice] = self._get_analog_samples(
+                        chnl, pulse_function[chnl], offset_bin, samples_to_add)
+
+                run_samples_written += samples_to_add
+                array_write_index += samples_to_add
+                processed_samples += samples_to_add
+                # if the rotating frame should be preserved (default) increment the offset
+                # counter for the time array.
+                if ensemble.rotating_frame:
+                    offset_bin += samples_to_add
+
+                # Check if the temporary sample array is full and write to the device if so.
+                if array_write_index == array_length:
+                    # Set first/last chunk flags
+                    is_first_chunk = array_write_index == processed_samples
+                    is_last_chunk = processed_samples == ensemble_info['number_of_samples']
+                    written_samples, wfm_list = self.pulsegenerator().write_waveform(
+                        name=waveform_name,
+                        analog_samples=analog_samples,
+                        digital_samples=digital_samples,
+                        is_first_chunk=is_first_chunk,
+                        is_last_chunk=is_last_chunk,
+                        total_number_of_samples=ensemble_info['number_of_samples'])
+
+                    # Update written waveforms set
+                    written_waveforms.update(wfm_list)
+
+                    # check if write process was successful
+                    if written_samples != array_length:
+                        self.log.error('Sampling of block "{0}" in ensemble "{1}" failed. '
+                                       'Write to device was unsuccessful.\nThe number of '
+                                       'actually written samples ({2:d}) does not match '
+                                       'the number of samples staged to write ({3:d}).'
+                                       ''.format(block_name, ensemble.name, written_samples,
+                                                 array_length))
+                        if not self.__sequence_generation_in_progress:
+                            self.module_state.unlock()
+                        self.sigAvailableWaveformsUpdated.emit(self.sampled_waveforms)
+                        self.sigSampleEnsembleComplete.emit(None)
+                        return -1, list(), dict()
+
+                    # Reset array write start pointer
+                    array_write_index = 0
+
+                    # check if the temporary write array needs to be truncated for the next
+                    # part. (because it is the last part of the ensemble to write which can
+                    # be shorter than the previous chunks)
+                    if array_length > ensemble_info['number_of_samples'] - processed_samples:
+                        array_length = ensemble_info['number_of_samples'] - processed_samples
+                        analog_samples = dict()
+                        digital_samples = dict()
+                        for chnl in ensemble_info['analog_channels']:
+                            analog_samples[chnl] = np.empty(array_length, dtype='float32')
+                        for chnl in ensemble_info['digital_channels']:
+                            digital_samples[chnl] = np.empty(array_length, dtype=bool)
 
         # Save sampling related parameters to the sampling_information container within the
         # PulseBlockEnsemble.
@@ -1887,12 +1904,131 @@ class SequenceGeneratorLogic(GenericLogic):
         if ensemble_info['number_of_samples'] == 0:
             self.log.warning('Empty waveform (0 samples) created from PulseBlockEnsemble "{0}".'
                              ''.format(ensemble.name))
+        # Remember the result to skip sampling of the same ensemble with the same settings
+        self._sampled_ensemble_cache[waveform_name] = (
+            self._get_ensemble_sampling_key(ensemble, ensemble_key[1]),
+            offset_bin,
+            tuple(natural_sort(written_waveforms)),
+            copy.deepcopy(ensemble_info))
         if not self.__sequence_generation_in_progress:
             self.module_state.unlock()
         self.sigAvailableWaveformsUpdated.emit(self.sampled_waveforms)
         self.sigSampleEnsembleComplete.emit(ensemble)
         return offset_bin, natural_sort(written_waveforms), ensemble_info
 
+    def _get_element_runs(self, ensemble, elements_length_bins):
+        """
+        Generator over the elements of an ensemble (including block repetitions) in playback order.
+        If the rotating frame is preserved, consecutive elements with identical sampling functions
+        and digital states are merged into a single run since their samples are continuous in time.
+
+        @param PulseBlockEnsemble ensemble: the ensemble to iterate over
+        @param list elements_length_bins: length in bins of each element (from analyze_block_ensemble)
+
+        @return tuple: (block_name, pulse_function, digital_high, run_length_bins) for each run
+        """
+        run = None
+        element_count = 0
+        for block_name, reps in ensemble.block_list:
+            block = self.get_block(block_name)
+            for rep_no in range(reps + 1):
+                for element in block.element_list:
+                    length_bins = elements_length_bins[element_count]
+                    element_count += 1
+                    if (run is not None and ensemble.rotating_frame
+                            and dict(element.digital_high) == dict(run[2])
+                            and self._equal_pulse_functions(element.pulse_function, run[1])):
+                        run[3] += length_bins
+                        continue
+                    if run is not None:
+                        yield tuple(run)
+                    run = [block_name, element.pulse_function, element.digital_high, length_bins]
+        if run is not None:
+            yield tuple(run)
+
+    @staticmethod
+    def _equal_pulse_functions(first, second):
+        if first is second:
+            return True
+        if set(first) != set(second):
+            return False
+        return all(repr(func) == repr(second[chnl]) for chnl, func in first.items())
+
+    def _get_analog_samples(self, channel, sampling_function, offset_bin, number_of_samples):
+        """
+        Sample a sampling function for a chunk of an element, normalized to the analog channel
+        amplitude. Identical chunks (same function, length and effective time offset) are taken
+        from a memory-bounded LRU cache instead of being sampled again.
+
+        @param str channel: the analog channel descriptor
+        @param SamplingBase sampling_function: the function to sample
+        @param int offset_bin: time offset of the first sample in bins
+        @param int number_of_samples: the number of samples to create
+
+        @return numpy.ndarray: normalized samples (float32)
+        """
+        half_amplitude = self.__analog_levels[0][channel] / 2
+        cache_enabled = 0 < 4 * number_of_samples <= self._sample_cache_bytes // 4
+        if cache_enabled:
+            key = (repr(sampling_function),
+                   number_of_samples,
+                   self._get_sampling_time_key(sampling_function, offset_bin),
+                   self.__sample_rate,
+                   half_amplitude)
+            samples = self._sample_chunk_cache.get(key)
+            if samples is not None:
+                self._sample_chunk_cache.move_to_end(key)
+                return samples
+
+        time_arr = (offset_bin + np.arange(number_of_samples, dtype='float64')) / self.__sample_rate
+        samples = (sampling_function.get_samples(time_arr) / half_amplitude).astype('float32')
+        del time_arr
+
+        if cache_enabled:
+            samples.flags.writeable = False
+            self._sample_chunk_cache[key] = samples
+            self._sample_chunk_cache_size += samples.nbytes
+            while self._sample_chunk_cache_size > self._sample_cache_bytes:
+                _, old_samples = self._sample_chunk_cache.popitem(last=False)
+                self._sample_chunk_cache_size -= old_samples.nbytes
+        return samples
+
+    def _get_sampling_time_key(self, sampling_function, offset_bin):
+        """
+        Get a hashable representation of the time offset that matters for the samples of a function.
+        Time invariant functions do not depend on the offset at all. For periodic functions only the
+        phases of all frequencies at the offset matter, so aligned periods produce the same key.
+
+        @param SamplingBase sampling_function: the function to sample
+        @param int offset_bin: time offset of the first sample in bins
+
+        @return: hashable time key
+        """
+        if getattr(sampling_function, 'time_invariant', False):
+            return None
+        freq_params = getattr(sampling_function, 'periodic_frequency_params', tuple())
+        if not freq_params:
+            return offset_bin
+        time_offset = offset_bin / self.__sample_rate
+        return tuple(round((getattr(sampling_function, param) * time_offset) % 1, 9) % 1
+                     for param in freq_params)
+
+    def _get_ensemble_sampling_key(self, ensemble, offset_bin):
+        """
+        Hash of everything the samples of an ensemble depend on: the ensemble content (including
+        all blocks), the time offset and the pulse generator settings.
+
+        @return tuple: (hex digest, offset_bin)
+        """
+        blocks = [(repr(self.get_block(block_name)), reps) for block_name, reps in
+                  ensemble.block_list]
+        settings = self.pulse_generator_settings
+        settings['flags'] = sorted(settings['flags'])
+        settings['activation_config'] = (settings['activation_config'][0],
+                                         sorted(settings['activation_config'][1]))
+        hash_str = repr((ensemble.rotating_frame, blocks, offset_bin, sorted(settings.items())))
+        return hashlib.sha1(hash_str.encode('utf-8')).hexdigest(), offset_bin
+
     @QtCore.Slot(str)
     def sample_pulse_sequence(self, sequence):
         """ Samples the PulseSequence object, which serves as the construction plan.
@@ -2045,6 +2181,10 @@ class SequenceGeneratorLogic(GenericLogic):
         for wfm in names:
             if wfm in current_waveforms:
                 self.pulsegenerator().delete_waveform(wfm)
+        # forget the sampling results the deleted waveforms belong to
+        for name_tag, cached_result in tuple(self._sampled_ensemble_cache.items()):
+            if any(wfm in cached_result[2] for wfm in names):
+                del self._sampled_ensemble_cache[name_tag]
         self.sigAvailableWaveformsUpdated.emit(self.sampled_waveforms)
         return
 
@@ -45,6 +45,7 @@ from itertools import product
 from math import ceil
 
 from core.connector import Connector
+from core.configoption import ConfigOption
 from core.statusvariable import StatusVar
 from datetime import datetime
 from logic.generic_logic import GenericLogic
@@ -52,31 +53,6 @@ from qtpy import QtCore
 from core.util.mutex import Mutex
 
 
-# ======================================================================================================================
-# Worker class for continuous stage position tracking mode
-# ======================================================================================================================
-
-class WorkerSignals(QtCore.QObject):
-    """ Defines the signals available from a running worker thread """
-    sigFinished = QtCore.Signal()
-
-
-class Worker(QtCore.QRunnable):
-    """ Worker thread to monitor the stage position every x seconds when tracking mode is on
-
-    The worker handles only the waiting time, and emits a signal that serves to trigger the update stage position """
-
-    def __init__(self, *args, **kwargs):
-        super(Worker, self).__init__(*args, **kwargs)
-        self.signals = WorkerSignals()
-
-    @QtCore.Slot()
-    def run(self):
-        """ """
-        sleep(1)  # 1 second as time constant
-        self.signals.sigFinished.emit()
-
-
 # ======================================================================================================================
 # Classes representing the ROIlist and the ROI
 # ======================================================================================================================
@@ -434,11 +410,18 @@ class RoiLogic(GenericLogic):
 
     roi_logic:
         module.Class: 'roi_logic.RoiLogic'
+        tracking_interval: 1  # optional, in s
         connect:
             stage: 'motor_dummy_roi'
+
+    With a stage polling its telemetry in the background (e.g. ASI MS2000 with telemetry_rate), reading the stage
+    position is free, so the tracking interval can be reduced down to the polling period.
     """
     # declare connectors
     stage = Connector(interface='MotorInterface')
+
+    # config options
+    _tracking_interval = ConfigOption('tracking_interval', 1)
     
     # status vars
     _roi_list = StatusVar(default=dict())  # Notice constructor and representer further below
@@ -470,8 +453,8 @@ class RoiLogic(GenericLogic):
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
-        self.threadpool = QtCore.QThreadPool()
         self._stage = None
+        self._tracking_job = None
 
         # not needed in this version but remember to use it when starting to handle threads
         # self._threadlock = Mutex()
@@ -480,6 +463,9 @@ class RoiLogic(GenericLogic):
         """ Initialisation performed during activation of the module.
         """
         self._stage = self.stage()
+        # periodic job updating the stage position on the GUI in tracking mode
+        self._tracking_job = self.getScheduler().add_job('{0}.stage_tracking'.format(self._name), self.tracking_loop,
+                                                         self._tracking_interval, owner=self, tags=('gui',))
 
         # Initialise the ROI camera image (xy image) if not present
         # if self._roi_list.cam_image is None:
@@ -494,7 +480,7 @@ class RoiLogic(GenericLogic):
 
     def on_deactivate(self):
         """ Perform required deactivation steps. """
-        pass
+        self.getScheduler().remove_job(self._tracking_job.name)
 
 # ----------------------------------------------------------------------------------------------------------------------
 # Getter and setter methods
@@ -1001,28 +987,22 @@ class RoiLogic(GenericLogic):
     def start_tracking(self):
         """ Start the tracking loop of the stage position. """
         self.tracking = True
-        # monitor the current stage position, using a worker thread
-        worker = Worker()
-        worker.signals.sigFinished.connect(self.tracking_loop)
-        self.threadpool.start(worker)
+        # monitor the current stage position, using a periodic job of the scheduler
+        self._tracking_job.start()
 
     def stop_tracking(self):
         """ Stop the tracking loop of the stage position. """
         self.tracking = False
+        self._tracking_job.stop()
         # get once again the latest position
         position = self.stage_position
         self.sigUpdateStagePosition.emit(position)
         self.sigTrackingModeStopped.emit()
 
     def tracking_loop(self):
-        """ Perform a step in the tracking loop and start a new one if tracking mode is still on. """
+        """ Perform a step in the tracking loop (called periodically by the scheduler while tracking mode is on). """
         position = self.stage_position
         self.sigUpdateStagePosition.emit(position)
-        if self.tracking:
-            # enter in a loop until tracking mode is switched off
-            worker = Worker()
-            worker.signals.sigFinished.connect(self.tracking_loop)
-            self.threadpool.start(worker)
 
 # ----------------------------------------------------------------------------------------------------------------------
 # Methods interacting with hardware
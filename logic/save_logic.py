@@ -21,23 +21,125 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 from cycler import cycler
 import datetime
-import inspect
 import logging
+import matplotlib
 import matplotlib.pyplot as plt
+import multiprocessing
 import numpy as np
 import os
 import sys
 import time
 
 from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
 from core.configoption import ConfigOption
 from core.util import units
 from core.util.mutex import Mutex
 from core.util.network import netobtain
+from functools import partial
 from logic.generic_logic import GenericLogic
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.backends.backend_pdf import PdfPages
-from PIL import Image
-from PIL import PngImagePlugin
+
+# h5py is only needed for the binary 'hdf5' filetype. Saving falls back to npz if it is missing.
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+def _init_figure_worker():
+    """ Initializer of the figure rendering process. Use a non-interactive backend since the
+    worker process has no Qt event loop.
+    """
+    matplotlib.use('Agg')
+
+
+def render_figure(plotfig, fig_base_path, metadata, save_pdf=False, save_png=True):
+    """ Render a matplotlib figure to PDF and/or PNG files including metadata.
+
+    The figure is neither shown nor closed here, so this function does not touch pyplot.
+
+    @param matplotlib.figure.Figure plotfig: figure to render
+    @param str fig_base_path: full path of the figure files without the '_fig.<ext>' suffix
+    @param dict metadata: metadata to attach to the figure files
+    @param bool save_pdf: save the figure as PDF
+    @param bool save_png: save the figure as PNG
+
+    @return list: paths of the created figure files
+    """
+    created_files = list()
+    if save_pdf:
+        fig_fname_vector = fig_base_path + '_fig.pdf'
+        # The with statement makes sure that the PdfPages object is closed properly at the end of
+        # the block, even if an Exception occurs.
+        with PdfPages(fig_fname_vector) as pdf:
+            pdf.savefig(plotfig, bbox_inches='tight', pad_inches=0.05)
+            pdf_metadata = pdf.infodict()
+            for x in metadata:
+                pdf_metadata[x] = metadata[x]
+        created_files.append(fig_fname_vector)
+
+    if save_png:
+        # PNG text chunks can only hold strings, so convert the dates and all other values.
+        png_metadata = dict()
+        for x in metadata:
+            if isinstance(metadata[x], datetime.datetime):
+                png_metadata[x] = metadata[x].strftime('%Y%m%d-%H%M-%S')
+            else:
+                png_metadata[x] = str(metadata[x])
+        # matplotlib writes the metadata directly into the PNG, no need to re-open the image
+        fig_fname_image = fig_base_path + '_fig.png'
+        plotfig.savefig(fig_fname_image, bbox_inches='tight', pad_inches=0.05,
+                        metadata=png_metadata)
+        created_files.append(fig_fname_image)
+
+    return created_files
+
+
+def figure_metadata(module_name, timestamp):
+    """ Metadata attached to the figure files.
+
+    @param str module_name: name of the module that produced the figure
+    @param datetime.datetime timestamp: creation date of the figure
+
+    @return dict: metadata
+    """
+    metadata = dict()
+    metadata['Title'] = 'Image produced by qudi: ' + module_name
+    metadata['Author'] = 'qudi - Software Suite'
+    metadata['Subject'] = 'Find more information on: https://github.com/Ulm-IQO/qudi'
+    metadata['Keywords'] = 'Python 3, Qt, experiment control, automation, measurement, software, framework, modular'
+    metadata['Producer'] = 'qudi - Software Suite'
+    metadata['CreationDate'] = timestamp
+    metadata['ModDate'] = timestamp
+    return metadata
+
+
+def draw_and_render_figure(plot_function, plot_data, plot_parameters, style, fig_base_path,
+                           metadata, save_pdf=False, save_png=True):
+    """ Draw a figure with plot_function(plot_data, **plot_parameters) and render it to PDF and/or
+    PNG files.
+
+    This function is kept at module level so it can be executed in the figure rendering process.
+    Only the plot function (by reference), the data and the plot parameters are sent there, no
+    figure. The plot function has to be defined at module level and has to return a
+    matplotlib.figure.Figure that is not managed by pyplot.
+
+    @param callable plot_function: function drawing the figure
+    @param plot_data: data passed as first argument to plot_function
+    @param dict plot_parameters: keyword arguments of plot_function
+    @param dict style: matplotlib rc parameters used to draw and render the figure
+    @param str fig_base_path: full path of the figure files without the '_fig.<ext>' suffix
+    @param dict metadata: metadata to attach to the figure files
+    @param bool save_pdf: save the figure as PDF
+    @param bool save_png: save the figure as PNG
+
+    @return list: paths of the created figure files
+    """
+    with matplotlib.rc_context(style):
+        plotfig = plot_function(plot_data, **(plot_parameters or {}))
+        return render_figure(plotfig, fig_base_path, metadata, save_pdf, save_png)
 
 
 class DailyLogHandler(logging.FileHandler):
@@ -129,6 +231,8 @@ class SaveLogic(GenericLogic):
         log_into_daily_directory: True
         save_pdf: True
         save_png: True
+        save_worker_threads: 1  # number of threads used by save_data_async. 1 keeps the save order.
+        render_figures_in_process: False  # draw and render the plot_function figures in a subprocess
     """
 
     _win_data_dir = ConfigOption('win_data_directory', 'C:/Data/')
@@ -136,6 +240,8 @@ class SaveLogic(GenericLogic):
     log_into_daily_directory = ConfigOption('log_into_daily_directory', False, missing='warn')
     save_pdf = ConfigOption('save_pdf', False)
     save_png = ConfigOption('save_png', True)
+    _save_worker_threads = ConfigOption('save_worker_threads', 1)
+    _render_figures_in_process = ConfigOption('render_figures_in_process', False)
 
     # Matplotlib style definition for saving plots
     mpl_qd_style = {
@@ -202,6 +308,10 @@ class SaveLogic(GenericLogic):
 
         self._daily_loghandler = None
 
+        # executors used by save_data_async, created on activation
+        self._save_executor = None
+        self._figure_executor = None
+
     def on_activate(self):
         """ Definition, configuration and initialisation of the SaveLogic.
         """
@@ -217,7 +327,25 @@ class SaveLogic(GenericLogic):
         else:
             self._daily_loghandler = None
 
+        self._save_executor = ThreadPoolExecutor(max_workers=max(1, int(self._save_worker_threads)),
+                                                 thread_name_prefix='save-logic')
+        if self._render_figures_in_process:
+            # spawn a fresh interpreter, forking the Qt application with its threads is not safe
+            self._figure_executor = ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_figure_worker)
+        else:
+            self._figure_executor = None
+
     def on_deactivate(self):
+        # finish all pending save jobs before shutting down
+        if self._save_executor is not None:
+            self._save_executor.shutdown(wait=True)
+            self._save_executor = None
+        if self._figure_executor is not None:
+            self._figure_executor.shutdown(wait=True)
+            self._figure_executor = None
+
         if self._daily_loghandler is not None:
             # removes the log handler logging into the daily directory
             logging.getLogger().removeHandler(self._daily_loghandler)
@@ -284,7 +412,9 @@ class SaveLogic(GenericLogic):
                                    filename and a timestamp, because then the timestamp will be
                                    ignored.
         @param string filetype: optional, the file format the data should be saved in. Valid inputs
-                                are 'text', 'xml' and 'npz'. Default is 'text'.
+                                are 'text', 'npz' and 'hdf5'. Default is 'text'. For 'hdf5' each
+                                data item is stored as a dataset and the parameters are stored as
+                                file attributes (falls back to 'npz' if h5py is not installed).
         @param string or list of strings fmt: optional, format specifier for saved data. See python
                                               documentation for
                                               "Format Specification Mini-Language". If you want for
@@ -329,6 +459,135 @@ class SaveLogic(GenericLogic):
         YOU ARE RESPONSIBLE FOR THE IDENTIFIER! DO NOT FORGET THE UNITS FOR THE SAVED TIME
         TRACE/MATRIX.
         """
+        module_name = self._get_caller_module_name()
+        try:
+            return self._save_data(data, module_name, filepath=filepath, parameters=parameters,
+                                   filename=filename, filelabel=filelabel, timestamp=timestamp,
+                                   filetype=filetype, fmt=fmt, delimiter=delimiter,
+                                   plotfig=plotfig)
+        finally:
+            if plotfig is not None:
+                plt.close(plotfig)
+
+    def save_data_async(self, data, filepath=None, parameters=None, filename=None, filelabel=None,
+                        timestamp=None, filetype='text', fmt='%.15e', delimiter='\t', plotfig=None,
+                        plot_function=None, plot_data=None, plot_parameters=None,
+                        saved_message=None):
+        """
+        Non-blocking version of save_data. Takes the same arguments as save_data.
+
+        The data arrays and parameters are copied in the calling thread, so the caller is free to
+        modify its buffers right after this call. Writing the files is done by the save worker
+        thread.
+
+        The thumbnail figure can be given in two ways:
+        - plotfig: a drawn figure. It is closed in pyplot and gets a non-interactive Agg canvas, so
+          the save worker thread renders it without any GUI figure manager. Do not use the figure
+          after this call.
+        - plot_function, plot_data and plot_parameters: the figure is drawn with
+          plot_function(plot_data, **plot_parameters) and rendered in the figure rendering process
+          if render_figures_in_process is configured, in the save worker thread otherwise. See
+          draw_and_render_figure. plot_data is copied like the data.
+
+        @param callable plot_function: optional, module level function returning a
+                                       matplotlib.figure.Figure
+        @param plot_data: optional, data passed as first argument to plot_function
+        @param dict plot_parameters: optional, keyword arguments of plot_function
+        @param str saved_message: optional, message logged (info level) once the files are written
+
+        @return concurrent.futures.Future: future of the save job. Its result is the return value
+                                           of save_data.
+        """
+        module_name = self._get_caller_module_name()
+        if timestamp is None:
+            timestamp = datetime.datetime.now()
+
+        # decouple everything from the caller
+        data = OrderedDict((key, np.array(netobtain(value))) for key, value in data.items())
+        if isinstance(parameters, dict):
+            parameters = OrderedDict(parameters)
+        if plotfig is not None:
+            # detach the figure from pyplot, it is a plain figure on an Agg canvas afterwards
+            plt.close(plotfig)
+            FigureCanvasAgg(plotfig)
+        if plot_function is not None:
+            plot_data = netobtain(plot_data)
+            if isinstance(plot_data, dict):
+                plot_data = {key: np.array(value) for key, value in plot_data.items()}
+            else:
+                plot_data = np.array(plot_data)
+            plot_parameters = dict(plot_parameters or {})
+
+        kwargs = {'filepath': filepath, 'parameters': parameters, 'filename': filename,
+                  'filelabel': filelabel, 'timestamp': timestamp, 'filetype': filetype, 'fmt': fmt,
+                  'delimiter': delimiter, 'plotfig': plotfig, 'plot_function': plot_function,
+                  'plot_data': plot_data, 'plot_parameters': plot_parameters}
+        if self._save_executor is None:
+            # module is not activated, save synchronously
+            future = Future()
+            future.add_done_callback(partial(self._check_save_job, saved_message=saved_message))
+            future.set_result(self._save_data(data, module_name, **kwargs))
+            return future
+
+        future = self._save_executor.submit(self._save_data, data, module_name, **kwargs)
+        future.add_done_callback(partial(self._check_save_job, saved_message=saved_message))
+        return future
+
+    def wait_for_pending_saves(self, timeout=None):
+        """
+        Block until all save jobs submitted so far by save_data_async are finished.
+
+        @param float timeout: optional, maximum time in seconds to wait
+
+        @return bool: True if all pending jobs have finished, False on timeout
+        """
+        if self._save_executor is None:
+            return True
+        # the marker job is queued behind all pending jobs
+        marker = self._save_executor.submit(lambda: None)
+        try:
+            marker.result(timeout=timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    def _check_save_job(self, future, saved_message=None):
+        """ Done callback of the save jobs. Errors would be lost silently otherwise.
+
+        @param str saved_message: optional, message logged if the job was successful
+        """
+        if future.cancelled():
+            return
+        exc = future.exception()
+        if exc is not None:
+            self.log.error('Asynchronous saving of data failed: {0!r}'.format(exc))
+        elif saved_message is not None and future.result() != -1:
+            self.log.info(saved_message)
+
+    @staticmethod
+    def _get_caller_module_name():
+        """
+        Get the name of the module which called save_data or save_data_async. Only the frame
+        object is accessed, inspect.stack() would read the source of every frame in the stack.
+
+        @return str: module name or 'UNSPECIFIED' if it can not be inferred (e.g. from console)
+        """
+        try:
+            # frame 0: this method, frame 1: save_data(_async), frame 2: the caller
+            name = sys._getframe(2).f_globals.get('__name__')
+            return name.split('.')[-1] if name else 'UNSPECIFIED'
+        except (ValueError, AttributeError):
+            return 'UNSPECIFIED'
+
+    def _save_data(self, data, module_name, filepath=None, parameters=None, filename=None,
+                   filelabel=None, timestamp=None, filetype='text', fmt='%.15e', delimiter='\t',
+                   plotfig=None, plot_function=None, plot_data=None, plot_parameters=None):
+        """
+        Worker of save_data and save_data_async. See save_data and save_data_async for a
+        description of the arguments.
+
+        @param str module_name: name of the module that requested the save
+        """
         start_time = time.time()
         # Create timestamp if none is present
         if timestamp is None:
@@ -384,18 +643,6 @@ class SaveLogic(GenericLogic):
                            'arrays only. Saving data failed!')
             return -1
 
-        # try to trace back the functioncall to the class which was calling it.
-        try:
-            frm = inspect.stack()[1]
-            # this will get the object, which called the save_data function.
-            mod = inspect.getmodule(frm[0])
-            # that will extract the name of the class.
-            module_name = mod.__name__.split('.')[-1]
-        except:
-            # Sometimes it is not possible to get the object which called the save_data function
-            # (such as when calling this from the console).
-            module_name = 'UNSPECIFIED'
-
         # determine proper file path
         if filepath is None:
             filepath = self.get_path_for_module(module_name)
@@ -425,9 +672,14 @@ class SaveLogic(GenericLogic):
         header = 'Saved Data from the class {0} on {1}.\n' \
                  ''.format(module_name, timestamp.strftime('%d.%m.%Y at %Hh%Mm%Ss'))
         header += '\nParameters:\n===========\n\n'
+        # The same information is stored as attributes by the binary (hdf5) backend
+        attributes = OrderedDict()
+        attributes['Saved from class'] = module_name
+        attributes['Time stamp'] = timestamp.isoformat()
         # Include the active POI name (if not empty) as a parameter in the header
         if self.active_poi_name != '':
             header += 'Measured at POI: {0}\n'.format(self.active_poi_name)
+            attributes['Measured at POI'] = self.active_poi_name
         # add the parameters if specified:
         if parameters is not None:
             # check whether the format for the parameters have a dict type:
@@ -439,13 +691,19 @@ class SaveLogic(GenericLogic):
                         header += '{0}: {1:.16e}\n'.format(entry, param)
                     else:
                         header += '{0}: {1}\n'.format(entry, param)
+                attributes.update(parameters)
             # make a hardcore string conversion and try to save the parameters directly:
             else:
                 self.log.error('The parameters are not passed as a dictionary! The SaveLogic will '
                                'try to save the parameters nevertheless.')
                 header += 'not specified parameters: {0}\n'.format(parameters)
+                attributes['not specified parameters'] = str(parameters)
         header += '\nData:\n=====\n'
 
+        if filetype == 'hdf5' and h5py is None:
+            self.log.warning('h5py is not installed. Saving data as npz-file instead of hdf5.')
+            filetype = 'npz'
+
         # write data to file
         # FIXME: Implement other file formats
         # write to textfile
@@ -498,8 +756,12 @@ class SaveLogic(GenericLogic):
             self.save_array_as_text(data=[], filename=filename[:-4]+'_params.dat', filepath=filepath,
                                     fmt=fmt, header=header, delimiter=delimiter, comments='#',
                                     append=False)
+        # write hdf5 file with one dataset per data item and the parameters as attributes
+        elif filetype == 'hdf5':
+            self.save_arrays_as_hdf5(data=data, filename=filename[:-4] + '.h5', filepath=filepath,
+                                     attributes=attributes)
         else:
-            self.log.error('Only saving of data as textfile and npz-file is implemented. Filetype "{0}" is not '
+            self.log.error('Only saving of data as textfile, npz-file and hdf5-file is implemented. Filetype "{0}" is not '
                            'supported yet. Saving as textfile.'.format(filetype))
             self.save_array_as_text(data=data[identifier_str], filename=filename, filepath=filepath,
                                     fmt=fmt, header=header, delimiter=delimiter, comments='#',
@@ -507,62 +769,21 @@ class SaveLogic(GenericLogic):
 
         #--------------------------------------------------------------------------------------------
         # Save thumbnail figure of plot
-        if plotfig is not None:
-            # create Metadata
-            metadata = dict()
-            metadata['Title'] = 'Image produced by qudi: ' + module_name
-            metadata['Author'] = 'qudi - Software Suite'
-            metadata['Subject'] = 'Find more information on: https://github.com/Ulm-IQO/qudi'
-            metadata['Keywords'] = 'Python 3, Qt, experiment control, automation, measurement, software, framework, modular'
-            metadata['Producer'] = 'qudi - Software Suite'
-            if timestamp is not None:
-                metadata['CreationDate'] = timestamp
-                metadata['ModDate'] = timestamp
+        if plotfig is not None or plot_function is not None:
+            metadata = figure_metadata(module_name, timestamp)
+
+            fig_base_path = os.path.join(filepath, filename)[:-4]
+            if plot_function is None:
+                render_figure(plotfig, fig_base_path, metadata, self.save_pdf, self.save_png)
+            elif self._figure_executor is not None:
+                # draw and render in the figure process. Only the data and plot parameters are sent.
+                self._figure_executor.submit(draw_and_render_figure, plot_function, plot_data,
+                                             plot_parameters, self.mpl_qd_style, fig_base_path,
+                                             metadata, self.save_pdf, self.save_png).result()
             else:
-                metadata['CreationDate'] = time
-                metadata['ModDate'] = time
-            
-            if self.save_pdf:
-                # determine the PDF-Filename
-                fig_fname_vector = os.path.join(filepath, filename)[:-4] + '_fig.pdf'
-
-                # Create the PdfPages object to which we will save the pages:
-                # The with statement makes sure that the PdfPages object is closed properly at
-                # the end of the block, even if an Exception occurs.
-                with PdfPages(fig_fname_vector) as pdf:
-                    pdf.savefig(plotfig, bbox_inches='tight', pad_inches=0.05)
-
-                    # We can also set the file's metadata via the PdfPages object:
-                    pdf_metadata = pdf.infodict()
-                    for x in metadata:
-                        pdf_metadata[x] = metadata[x]
-
-            if self.save_png:
-                # determine the PNG-Filename and save the plain PNG
-                fig_fname_image = os.path.join(filepath, filename)[:-4] + '_fig.png'
-                plotfig.savefig(fig_fname_image, bbox_inches='tight', pad_inches=0.05)
-
-                # Use Pillow (an fork for PIL) to attach metadata to the PNG
-                png_image = Image.open(fig_fname_image)
-                png_metadata = PngImagePlugin.PngInfo()
-
-                # PIL can only handle Strings, so let's convert our times
-                metadata['CreationDate'] = metadata['CreationDate'].strftime('%Y%m%d-%H%M-%S')
-                metadata['ModDate'] = metadata['ModDate'].strftime('%Y%m%d-%H%M-%S')
-
-                for x in metadata:
-                    # make sure every value of the metadata is a string
-                    if not isinstance(metadata[x], str):
-                        metadata[x] = str(metadata[x])
-
-                    # add the metadata to the picture
-                    png_metadata.add_text(x, metadata[x])
-
-                # save the picture again, this time including the metadata
-                png_image.save(fig_fname_image, "png", pnginfo=png_metadata)
-
-            # close matplotlib figure
-            plt.close(plotfig)
+                draw_and_render_figure(plot_function, plot_data, plot_parameters,
+                                       self.mpl_qd_style, fig_base_path, metadata, self.save_pdf,
+                                       self.save_png)
             self.log.debug('Time needed to save data: {0:.2f}s'.format(time.time()-start_time))
             #----------------------------------------------------------------------------------
 
@@ -583,6 +804,36 @@ class SaveLogic(GenericLogic):
                            comments=comments)
         return
 
+    def save_arrays_as_hdf5(self, data, filename, filepath='', attributes=None, compression=None):
+        """
+        An Independent method, which saves a dictionary of numpy.ndarrays as datasets of a hdf5
+        file. The attributes are stored as file attributes. Attribute values which can not be
+        stored natively by hdf5 are converted to strings.
+
+        @param dict data: the arrays to save. The keys are used as dataset names.
+        @param str filename: name of the file including the ending
+        @param str filepath: path to the directory of the file
+        @param dict attributes: optional, the attributes (i.e. parameters) of the file
+        @param str compression: optional, hdf5 compression filter of the datasets (e.g. 'gzip')
+        """
+        if h5py is None:
+            raise ImportError('Saving of hdf5 files requires the h5py package.')
+        with h5py.File(os.path.join(filepath, filename), 'w') as file:
+            for keyname, arr in data.items():
+                arr = np.asarray(arr)
+                if arr.dtype.kind == 'U':
+                    # hdf5 has no native unicode array type
+                    arr = np.char.encode(arr, 'utf-8')
+                # a slash would create a group in the hdf5 file
+                file.create_dataset(keyname.replace('/', '|'), data=arr, compression=compression)
+            if attributes is not None:
+                for key, value in attributes.items():
+                    try:
+                        file.attrs[key] = value
+                    except (TypeError, ValueError):
+                        file.attrs[key] = str(value)
+        return
+
     def get_daily_directory(self):
         """ Gets or creates daily save directory.
 
@@ -1,7 +1,12 @@
+import csv
+import json
+import os
 import yaml
+import numpy as np
+from contextlib import contextmanager
 from datetime import datetime
 import pandas as pd
-from time import sleep
+from time import sleep, time, perf_counter
 
 
 def write_status_dict_to_file(path, status_dict):
@@ -97,3 +102,209 @@ def write_dict_to_file(path, dictionary):
     """
     with open(path, 'w') as outfile:
         yaml.safe_dump(dictionary, outfile, default_flow_style=False)
+
+
+class SpanRecorder:
+    """ Records the durations of the (nested) phases of a task, e.g. the hybridization, imaging and photobleaching
+    phases of a Hi-M cycle, and their statistics.
+
+    The finished spans are kept in a column buffer (one numpy array per column) and appended to a csv file when
+    flush is called. flush is called automatically when the buffer is full or after flush_interval seconds. If no
+    file is set, the older half of the spans is discarded when the buffer is full, so the memory used stays bounded.
+    The statistics per phase cover all spans since the last reset, including the ones written to file or discarded.
+
+    A phase is identified by its path, the names of the enclosing open spans and its own name separated by '/', for
+    example 'step/imaging/autofocus'.
+    """
+    columns = ['timestamp', 'task', 'phase', 'duration', 'attributes']
+
+    def __init__(self, task_name='', path=None, capacity=1024, flush_interval=60.):
+        """
+        :param: str task_name: name of the task, written to each line of the file
+        :param: str path: optional, complete path to the csv file. Spans are only kept in memory if None.
+        :param: int capacity: number of spans kept in memory before they are written to file (or the older ones
+                              discarded)
+        :param: float flush_interval: time in s after which finished spans are written to file
+        """
+        self.task_name = task_name
+        self.capacity = int(capacity)
+        self.flush_interval = flush_interval
+        self.path = None
+        self._phases = []  # phase paths, referenced by index in the buffer
+        self._phase_index = {}
+        self._attributes = ['']  # json encoded attributes, referenced by index in the buffer
+        self._attribute_index = {'': 0}
+        self.reset(path)
+
+    def reset(self, path=None):
+        """ Discard all spans and statistics and set the path of the csv file.
+        :param: str path: optional, complete path to the csv file
+        """
+        self._start = np.zeros(self.capacity, dtype=np.float64)
+        self._duration = np.zeros(self.capacity, dtype=np.float64)
+        self._phase = np.zeros(self.capacity, dtype=np.int32)
+        self._attribute = np.zeros(self.capacity, dtype=np.int32)
+        self._count = 0
+        self._open = []  # (name, path, wall clock start, perf_counter start, attributes) of the open spans
+        self._stats = {}  # phase path -> [count, total, minimum, maximum]
+        self._last_flush = perf_counter()
+        self.set_path(path)
+
+    def set_path(self, path):
+        """ Set the csv file the spans are written to. The header is written if the file does not exist yet.
+        :param: str path: complete path to the csv file, or None to keep the spans in memory only
+        """
+        self.path = path
+        if path is not None and not os.path.exists(path):
+            with open(path, 'w', newline='') as file:
+                csv.writer(file).writerow(self.columns)
+
+    @property
+    def current_phase(self):
+        """ Path of the innermost open span, '' if no span is open. """
+        return self._open[-1][1] if self._open else ''
+
+    def begin(self, name, **attributes):
+        """ Open a span. It is closed by end(name).
+        :param: str name: name of the phase
+        :param: attributes: optional, json serializable values describing the span (e.g. roi='ROI_001')
+        """
+        parent = self.current_phase
+        path = '{}/{}'.format(parent, name) if parent else name
+        self._open.append((name, path, time(), perf_counter(), attributes))
+
+    def end(self, name=None):
+        """ Close the innermost span with the given name (the innermost span if None). Spans opened after it and not
+        closed yet are closed as well.
+        :param: str name: optional, name of the phase
+        """
+        if name is not None and not any(span[0] == name for span in self._open):
+            return
+        stop = perf_counter()
+        while self._open:
+            span_name, path, timestamp, start, attributes = self._open.pop()
+            self._record(path, timestamp, stop - start, attributes)
+            if name is None or span_name == name:
+                break
+        if self._count == self.capacity or stop - self._last_flush > self.flush_interval:
+            self.flush()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """ Context manager measuring the duration of the enclosed block as a span.
+        :param: str name: name of the phase
+        :param: attributes: optional, json serializable values describing the span
+        """
+        self.begin(name, **attributes)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def close_all(self):
+        """ Close all open spans, e.g. when a task step was left by an exception. """
+        while self._open:
+            self.end(self._open[0][0])
+
+    def flush(self):
+        """ Write the spans in memory to the csv file. Nothing is done if no file is set. """
+        self._last_flush = perf_counter()
+        if self.path is None or self._count == 0:
+            return
+        with open(self.path, 'a', newline='') as file:
+            writer = csv.writer(file)
+            for i in range(self._count):
+                writer.writerow([datetime.fromtimestamp(self._start[i]).isoformat(), self.task_name,
+                                 self._phases[self._phase[i]], '{:.6f}'.format(self._duration[i]),
+                                 self._attributes[self._attribute[i]]])
+        self._count = 0
+        # the attribute strings are only referenced by the spans in memory
+        self._attributes = ['']
+        self._attribute_index = {'': 0}
+
+    def spans(self):
+        """ Spans currently kept in memory.
+        :return: dict: column name -> list of values
+        """
+        n = self._count
+        return {'timestamp': self._start[:n].copy(),
+                'phase': [self._phases[i] for i in self._phase[:n]],
+                'duration': self._duration[:n].copy(),
+                'attributes': [self._attributes[i] for i in self._attribute[:n]]}
+
+    def summary(self):
+        """ Statistics per phase since the last reset, sorted by total duration.
+        :return: list of dict: with keys 'phase', 'count', 'total', 'mean', 'min', 'max' (durations in s)
+        """
+        summary = [{'phase': phase, 'count': count, 'total': total, 'mean': total / count, 'min': minimum,
+                    'max': maximum} for phase, (count, total, minimum, maximum) in self._stats.items()]
+        summary.sort(key=lambda item: item['total'], reverse=True)
+        return summary
+
+    def format_summary(self):
+        """ Summary as a text table, for the log.
+        :return: str: one line per phase, empty if no span was recorded
+        """
+        lines = ['{:<40} {:>6} {:>12} {:>10} {:>10} {:>10}'.format('phase', 'count', 'total (s)', 'mean (s)',
+                                                                    'min (s)', 'max (s)')]
+        for item in self.summary():
+            lines.append('{phase:<40} {count:>6} {total:>12.3f} {mean:>10.3f} {min:>10.3f} {max:>10.3f}'.format(
+                **item))
+        return '\n'.join(lines) if len(lines) > 1 else ''
+
+    def save_summary(self, path):
+        """ Write the summary to a csv file.
+        :param: str path: complete path to the csv file
+        """
+        with open(path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=['phase', 'count', 'total', 'mean', 'min', 'max'])
+            writer.writeheader()
+            writer.writerows(self.summary())
+
+    def _record(self, path, timestamp, duration, attributes):
+        # make room first, flush and _discard_oldest renumber the attribute strings
+        if self._count == self.capacity:
+            self.flush()
+            if self._count == self.capacity:  # no file to flush to
+                self._discard_oldest()
+        phase = self._phase_index.get(path)
+        if phase is None:
+            phase = self._phase_index[path] = len(self._phases)
+            self._phases.append(path)
+        attribute_string = json.dumps(attributes, default=str, sort_keys=True) if attributes else ''
+        attribute = self._attribute_index.get(attribute_string)
+        if attribute is None:
+            attribute = self._attribute_index[attribute_string] = len(self._attributes)
+            self._attributes.append(attribute_string)
+        i = self._count
+        self._start[i] = timestamp
+        self._duration[i] = duration
+        self._phase[i] = phase
+        self._attribute[i] = attribute
+        self._count += 1
+
+        stats = self._stats.get(path)
+        if stats is None:
+            self._stats[path] = [1, duration, duration, duration]
+        else:
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = min(stats[2], duration)
+            stats[3] = max(stats[3], duration)
+
+    def _discard_oldest(self):
+        """ Discard the older half of the spans in memory. Their durations are already included in the statistics.
+        The attribute strings that are not referenced anymore are discarded as well.
+        """
+        keep = self.capacity // 2
+        for column in ('_start', '_duration', '_phase', '_attribute'):
+            values = getattr(self, column)
+            values[:keep] = values[self._count - keep:self._count]
+        self._count = keep
+
+        used = np.union1d([0], self._attribute[:keep])  # index 0 is the empty attribute string
+        new_index = np.zeros(len(self._attributes), dtype=np.int32)
+        new_index[used] = np.arange(len(used))
+        self._attribute[:keep] = new_index[self._attribute[:keep]]
+        self._attributes = [self._attributes[i] for i in used]
+        self._attribute_index = {attribute: i for i, attribute in enumerate(self._attributes)}
@@ -139,6 +139,11 @@ class TaskRunner(GenericLogic):
             else:
                 t['pausetasks'] = []
 
+            if 'pauseloops' in config['tasks'][task]:
+                t['pauseloops'] = config['tasks'][task]['pauseloops']
+            else:
+                t['pauseloops'] = []
+
             if 'needsmodules' in config['tasks'][task]:
                 t['needsmodules'] = config['tasks'][task]['needsmodules']
             else:
@@ -187,6 +192,7 @@ class TaskRunner(GenericLogic):
             str module: module name of task module
             [str] preposttasks: pre/post execution tasks for this task
             [str] pausetasks: this stuff needs to be paused before task can run
+            [str] pauseloops: tags of the periodic jobs (e.g. 'gui') paused while the task runs
             dict needsmodules: task needs these modules
             dict config: extra configuration
         """
@@ -195,6 +201,8 @@ class TaskRunner(GenericLogic):
                 task['preposttasks'] = []
             if not 'pausetasks' in task:
                 task['pausetasks'] = []
+            if not 'pauseloops' in task:
+                task['pauseloops'] = []
             task['module'] = None
             task['needsmodules'] = {}
             task['config'] = {}
@@ -550,3 +558,34 @@ class TaskRunner(GenericLogic):
                 return False
         return True
 
+    def pausePauseLoops(self, ref):
+        """ Pause the periodic jobs (e.g. display loops) with the tags listed in pauseloops of a given task.
+
+        @param task ref: task object
+
+        @return bool: whether pausing the loops was successful
+        """
+        task = self.getTaskByReference(ref)
+        try:
+            for tag in task['pauseloops']:
+                self.getScheduler().pause(tag, task['name'])
+        except:
+            self.log.exception('Pausing the periodic jobs failed while preparing: {}'.format(task['name']))
+            return False
+        return True
+
+    def resumePauseLoops(self, ref):
+        """ Resume the periodic jobs paused by a given task.
+
+        @param task ref: task object
+
+        @return bool: whether resuming the loops was successful
+        """
+        task = self.getTaskByReference(ref)
+        try:
+            for tag in task['pauseloops']:
+                self.getScheduler().resume(tag, task['name'])
+        except:
+            self.log.exception('Resuming the periodic jobs failed after: {}'.format(task['name']))
+            return False
+        return True
@@ -37,12 +37,15 @@ import shutil
 from datetime import datetime
 from tqdm import tqdm
 from logic.generic_task import InterruptableTask
+from logic.injection_scheduler import InjectionScheduler
 from logic.task_helper_functions import save_z_positions_to_file, save_injection_data_to_csv, \
     create_path_for_injection_data
 from logic.task_logging_functions import update_default_info, write_status_dict_to_file, add_log_entry
 from qtpy import QtCore
 from glob import glob
 
+ZARR_METADATA_FILES = ('.zarray', '.zattrs', '.zgroup')
+
 data_saved = True  # Global variable to follow data registration for each cycle (signal/slot communication is not
 
 
@@ -61,13 +64,36 @@ class UploadDataWorker(QtCore.QRunnable):
 
     @QtCore.Slot()
     def run(self):
-        """ Copy the file to destination
+        """ Copy the file to destination. An OME-Zarr image is copied as a whole directory: the missing chunks first,
+        then the metadata files, which are always copied again since they are updated with each appended frame.
         """
-        shutil.copy(self.data_local_path, self.data_network_path)
+        if os.path.isdir(self.data_local_path):
+            zarr_destination = os.path.join(self.data_network_path, os.path.basename(self.data_local_path))
+            shutil.copytree(self.data_local_path, zarr_destination, dirs_exist_ok=True,
+                            ignore=shutil.ignore_patterns(*ZARR_METADATA_FILES), copy_function=copy_missing_file)
+            for root, dirs, files in os.walk(self.data_local_path):
+                for file in files:
+                    if file in ZARR_METADATA_FILES:
+                        relative_path = os.path.relpath(os.path.join(root, file), start=self.data_local_path)
+                        shutil.copy(os.path.join(root, file), os.path.join(zarr_destination, relative_path))
+        else:
+            shutil.copy(self.data_local_path, self.data_network_path)
         global data_saved
         data_saved = True
 
 
+def copy_missing_file(src, dst):
+    """ Copy a file unless it is already present at the destination with the same size (chunks of an OME-Zarr image
+    are written once, so an interrupted upload is resumed with the missing chunks only).
+
+    :@param: str src = path to the local file
+    :@param: str dst = path to the destination file
+    """
+    if os.path.isfile(dst) and os.path.getsize(dst) == os.path.getsize(src):
+        return dst
+    return shutil.copy2(src, dst)
+
+
 class Task(InterruptableTask):  # do not change the name of the class. it is always called Task !
     """ This task performs a Hi-M experiment on the RAMM setup.
 
@@ -136,6 +162,14 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         self.probe_list: list = []
         self.prefix: str = ""
         self.timeout: float = 0
+        self.rinse_during_imaging: bool = False
+        self.injections = None
+        self.injection_process: tuple = ('hybridization', 1)
+        self.path_to_upload: list = []
+        self.flow_data: tuple = ([0], [0], [0])
+        self.needle_pos: int = 0
+        self.rt_injection: int = 0
+        self.start_rinsing_time = None
 
     def startTask(self):
         """ """
@@ -179,6 +213,11 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         # read all user parameters from config
         self.load_user_parameters()
 
+        # the injection sequences are run by the scheduler, moving the valves in advance during incubations
+        self.injections = InjectionScheduler(self.ref['valves'], self.ref['flow'], self.buffer_dict, log=self.log,
+                                             is_aborted=lambda: self.aborted, span=self.span)
+        self.start_rinsing_time = None
+
         # create a directory in which all the data will be saved
         self.directory = self.create_directory(self.save_path)
         self.network_directory = self.create_directory(self.save_network_path)
@@ -194,6 +233,8 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         # the log file contains more detailed information about individual steps and is a user readable format.
         # It is also useful after the experiment has finished.
         self.log_path = os.path.join(self.log_folder, 'log.csv')
+        # the durations of the phases of each cycle (hybridization, imaging of each roi, ..) are saved next to the log
+        self.setSpanFile(os.path.join(self.log_folder, 'timing.csv'))
 
         if self.logging:
             # initialize the status dict yaml file
@@ -238,6 +279,9 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         # initialize a counter to iterate over the number of probes to inject
         self.probe_counter = 0
 
+        # the focus positions recorded on the rois during the previous experiment do not apply anymore
+        self.ref['focus'].reset_focus_map()
+
     def runTaskStep(self):
         """ Implement one work step of your task here.
         :return: bool: True if the task should continue running, False if it should finish.
@@ -266,13 +310,14 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
                 time.sleep(0.1)
 
             # keep in memory the position of the needle
-            needle_pos = self.probe_list[self.probe_counter - 1][0]
-            rt_injection = 0
+            self.needle_pos = self.probe_list[self.probe_counter - 1][0]
+            self.rt_injection = 0
 
         # --------------------------------------------------------------------------------------------------------------
         # Hybridization
         # --------------------------------------------------------------------------------------------------------------
         if not self.aborted:
+            self.beginSpan('hybridization', cycle=self.probe_counter)
 
             if self.logging:
                 self.status_dict['process'] = 'Hybridization'
@@ -281,9 +326,9 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
 
             # list all the files that were already acquired and uploaded
             if self.transfer_data:
-                path_to_upload = self.check_acquired_data()
+                self.path_to_upload = self.check_acquired_data()
             else:
-                path_to_upload = []
+                self.path_to_upload = []
 
             # position the valves for hybridization sequence
             self.ref['valves'].set_valve_position('b', 2)  # RT rinsing valve: inject probe
@@ -291,101 +336,10 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
             self.ref['valves'].set_valve_position('c', 2)  # Syringe valve: towards pump
             self.ref['valves'].wait_for_idle()
 
-            # iterate over the steps in the hybridization sequence
-            for step in range(len(self.hybridization_list)):
-                if self.aborted:
-                    break
-
-                self.log.info(f'Hybridisation step {step + 1}')
-                if self.logging:
-                    add_log_entry(self.log_path, self.probe_counter, 1, f'Started injection {step + 1}')
-
-                if self.hybridization_list[step]['product'] is not None:  # an injection step
-                    # set the 8 way valve to the position corresponding to the product
-                    product = self.hybridization_list[step]['product']
-                    valve_pos = self.buffer_dict[product]
-                    self.ref['valves'].set_valve_position('a', valve_pos)
-                    self.ref['valves'].wait_for_idle()
-
-                    # for the RAMM, the needle is connected to valve position 7. If this valve is called more than once,
-                    # the needle will be moved to the next position. The procedure was added to make the DAPI injection
-                    # easier.
-                    if rt_injection == 0 and valve_pos == 7:
-                        rt_injection += 1
-                        needle_pos += 1
-                    elif rt_injection > 0 and valve_pos == 7:
-                        self.ref['valves'].set_valve_position('c', 1)  # Syringe valve: close
-                        self.ref['valves'].wait_for_idle()
-                        self.ref['pos'].start_move_to_target(needle_pos)
-                        rt_injection += 1
-                        needle_pos += 1
-                        while self.ref['pos'].moving is True:
-                            time.sleep(0.1)
-                        self.ref['valves'].set_valve_position('c', 2)  # Syringe valve: open
-                        self.ref['valves'].wait_for_idle()
-
-                    # pressure regulation
-                    # create lists containing pressure and volume data and initialize first value to 0
-                    pressure = [0]
-                    volume = [0]
-                    flowrate = [0]
-
-                    self.ref['flow'].set_pressure(0.0)  # as initial value
-                    self.ref['flow'].start_pressure_regulation_loop(self.hybridization_list[step]['flowrate'])
-
-                    # start counting the volume of buffer or probe
-                    self.ref['flow'].start_volume_measurement(self.hybridization_list[step]['volume'])
-
-                    ready = self.ref['flow'].target_volume_reached
-                    while not ready:
-                        time.sleep(1)
-                        ready = self.ref['flow'].target_volume_reached
-                        # retrieve data for data saving at the end of interation
-                        self.append_flow_data(pressure, volume, flowrate)
-                        # if data are ready to be saved, launch a worker
-                        path_to_upload = self.launch_data_uploading(path_to_upload)
-
-                        if self.aborted:
-                            ready = True
-
-                    self.ref['flow'].stop_pressure_regulation_loop()
-                    time.sleep(1)  # time to wait until last regulation step is finished, afterwards reset pressure to 0
-                    # get the last data points for flow data
-                    self.append_flow_data(pressure, volume, flowrate)
-                    time.sleep(1)
-                    self.ref['flow'].set_pressure(0.0)
-
-                    # save pressure and volume data to file
-                    complete_path = create_path_for_injection_data(self.network_directory,
-                                                                   self.probe_list[self.probe_counter - 1][1],
-                                                                   'hybridization', step)
-                    save_injection_data_to_csv(pressure, volume, flowrate, complete_path)
-
-                else:  # an incubation step
-                    t = self.hybridization_list[step]['time']
-                    self.log.info(f'Incubation time.. {t} s')
-                    self.ref['valves'].set_valve_position('c', 1)  # stop flux
-                    self.ref['valves'].wait_for_idle()
-
-                    # allow abort by splitting the waiting time into small intervals of 30 s
-                    num_steps = t // 30
-                    remainder = t % 30
-                    for i in range(num_steps):
-
-                        # if data are ready to be saved, launch a worker
-                        path_to_upload = self.launch_data_uploading(path_to_upload)
-
-                        if not self.aborted:
-                            time.sleep(30)
-                            print("Elapsed time : {}s".format((i + 1) * 30))
-                    time.sleep(remainder)
-
-                    self.ref['valves'].set_valve_position('c', 2)  # open flux again
-                    self.ref['valves'].wait_for_idle()
-                    self.log.info('Incubation time finished')
-
-                if self.logging:
-                    add_log_entry(self.log_path, self.probe_counter, 1, f'Finished injection {step + 1}')
+            # run the hybridization sequence
+            self.injection_process = ('hybridization', 1)
+            self.injections.run(self.hybridization_list, on_tick=self.injection_tick, before_step=self.start_injection,
+                                before_injection=self.move_needle_if_needed, after_step=self.finish_injection)
 
             # set valves to default positions
             self.ref['valves'].set_valve_position('c', 1)  # Syringe valve: towards syringe
@@ -395,6 +349,12 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
             self.ref['valves'].set_valve_position('b', 1)  # RT rinsing valve: Rinse needle
             self.ref['valves'].wait_for_idle()
 
+            # rinse the needle during imaging instead of during photobleaching
+            if self.rinse_during_imaging and not self.aborted:
+                self.ref['daq'].start_rinsing(30)
+                self.start_rinsing_time = time.time()
+
+            self.endSpan('hybridization')
             if self.logging:
                 add_log_entry(self.log_path, self.probe_counter, 1, 'Finished Hybridization', 'info')
         # Hybridization finished ---------------------------------------------------------------------------------------
@@ -403,11 +363,14 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         # Imaging for all ROI
         # --------------------------------------------------------------------------------------------------------------
         if not self.aborted:
+            self.beginSpan('imaging', cycle=self.probe_counter)
             if self.logging:
                 self.status_dict['process'] = 'Imaging'
                 write_status_dict_to_file(self.status_dict_path, self.status_dict)
                 add_log_entry(self.log_path, self.probe_counter, 2, 'Started Imaging', 'info')
 
+            self.ref['focus'].start_focus_map_cycle()
+
             # make sure there is no data being transferred
             global data_saved
             print('Checking there is no data being transferred ...')
@@ -418,6 +381,8 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
                 if self.aborted:
                     break
 
+                self.beginSpan('roi', roi=item)
+
                 # create the save path for each roi --------------------------------------------------------------------
                 cur_save_path = self.get_complete_path(self.directory, item, self.probe_list[self.probe_counter - 1][1])
 
@@ -431,25 +396,30 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
                     add_log_entry(self.log_path, self.probe_counter, 2, f'Moved to {item}')
 
                 # autofocus --------------------------------------------------------------------------------------------
-                self.ref['focus'].start_search_focus()
-                # need to ensure that focus is stable here.
-                ready = self.ref['focus']._stage_is_positioned
-                counter = 0
-                while not ready:
-                    counter += 1
-                    time.sleep(0.1)
+                with self.span('autofocus'):
+                    roi_position = self.ref['roi'].get_roi_position(item)
+                    self.ref['focus'].go_to_predicted_focus(item, roi_position)
+                    self.ref['focus'].start_search_focus()
+                    # need to ensure that focus is stable here.
                     ready = self.ref['focus']._stage_is_positioned
-                    if counter > 500:
-                        break
+                    counter = 0
+                    while not ready:
+                        counter += 1
+                        time.sleep(0.1)
+                        ready = self.ref['focus']._stage_is_positioned
+                        if counter > 500:
+                            break
 
-                # reset piezo position to 25 um if too close to the limit of travel range (< 10 or > 50) ---------------
-                self.ref['focus'].do_piezo_position_correction()
-                busy = True
-                while busy:
-                    time.sleep(0.5)
-                    busy = self.ref['focus'].piezo_correction_running
+                    # reset piezo position to 25 um if too close to the limit of travel range (< 10 or > 50) -----------
+                    self.ref['focus'].do_piezo_position_correction()
+                    busy = True
+                    while busy:
+                        time.sleep(0.5)
+                        busy = self.ref['focus'].piezo_correction_running
 
-                reference_position = self.ref['focus'].get_position()  # save it to go back to this plane after imaging
+                    # save it to go back to this plane after imaging
+                    reference_position = self.ref['focus'].get_position()
+                    self.ref['focus'].record_focus(item, roi_position)
                 start_position = self.calculate_start_position(self.centered_focal_plane)
 
                 # imaging sequence -------------------------------------------------------------------------------------
@@ -466,6 +436,7 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
                 # z_actual_positions = []
 
                 print(f'{item}: performing z stack..')
+                self.beginSpan('z_stack')
 
                 # iterate over all planes in z
                 for plane in tqdm(range(self.num_z_planes)):
@@ -502,8 +473,10 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
                             break
 
                 self.ref['focus'].go_to_position(reference_position, direct=True)
+                self.endSpan('z_stack')
 
                 # data handling ----------------------------------------------------------------------------------------
+                self.beginSpan('saving')
                 image_data = self.ref['cam'].get_acquired_data()
 
                 if self.file_format == 'fits':
@@ -514,6 +487,9 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
                     metadata = self.get_metadata()
                     file_path = cur_save_path.replace('npy', 'yaml', 1)
                     self.save_metadata_file(metadata, file_path)
+                elif self.file_format == 'zarr':  # metadata is saved in the zarr attributes
+                    self.ref['cam'].save_to_zarr(cur_save_path, image_data, self.get_metadata(),
+                                                 channels=self.num_laserlines, z_step=self.z_step)
                 else:  # use tiff as default format
                     self.ref['cam'].save_to_tiff(self.num_frames, cur_save_path, image_data)
                     metadata = self.get_metadata()
@@ -530,6 +506,8 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
                 # file_path = os.path.join(os.path.split(cur_save_path)[0], 'z_positions.yaml')
                 # save_z_positions_to_file(z_target_positions, z_actual_positions, file_path)
 
+                self.endSpan('saving')
+                self.endSpan('roi')
                 if self.logging:  # to modify: check if data saved correctly before writing this log entry
                     add_log_entry(self.log_path, self.probe_counter, 2, 'Image data saved', 'info')
 
@@ -537,6 +515,7 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
             self.ref['roi'].set_active_roi(name=self.roi_names[0])
             self.ref['roi'].go_to_roi_xy()
 
+            self.endSpan('imaging')
             if self.logging:
                 add_log_entry(self.log_path, self.probe_counter, 2, 'Finished Imaging', 'info')
         # Imaging (for all ROIs) finished ------------------------------------------------------------------------------
@@ -545,103 +524,34 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         # Photobleaching
         # --------------------------------------------------------------------------------------------------------------
         if not self.aborted:
+            self.beginSpan('photobleaching', cycle=self.probe_counter)
 
             if self.logging:
                 self.status_dict['process'] = 'Photobleaching'
                 write_status_dict_to_file(self.status_dict_path, self.status_dict)
                 add_log_entry(self.log_path, self.probe_counter, 3, 'Started Photobleaching', 'info')
 
-            # rinse needle in parallel with photobleaching
-            self.ref['valves'].set_valve_position('b', 1)  # RT rinsing valve: rinse needle
-            self.ref['valves'].wait_for_idle()
-            self.ref['daq'].start_rinsing(30)
-            start_rinsing_time = time.time()
+            # rinse needle in parallel with photobleaching (if not already done during imaging)
+            if not self.start_rinsing_time:
+                self.ref['valves'].set_valve_position('b', 1)  # RT rinsing valve: rinse needle
+                self.ref['valves'].wait_for_idle()
+                self.ref['daq'].start_rinsing(30)
+                self.start_rinsing_time = time.time()
 
             # list all the files that were already acquired and uploaded
             if self.transfer_data:
-                path_to_upload = self.check_acquired_data()
+                self.path_to_upload = self.check_acquired_data()
             else:
-                path_to_upload = []
+                self.path_to_upload = []
 
             # inject product
             self.ref['valves'].set_valve_position('c', 2)  # Syringe valve: towards pump
             self.ref['valves'].wait_for_idle()
 
-            # iterate over the steps in the photobleaching sequence
-            for step in range(len(self.photobleaching_list)):
-                if self.aborted:
-                    break
-
-                self.log.info(f'Photobleaching step {step + 1}')
-                if self.logging:
-                    add_log_entry(self.log_path, self.probe_counter, 3, f'Started injection {step + 1}')
-
-                if self.photobleaching_list[step]['product'] is not None:  # an injection step
-                    # set the 8 way valve to the position corresponding to the product
-                    product = self.photobleaching_list[step]['product']
-                    valve_pos = self.buffer_dict[product]
-                    self.ref['valves'].set_valve_position('a', valve_pos)
-                    self.ref['valves'].wait_for_idle()
-
-                    # pressure regulation
-                    # create lists containing pressure, volume and flowrate data and initialize first value to 0
-                    pressure = [0]
-                    volume = [0]
-                    flowrate = [0]
-
-                    self.ref['flow'].set_pressure(0.0)  # as initial value
-                    self.ref['flow'].start_pressure_regulation_loop(self.photobleaching_list[step]['flowrate'])
-                    # start counting the volume of buffer or probe
-                    self.ref['flow'].start_volume_measurement(self.photobleaching_list[step]['volume'])
-
-                    ready = self.ref['flow'].target_volume_reached
-
-                    while not ready:
-                        time.sleep(1)
-                        ready = self.ref['flow'].target_volume_reached
-                        # retrieve data for data saving at the end of interation
-                        self.append_flow_data(pressure, volume, flowrate)
-                        # if data are ready to be saved, launch a worker
-                        path_to_upload = self.launch_data_uploading(path_to_upload)
-
-                        if self.aborted:
-                            ready = True
-
-                    self.ref['flow'].stop_pressure_regulation_loop()
-                    time.sleep(1)  # time to wait until last regulation step is finished, afterwards reset pressure to 0
-                    # get the last data points
-                    self.append_flow_data(pressure, volume, flowrate)
-                    time.sleep(1)
-                    self.ref['flow'].set_pressure(0.0)
-
-                    # save pressure and volume data to file
-                    complete_path = create_path_for_injection_data(self.network_directory,
-                                                                   self.probe_list[self.probe_counter - 1][1],
-                                                                   'photobleaching', step)
-                    save_injection_data_to_csv(pressure, volume, flowrate, complete_path)
-
-                else:  # an incubation step
-                    t = self.photobleaching_list[step]['time']
-                    self.log.info(f'Incubation time.. {t} s')
-                    self.ref['valves'].set_valve_position('c', 1)
-                    self.ref['valves'].wait_for_idle()
-
-                    # allow abort by splitting the waiting time into small intervals of 30 s
-                    num_steps = t // 30
-                    remainder = t % 30
-                    for i in range(num_steps):
-                        # if data are ready to be saved, launch a worker
-                        path_to_upload = self.launch_data_uploading(path_to_upload)
-                        if not self.aborted:
-                            time.sleep(30)
-                    time.sleep(remainder)
-
-                    self.ref['valves'].set_valve_position('c', 2)
-                    self.ref['valves'].wait_for_idle()
-                    self.log.info('Incubation time finished')
-
-                if self.logging:
-                    add_log_entry(self.log_path, self.probe_counter, 3, f'Finished injection {step + 1}')
+            # run the photobleaching sequence
+            self.injection_process = ('photobleaching', 3)
+            self.injections.run(self.photobleaching_list, on_tick=self.injection_tick, before_step=self.start_injection,
+                                after_step=self.finish_injection)
 
             # stop flux by closing valve towards pump
             self.ref['valves'].set_valve_position('c', 1)  # Syringe valve: towards syringe
@@ -649,9 +559,10 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
 
             # verify if rinsing finished in the meantime
             current_time = time.time()
-            diff = current_time - start_rinsing_time
+            diff = current_time - self.start_rinsing_time
             if diff < 60:
                 time.sleep(60 - diff + 1)
+            self.start_rinsing_time = None
 
             # set valves to default positions
             self.ref['valves'].set_valve_position('a', 1)  # 8 way valve
@@ -659,6 +570,7 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
             self.ref['valves'].set_valve_position('b', 1)  # RT rinsing valve: Rinse needle
             self.ref['valves'].wait_for_idle()
 
+            self.endSpan('photobleaching')
             if self.logging:
                 add_log_entry(self.log_path, self.probe_counter, 3, 'Finished Photobleaching', 'info')
         # Photobleaching finished --------------------------------------------------------------------------------------
@@ -755,10 +667,11 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
             centered_focal_plane: False
             imaging_sequence: [('488 nm', 3), ('561 nm', 3), ('641 nm', 10)]
             save_path: 'E:/'
-            file_format: 'tif'
+            file_format: 'tif'  # 'tif', 'npy', 'fits' or 'zarr' (OME-Zarr)
             roi_list_path: 'pathstem/qudi_files/qudi_roi_lists/roilist_20210101_1128_23_123243.json'
             injections_path: 'pathstem/qudi_files/qudi_injection_parameters/injections_2021_01_01.yml'
             dapi_path: 'E:/imagedata/2021_01_01/001_HiM_MySample_dapi'
+            rinse_during_imaging: False  # optional, rinse the needle during imaging instead of photobleaching
         """
         try:
             with open(self.user_config_path, 'r') as stream:
@@ -777,6 +690,7 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
                 self.roi_list_path = self.user_param_dict['roi_list_path']
                 self.injections_path = self.user_param_dict['injections_path']
                 self.dapi_path = self.user_param_dict['dapi_path']
+                self.rinse_during_imaging = self.user_param_dict.get('rinse_during_imaging', False)
 
         except Exception as e:  # add the type of exception
             self.log.warning(f'Could not load user parameters for task {self.name}: {e}')
@@ -992,6 +906,73 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
     # data for injection tracking
     # ------------------------------------------------------------------------------------------------------------------
 
+    def start_injection(self, step, step_dict):
+        """ Called by the injection scheduler at the start of each step of the hybridization or photobleaching sequence.
+        :param: int step: index of the step in the sequence
+        :param: dict step_dict: injection or incubation step
+        :return: None
+        """
+        process, process_no = self.injection_process
+        self.log.info(f'{process.capitalize()} step {step + 1}')
+        # create lists containing pressure, volume and flowrate data and initialize first value to 0
+        self.flow_data = ([0], [0], [0])
+        if self.logging:
+            # predicted end of the running sequence, updated with the measured duration of the previous steps
+            self.status_dict['predicted_end'] = self.injections.predicted_end
+            write_status_dict_to_file(self.status_dict_path, self.status_dict)
+            add_log_entry(self.log_path, self.probe_counter, process_no, f'Started injection {step + 1}')
+
+    def injection_tick(self, step, step_dict):
+        """ Called by the injection scheduler every second during the steps of the sequence.
+        :param: int step: index of the step in the sequence
+        :param: dict step_dict: injection or incubation step
+        :return: None
+        """
+        if step_dict['product'] is not None:
+            # retrieve data for data saving at the end of injection
+            self.append_flow_data(*self.flow_data)
+        # if data are ready to be saved, launch a worker
+        self.path_to_upload = self.launch_data_uploading(self.path_to_upload)
+
+    def move_needle_if_needed(self, step, step_dict, valve_pos):
+        """ Called by the injection scheduler when the 8 way valve is in position, before the injection.
+        For the RAMM, the needle is connected to valve position 7. If this valve is called more than once, the needle
+        will be moved to the next position. The procedure was added to make the DAPI injection easier.
+        :param: int step: index of the step in the sequence
+        :param: dict step_dict: injection step
+        :param: int valve_pos: position of the 8 way valve
+        :return: None
+        """
+        if valve_pos != 7:
+            return
+        if self.rt_injection > 0:
+            self.ref['valves'].set_valve_position('c', 1)  # Syringe valve: close
+            self.ref['valves'].wait_for_idle()
+            self.ref['pos'].start_move_to_target(self.needle_pos)
+            while self.ref['pos'].moving is True:
+                time.sleep(0.1)
+            self.ref['valves'].set_valve_position('c', 2)  # Syringe valve: open
+            self.ref['valves'].wait_for_idle()
+        self.rt_injection += 1
+        self.needle_pos += 1
+
+    def finish_injection(self, step, step_dict):
+        """ Called by the injection scheduler at the end of each step of the sequence. Saves the flow data of an
+        injection.
+        :param: int step: index of the step in the sequence
+        :param: dict step_dict: injection or incubation step
+        :return: None
+        """
+        process, process_no = self.injection_process
+        if step_dict['product'] is not None:
+            # save pressure and volume data to file
+            complete_path = create_path_for_injection_data(self.network_directory,
+                                                           self.probe_list[self.probe_counter - 1][1],
+                                                           process, step)
+            save_injection_data_to_csv(*self.flow_data, complete_path)
+        if self.logging:
+            add_log_entry(self.log_path, self.probe_counter, process_no, f'Finished injection {step + 1}')
+
     def append_flow_data(self, pressure_list, volume_list, flowrate_list):
         """ Retrieve most recent values of pressure, volume and flowrate from flowcontrol logic and
         append them to lists storing all values.
@@ -1021,7 +1002,7 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         for n_channel in range(num_channel):
             image_array = deinterleaved_array_list[n_channel]
             projection = np.max(image_array, axis=0)
-            path = saving_path.replace('.tif', f'_ch{n_channel}_2D', 1)
+            path = os.path.splitext(saving_path)[0] + f'_ch{n_channel}_2D'
             np.save(path, projection)
 
     def check_acquired_data(self):
@@ -1075,13 +1056,42 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
                                 + [selected_path_to_upload[i] for i in idx_yaml] \
                                 + [selected_path_to_upload[i] for i in idx_tif]
 
+        # OME-Zarr images are uploaded as a whole directory by a single worker, as long as chunks are missing on the
+        # server or the metadata of the local image is more recent. The relative paths are compared since the chunk
+        # names are not unique.
+        path_to_upload_zarr = [path for path in glob(self.directory + '/**/*.zarr', recursive=True)
+                               if not self.zarr_uploaded(path, os.path.join(self.network_directory,
+                                                                            os.path.relpath(path, self.directory)))]
+        print(f'Number of zarr images to upload : {len(path_to_upload_zarr)}')
+        path_to_upload_sorted += path_to_upload_zarr
+
         print(f'Number of files to upload : {len(path_to_upload_sorted)}')
         return list(path_to_upload_sorted)
 
+    @staticmethod
+    def zarr_uploaded(local_path, network_path):
+        """ Check if an OME-Zarr image was entirely uploaded: all its chunks are on the server and the metadata files
+        on the server are not older than the local ones.
+
+        @param: str local_path: path of the local .zarr directory
+        @param: str network_path: path of the .zarr directory on the server
+        @return: bool: True if there is nothing left to upload
+        """
+        for root, dirs, files in os.walk(local_path):  # os.walk also lists the hidden .zarray and .zattrs files
+            for file in files:
+                uploaded_file = os.path.join(network_path, os.path.relpath(os.path.join(root, file), local_path))
+                if not os.path.isfile(uploaded_file):
+                    return False
+                if file in ZARR_METADATA_FILES \
+                        and os.path.getmtime(uploaded_file) < os.path.getmtime(os.path.join(root, file)):
+                    return False
+        return True
+
     def launch_data_uploading(self, path_to_upload):
-        """ Look for the next .tif file to upload and start the worker on a specific thread to launch the transfer
+        """ Look for the next file (or OME-Zarr directory) to upload and start the worker on a specific thread to launch
+        the transfer
 
-        @param path_to_upload: list of all the .tif files in the local directory
+        @param path_to_upload: list of all the files and OME-Zarr directories to upload from the local directory
         """
         global data_saved
 
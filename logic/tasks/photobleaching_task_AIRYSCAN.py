@@ -97,10 +97,11 @@ class Task(InterruptableTask):
         # set the intensity of each laser line for the lumencor
         self.ref['laser'].lumencor_set_laser_line_intensities(self.intensity_dict)
 
-        # update the laser intensity dictionary for the lasercontrol_logic
-        for key in self.intensity_dict:
-            intensity = self.intensity_dict[key]
-            self.ref['laser'].update_intensity_dict(key, intensity)
+        # update the laser intensity dictionary for the lasercontrol_logic (sent at once if the lasers are on)
+        with self.ref['laser'].lumencor_coalesced_update():
+            for key in self.intensity_dict:
+                intensity = self.intensity_dict[key]
+                self.ref['laser'].update_intensity_dict(key, intensity)
 
         # initialize a counter to iterate over the ROIs
         self.roi_counter = 0
@@ -153,6 +153,9 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         # initialize a counter to iterate over the ROIs
         self.roi_counter = 0
 
+        # use the focus positions of the rois measured so far as starting point, refitted as a new cycle
+        self.ref['focus'].start_focus_map_cycle()
+
         # set the active_roi to none to avoid having two active rois displayed
         self.ref['roi'].active_roi = None
 
@@ -172,7 +175,9 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         self.log.info('Moved to {} xy position'.format(self.roi_names[self.roi_counter]))
         self.ref['roi'].stage_wait_for_idle()
 
-        # autofocus
+        # autofocus, starting from the focus position predicted by the map of the sample surface
+        roi_position = self.ref['roi'].get_roi_position(self.roi_names[self.roi_counter])
+        self.ref['focus'].go_to_predicted_focus(self.roi_names[self.roi_counter], roi_position)
         self.ref['focus'].start_search_focus()
         # need to ensure that focus is stable here and stage is back at the sample surface, not on the reference plane
         ready = self.ref['focus']._stage_is_positioned
@@ -191,6 +196,7 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
             sleep(0.5)
             busy = self.ref['focus'].piezo_correction_running
 
+        self.ref['focus'].record_focus(self.roi_names[self.roi_counter], roi_position)
         start_position = self.calculate_start_position(self.centered_focal_plane)
 
         # --------------------------------------------------------------------------------------------------------------
@@ -22,18 +22,51 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 from qtpy import QtCore
 import numpy as np
 import datetime as dt
+import os
 import time
+from functools import partial
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 
 from core.connector import Connector
 from core.statusvariable import StatusVar
 from core.configoption import ConfigOption
 from logic.generic_logic import GenericLogic
+from logic.save_logic import draw_and_render_figure, figure_metadata
 from core.util.mutex import Mutex
+from core.util.ring_buffer import RingBuffer, MovingAverageFilter
+from core.util.stream_file import BackgroundStreamFileWriter, read_stream_file
 from core.util.units import ScaledFloat
 from interface.data_instream_interface import StreamChannelType, StreamingMode
 
 
+def draw_time_series_figure(data, timebase, y_unit):
+    """ Draw the figure saved with the time series. Kept at module level, so the save logic can
+    draw it in its figure rendering process.
+
+    @param: nparray data: a numpy array containing the samples of all channels (channels x samples)
+    @param: float timebase: data rate in Hz
+    @param: str y_unit: unit of the signal
+
+    @return: fig fig: a matplotlib figure object (not managed by pyplot) to be saved to file.
+    """
+    # Create figure and scale data
+    max_abs_value = ScaledFloat(max(data.max(), np.abs(data.min())))
+    time_data = np.arange(data.shape[1]) / timebase
+    fig = Figure()
+    ax = fig.subplots()
+    if max_abs_value.scale:
+        ax.plot(time_data,
+                data.transpose() / max_abs_value.scale_val,
+                linestyle=':',
+                linewidth=0.5)
+    else:
+        ax.plot(time_data, data.transpose(), linestyle=':', linewidth=0.5)
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('Signal ({0}{1})'.format(max_abs_value.scale, y_unit))
+    return fig
+
+
 class TimeSeriesReaderLogic(GenericLogic):
     """
     This logic module gathers data from a hardware streaming device.
@@ -44,6 +77,8 @@ class TimeSeriesReaderLogic(GenericLogic):
         module.Class: 'time_series_reader_logic.TimeSeriesReaderLogic'
         max_frame_rate: 10  # optional (10Hz by default)
         calc_digital_freq: True  # optional (True by default)
+        stream_recording_to_disk: False  # optional, write recorded data blocks directly to disk
+        recording_fsync_interval: 5  # optional, max. time in s between syncs of the recording file
         connect:
             _streamer_con: <streamer_name>
             _savelogic_con: <save_logic_name>
@@ -61,6 +96,8 @@ class TimeSeriesReaderLogic(GenericLogic):
     # config options
     _max_frame_rate = ConfigOption('max_frame_rate', default=10, missing='warn')
     _calc_digital_freq = ConfigOption('calc_digital_freq', default=True, missing='warn')
+    _stream_recording_to_disk = ConfigOption('stream_recording_to_disk', default=False)
+    _recording_fsync_interval = ConfigOption('recording_fsync_interval', default=5.0)
 
     # status vars
     _trace_window_size = StatusVar('trace_window_size', default=6)
@@ -83,7 +120,7 @@ class TimeSeriesReaderLogic(GenericLogic):
         self._samples_per_frame = None
         self._stop_requested = True
 
-        # Data arrays
+        # Data ring buffers
         self._trace_data = None
         self._trace_times = None
         self._trace_data_averaged = None
@@ -93,6 +130,8 @@ class TimeSeriesReaderLogic(GenericLogic):
         self._recorded_data = None
         self._data_recording_active = False
         self._record_start_time = None
+        # file writer used instead of _recorded_data if stream_recording_to_disk is True
+        self._record_writer = None
         return
 
     def on_activate(self):
@@ -154,6 +193,8 @@ class TimeSeriesReaderLogic(GenericLogic):
             self._stop_reader_wait()
 
         self._sigNextDataFrame.disconnect()
+        # the data of a streamed recording is already on disk, only finalize the file
+        self._close_record_writer()
 
         # Save status vars
         self._active_channels = self.active_channel_names
@@ -162,10 +203,10 @@ class TimeSeriesReaderLogic(GenericLogic):
 
     def _init_data_arrays(self):
         window_size = self.trace_window_size_samples
-        self._trace_data = np.zeros(
-            [self.number_of_active_channels, window_size + self._moving_average_width // 2])
-        self._trace_data_averaged = np.zeros(
-            [len(self._averaged_channels), window_size - self._moving_average_width // 2])
+        self._trace_data = RingBuffer(self.number_of_active_channels,
+                                      window_size + self._moving_average_width // 2)
+        self._trace_data_averaged = RingBuffer(len(self._averaged_channels),
+                                               window_size - self._moving_average_width // 2)
         self._trace_times = np.arange(window_size) / self.data_rate
         self._recorded_data = list()
         return
@@ -279,18 +320,18 @@ class TimeSeriesReaderLogic(GenericLogic):
 
     @property
     def trace_data(self):
-        data_offset = self._trace_data.shape[1] - self._moving_average_width // 2
-        data = {ch: self._trace_data[i, :data_offset] for i, ch in
-                enumerate(self.active_channel_names)}
+        data_offset = self._trace_data.size - self._moving_average_width // 2
+        trace = self._trace_data.data
+        data = {ch: trace[i, :data_offset] for i, ch in enumerate(self.active_channel_names)}
         return self._trace_times, data
 
     @property
     def averaged_trace_data(self):
         if not self.averaged_channel_names or self.moving_average_width <= 1:
             return None, None
-        data = {ch: self._trace_data_averaged[i] for i, ch in
-                enumerate(self.averaged_channel_names)}
-        return self._trace_times[-self._trace_data_averaged.shape[1]:], data
+        trace = self._trace_data_averaged.data
+        data = {ch: trace[i] for i, ch in enumerate(self.averaged_channel_names)}
+        return self._trace_times[-self._trace_data_averaged.size:], data
 
     @property
     def all_settings(self):
@@ -373,8 +414,7 @@ class TimeSeriesReaderLogic(GenericLogic):
                 if new_val / data_rate > self.trace_window_size:
                     if 'data_rate' in settings_dict or 'trace_window_size' in settings_dict:
                         self._moving_average_width = new_val
-                        self.__moving_filter = np.full(shape=self.moving_average_width,
-                                                       fill_value=1.0 / self.moving_average_width)
+                        self.__moving_filter = MovingAverageFilter(self.moving_average_width)
                     else:
                         self.log.warning('Moving average width to set ({0:d}) is smaller than the '
                                          'trace window size. Will adjust trace window size to '
@@ -382,8 +422,7 @@ class TimeSeriesReaderLogic(GenericLogic):
                         self._trace_window_size = float(new_val / data_rate)
                 else:
                     self._moving_average_width = new_val
-                    self.__moving_filter = np.full(shape=self.moving_average_width,
-                                                   fill_value=1.0 / self.moving_average_width)
+                    self.__moving_filter = MovingAverageFilter(self.moving_average_width)
 
             if 'data_rate' in settings_dict:
                 new_val = float(settings_dict['data_rate'])
@@ -505,8 +544,7 @@ class TimeSeriesReaderLogic(GenericLogic):
             # self.sigSettingsChanged.emit(settings)
 
             if self._data_recording_active:
-                self._record_start_time = dt.datetime.now()
-                self._recorded_data = list()
+                self._start_new_recording()
 
             if self._streamer.start_stream() < 0:
                 self.log.error('Error while starting streaming device data acquisition.')
@@ -599,25 +637,26 @@ class TimeSeriesReaderLogic(GenericLogic):
 
         # Append data to save if necessary
         if self._data_recording_active:
-            self._recorded_data.append(data.copy())
+            if self._record_writer is not None:
+                # samples are stored frame by frame (one value per channel). The writer thread
+                # writes the block later, so it gets its own copy.
+                self._record_writer.append(np.ascontiguousarray(data.transpose()))
+            else:
+                self._recorded_data.append(data.copy())
 
-        data = data[:, -self._trace_data.shape[1]:]
+        data = data[:, -self._trace_data.size:]
         new_samples = data.shape[1]
 
-        # Roll data array to have a continuously running time trace
-        self._trace_data = np.roll(self._trace_data, -new_samples, axis=1)
-        # Insert new data
-        self._trace_data[:, -new_samples:] = data
+        # Insert new data into the ring buffer to have a continuously running time trace
+        self._trace_data.append(data)
 
-        # Calculate moving average by using numpy.convolve with a normalized uniform filter
+        # Calculate moving average with a normalized uniform filter
         if self.moving_average_width > 1 and self.averaged_channel_names:
-            # Only convolve the new data and roll the previously calculated moving average
-            self._trace_data_averaged = np.roll(self._trace_data_averaged, -new_samples, axis=1)
-            offset = new_samples + len(self.__moving_filter) - 1
-            for i, ch in enumerate(self.averaged_channel_names):
-                data_index = self.active_channel_names.index(ch)
-                self._trace_data_averaged[i, -new_samples:] = np.convolve(
-                    self._trace_data[data_index, -offset:], self.__moving_filter, mode='valid')
+            # Only filter the new data and append it to the previously calculated moving average
+            active_channels = self.active_channel_names
+            rows = [active_channels.index(ch) for ch in self.averaged_channel_names]
+            self._trace_data_averaged.append(
+                self.__moving_filter(self._trace_data, new_samples, rows=rows))
         return
 
     @QtCore.Slot()
@@ -635,8 +674,7 @@ class TimeSeriesReaderLogic(GenericLogic):
 
             self._data_recording_active = True
             if self.module_state() == 'locked':
-                self._recorded_data = list()
-                self._record_start_time = dt.datetime.now()
+                self._start_new_recording()
                 self.sigStatusChanged.emit(True, True)
             else:
                 self.start_reading()
@@ -662,6 +700,52 @@ class TimeSeriesReaderLogic(GenericLogic):
                 self.sigStatusChanged.emit(True, False)
         return 0
 
+    def _start_new_recording(self):
+        """
+        Reset the recording buffer. If stream_recording_to_disk is configured, a new recording file
+        is opened in the TimeSeriesReader data directory and the data blocks are appended to it as
+        they arrive instead of being kept in memory.
+        """
+        self._record_start_time = dt.datetime.now()
+        self._recorded_data = list()
+        self._close_record_writer()
+        if not self._stream_recording_to_disk:
+            return
+
+        filepath = self._savelogic.get_path_for_module(module_name='TimeSeriesReader')
+        filename = self._record_start_time.strftime('%Y%m%d-%H%M-%S_data_trace_stream.raw')
+        metadata = {'Start recoding time': self._record_start_time.strftime(
+                        '%d.%m.%Y, %H:%M:%S.%f'),
+                    'Data rate (Hz)': self.data_rate,
+                    'Oversampling factor (samples)': self.oversampling_factor,
+                    'Sampling rate (Hz)': self.sampling_rate,
+                    'Channels': list(self.active_channel_names),
+                    'Units': [self.active_channel_units[ch] for ch in self.active_channel_names]}
+        try:
+            self._record_writer = BackgroundStreamFileWriter(
+                os.path.join(filepath, filename),
+                frame_shape=(self.number_of_active_channels,),
+                dtype=np.float64,
+                metadata=metadata,
+                fsync_interval=self._recording_fsync_interval)
+        except OSError:
+            self.log.exception('Unable to open recording file. Recording data into memory instead.')
+            self._record_writer = None
+        return
+
+    def _close_record_writer(self, callback=None, wait=True):
+        """ Close the current recording file (if any) in the writer thread and return its path.
+
+        @param callable callback: optional, called in the writer thread with the path once closed
+        @param bool wait: optional, block until the file is closed
+        """
+        if self._record_writer is None:
+            return None
+        path = self._record_writer.path
+        self._record_writer.close(callback=callback, wait=wait)
+        self._record_writer = None
+        return path
+
     def _save_recorded_data(self, to_file=True, name_tag='', save_figure=True):
         """ Save the counter trace data and writes it to a file.
 
@@ -670,7 +754,15 @@ class TimeSeriesReaderLogic(GenericLogic):
         @param bool save_figure: select whether png and pdf should be saved
 
         @return dict parameters: Dictionary which contains the saving parameters
+
+        In disk streaming mode the data is already saved, so the file is only finalized (in the
+        background, the returned data is empty): it is deleted if to_file is False, name_tag is
+        added to the file name and the figure is saved next to it if save_figure is True.
         """
+        if self._record_writer is not None:
+            return self._finish_streamed_recording(to_file=to_file, name_tag=name_tag,
+                                                   save_figure=save_figure)
+
         if not self._recorded_data:
             self.log.error('No data has been recorded. Save to file failed.')
             return np.empty(0), dict()
@@ -702,28 +794,97 @@ class TimeSeriesReaderLogic(GenericLogic):
 
             data = {header: data_arr.transpose()}
             filepath = self._savelogic.get_path_for_module(module_name='TimeSeriesReader')
-            set_of_units = set(self.active_channel_units.values())
-            unit_list = tuple(self.active_channel_units)
-            y_unit = 'arb.u.'
-            occurrences = 0
-            for unit in set_of_units:
-                count = unit_list.count(unit)
-                if count > occurrences:
-                    occurrences = count
-                    y_unit = unit
-
-            fig = self._draw_figure(data_arr, self.data_rate, y_unit) if save_figure else None
-
-            self._savelogic.save_data(data=data,
-                                      filepath=filepath,
-                                      parameters=parameters,
-                                      filelabel=filelabel,
-                                      plotfig=fig,
-                                      delimiter='\t',
-                                      timestamp=saving_stop_time)
-            self.log.info('Time series saved to: {0}'.format(filepath))
+            self._savelogic.save_data_async(data=data,
+                                            filepath=filepath,
+                                            parameters=parameters,
+                                            filelabel=filelabel,
+                                            plot_function=draw_time_series_figure if save_figure else None,
+                                            plot_data=data_arr,
+                                            plot_parameters={'timebase': self.data_rate,
+                                                             'y_unit': self._figure_y_unit()},
+                                            delimiter='\t',
+                                            timestamp=saving_stop_time,
+                                            saved_message='Time series saved to: {0}'.format(filepath))
         return data_arr, parameters
 
+    def _finish_streamed_recording(self, to_file=True, name_tag='', save_figure=True):
+        """
+        Finalize the recording file written by the disk streaming mode. The recording parameters
+        are added to the file header. The acquisition is not blocked: the final sync, the closing
+        of the file and the options of _save_recorded_data are done in the writer thread (see
+        _finalize_stream_file). The data is not loaded into memory.
+
+        @param bool to_file: keep the recording file
+        @param str name_tag: an additional tag, which will be added to the file name
+        @param bool save_figure: save a figure of the recording next to the file
+
+        @return numpy.ndarray, dict: empty array (read the file with read_stream_file), recording
+                                     parameters
+        """
+        writer = self._record_writer
+        saving_stop_time = self._record_start_time + dt.timedelta(
+            seconds=writer.frame_count / self.data_rate)
+        parameters = dict()
+        parameters['Start recoding time'] = self._record_start_time.strftime(
+            '%d.%m.%Y, %H:%M:%S.%f')
+        parameters['Stop recoding time'] = saving_stop_time.strftime('%d.%m.%Y, %H:%M:%S.%f')
+        parameters['Data rate (Hz)'] = self.data_rate
+        parameters['Oversampling factor (samples)'] = self.oversampling_factor
+        parameters['Sampling rate (Hz)'] = self.sampling_rate
+        writer.update_metadata(**parameters)
+
+        plot_parameters = {'timebase': self.data_rate, 'y_unit': self._figure_y_unit()}
+        self._close_record_writer(
+            callback=partial(self._finalize_stream_file, to_file=to_file, name_tag=name_tag,
+                             save_figure=save_figure, plot_parameters=plot_parameters,
+                             timestamp=saving_stop_time),
+            wait=False)
+        return np.empty(0), parameters
+
+    def _finalize_stream_file(self, path, to_file, name_tag, save_figure, plot_parameters,
+                              timestamp):
+        """
+        Apply the saving options to a closed recording file. Called in the writer thread.
+
+        @param str path: path of the recording file
+        @param dict plot_parameters: parameters of draw_time_series_figure besides the data
+        @param datetime.datetime timestamp: end of the recording
+
+        See _finish_streamed_recording for the other parameters.
+        """
+        if not to_file:
+            os.remove(path)
+            return
+        if name_tag:
+            tagged_path = path.replace('_data_trace_stream.raw',
+                                       '_data_trace_{0}_stream.raw'.format(name_tag))
+            os.replace(path, tagged_path)
+            path = tagged_path
+        data_arr, header = read_stream_file(path, mmap=True)
+        if header['frame_count'] == 0:
+            self.log.error('No data has been recorded.')
+            return
+        if save_figure:
+            draw_and_render_figure(draw_time_series_figure, data_arr.transpose(), plot_parameters,
+                                   self._savelogic.mpl_qd_style, os.path.splitext(path)[0],
+                                   figure_metadata(__name__.split('.')[-1], timestamp),
+                                   self._savelogic.save_pdf, self._savelogic.save_png)
+        del data_arr
+        self.log.info('Time series streamed to: {0}'.format(path))
+
+    def _figure_y_unit(self):
+        """ @return str: the unit of most of the active channels, used as y axis label """
+        set_of_units = set(self.active_channel_units.values())
+        unit_list = tuple(self.active_channel_units.values())
+        y_unit = 'arb.u.'
+        occurrences = 0
+        for unit in set_of_units:
+            count = unit_list.count(unit)
+            if count > occurrences:
+                occurrences = count
+                y_unit = unit
+        return y_unit
+
     def _draw_figure(self, data, timebase, y_unit):
         """ Draw figure to save with data file.
 
@@ -733,21 +894,7 @@ class TimeSeriesReaderLogic(GenericLogic):
         """
         # Use qudi style
         plt.style.use(self._savelogic.mpl_qd_style)
-
-        # Create figure and scale data
-        max_abs_value = ScaledFloat(max(data.max(), np.abs(data.min())))
-        time_data = np.arange(data.shape[1]) / timebase
-        fig, ax = plt.subplots()
-        if max_abs_value.scale:
-            ax.plot(time_data,
-                    data.transpose() / max_abs_value.scale_val,
-                    linestyle=':',
-                    linewidth=0.5)
-        else:
-            ax.plot(time_data, data.transpose(), linestyle=':', linewidth=0.5)
-        ax.set_xlabel('Time (s)')
-        ax.set_ylabel('Signal ({0}{1})'.format(max_abs_value.scale, y_unit))
-        return fig
+        return draw_time_series_figure(data, timebase, y_unit)
 
     @QtCore.Slot()
     def save_trace_snapshot(self, to_file=True, name_tag='', save_figure=True):
@@ -774,20 +921,20 @@ class TimeSeriesReaderLogic(GenericLogic):
 
             header = ', '.join(
                 '{0} ({1})'.format(ch, unit) for ch, unit in self.active_channel_units.items())
-            data_offset = self._trace_data.shape[1] - self.moving_average_width // 2
-            data = {header: self._trace_data[:, :data_offset].transpose()}
+            data_offset = self._trace_data.size - self.moving_average_width // 2
+            data = {header: self._trace_data.data[:, :data_offset].transpose()}
 
             if to_file:
                 filepath = self._savelogic.get_path_for_module(module_name='TimeSeriesReader')
                 filelabel = 'data_trace_snapshot_{0}'.format(
                     name_tag) if name_tag else 'data_trace_snapshot'
-                self._savelogic.save_data(data=data,
-                                          filepath=filepath,
-                                          parameters=parameters,
-                                          filelabel=filelabel,
-                                          timestamp=timestamp,
-                                          delimiter='\t')
-                self.log.info('Time series snapshot saved to: {0}'.format(filepath))
+                self._savelogic.save_data_async(data=data,
+                                                filepath=filepath,
+                                                parameters=parameters,
+                                                filelabel=filelabel,
+                                                timestamp=timestamp,
+                                                delimiter='\t',
+                                                saved_message='Time series snapshot saved to: {0}'.format(filepath))
         return data, parameters
 
     def _stop_reader_wait(self):
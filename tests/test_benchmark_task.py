@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the task benchmark (tools/benchmark_task.py) on the dummy hardware.
+"""
+import argparse
+import importlib.util
+import os
+
+TOOLS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools')
+spec = importlib.util.spec_from_file_location('benchmark_task', os.path.join(TOOLS, 'benchmark_task.py'))
+benchmark_task = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(benchmark_task)
+
+
+def run(task, rois=4, cycles=1):
+    args = argparse.Namespace(task=task, rois=rois, cycles=cycles, probes=1, z_planes=5, exposure=0.05,
+                              incubation=10, time_step=0, file_format='npy', no_host_time=True, label=None)
+    return benchmark_task.run_benchmark(args, dict(benchmark_task.DEFAULT_LATENCIES))
+
+
+def test_clock_fires_callbacks_in_order():
+    clock = benchmark_task.VirtualClock(include_host_time=False)
+    start = clock.now
+    fired = []
+    clock.call_at(start + 2, lambda: fired.append(('b', clock.now - start)))
+    clock.call_at(start + 1, lambda: (fired.append(('a', clock.now - start)), clock.sleep(5)))
+    clock.sleep(3)
+    # the sleep within the first callback only advances the clock, the second callback is late
+    assert fired == [('a', 1), ('b', 6)]
+    assert clock.now - start == 6
+    assert clock.pop_durations()[0]['other'] == 6
+
+
+def test_autofocus_is_timed():
+    result = run('timelapse_task_RAMM')
+    assert result['cycles'][0]['autofocus'] > 0
+    assert result['cycles'][0]['stage move'] >= 4 * benchmark_task.DEFAULT_LATENCIES['stage_settle']
+    assert result['bytes_saved'] > 0
+
+
+def test_dummy_task_runs():
+    result = run('fast_timelapse_task_dummy')
+    assert result['cycles'][0]['acquisition'] > 0
+    assert result['cycles'][0]['autofocus'] == 0
+
+
+def test_him_task_ramm_uploads_data():
+    result = run('HiM_task_RAMM')
+    cycle = result['cycles'][0]
+    # four injections of 300 µl at 50 µl/min at least
+    assert cycle['injection'] > 4 * 300 / 50 * 60
+    assert cycle['autofocus'] > 0
+    assert result['bytes_saved'] > 0
+    assert result['bytes_uploaded'] > 0
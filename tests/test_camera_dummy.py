@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the synthetic frames of the dummy camera.
+"""
+import types
+
+import numpy as np
+
+from hardware.camera.camera_dummy import CameraDummy, SyntheticFrameSource
+
+
+class CameraStub(types.SimpleNamespace):
+    """ Stand-in for the dummy camera: the frame source methods are called unbound with this object. """
+    _get_frames = CameraDummy._get_frames
+    _clear_frame_bank = CameraDummy._clear_frame_bank
+    set_exposure = CameraDummy.set_exposure
+    set_gain = CameraDummy.set_gain
+    _random_offset = CameraDummy._random_offset
+
+    def _get_piezo_position(self):
+        return self.z
+
+
+def make_camera(mode='bank'):
+    return CameraStub(image_size=(32, 48), _exposure=0.1, _gain=1., _frame_source=None, _frame_source_mode=mode,
+                      _number_of_spots=20, _frame_bank_size=9, _frame_bank_path=None, z=0.)
+
+
+def test_bank_follows_z():
+    camera = make_camera()
+    in_focus = camera._get_frames(2)
+    assert in_focus.shape == (2, 32, 48)
+    assert not in_focus.flags.writeable
+    camera.z = 2.
+    defocused = camera._get_frames(1)
+    assert not np.array_equal(in_focus[0], defocused[0])
+    # the spots are spread out of focus, so the brightest pixel gets dimmer
+    assert defocused.max() < in_focus.max()
+
+
+def test_bank_invalidated_by_exposure_and_gain():
+    camera = make_camera()
+    short = camera._get_frames(1)[0].astype(float).mean()
+    camera.set_exposure(0.4)
+    long = camera._get_frames(1)[0].astype(float).mean()
+    assert camera._frame_source.bank_scale == 0.4
+    assert long > 2 * short - 100
+    camera.set_gain(2.)
+    assert camera._frame_source.bank is None
+    camera._get_frames(1)
+    assert camera._frame_source.bank_scale == 0.8
+
+
+def test_bank_file_is_regenerated_for_new_scale(tmp_path):
+    path = str(tmp_path / 'bank.npy')
+    source = SyntheticFrameSource((16, 16), number_of_spots=5)
+    source.build_bank([-1, 0, 1], 0.1, path=path)
+    first = np.array(source.bank)
+    source.build_bank([-1, 0, 1], 0.1, path=path)
+    assert np.array_equal(first, source.bank)
+    source.build_bank([-1, 0, 1], 1., path=path)
+    assert source.bank.mean() > first.mean()
+
+
+def test_random_movie_frames_do_not_wrap(monkeypatch):
+    camera = make_camera(mode='random')
+    camera.n_frames = 5
+    camera._frames_delivered = 0
+    camera._movie_start_time = 0.
+    camera._data_generator = lambda size: np.full(size, -1e4)
+    monkeypatch.setattr('hardware.camera.camera_dummy.time.monotonic', lambda: 1.)
+    frames, acquired = CameraDummy.get_new_frames(camera)
+    assert acquired == 5
+    assert frames.dtype == np.uint16
+    assert frames.max() == 0
+
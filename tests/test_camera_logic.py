@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the camera logic.
+"""
+import types
+
+from logic.camera_logic2 import CameraLogic
+
+
+class HardwareWithoutSpooling:
+    """ Camera implementing the movie acquisition of the camera interface only. """
+    def start_movie_acquisition(self, n_frames): pass
+
+    def get_progress(self): pass
+
+    def get_most_recent_image(self): pass
+
+    def get_ready_state(self): pass
+
+
+class HardwareWithFrameBuffer(HardwareWithoutSpooling):
+    """ Camera delivering all frames acquired since the last call. """
+    def get_new_frames(self): pass
+
+
+def make_logic(hardware):
+    logic = types.SimpleNamespace(_hardware=hardware, software_spooling=False)
+    logic.has_hardware_spooling = types.MethodType(CameraLogic.has_hardware_spooling, logic)
+    logic.has_software_spooling = types.MethodType(CameraLogic.has_software_spooling, logic)
+    return logic
+
+
+def test_spooling_needs_all_frames():
+    logic = make_logic(HardwareWithoutSpooling())
+    assert not logic.has_hardware_spooling()
+    assert not CameraLogic.spooling_available(logic)
+
+
+def test_spooling_available_without_hardware_spooling():
+    logic = make_logic(HardwareWithFrameBuffer())
+    assert not logic.has_hardware_spooling()
+    assert CameraLogic.spooling_available(logic)
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the compressed and persisted images of the confocal history.
+"""
+import os
+
+import numpy as np
+
+from logic.confocal_logic import HistoryImage
+
+
+def test_persisted_image_is_loaded_lazily(tmp_path):
+    image = np.random.default_rng(0).random((8, 5))
+    filename = HistoryImage(image).persist(str(tmp_path))
+    store = HistoryImage(filename=filename)
+    assert store.nbytes == 0
+    assert store.persist(str(tmp_path)) == filename
+    assert np.array_equal(store.array, image)
+
+
+def test_missing_file_is_empty_image(tmp_path):
+    store = HistoryImage(filename=str(tmp_path / 'missing.npz'))
+    filename = store.persist(str(tmp_path))
+    assert os.path.isfile(filename)
+    assert store.shape == (0, 0)
+    assert store.array.size == 0
+    assert HistoryImage(filename=filename).array.shape == (0, 0)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the focus map used by the tasks to predict the focus position on each ROI.
+"""
+import types
+
+import pytest
+
+from logic.focus_logic import FocusLogic, FocusMap
+
+
+def plane(x, y):
+    return 0.002 * x - 0.001 * y + 25.
+
+
+class FocusLogicStub(types.SimpleNamespace):
+    """ Minimal stand-in for the focus logic: only the piezo position is needed by the focus map methods. """
+    def get_position(self):
+        return self.z
+
+
+def run_cycle(logic, rois, dz=0.):
+    """ Visit all rois as done by the tasks: start a cycle, then record the focus found on each roi. """
+    FocusLogic.start_focus_map_cycle(logic)
+    for name, (x, y) in rois.items():
+        logic.z = plane(x, y) + dz
+        FocusLogic.record_focus(logic, name, (x, y, 0))
+
+
+ROIS = {'ROI_1': (0., 0.), 'ROI_2': (1000., 0.), 'ROI_3': (0., 1000.), 'ROI_4': (1000., 1000.)}
+
+
+@pytest.mark.parametrize('model', ['plane', 'spline'])
+def test_first_cycle_prediction_follows_plane(model):
+    logic = FocusLogicStub(focus_map=FocusMap(model=model), z=0.)
+    FocusLogic.start_focus_map_cycle(logic)
+    for name in ['ROI_1', 'ROI_2', 'ROI_3']:
+        x, y = ROIS[name]
+        logic.z = plane(x, y)
+        FocusLogic.record_focus(logic, name, (x, y, 0))
+
+    assert logic.focus_map.cycle == 0
+    prediction = FocusLogic.predict_focus(logic, 'ROI_4', (1000., 1000., 0))
+    assert prediction == pytest.approx(plane(1000., 1000.), abs=1e-6)
+
+
+def test_drift_is_added_in_following_cycles():
+    logic = FocusLogicStub(focus_map=FocusMap(), z=0.)
+    run_cycle(logic, ROIS)
+
+    FocusLogic.start_focus_map_cycle(logic)
+    assert logic.focus_map.cycle == 1
+    logic.z = plane(0., 0.) + 1.5
+    FocusLogic.record_focus(logic, 'ROI_1', (0., 0., 0))
+
+    assert logic.focus_map.drift == pytest.approx(1.5)
+    prediction = FocusLogic.predict_focus(logic, 'ROI_4', (1000., 1000., 0))
+    assert prediction == pytest.approx(plane(1000., 1000.) + 1.5, abs=1e-6)
+
+
+def test_surface_is_refined_until_enough_rois_were_measured():
+    logic = FocusLogicStub(focus_map=FocusMap(), z=0.)
+    run_cycle(logic, {'ROI_1': ROIS['ROI_1'], 'ROI_2': ROIS['ROI_2']})
+
+    # only 2 rois in the first cycle: no surface yet, the next cycle refines it again
+    run_cycle(logic, {'ROI_3': ROIS['ROI_3']})
+    prediction = FocusLogic.predict_focus(logic, 'ROI_4', (1000., 1000., 0))
+    assert prediction == pytest.approx(plane(1000., 1000.), abs=1e-6)
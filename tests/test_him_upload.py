@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the upload of the OME-Zarr images acquired by the RAMM Hi-M task to the network directory.
+"""
+import os
+import types
+
+from logic.tasks import HiM_task_RAMM
+from logic.tasks.HiM_task_RAMM import Task, UploadDataWorker
+
+
+def write_zarr(directory, chunks, shape):
+    path = os.path.join(directory, 'scan_001.zarr')
+    os.makedirs(os.path.join(path, '0'), exist_ok=True)
+    for chunk in chunks:
+        with open(os.path.join(path, '0', chunk), 'wb') as file:
+            file.write(b'chunk')
+    for name in ('.zgroup', '.zattrs', os.path.join('0', '.zarray')):
+        with open(os.path.join(path, name), 'w') as file:
+            file.write(shape)
+    return path
+
+
+def make_task(tmp_path):
+    local, network = str(tmp_path / 'local'), str(tmp_path / 'network')
+    os.makedirs(local)
+    os.makedirs(network)
+    task = types.SimpleNamespace(directory=local, network_directory=network, zarr_uploaded=Task.zarr_uploaded)
+    return task
+
+
+def upload(path, destination):
+    worker = UploadDataWorker(path, destination)
+    worker.run()
+
+
+def test_zarr_image_is_one_upload(tmp_path):
+    task = make_task(tmp_path)
+    path = write_zarr(task.directory, ['0.0.0.0', '0.1.0.0', '0.2.0.0'], '[3]')
+    assert Task.check_acquired_data(task) == [path]
+    upload(path, task.network_directory)
+    assert HiM_task_RAMM.data_saved
+    assert sorted(os.listdir(os.path.join(task.network_directory, 'scan_001.zarr', '0'))) \
+        == ['.zarray', '0.0.0.0', '0.1.0.0', '0.2.0.0']
+    assert Task.check_acquired_data(task) == []
+
+
+def test_metadata_copied_again(tmp_path):
+    task = make_task(tmp_path)
+    path = write_zarr(task.directory, ['0.0.0.0'], '[1]')
+    upload(path, task.network_directory)
+    # the image grows after the upload: the new chunk and the updated metadata must be uploaded
+    write_zarr(task.directory, ['0.1.0.0'], '[2]')
+    os.utime(os.path.join(path, '0', '.zarray'), (2e9, 2e9))
+    assert Task.check_acquired_data(task) == [path]
+    upload(path, task.network_directory)
+    with open(os.path.join(task.network_directory, 'scan_001.zarr', '0', '.zarray')) as file:
+        assert file.read() == '[2]'
+    assert os.path.isfile(os.path.join(task.network_directory, 'scan_001.zarr', '0', '0.1.0.0'))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the injection scheduler running the hybridization and photobleaching sequences of the Hi-M tasks.
+"""
+from logic.injection_scheduler import InjectionScheduler
+
+
+class ValveChainStub:
+    """ Hamilton valves on one chain: a valve can not be commanded while another one is moving. """
+    def __init__(self):
+        self.moving = None
+        self.moves = []
+
+    def set_valve_position(self, valve_id, position):
+        assert self.moving is None, f'valve {valve_id} commanded while valve {self.moving} is moving'
+        self.moving = valve_id
+        self.moves.append((valve_id, position))
+
+    def wait_for_idle(self):
+        self.moving = None
+
+
+class FlowStub:
+    target_volume_reached = True
+
+    def set_pressure(self, pressure):
+        pass
+
+    def start_pressure_regulation_loop(self, flowrate):
+        pass
+
+    def start_volume_measurement(self, volume):
+        pass
+
+    def stop_pressure_regulation_loop(self):
+        pass
+
+
+def injection(product):
+    return {'product': product, 'volume': 100, 'flowrate': 100, 'time': None}
+
+
+def incubation(t):
+    return {'product': None, 'volume': None, 'flowrate': None, 'time': t}
+
+
+def make_scheduler(valves):
+    return InjectionScheduler(valves, FlowStub(), {'Buffer': 1, 'Probe': 7, 'Wash': 2}, poll_interval=0.,
+                              settle_time=0.)
+
+
+def test_valve_moved_during_incubation():
+    valves = ValveChainStub()
+    scheduler = make_scheduler(valves)
+    scheduler.run([injection('Buffer'), incubation(0), injection('Probe'), injection('Probe')])
+    # the product valve is moved to the next injection while the syringe valve is closed, and only once
+    assert valves.moves == [('a', 1), ('c', 1), ('a', 7), ('c', 2)]
+    assert valves.moving is None
+
+
+def test_no_move_while_another_valve_moves():
+    valves = ValveChainStub()
+    scheduler = make_scheduler(valves)
+    scheduler.run([incubation(0), injection('Wash'), incubation(0), incubation(0), injection('Buffer')])
+    assert [move for move in valves.moves if move[0] == 'a'] == [('a', 2), ('a', 1)]
+    assert valves.moving is None
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the Lumencor celesta driver against a local HTTP stand-in for the light engine.
+"""
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from hardware.laser.lumencor_celesta import LumencorCelesta
+
+WAVELENGTHS = ['405', '446', '477', '520', '546', '638', '749']
+
+
+class CelestaStandIn(BaseHTTPRequestHandler):
+    """ Answers the commands of the driver like the celesta source and records them. """
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_GET(self):
+        command = urllib.parse.unquote(urllib.parse.urlparse(self.path).query.split('=', 1)[1])
+        server = self.server
+        server.commands.append(command)
+        words = command.split()
+        if command == 'GET VER':
+            answer = 'A VER 1.0'
+        elif command == 'GET STAT':
+            answer = 'A STAT 0'
+        elif command == 'GET MULCHINT':
+            answer = 'A MULCHINT ' + ' '.join(map(str, server.intensity))
+        elif command == 'GET MULCH':
+            answer = 'A MULCH ' + ' '.join(map(str, server.state))
+        elif words[:2] == ['SET', 'MULCHINT']:
+            server.intensity = [int(value) for value in words[2:]]
+            answer = 'A MULCHINT'
+        elif words[:2] == ['SET', 'MULCH']:
+            server.state = [int(value) for value in words[2:]]
+            answer = 'A MULCH'
+        else:
+            answer = 'A ' + command
+        body = json.dumps({'message': answer}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if server.drop_connection:
+            # close the connection without announcing it, as the source does after an idle time
+            server.drop_connection = False
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CelestaStandIn)
+    server.commands = []
+    server.intensity = [0] * len(WAVELENGTHS)
+    server.state = [0] * len(WAVELENGTHS)
+    server.drop_connection = False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def celesta(server):
+    ip = '127.0.0.1:{0}'.format(server.server_address[1])
+    celesta = LumencorCelesta(manager=None, name='celesta', config={'ip': ip, 'wavelengths': WAVELENGTHS})
+    celesta.on_activate()
+    server.commands.clear()
+    yield celesta
+    celesta._close_connection()
+
+
+def set_commands(server):
+    return [command for command in server.commands if command.startswith('SET')]
+
+
+def test_channel_switch_is_one_request(server, celesta):
+    intensity = [0, 0, 0, 500, 0, 0, 0]
+    celesta.apply_voltage(intensity, [0, 0, 0, 1, 0, 0, 0])
+    assert set_commands(server) == ['SET MULCHINT 0 0 0 500 0 0 0', 'SET MULCH 0 0 0 1 0 0 0']
+
+    # switching to another channel with unchanged intensities only changes the emission
+    server.commands.clear()
+    celesta.apply_voltage(intensity, [0, 0, 0, 0, 0, 0, 0])
+    assert server.commands == ['SET MULCH 0 0 0 0 0 0 0']
+
+    # nothing is sent if nothing changes
+    server.commands.clear()
+    celesta.apply_voltage(intensity, [0, 0, 0, 0, 0, 0, 0])
+    assert server.commands == []
+    assert server.state == [0] * len(WAVELENGTHS)
+
+
+def test_coalesced_updates_send_final_values(server, celesta):
+    with celesta.coalesced_update():
+        for line in range(len(WAVELENGTHS)):
+            intensity = [0] * len(WAVELENGTHS)
+            intensity[line] = 100 * (line + 1)
+            celesta.set_intensity_all_laser_lines(intensity)
+            celesta.set_state_all_laser_lines([1 if i == line else 0 for i in range(len(WAVELENGTHS))])
+        assert server.commands == []
+    assert server.commands == ['SET MULCHINT 0 0 0 0 0 0 700', 'SET MULCH 0 0 0 0 0 0 1']
+    assert server.intensity == [0, 0, 0, 0, 0, 0, 700]
+
+
+def test_other_threads_are_not_coalesced(server, celesta):
+    with celesta.coalesced_update():
+        celesta.set_intensity_all_laser_lines([100] * len(WAVELENGTHS))
+        thread = threading.Thread(target=celesta.set_state_all_laser_lines, args=([1] + [0] * 6,))
+        thread.start()
+        thread.join()
+        # the update of the other thread was sent right away, the own update is still pending
+        assert server.commands == ['SET MULCH 1 0 0 0 0 0 0']
+        assert celesta.get_laserline_intensity() == [100] * len(WAVELENGTHS)
+    assert server.intensity == [100] * len(WAVELENGTHS)
+    assert server.state == [1, 0, 0, 0, 0, 0, 0]
+
+
+def test_keep_alive_reconnects(server, celesta):
+    # the source closes the connection after this command: the driver reconnects and the next command is not lost
+    server.drop_connection = True
+    celesta.set_intensity_all_laser_lines([1] * len(WAVELENGTHS))
+    celesta.set_intensity_all_laser_lines([2] * len(WAVELENGTHS))
+    assert server.intensity == [2] * len(WAVELENGTHS)
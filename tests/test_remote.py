@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Round trip tests of remote modules over localhost.
+"""
+import pickle
+import struct
+import threading
+import time
+import types
+import zlib
+
+import numpy as np
+import pytest
+from rpyc.utils.server import ThreadedServer
+
+from core.remote import RemoteObjectManager
+from core.util.network import PAYLOAD_RAW, PAYLOAD_ZLIB, pack_payload, unpack_payload
+
+
+class CameraStandIn:
+    """ Shared module returning camera frames. """
+    def __init__(self):
+        self.exposure = 0.1
+        self.frame = np.random.default_rng(0).integers(0, 4096, (512, 512), dtype=np.uint16)
+
+    def get_last_image(self):
+        return self.frame
+
+    def get_exposure(self):
+        return self.exposure
+
+    def set_exposure(self, exposure):
+        self.exposure = exposure
+        return {'exposure': exposure, 'limits': (0.001, 10.)}
+
+    def get_lock(self):
+        return threading.Lock()
+
+
+@pytest.fixture
+def remote():
+    manager = types.SimpleNamespace(tm=None, tree={'defined': {'hardware': {}, 'logic': {}, 'gui': {}}})
+    rm = RemoteObjectManager(manager)
+    camera = CameraStandIn()
+    rm.shareModule('camera', camera)
+    server = ThreadedServer(rm.makeRemoteService(), hostname='localhost', port=0,
+                            protocol_config={'allow_all_attrs': True})
+    thread = threading.Thread(target=server.start, daemon=True)
+    thread.start()
+    # the server listens once started
+    while not server.active:
+        time.sleep(0.01)
+    yield rm, server.port, camera
+    rm.closeConnections()
+    server.close()
+
+
+def test_bulk_round_trip(remote):
+    rm, port, camera = remote
+    proxy = rm.getRemoteModule('localhost', port, 'camera', transport='bulk', compression=1)
+
+    image = proxy.get_last_image()
+    assert isinstance(image, np.ndarray)
+    np.testing.assert_array_equal(image, camera.frame)
+    assert proxy.set_exposure(0.2) == {'exposure': 0.2, 'limits': (0.001, 10.)}
+    assert camera.exposure == 0.2
+
+    with proxy.remote_module.batch() as batch:
+        batch.add('get_last_image')
+        batch.add('get_exposure')
+    image, exposure = batch.results
+    np.testing.assert_array_equal(image, camera.frame)
+    assert exposure == 0.2
+
+    statistics = proxy.remote_module.statistics.as_dict()
+    assert statistics['requests'] == 3
+    assert statistics['calls'] == 4
+    assert statistics['bytes_received'] > camera.frame.nbytes
+
+
+def test_bulk_connection_is_separate_and_reconnects(remote):
+    rm, port, camera = remote
+    proxy = rm.getRemoteModule('localhost', port, 'camera', transport='bulk')
+    netref = rm.getRemoteModule('localhost', port, 'camera')
+
+    bulk_connection = proxy.remote_module.connection
+    assert not bulk_connection._channel.compress
+    assert netref.____conn__._channel.compress
+
+    bulk_connection.close()
+    assert proxy.get_exposure() == camera.exposure
+    assert proxy.remote_module.connection is not bulk_connection
+
+
+def test_only_data_is_transferred(remote):
+    rm, port, camera = remote
+    proxy = rm.getRemoteModule('localhost', port, 'camera', transport='bulk')
+    with pytest.raises(Exception, match='get_lock'):
+        proxy.get_lock()
+
+    # a pickle is not accepted as payload
+    with pytest.raises(Exception):
+        unpack_payload(PAYLOAD_RAW + pickle.dumps(camera.frame))
+    with pytest.raises(TypeError):
+        pack_payload(threading.Lock())
+
+
+def test_close_connections(remote):
+    rm, port, camera = remote
+    proxy = rm.getRemoteModule('localhost', port, 'camera', transport='bulk')
+    connection = proxy.remote_module.connection
+    rm.closeConnections()
+    assert connection.closed
+
+
+def test_compressed_payload_is_bounded():
+    frame = np.zeros((256, 256), dtype=np.uint16)
+    payload = pack_payload(frame, 1)
+    assert payload[:1] == PAYLOAD_ZLIB
+    assert np.array_equal(unpack_payload(payload), frame)
+    with pytest.raises(ValueError, match='limit'):
+        unpack_payload(payload, max_size=1024)
+    # a payload expanding beyond its declared size is rejected
+    bomb = PAYLOAD_ZLIB + struct.pack('<Q', 1024) + zlib.compress(bytes(2**20), 9)
+    with pytest.raises(ValueError, match='declared size'):
+        unpack_payload(bomb)
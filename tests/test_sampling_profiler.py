@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the sampling profiler of the qudi threads.
+"""
+import threading
+
+from core.sampling_profiler import SamplingProfiler
+
+
+def sample_thread(profiler, name, register=False):
+    """ Take one sample while a thread of the given name waits, then let the thread finish. """
+    started = threading.Event()
+    release = threading.Event()
+
+    def run():
+        if register:
+            profiler.register_thread(name)
+        started.set()
+        release.wait(5)
+        if register:
+            profiler.unregister_thread()
+
+    thread = threading.Thread(target=run, name=name)
+    thread.start()
+    assert started.wait(5)
+    profiler._sample(threading.get_ident())
+    release.set()
+    thread.join()
+    return thread.ident
+
+
+def test_samples_keep_name_of_finished_threads():
+    profiler = SamplingProfiler()
+    sample_thread(profiler, 'mod-logic-first', register=True)
+    sample_thread(profiler, 'second')
+    threads = set(line.split(';')[0] for line in profiler.collapsed())
+    # the stacks are counted by name, also if the identifier of the finished thread was reused
+    assert {'mod-logic-first', 'second'} <= threads
+    assert 'mod-logic-first' not in profiler._thread_names.values()
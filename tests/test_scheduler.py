@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the scheduler of the periodic jobs.
+"""
+from qtpy import QtCore
+
+from core.scheduler import Scheduler
+
+app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.
+
+    def monotonic(self):
+        return self.now
+
+
+def test_coalesced_job_receives_elapsed_time(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('core.scheduler.time.monotonic', clock.monotonic)
+    elapsed = []
+    job = Scheduler().add_job('volume', elapsed.append, 1., overrun='coalesce', pass_elapsed=True)
+    job.start()
+    job._start_timer()
+    for delay in (1., 3.5, 1.):
+        clock.now += delay
+        job._tick()
+    job.stop()
+    # the late call accounts for the missed ticks, nothing is lost in the integral
+    assert elapsed == [1., 3.5, 1.]
+
+
+def test_remove_jobs_of_owner():
+    scheduler = Scheduler()
+    owner = QtCore.QObject()
+    scheduler.add_job('a', lambda: None, 1., owner=owner)
+    scheduler.add_job('b', lambda: None, 1.)
+    scheduler.remove_jobs(owner)
+    assert scheduler.jobs() == ['b']
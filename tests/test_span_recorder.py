@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the recorder of the durations of the task phases.
+"""
+import csv
+import subprocess
+import sys
+
+from logic.task_logging_functions import SpanRecorder
+
+
+def test_memory_bounded_without_file():
+    recorder = SpanRecorder(capacity=8)
+    for n in range(100):
+        with recorder.span('step', cycle=n):
+            pass
+    spans = recorder.spans()
+    assert len(spans['duration']) <= 8
+    assert len(recorder._start) == 8
+    # the newest spans are kept, the statistics cover all of them
+    assert spans['attributes'][-1] == '{"cycle": 99}'
+    assert recorder.summary()[0]['count'] == 100
+    assert len(recorder._attributes) <= 9
+
+
+def test_spans_written_to_file(tmp_path):
+    path = str(tmp_path / 'spans.csv')
+    recorder = SpanRecorder(path=path, capacity=4)
+    for n in range(10):
+        with recorder.span('step', cycle=n):
+            with recorder.span('imaging'):
+                pass
+    recorder.flush()
+    with open(path, newline='') as file:
+        rows = list(csv.DictReader(file))
+    assert len(rows) == 20
+    assert rows[0]['phase'] == 'step/imaging'
+    assert rows[-1]['attributes'] == '{"cycle": 9}'
+
+
+def test_generic_task_does_not_import_pandas():
+    code = 'import sys, logic.generic_task; sys.exit("pandas" in sys.modules)'
+    assert subprocess.run([sys.executable, '-c', code], capture_output=True).returncode == 0
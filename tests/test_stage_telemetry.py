@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the telemetry broker polling the ASI MS2000 stage.
+"""
+import logging
+import threading
+import types
+from contextlib import contextmanager
+
+from hardware.motor.motor_asi_ms2000 import MS2000, StageTelemetryBroker
+
+
+class StageStub:
+    """ Stage answering the polling queries. A poll can be held between its status and position queries. """
+    def __init__(self):
+        self.status = 'N'
+        self.position = 0.
+        self.hold = threading.Event()
+        self.holding = threading.Event()
+        self.release = threading.Event()
+        self.broker = StageTelemetryBroker(self.poll, 200, logging.getLogger(__name__))
+
+    def poll(self):
+        with self.broker.serial_access(high_priority=False):
+            status = self.status
+        if self.hold.is_set():
+            self.hold.clear()
+            self.holding.set()
+            self.release.wait(5)
+        with self.broker.serial_access(high_priority=False):
+            position = self.position
+        return {'status': status, 'position': position}
+
+    def move(self, position):
+        with self.broker.serial_access():
+            self.status = 'B'
+            self.position = position
+            self.broker.notify_motion()
+
+
+def test_poll_started_before_motion_is_discarded():
+    stage = StageStub()
+    stage.broker.start()
+    try:
+        assert stage.broker.wait_for(lambda telemetry: True, 5)
+        stage.hold.set()
+        assert stage.holding.wait(5)
+        # the held poll read the idle status of the stage before the move command
+        stage.move(100.)
+        stage.release.set()
+        assert stage.broker.wait_for(lambda telemetry: True, 5)
+        telemetry = stage.broker.get_latest(max_age=5)
+        assert telemetry['status'] == 'B'
+        assert telemetry['position'] == 100.
+    finally:
+        stage.broker.stop()
+
+
+def test_motion_invalidates_cached_telemetry():
+    stage = StageStub()
+    stage.broker.start()
+    try:
+        assert stage.broker.wait_for(lambda telemetry: telemetry['status'] == 'N', 5)
+        stage.broker.stop()
+        stage.move(10.)
+        assert stage.broker.get_latest(max_age=5) is None
+    finally:
+        stage.broker.stop()
+
+
+class SerialStub:
+    """ Serial connection of the stage: answers the status, position and move commands. """
+    def __init__(self):
+        self.status = 'N'
+        self.position = {'X': 0., 'Y': 0.}
+        self._answer = ''
+
+    def flushInput(self):
+        pass
+
+    def flushOutput(self):
+        pass
+
+    def write(self, data):
+        command = data.decode().split()
+        if command[0] == '/':
+            self._answer = self.status
+        elif command[0] == 'W':
+            self._answer = ':A ' + ' '.join(str(self.position[axis]) for axis in command[1:])
+        elif command[0] == 'M':
+            for item in command[1:]:
+                axis, value = item.split('=')
+                self.position[axis] = float(value)
+            self.status = 'B'
+            self._answer = ':A'
+
+    def readline(self):
+        return (self._answer + '\r\n').encode()
+
+
+class RacingBroker(StageTelemetryBroker):
+    """ A polling cycle wins the line right before the next command. """
+    race = False
+
+    @contextmanager
+    def serial_access(self, high_priority=True):
+        if high_priority and self.race:
+            self.race = False
+            self.poll_once()
+        with super().serial_access(high_priority):
+            yield
+
+
+class MS2000Stub(types.SimpleNamespace):
+    move_abs = MS2000.move_abs
+    write = MS2000.write
+    query = MS2000.query
+    get_pos = MS2000.get_pos
+    _query_positions = MS2000._query_positions
+    _poll_telemetry = MS2000._poll_telemetry
+
+
+def test_poll_before_move_command_is_not_fresh():
+    stage = MS2000Stub(axis_list=['X', 'Y'], _conversion_factor=10, log=logging.getLogger(__name__),
+                       _serial_connection=SerialStub())
+    stage._broker = RacingBroker(stage._poll_telemetry, 10, stage.log)
+    stage._broker.race = True
+    assert stage.move_abs({'X': 100.})
+    # the status and position polled just before the move command was sent must not be used
+    assert stage._broker.get_latest(max_age=5) is None
+    assert stage.get_pos()['X'] == 100.
+    assert stage._broker.poll_once()
+    assert stage._broker.get_latest(max_age=5)['status'] == 'B'
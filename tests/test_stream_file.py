@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the stream file used by the disk streaming recording of the time series reader.
+"""
+import datetime as dt
+import logging
+import os
+import types
+
+import numpy as np
+
+from core.util.stream_file import BackgroundStreamFileWriter, read_stream_file
+from logic.save_logic import SaveLogic
+from logic.time_series_reader_logic import TimeSeriesReaderLogic
+
+
+def test_background_writer_closes_in_writer_thread(tmp_path):
+    path = str(tmp_path / 'trace.raw')
+    writer = BackgroundStreamFileWriter(path, frame_shape=(2,), dtype=np.float64, fsync_interval=0)
+    for n in range(10):
+        writer.append(np.full((5, 2), n, dtype=float))
+    writer.update_metadata(channels=['a', 'b'])
+    closed = []
+    writer.close(callback=closed.append)
+    assert closed == [path]
+    data, header = read_stream_file(path)
+    assert header['frame_count'] == writer.frame_count == 50
+    assert header['metadata'] == {'channels': ['a', 'b']}
+    assert data[-1, 1] == 9
+
+
+def make_logic(tmp_path):
+    logic = types.SimpleNamespace(
+        _record_start_time=dt.datetime.now(), data_rate=10., oversampling_factor=1, sampling_rate=10.,
+        active_channel_units={'a': 'V', 'b': 'V'}, log=logging.getLogger(__name__),
+        _savelogic=types.SimpleNamespace(mpl_qd_style=SaveLogic.mpl_qd_style, save_pdf=False, save_png=True))
+    for name in ('_close_record_writer', '_finalize_stream_file', '_figure_y_unit'):
+        setattr(logic, name, types.MethodType(getattr(TimeSeriesReaderLogic, name), logic))
+    logic._record_writer = BackgroundStreamFileWriter(str(tmp_path / '20261018-1200-00_data_trace_stream.raw'),
+                                                      frame_shape=(2,), dtype=np.float64)
+    logic._record_writer.append(np.random.rand(100, 2))
+    return logic
+
+
+def test_streamed_recording_applies_save_options(tmp_path):
+    logic = make_logic(tmp_path)
+    writer = logic._record_writer
+    _, parameters = TimeSeriesReaderLogic._finish_streamed_recording(logic, name_tag='sample')
+    writer.close()  # wait for the writer thread
+    assert sorted(os.listdir(tmp_path)) == ['20261018-1200-00_data_trace_sample_stream.raw',
+                                            '20261018-1200-00_data_trace_sample_stream_fig.png']
+    _, header = read_stream_file(str(tmp_path / '20261018-1200-00_data_trace_sample_stream.raw'))
+    assert header['metadata']['Data rate (Hz)'] == 10.
+    assert logic._figure_y_unit() == 'V'
+
+
+def test_streamed_recording_not_kept_without_to_file(tmp_path):
+    logic = make_logic(tmp_path)
+    writer = logic._record_writer
+    TimeSeriesReaderLogic._finish_streamed_recording(logic, to_file=False)
+    writer.close()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the ungated laser pulse extraction methods on synthetic timetraces.
+
+Compares BasicPulseExtractor.ungated_conv_deriv with the vectorized
+BasicPulseExtractor.ungated_conv_deriv_batched (first call and cached edge positions).
+
+Run from the qudi root directory:
+
+python tools/benchmark_pulse_extraction.py
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import logging
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from logic.pulsed.pulse_extraction_methods.basic_extraction_methods import BasicPulseExtractor
+
+
+def make_timetrace(number_of_lasers, laser_length=1000, wait_length=1000, rate=5.0,
+                   background=0.2, seed=0):
+    """ Synthetic ungated timetrace with poissonian noise and laser pulses with a decaying peak.
+    """
+    rng = np.random.default_rng(seed)
+    period = laser_length + wait_length
+    signal = np.full(number_of_lasers * period + wait_length, background)
+    pulse = rate * (1 + np.exp(-np.arange(laser_length) / (laser_length / 10)))
+    rising_bins = wait_length + period * np.arange(number_of_lasers)
+    for start in rising_bins:
+        signal[start:start + laser_length] += pulse
+    return rng.poisson(signal).astype('int64'), rising_bins
+
+
+def make_extractor(number_of_lasers):
+    """ BasicPulseExtractor with a minimal stand-in for the PulsedMeasurementLogic. """
+    pulsedmeasurementlogic = SimpleNamespace(
+        measurement_settings={'number_of_lasers': number_of_lasers},
+        sampling_information=dict(),
+        fast_counter_settings={'bin_width': 1e-9, 'is_gated': False},
+        log=logging.getLogger('benchmark_pulse_extraction'))
+    return BasicPulseExtractor(pulsedmeasurementlogic)
+
+
+def time_call(func, repetitions):
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        result = func()
+    return (time.perf_counter() - start) / repetitions, result
+
+
+def run_benchmark(laser_numbers=(10, 100, 500, 1000), repetitions=3):
+    print('{0:>8} {1:>14} {2:>14} {3:>14} {4:>12}'.format(
+        'lasers', 'loop [ms]', 'batched [ms]', 'cached [ms]', 'max dev [bin]'))
+    for number_of_lasers in laser_numbers:
+        count_data, rising_bins = make_timetrace(number_of_lasers)
+        extractor = make_extractor(number_of_lasers)
+
+        t_loop, result_loop = time_call(lambda: extractor.ungated_conv_deriv(count_data),
+                                        repetitions)
+
+        def batched_uncached():
+            extractor._edge_cache = None
+            return extractor.ungated_conv_deriv_batched(count_data)
+        t_batched, result_batched = time_call(batched_uncached, repetitions)
+        t_cached, _ = time_call(lambda: extractor.ungated_conv_deriv_batched(count_data),
+                                repetitions)
+
+        deviation = np.max(np.abs(result_batched['laser_indices_rising'] - rising_bins))
+        if not np.array_equal(result_loop['laser_indices_rising'],
+                              result_batched['laser_indices_rising']):
+            deviation_loop = np.max(np.abs(result_loop['laser_indices_rising'] - rising_bins))
+            deviation = '{0} (loop: {1})'.format(deviation, deviation_loop)
+        print('{0:>8d} {1:>14.2f} {2:>14.2f} {3:>14.2f} {4:>12}'.format(
+            number_of_lasers, t_loop * 1e3, t_batched * 1e3, t_cached * 1e3, deviation))
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,816 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark of the Hi-M and timelapse tasks on the dummy hardware with a virtual clock.
+
+The unmodified task code (logic/tasks/<task>.py) runs on the logic modules of the dummy setup
+(config/custom_config/config_dummy.cfg: camera, lasers, brightfield, focus, roi, valves,
+flowcontrol, daq and positioning logic), which are connected to the dummy hardware modules
+(camera_dummy, motor dummies for the piezo, the roi stage and the needle, valve_dummy,
+flowboard_dummy, dummy_daq). The qudi manager is replaced by a stand-in providing the scheduler.
+
+All modules run in a single thread on a virtual clock: time.sleep, time.time and the other clock
+functions imported by the logic, hardware and task modules are replaced by the clock, the timers
+of the periodic jobs of the scheduler and the workers started on the thread pools of the modules
+are fired by the clock, and the PID controllers use it as time function. An experiment of several
+hours runs in minutes. The python code executed on the host (logic and hardware modules, logging,
+file writing) is measured and added to the virtual clock as well, unless --no-host-time is given.
+
+The waiting times of the dummy hardware (valve and motor dummies) are completed by latency models
+(DEFAULT_LATENCIES): valve switching, travel time of the roi stage at its velocity, settling of the
+stages and of the piezo, exposure and readout of the camera frames acquired on the trigger of the
+simulated FPGA. The autofocus detector is modeled (ModeledAutofocusLogic), the autofocus loop of
+the focus logic runs on this signal.
+
+Each call of the task to a logic module sets the current phase (injection, stage move, autofocus,
+acquisition, save, upload). Waiting time and host time are charged to the current phase, so a
+per-phase breakdown of each cycle (one runTaskStep) is obtained. Results are appended to a json
+lines file together with the git commit, so that runs of different commits can be compared.
+
+Run from the qudi root directory:
+
+python tools/benchmark_task.py --task HiM_task_RAMM --rois 9 --probes 3
+python tools/benchmark_task.py --task timelapse_task_RAMM --rois 16 --cycles 5 --latencies my_setup.yml
+python tools/benchmark_task.py --compare benchmark_results.jsonl
+
+The latency file is a yaml dictionary overwriting entries of DEFAULT_LATENCIES.
+
+What the benchmark does not measure:
+    - gui modules and the Qt event loop are not involved, and the logic modules do not run in their own threads:
+      waiting for locks held by other threads does not appear, a worker or periodic job runs when the task waits.
+    - the data is saved to a temporary directory and uploaded (HiM_task_RAMM) to another temporary directory on the
+      same disk: the throughput of the acquisition disk and of the network is not modeled.
+    - the dummy tasks do not run an autofocus (the call is commented out in HiM_task_dummy and the timelapse dummy
+      tasks), so their autofocus phase is 0. The RAMM tasks run the autofocus at each roi.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import argparse
+import functools
+import heapq
+import importlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import yaml
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from qtpy import QtCore
+
+from core.configoption import ConfigOption
+from core.connector import Connector
+from core.scheduler import Scheduler
+from logic.autofocus_logic_camera import AutofocusLogic
+
+PHASES = ('injection', 'stage move', 'autofocus', 'acquisition', 'save', 'upload', 'other')
+
+DEFAULT_LATENCIES = {
+    'valve_switch': 0.5,  # in s, per call of set_valve_position, in addition to the wait of the valve dummy (0.5 s)
+    'stage_settle': 0.2,  # in s, per movement of the roi stage, in addition to the travel time at the stage velocity
+    'needle_settle': 0.5,  # in s, per axis movement of the positioning stage
+    'piezo_settle': 0.005,  # in s, per movement of the piezo
+    'roi_spacing': 0.2,  # in mm, distance between neighbouring rois of the mosaic
+    'sample_tilt': 2.0,  # in µm/mm, tilt of the sample surface seen by the modeled autofocus detector
+    'camera_readout': 0.01,  # in s, per frame, in addition to the exposure time
+    'frame_shape': [256, 256],  # in pixels, resolution of the camera dummy
+}
+
+# methods of the task that are charged to a phase in addition to the calls of the logic modules
+TASK_METHOD_PHASES = {
+    'save_metadata_file': 'save',
+    'check_acquired_data': 'save',
+    'launch_data_uploading': 'upload',
+}
+
+# phase of the calls of the task to each logic module (task reference), and exceptions for some of the methods.
+# Calls to getters keep the current phase, enabling or disabling the gui actions is charged to 'other'.
+REFERENCE_PHASES = {'valves': 'injection', 'flow': 'injection', 'pos': 'injection', 'roi': 'stage move',
+                    'focus': 'acquisition', 'cam': 'acquisition', 'daq': 'acquisition', 'laser': 'acquisition',
+                    'bf': 'acquisition'}
+METHOD_PHASES = {'focus': {'go_to_predicted_focus': 'autofocus', 'start_search_focus': 'autofocus',
+                           'start_autofocus': 'autofocus', 'do_piezo_position_correction': 'autofocus',
+                           'record_focus': 'autofocus'},
+                 'cam': {'save_to_tiff': 'save', 'save_to_fits': 'save', 'save_to_npy': 'save', 'save_to_zarr': 'save'},
+                 'daq': {'start_rinsing': 'injection'}}
+
+
+# ======================================================================================================================
+# Virtual clock
+# ======================================================================================================================
+
+class VirtualClock:
+    """ Clock advanced by the sleep calls of the modules and the task, and by the time spent on the host if
+    include_host_time is True. The elapsed time is charged to the current phase.
+
+    Callbacks (timers of the periodic jobs, workers of the thread pools) are scheduled with call_at and fired in order
+    while the clock is advanced. A sleep within a callback only advances the clock. A sleep within a worker is
+    deferred: the signals it emits afterwards are delivered when the clock reaches the end of the sleep.
+    """
+    def __init__(self, include_host_time=True):
+        self.include_host_time = include_host_time
+        self.now = time.time()
+        self.phase = 'other'
+        self.durations = OrderedDict((phase, 0.) for phase in PHASES)
+        self.host_durations = OrderedDict((phase, 0.) for phase in PHASES)
+        self._last_host_time = time.perf_counter()
+        self._events = []
+        self._event_count = 0
+        self._firing = False
+        self.deferred = None  # time slept so far by the running worker, None outside of a worker
+
+    def time(self):
+        self._update_host_time()
+        return self.now
+
+    def sleep(self, seconds):
+        if self.deferred is not None:
+            self.deferred += max(float(seconds), 0.)
+        else:
+            self.advance(seconds)
+
+    def call_at(self, due, callback):
+        """ Call callback once the clock reaches due. """
+        self._event_count += 1
+        heapq.heappush(self._events, (due, self._event_count, callback))
+
+    def advance(self, seconds, phase=None):
+        """ Advance the clock by seconds, charged to phase (the current phase if None). The callbacks due in this
+        interval are fired. """
+        self._update_host_time()
+        if phase is not None:
+            self.phase = phase
+        target = self.now + max(float(seconds), 0.)
+        if not self._firing:
+            self._firing = True
+            try:
+                while self._events and self._events[0][0] <= target:
+                    due, _, callback = heapq.heappop(self._events)
+                    self._move_to(due)
+                    callback()
+                    self._update_host_time()
+            finally:
+                self._firing = False
+        self._move_to(target)
+
+    def set_phase(self, phase):
+        """ Charge the host time elapsed so far to the previous phase and switch to phase. """
+        self._update_host_time()
+        self.phase = phase
+
+    def pop_durations(self):
+        """ Return the durations per phase since the last call and reset them. """
+        self._update_host_time()
+        durations = dict(self.durations)
+        host_durations = dict(self.host_durations)
+        for phase in PHASES:
+            self.durations[phase] = 0.
+            self.host_durations[phase] = 0.
+        return durations, host_durations
+
+    def _move_to(self, t):
+        if t > self.now:
+            self.durations[self.phase] += t - self.now
+            self.now = t
+
+    def _update_host_time(self):
+        now = time.perf_counter()
+        elapsed = now - self._last_host_time
+        self._last_host_time = now
+        self.host_durations[self.phase] += elapsed
+        if self.include_host_time:
+            self.now += elapsed
+            self.durations[self.phase] += elapsed
+
+
+class VirtualTimeModule:
+    """ Replacement for the time module in the namespace of the logic, hardware and task modules. """
+    def __init__(self, clock):
+        self._clock = clock
+
+    def __getattr__(self, item):
+        return getattr(time, item)
+
+    def time(self):
+        return self._clock.time()
+
+    def monotonic(self):
+        return self._clock.time()
+
+    def perf_counter(self):
+        return self._clock.time()
+
+    def sleep(self, seconds):
+        self._clock.sleep(seconds)
+
+
+def install_virtual_time(clock):
+    """ Replace time, sleep and the clock functions imported by the loaded logic and hardware modules (including the
+    tasks) and by the scheduler by the virtual clock. The PID controllers use the virtual clock as time function.
+
+    :return: list of (module, name, value) to restore the original attributes with restore_attributes
+    """
+    from simple_pid import PID
+    virtual_time = VirtualTimeModule(clock)
+    replacements = [(time, virtual_time), (time.time, virtual_time.time), (time.sleep, virtual_time.sleep),
+                    (time.monotonic, virtual_time.monotonic), (time.perf_counter, virtual_time.perf_counter),
+                    (PID, functools.partial(PID, time_fn=clock.time))]
+    replaced = []
+    for name, module in list(sys.modules.items()):
+        if module is None or not (name.split('.')[0] in ('logic', 'hardware') or name == 'core.scheduler'):
+            continue
+        for attribute, value in list(vars(module).items()):
+            for original, replacement in replacements:
+                if value is original:
+                    replaced.append((module, attribute, value))
+                    setattr(module, attribute, replacement)
+    return replaced
+
+
+def restore_attributes(replaced):
+    for obj, attribute, value in reversed(replaced):
+        setattr(obj, attribute, value)
+
+
+# ======================================================================================================================
+# Scheduler, thread pool and manager on the virtual clock
+# ======================================================================================================================
+
+class VirtualTimer:
+    """ Replacement for the single shot timer of a periodic job, fired by the virtual clock. """
+    def __init__(self, clock, callback):
+        self._clock = clock
+        self._callback = callback
+        self._generation = 0
+
+    def start(self, msec):
+        self._generation += 1
+        self._clock.call_at(self._clock.now + msec / 1000, functools.partial(self._fire, self._generation))
+
+    def stop(self):
+        self._generation += 1
+
+    def _fire(self, generation):
+        if generation == self._generation:
+            self._callback()
+
+
+class VirtualScheduler(Scheduler):
+    """ Scheduler of the periodic jobs whose timers are fired by the virtual clock. """
+    def __init__(self, clock):
+        super().__init__()
+        self._refresh_timer.stop()
+        self._clock = clock
+
+    def add_job(self, name, callback, interval, owner=None, thread=None, overrun='skip', tags=(),
+                pass_elapsed=False):
+        # all jobs run in the thread of the benchmark
+        job = super().add_job(name, callback, interval, overrun=overrun, tags=tags, pass_elapsed=pass_elapsed)
+        job.owner = owner
+        job._timer = VirtualTimer(self._clock, job._tick)
+        return job
+
+
+class DeferredSignals:
+    """ Signals of a worker, emitted when the virtual clock reaches the end of the time slept by the worker. """
+    def __init__(self, signals, clock):
+        self._signals = signals
+        self._clock = clock
+
+    def __getattr__(self, item):
+        signals = self._signals  # a bound signal does not keep the QObject of the worker alive
+        clock = self._clock
+
+        def emit(*args):
+            clock.call_at(clock.now + clock.deferred, lambda: getattr(signals, item).emit(*args))
+        return SimpleNamespace(emit=emit, connect=getattr(signals, item).connect)
+
+
+class VirtualThreadPool:
+    """ Replacement for the QThreadPool of the logic modules and the tasks. A worker runs once the caller waits. """
+    def __init__(self, clock):
+        self._clock = clock
+
+    def start(self, worker):
+        self._clock.call_at(self._clock.now, functools.partial(self._run, worker))
+
+    def _run(self, worker):
+        if hasattr(worker, 'signals'):
+            worker.signals = DeferredSignals(worker.signals, self._clock)
+        self._clock.deferred = 0.
+        try:
+            worker.run()
+        finally:
+            self._clock.deferred = None
+
+
+def replace_thread_pools(obj, pool):
+    for attribute, value in list(vars(obj).items()):
+        if isinstance(value, QtCore.QThreadPool):
+            setattr(obj, attribute, pool)
+
+
+# ======================================================================================================================
+# Dummy setup
+# ======================================================================================================================
+
+class ModeledAutofocusLogic(AutofocusLogic):
+    """ Camera based autofocus logic whose detector signal is modeled: the position of the spot reflected on the
+    sample changes linearly with the distance between the piezo position and the sample surface, which is tilted
+    along x. The pid, the stabilization check of the autofocus logic and the autofocus loop of the focus logic are
+    unchanged.
+    """
+    piezo = Connector(interface='MotorInterface')
+    stage = Connector(interface='MotorInterface')
+
+    _signal_slope = ConfigOption('signal_slope', 10)  # in pixels / µm
+    _surface_position = ConfigOption('surface_position', 25)  # piezo position in focus at x = 0, in µm
+    _sample_tilt = ConfigOption('sample_tilt', 0)  # in µm/mm
+    _capture_range = ConfigOption('capture_range', 20)  # in µm, maximum defocus for which the spot is detected
+    _spot_position = 100  # in pixels, position of the spot in focus
+
+    def on_activate(self):
+        self._piezo = self.piezo()
+        self._stage = self.stage()
+        self.init_pid()
+        self._last_pid_output_values = np.zeros((self._num_points_fit,))
+        self.X_stabilization = np.linspace(0, self._num_points_fit - 1, num=self._num_points_fit)
+
+    def on_deactivate(self):
+        pass
+
+    def defocus(self):
+        """ Distance between the piezo position and the sample surface below the stage position, in µm. """
+        x = self._stage.get_pos()['x']
+        z = self._piezo.get_pos()['z']
+        return z - (self._surface_position + self._sample_tilt * x)
+
+    def read_detector_signal(self):
+        return self._spot_position + self._signal_slope * self.defocus()
+
+    def autofocus_check_signal(self):
+        return abs(self.defocus()) < self._capture_range
+
+    def start_camera_live(self):
+        pass
+
+    def stop_camera_live(self):
+        pass
+
+
+def dummy_setup(latencies):
+    """ Modules of the dummy setup (config/custom_config/config_dummy.cfg) used by the tasks, in the format of the
+    qudi configuration. The modules are activated in this order. """
+    hardware = OrderedDict([
+        ('daq_dummy', {'module.Class': 'daq.dummy_daq.DummyDaq',
+                       'wavelengths': ['405 nm', '488 nm', '561 nm', '640 nm'],
+                       'ao_channels': ['/Dev1/AO0', '/Dev1/AO1', '/Dev1/AO2', '/Dev1/AO3'],
+                       'ao_voltage_ranges': [[0, 10], [0, 10], [0, 10], [0, 10]]}),
+        ('piezo_dummy', {'module.Class': 'motor.motor_dummy.MotorDummy'}),
+        ('motor_dummy_roi', {'module.Class': 'motor.motor_dummy.MotorDummy'}),
+        ('motor_dummy_fluidics', {'module.Class': 'motor.motor_dummy.MotorDummy'}),
+        ('camera_dummy', {'module.Class': 'camera.camera_dummy.CameraDummy',
+                          'resolution': tuple(latencies['frame_shape']), 'frame_source': 'bank',
+                          'frame_bank_size': 9, 'number_of_spots': 50,
+                          'connect': {'piezo': 'piezo_dummy'}}),
+        ('brightfield_dummy', {'module.Class': 'brightfield_dummy.BrightfieldDummy'}),
+        ('valve_dummy', {'module.Class': 'valve.valve_dummy.ValveDummy', 'num_valves': 3,
+                         'daisychain_ID': ['a', 'b', 'c'],
+                         'name': ['Buffer 8-way valve', 'RT rinsing 2-way valve', 'Syringe 2-way valve'],
+                         'number_outputs': [8, 2, 2],
+                         'valve_positions': [[str(n) for n in range(1, 9)], ['1: Rinse needle', '2: Inject probe'],
+                                             ['1: Syringe', '2: Pump']]}),
+        ('flowboard_dummy', {'module.Class': 'microfluidics.flowboard_dummy.FlowboardDummy',
+                             'pressure_channel_IDs': [0], 'sensor_channel_IDs': [0]}),
+    ])
+    logic = OrderedDict([
+        ('camera_logic', {'module.Class': 'camera_logic2.CameraLogic', 'connect': {'hardware': 'camera_dummy'}}),
+        ('lasercontrol_logic', {'module.Class': 'lasercontrol_logic.LaserControlLogic', 'controllertype': 'daq',
+                                'connect': {'controller': 'daq_dummy'}}),
+        ('brightfield_logic', {'module.Class': 'brightfield_logic.BrightfieldLogic',
+                               'connect': {'controller': 'brightfield_dummy'}}),
+        ('autofocus_logic', {'module.Class': ModeledAutofocusLogic, 'proportional_gain': 0,
+                             'integration_gain': 2.5, 'sample_tilt': latencies['sample_tilt'],
+                             'connect': {'piezo': 'piezo_dummy', 'stage': 'motor_dummy_roi'}}),
+        ('focus_logic', {'module.Class': 'focus_logic.FocusLogic', 'readout_device': 'qpd',
+                         'rescue_autofocus_possible': False, 'init_position': 25,
+                         'connect': {'piezo': 'piezo_dummy', 'autofocus': 'autofocus_logic'}}),
+        ('roi_logic', {'module.Class': 'roi_logic.RoiLogic', 'connect': {'stage': 'motor_dummy_roi'}}),
+        ('valve_logic', {'module.Class': 'valve_logic.ValveLogic', 'connect': {'valves': 'valve_dummy'}}),
+        ('daq_logic', {'module.Class': 'daq_logic.DAQLogic', 'voltage_rinsing_pump': -3,
+                       'connect': {'daq': 'daq_dummy'}}),
+        ('flowcontrol_logic', {'module.Class': 'flowcontrol_logic.FlowcontrolLogic', 'p_gain': 0.005,
+                               'i_gain': 0.01, 'd_gain': 0.0, 'pid_sample_time': 0.1, 'pid_output_min': 0,
+                               'pid_output_max': 15,
+                               'connect': {'flowboard': 'flowboard_dummy', 'daq_logic': 'daq_logic'}}),
+        ('positioning_logic', {'module.Class': 'positioning_logic.PositioningLogic', 'z_safety_position': 50,
+                               'first_axis': 'X axis', 'second_axis': 'Y axis', 'third_axis': 'Z axis',
+                               'grid': 'cartesian', 'connect': {'stage': 'motor_dummy_fluidics'}}),
+    ])
+    return OrderedDict([('hardware', hardware), ('logic', logic)])
+
+
+def create_modules(setup, manager):
+    """ Create, connect and activate the modules of the setup.
+
+    :return: OrderedDict of the modules by name, in the order of activation
+    """
+    modules = OrderedDict()
+    for base, entries in setup.items():
+        for name, entry in entries.items():
+            config = {key: value for key, value in entry.items() if key not in ('module.Class', 'connect')}
+            module_class = entry['module.Class']
+            if isinstance(module_class, str):
+                module_name, class_name = module_class.rsplit('.', 1)
+                module_class = getattr(importlib.import_module(f'{base}.{module_name}'), class_name)
+            modules[name] = module_class(manager=manager, name=name, config=config)
+    for entries in setup.values():
+        for name, entry in entries.items():
+            for connector, target in entry.get('connect', {}).items():
+                modules[name].connectors[connector].connect(modules[target])
+    return modules
+
+
+def activate_modules(modules, pool):
+    for module in modules.values():
+        replace_thread_pools(module, pool)
+        module.module_state.activate()
+
+
+def deactivate_modules(modules):
+    for module in reversed(modules.values()):
+        if module.module_state() != 'deactivated':
+            module.module_state.deactivate()
+
+
+def add_latency(module, method_name, clock, latency):
+    """ Advance the clock by latency(*args, **kwargs) seconds (evaluated before the call) after each call of the
+    method of the hardware module. """
+    method = getattr(module, method_name)
+
+    def wrapped(*args, **kwargs):
+        seconds = latency(*args, **kwargs)
+        result = method(*args, **kwargs)
+        clock.sleep(seconds)
+        return result
+    setattr(module, method_name, wrapped)
+
+
+def add_latency_models(modules, clock, latencies, z_planes):
+    """ Complete the waiting times of the dummy hardware with the latency models. """
+    modules['piezo_dummy']._wait_after_movement = latencies['piezo_settle']
+    modules['motor_dummy_fluidics']._wait_after_movement = latencies['needle_settle']
+    add_latency(modules['valve_dummy'], 'set_valve_position', clock, lambda *args: latencies['valve_switch'])
+
+    stage = modules['motor_dummy_roi']
+    stage._wait_after_movement = 0
+
+    def travel_time(param_dict):
+        axes = {'x': stage._x_axis, 'y': stage._y_axis}
+        travel = [abs(param_dict[label] - axis.pos) / axis.vel for label, axis in axes.items()
+                  if param_dict.get(label) is not None]
+        return max(travel, default=0) + latencies['stage_settle']
+    add_latency(stage, 'move_abs', clock, travel_time)
+
+    # simulated FPGA: a rising edge on the start acquisition line triggers the acquisition of the frames of one plane
+    # (one per laser line), the acquisition done line is set once they are exposed and read out
+    daq = modules['daq_dummy']
+    camera = modules['camera_dummy']
+    write_to_do_channel = daq.write_to_do_channel
+    read_di_channel = daq.read_di_channel
+    fpga = {'done': 0.}
+
+    def write_trigger(taskhandle, num_samp, digital_write):
+        if taskhandle == daq.start_acquisition_taskhandle and digital_write[-1] == 1:
+            frames_per_plane = max(camera.n_frames // z_planes, 1)
+            fpga['done'] = clock.time() + frames_per_plane * (camera.get_exposure() + latencies['camera_readout'])
+        return write_to_do_channel(taskhandle, num_samp, digital_write)
+
+    def read_done(taskhandle, num_samp):
+        data = read_di_channel(taskhandle, num_samp)
+        if taskhandle == daq.acquisition_done_taskhandle and clock.time() < fpga['done']:
+            data[:] = 0
+        return data
+    daq.write_to_do_channel = write_trigger
+    daq.read_di_channel = read_done
+
+
+def prepare_sample(modules, args, latencies, directory):
+    """ Do the steps done by the user before starting a task: calibrate the autofocus and define its setpoint on the
+    sample surface, define the position of the first probe for the needle and save a mosaic of rois.
+
+    :return: str path to the roi list
+    """
+    focus = modules['focus_logic']
+    focus.calibrate_focus_stabilization()
+    focus.define_autofocus_setpoint()
+    modules['positioning_logic'].set_origin((12.0, 4.5, 89.0))
+
+    roi = modules['roi_logic']
+    size = int(np.ceil(np.sqrt(args.rois)))
+    spacing = latencies['roi_spacing']
+    for n in range(args.rois):
+        roi.add_roi(position=np.array([n % size * spacing, n // size * spacing, 0.]))
+    roi.save_roi_list(directory, 'roi_list')
+    return os.path.join(directory, 'roi_list.json')
+
+
+class PhaseProxy:
+    """ Reference of the task to a logic module. A method call switches the clock to the phase of the method. """
+    def __init__(self, module, clock, phase, method_phases):
+        object.__setattr__(self, '_module', module)
+        object.__setattr__(self, '_clock', clock)
+        object.__setattr__(self, '_phase', phase)
+        object.__setattr__(self, '_method_phases', method_phases)
+
+    def __getattr__(self, item):
+        attribute = getattr(self._module, item)
+        if not callable(attribute) or not hasattr(attribute, '__self__'):
+            return attribute
+        if item in self._method_phases:
+            phase = self._method_phases[item]
+        elif item.startswith('get_'):
+            phase = None
+        elif item.startswith(('enable_', 'disable_')):
+            phase = 'other'
+        else:
+            phase = self._phase
+
+        def call(*args, **kwargs):
+            if phase is not None:
+                self._clock.set_phase(phase)
+            return attribute(*args, **kwargs)
+        return call
+
+    def __setattr__(self, key, value):
+        setattr(self._module, key, value)
+
+
+def create_references(modules, clock):
+    """ References of the tasks (as in the task runner configuration of the RAMM setup) to the logic modules. """
+    names = {'laser': 'lasercontrol_logic', 'bf': 'brightfield_logic', 'cam': 'camera_logic', 'daq': 'daq_logic',
+             'focus': 'focus_logic', 'roi': 'roi_logic', 'valves': 'valve_logic', 'pos': 'positioning_logic',
+             'flow': 'flowcontrol_logic'}
+    return {key: PhaseProxy(modules[name], clock, REFERENCE_PHASES[key], METHOD_PHASES.get(key, {}))
+            for key, name in names.items()}
+
+
+# ======================================================================================================================
+# User parameters of the supported tasks
+# ======================================================================================================================
+
+def him_task_parameters(args, directory, roi_list_path):
+    """ Write the injection file and return the user parameters of the Hi-M tasks. """
+    injections = {'buffer': {1: 'Hybridization buffer', 2: 'Wash buffer', 3: 'Imaging buffer', 4: 'SSC'},
+                  'probes': {n + 1: f'RT{n + 1}' for n in range(args.probes)},
+                  'hybridization list': [{'product': 'Hybridization buffer', 'volume': 300, 'flowrate': 50,
+                                          'time': None},
+                                         {'product': None, 'volume': None, 'flowrate': None,
+                                          'time': args.incubation},
+                                         {'product': 'Wash buffer', 'volume': 300, 'flowrate': 50, 'time': None},
+                                         {'product': 'Imaging buffer', 'volume': 300, 'flowrate': 50,
+                                          'time': None}],
+                  'photobleaching list': [{'product': 'SSC', 'volume': 300, 'flowrate': 50, 'time': None},
+                                          {'product': None, 'volume': None, 'flowrate': None,
+                                           'time': args.incubation}]}
+    injections_path = os.path.join(directory, 'injections.yml')
+    with open(injections_path, 'w') as file:
+        yaml.safe_dump(injections, file)
+    return {'sample_name': 'benchmark', 'exposure': args.exposure, 'num_z_planes': args.z_planes, 'z_step': 0.25,
+            'centered_focal_plane': True,
+            'imaging_sequence': [('488 nm', 3), ('561 nm', 3), ('640 nm', 10)],
+            'save_path': os.path.join(directory, 'data'), 'file_format': args.file_format,
+            'roi_list_path': roi_list_path, 'injections_path': injections_path, 'dapi_path': ''}
+
+
+def him_ramm_task_parameters(args, directory, roi_list_path):
+    """ Return the user parameters of the Hi-M task of the RAMM setup. The data is uploaded to a second directory. """
+    parameters = him_task_parameters(args, directory, roi_list_path)
+    parameters.update({'save_network_path': os.path.join(directory, 'network'), 'transfer_data': True})
+    return parameters
+
+
+def timelapse_task_parameters(args, directory, roi_list_path):
+    """ Return the user parameters of the timelapse tasks. """
+    return {'sample_name': 'benchmark', 'exposure': args.exposure, 'centered_focal_plane': False,
+            'save_path': os.path.join(directory, 'data'), 'file_format': args.file_format,
+            'roi_list_path': roi_list_path, 'num_iterations': args.cycles, 'time_step': args.time_step,
+            'imaging_sequence': [{'laserline': '488 nm', 'intensity': 5, 'num_z_planes': args.z_planes,
+                                  'z_step': 0.25},
+                                 {'laserline': '561 nm', 'intensity': 5, 'num_z_planes': args.z_planes,
+                                  'z_step': 0.25}]}
+
+
+def fast_timelapse_task_parameters(args, directory, roi_list_path):
+    """ Return the user parameters of the fast timelapse tasks. """
+    return {'sample_name': 'benchmark', 'exposure': args.exposure, 'centered_focal_plane': False,
+            'num_z_planes': args.z_planes, 'z_step': 0.25, 'save_path': os.path.join(directory, 'data'),
+            'file_format': args.file_format, 'roi_list_path': roi_list_path, 'num_iterations': args.cycles,
+            'imaging_sequence': [('488 nm', 5), ('561 nm', 5)]}
+
+
+def timelapse_ramm_task_parameters(args, directory, roi_list_path):
+    """ Return the user parameters of the timelapse task of the RAMM setup. """
+    parameters = timelapse_task_parameters(args, directory, roi_list_path)
+    for item in parameters['imaging_sequence']:
+        item['lightsource'] = item.pop('laserline')
+    return parameters
+
+
+TASK_PARAMETERS = {'HiM_task_dummy': him_task_parameters,
+                   'HiM_task_RAMM': him_ramm_task_parameters,
+                   'timelapse_task_dummy': timelapse_task_parameters,
+                   'fast_timelapse_task_dummy': fast_timelapse_task_parameters,
+                   'timelapse_task_RAMM': timelapse_ramm_task_parameters}
+
+
+# ======================================================================================================================
+# Benchmark
+# ======================================================================================================================
+
+def wrap_task_methods(task, clock):
+    """ Charge the methods of TASK_METHOD_PHASES to their phase. The previous phase is restored afterwards. """
+    for name, phase in TASK_METHOD_PHASES.items():
+        method = getattr(task, name, None)
+        if method is None:
+            continue
+
+        def wrapped(*args, _method=method, _phase=phase, **kwargs):
+            previous_phase = clock.phase
+            clock.set_phase(_phase)
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                clock.set_phase(previous_phase)
+        setattr(task, name, wrapped)
+
+
+def directory_size(path):
+    """ Total size of the files in the directory tree, in bytes. """
+    return sum(os.path.getsize(os.path.join(root, file)) for root, dirs, files in os.walk(path) for file in files)
+
+
+def run_benchmark(args, latencies):
+    """ Run the task on the dummy setup and return the result dictionary. """
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    task_module = importlib.import_module(f'logic.tasks.{args.task}')
+    clock = VirtualClock(include_host_time=not args.no_host_time)
+    pool = VirtualThreadPool(clock)
+    np.random.seed(0)  # noise of the flowboard dummy
+
+    modules = create_modules(dummy_setup(latencies), SimpleNamespace(scheduler=VirtualScheduler(clock)))
+    replaced = install_virtual_time(clock)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            activate_modules(modules, pool)
+            try:
+                add_latency_models(modules, clock, latencies, args.z_planes)
+                roi_list_path = prepare_sample(modules, args, latencies, directory)
+                user_config_path = os.path.join(directory, 'user_config.yml')
+                with open(user_config_path, 'w') as file:
+                    yaml.safe_dump(TASK_PARAMETERS[args.task](args, directory, roi_list_path), file)
+
+                task = task_module.Task(name=args.task, runner=None, references=create_references(modules, clock),
+                                        config={'path_to_user_config': user_config_path})
+                replace_thread_pools(task, pool)
+                wrap_task_methods(task, clock)
+
+                clock.set_phase('other')
+                clock.pop_durations()
+                task.startTask()
+                setup, _ = clock.pop_durations()
+                cycles = []
+                host_durations = []
+                running = True
+                while running and len(cycles) < args.cycles:
+                    running = task.runTaskStep()
+                    durations, host = clock.pop_durations()
+                    cycles.append(durations)
+                    host_durations.append(host)
+                    clock.set_phase('other')
+                task.cleanupTask()
+                cleanup, _ = clock.pop_durations()
+            finally:
+                deactivate_modules(modules)
+            bytes_saved = directory_size(os.path.join(directory, 'data'))
+            bytes_uploaded = directory_size(os.path.join(directory, 'network'))
+    finally:
+        restore_attributes(replaced)
+
+    return {'date': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'label': args.label,
+            'task': args.task,
+            'parameters': {'rois': args.rois, 'cycles': args.cycles, 'probes': args.probes,
+                           'z_planes': args.z_planes, 'exposure': args.exposure, 'incubation': args.incubation,
+                           'file_format': args.file_format, 'host_time': not args.no_host_time},
+            'latencies': latencies,
+            'setup': setup,
+            'cycles': cycles,
+            'host_durations': host_durations,
+            'cleanup': cleanup,
+            'bytes_saved': bytes_saved,
+            'bytes_uploaded': bytes_uploaded}
+
+
+def git_commit():
+    """ Short hash of the current commit, with a '+' if the working tree contains changes. None outside of git. """
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=root,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                        stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + '+' if dirty else commit
+
+
+def print_result(result):
+    print(f"{result['task']} at commit {result['commit']}: {result['parameters']}")
+    print('{0:>8}'.format('cycle') + ''.join(f'{phase:>13}' for phase in PHASES) + '{0:>13}'.format('total [s]'))
+    rows = [('setup', result['setup'])] + [(str(n + 1), durations) for n, durations in enumerate(result['cycles'])] \
+        + [('cleanup', result['cleanup'])]
+    for name, durations in rows:
+        print(f'{name:>8}' + ''.join(f'{durations[phase]:>13.2f}' for phase in PHASES)
+              + f'{sum(durations.values()):>13.2f}')
+    host = sum(sum(durations.values()) for durations in result['host_durations'])
+    print(f"host time in cycles: {host:.2f} s, data saved: {result['bytes_saved'] / 1e9:.2f} GB, "
+          f"uploaded: {result['bytes_uploaded'] / 1e9:.2f} GB")
+
+
+def compare_results(path):
+    """ Print the mean duration per cycle and phase of all runs stored in the results file. """
+    with open(path, 'r') as file:
+        results = [json.loads(line) for line in file if line.strip()]
+    print('{0:>20} {1:>10} {2:>12} {3:>26}'.format('date', 'commit', 'label', 'task')
+          + ''.join(f'{phase:>13}' for phase in PHASES) + '{0:>13}'.format('cycle [s]'))
+    for result in results:
+        means = {phase: np.mean([cycle[phase] for cycle in result['cycles']]) for phase in PHASES}
+        print('{0:>20} {1:>10} {2:>12} {3:>26}'.format(result['date'], str(result['commit']),
+                                                     str(result['label'] or ''), result['task'])
+              + ''.join(f'{means[phase]:>13.2f}' for phase in PHASES) + f'{sum(means.values()):>13.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1], formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--task', default='HiM_task_dummy', choices=sorted(TASK_PARAMETERS.keys()))
+    parser.add_argument('--rois', type=int, default=9, help='number of rois')
+    parser.add_argument('--cycles', type=int, default=3, help='maximum number of cycles (task steps) to run')
+    parser.add_argument('--probes', type=int, default=3, help='number of probes (Hi-M tasks)')
+    parser.add_argument('--z-planes', type=int, default=50, help='number of planes per stack')
+    parser.add_argument('--exposure', type=float, default=0.05, help='exposure time in s')
+    parser.add_argument('--incubation', type=int, default=900, help='incubation time in s (Hi-M tasks)')
+    parser.add_argument('--time-step', type=float, default=0, help='time between cycles in s (timelapse tasks)')
+    parser.add_argument('--file-format', default='tif', choices=['tif', 'npy', 'fits', 'zarr'],
+                        help='format of the saved data')
+    parser.add_argument('--latencies', help='yaml file overwriting the default latencies')
+    parser.add_argument('--no-host-time', action='store_true', help='do not add the time spent on the host')
+    parser.add_argument('--label', help='label stored with the result')
+    parser.add_argument('--results', default='benchmark_results.jsonl',
+                        help='json lines file the result is appended to. Use "" to not store it')
+    parser.add_argument('--compare', metavar='RESULTS', help='print the stored results and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(args.compare)
+        return
+
+    latencies = dict(DEFAULT_LATENCIES)
+    if args.latencies:
+        with open(args.latencies, 'r') as file:
+            latencies.update(yaml.safe_load(file) or {})
+
+    logging.basicConfig(level=logging.WARNING)
+    result = run_benchmark(args, latencies)
+    print_result(result)
+    if args.results:
+        with open(args.results, 'a') as file:
+            file.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()